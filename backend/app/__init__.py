@@ -1,37 +1,97 @@
-import os
+import gc
+from collections.abc import Mapping
 from flask import Flask
-from flask_cors import CORS
 
-def create_app(test_config=None):
+def create_app(config=None):
     """Create and configure the Flask application.
-    
+
+    Heavy dependencies (openai, Pillow codecs) are not imported here; they load
+    on first use or ahead of time through ``warm_up``.
+
     Args:
-        test_config: Configuration for testing
-        
+        config: Configuration object (e.g. ``TestingConfig()``), or a mapping of
+            overrides applied on top of the default ``Config``. When omitted the
+            ``.env`` file is loaded and ``Config`` is read from the environment.
+
     Returns:
         Flask application
     """
+    from app.config import Config
+
     app = Flask(__name__, instance_relative_config=True)
-    
-    # Load default configuration
-    app.config.from_mapping(
-        SECRET_KEY='dev',
-        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY'),
-    )
-    
-    # Load test configuration if provided
-    if test_config is not None:
-        app.config.update(test_config)
-    
-    # Register blueprints
-    from app.routes import generate_bp
-    app.register_blueprint(generate_bp)
-    
+
+    # Load configuration
+    if config is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        config = Config()
+    elif isinstance(config, Mapping):
+        overrides = config
+        config = Config()
+        for key, value in overrides.items():
+            setattr(config, key, value)
+    app.config.from_object(config)
+
+    # Structured logging through a background queue; tests keep pytest's handlers
+    from app.utils.structured_logging import configure_logging, init_request_logging
+    if not app.config['TESTING']:
+        configure_logging(
+            level=app.config['LOG_LEVEL'],
+            fmt=app.config['LOG_FORMAT'],
+            sample_rate=app.config['LOG_SUCCESS_SAMPLE_RATE'],
+        )
+    init_request_logging(app)
+
+    # Compression and conditional requests; runs before the request log line
+    from app.utils.http_responses import init_response_layer
+    init_response_layer(app)
+
+    # Admin-only CPU/allocation profiling of live requests
+    if app.config['PROFILING_ENABLED']:
+        from app.utils.profiling import init_profiling
+        from app.routes.profiling import profiling_bp
+        init_profiling(app)
+        app.register_blueprint(profiling_bp)
+
     # Register health check blueprint for production monitoring
     from app.routes.health import health_bp
     app.register_blueprint(health_bp)
-    
+
+    # Register API blueprint
+    from app.api.routes import api
+    app.register_blueprint(api, url_prefix='/api')
+
     # Enable CORS
+    from flask_cors import CORS
     CORS(app)
-    
+
+    if app.config['WARM_UP_ON_START']:
+        warm_up()
+
     return app
+
+def warm_up(freeze=False):
+    """Import and initialise everything the first request would otherwise load.
+
+    Meant for pre-fork servers (gunicorn ``--preload``): running it once in the
+    master means every worker shares these pages copy-on-write instead of
+    importing them separately.
+
+    Args:
+        freeze (bool): Move all objects created so far into the permanent GC
+            generation so collections in workers do not touch (and copy) them
+    """
+    import io
+    import openai  # noqa: F401  (the SDK import is the bulk of cold-start time)
+    from PIL import Image
+    from app.utils.image_utils import validate_and_process_image
+
+    # Register the PNG/JPEG/GIF/BMP decoders and run the processing path once
+    Image.preinit()
+    sample = io.BytesIO()
+    Image.new('RGBA', (8, 8)).save(sample, format='PNG')
+    validate_and_process_image(sample.getvalue())
+
+    if freeze:
+        gc.collect()
+        gc.freeze()
@@ -1,7 +1,31 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app, send_file, stream_with_context, url_for
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from werkzeug.exceptions import RequestEntityTooLarge
+import base64
+import io
 import logging
+import os
+import re
+import threading
+import time
 from app.utils.image_utils import decode_base64_image, validate_and_process_image
+from app.utils.image_guard import ImageLimits
+from app.utils.deadline import DeadlineExceeded, deadline_from_headers, REMAINING_HEADER
 from app.services.openai_service import generate_art_from_doodle
+from app.services.shared_store import get_shared_store, generation_cache_key
+from app.services.job_queue import get_job_queue, DONE, FAILED
+from app.services.postprocess import EXTENSION_MIMETYPES, get_postprocessor, get_variant_store
+from app.services.usage import UsageRecord, get_usage_accountant, parse_api_keys, resolve_tenant
+from app.services.capture import get_corpus_capture
+from app.utils.admin import is_admin
+from app.utils.http_responses import add_etag, cache_immutable, cache_revalidate
+from app.services.batch import (
+    get_preprocess_executor,
+    parse_multipart_items,
+    parse_ndjson_items,
+    run_batch,
+    stream_ndjson
+)
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -9,14 +33,142 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 api = Blueprint('api', __name__)
 
-@api.route('/health', methods=['GET'])
-def health_check():
+# Content types accepted as a binary /generate body
+UPLOAD_MIMETYPES = ('image/png', 'image/jpeg', 'image/webp')
+
+def _rate_limited(store, requests=1):
+    """
+    Count the request against its client's per-minute window.
+    
+    A batch counts each of its items as one request.
+    
+    Returns a 429 response once the window's limit is exceeded, otherwise None.
+    """
+    limit = current_app.config['RATE_LIMIT_PER_MINUTE']
+    if store is None or not limit:
+        return None
+    window = int(time.time() // 60)
+    count = store.incr(f"rate:{request.remote_addr}:{window}", delta=requests, ttl=120)
+    if count <= limit:
+        return None
+    response = jsonify({"error": "Rate limit exceeded, please try again shortly"})
+    response.headers['Retry-After'] = str(60 - int(time.time()) % 60)
+    return response, 429
+
+def _request_tenant():
+    """
+    Identify the caller for usage accounting (see ``resolve_tenant``).
+    
+    Returns the tenant and None, or None and a 401 response for an API key
+    that is not in USAGE_API_KEYS.
+    """
+    try:
+        return resolve_tenant(request.headers, parse_api_keys(current_app.config['USAGE_API_KEYS'])), None
+    except PermissionError as e:
+        logger.warning("Refused request: %s", e)
+        return None, (jsonify({"error": "Invalid API key"}), 401)
+
+def _usage_budget(accountant, tenant):
     """
-    Health check endpoint.
+    Check the tenant's daily spend budget (an in-memory lookup).
     
-    Returns a success message to confirm the API is running.
+    Returns a 429 response once the budget is spent, otherwise None.
     """
-    return jsonify({"status": "ok", "message": "API is running"}), 200
+    if accountant is None or accountant.allow(tenant):
+        return None
+    logger.warning("Usage budget exhausted for %s", tenant)
+    response = jsonify({"error": "Daily usage budget exhausted, please try again tomorrow"})
+    response.headers['Retry-After'] = str(accountant.seconds_until_reset())
+    return response, 429
+
+def _batch_too_large(max_bytes):
+    logger.error("Rejected batch over %d bytes", max_bytes)
+    return jsonify({"error": f"Batch body is limited to {max_bytes} bytes"}), 413
+
+def _batch_accounting(accountant, tenant):
+    """
+    Per-item budget checks and usage recording for a batch.
+    
+    Returns ``(generate, admit)`` for ``run_batch``. ``admit`` refuses an item
+    once the tenant's spend, counting the batch's calls still in flight,
+    reaches its budget; ``generate`` records each item's upstream calls as
+    soon as the item finishes rather than when the stream ends.
+    """
+    lock = threading.Lock()
+    in_flight = [0]
+    
+    def admit():
+        with lock:
+            if not accountant.allow(tenant, in_flight[0]):
+                logger.warning("Usage budget exhausted for %s during a batch", tenant)
+                return False
+            in_flight[0] += 1
+            return True
+    
+    def generate(image, prompt_hint, deadline=None):
+        usage = UsageRecord(tenant)
+        usage.requests = 0  # The batch's own record counts its items
+        try:
+            return generate_art_from_doodle(image, prompt_hint, deadline=deadline, usage=usage)
+        finally:
+            # Recorded before the call leaves in_flight, so its cost is never uncounted
+            with lock:
+                accountant.record(usage)
+                in_flight[0] -= 1
+    
+    return generate, admit
+
+def _accounted(results, accountant, usage, started):
+    """Pass batch results through, recording the batch's requests and cache hits once streamed."""
+    try:
+        for result in results:
+            if result.get('cached'):
+                usage.cache_hits += 1
+            yield result
+    finally:
+        accountant.record(usage, time.perf_counter() - started)
+
+def _variant_urls(variants):
+    """Add the download URL to each stored variant."""
+    return {name: dict(variant, url=url_for('api.get_image', name=variant['name']))
+            for name, variant in variants.items()}
+
+def _postprocess(image_url, deadline):
+    """
+    Render the branded variants of a generated image within the request budget.
+    
+    Returns (variants, timings), or (None, None) when post-processing is
+    disabled, fails or does not finish in time. The render stops at the
+    request deadline too, so a late one does not keep the pool busy.
+    """
+    processor = get_postprocessor(current_app.config)
+    if processor is None:
+        return None, None
+    future = processor.submit(image_url, deadline)
+    try:
+        result = future.result(timeout=deadline.remaining())
+    except (FutureTimeoutError, DeadlineExceeded):
+        logger.warning("Post-processing did not finish within the request budget")
+        return None, None
+    except Exception as e:
+        logger.error("Post-processing failed: %s", e)
+        return None, None
+    return _variant_urls(result.variants), result.timings
+
+def _generated_response(image_url, deadline, cache_status=None, with_variants=False):
+    """Build the /generate success response, with variants when requested and available."""
+    body = {"imageUrl": image_url}
+    variants, timings = _postprocess(image_url, deadline) if with_variants else (None, None)
+    if variants:
+        body["variants"] = variants
+    body["budget"] = deadline.to_dict()
+    response = jsonify(body)
+    response.headers[REMAINING_HEADER] = str(int(deadline.remaining() * 1000))
+    if cache_status:
+        response.headers['X-Cache'] = cache_status
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(f"{stage};dur={ms}" for stage, ms in timings.items())
+    return response, 200
 
 @api.route('/generate', methods=['POST'])
 def generate():
@@ -26,42 +178,388 @@ def generate():
     Expects a JSON payload with:
     - imageData: Base64 encoded PNG image (with or without data URL prefix)
     - promptHint (optional): String describing the content (e.g., "cat", "robot")
+    - variants (optional): true to also return branded variants
+    
+    or a binary image/png, image/jpeg or image/webp body, with the prompt
+    hint in the X-Prompt-Hint header (or promptHint query parameter). A
+    binary upload sent with X-Image-Normalized: 1 has been cropped and
+    fitted to the 1024 target by the client; once the image header confirms
+    it, preprocessing skips its size pre-check (see
+    ``validate_and_process_image``). X-Variants: 1 asks for variants.
+    
+    The whole request runs under a time budget taken from the
+    X-Request-Budget-Ms header (clamped to REQUEST_BUDGET_MAX_SECONDS) or
+    REQUEST_BUDGET_SECONDS when the header is absent.
     
     Returns a JSON response with:
     - imageUrl: URL of the generated image
+    - variants (when requested, post-processing is enabled and it finishes
+      within the budget): branded, downscaled copies keyed by variant name,
+      each with url, format, width, height and bytes. Fetching and rendering
+      them delays the response, so they are opt-in here; queued jobs
+      (``POST /api/jobs``) render them in the worker.
+    - budget: Budget, elapsed and remaining milliseconds
     Or if an error occurs:
     - error: Description of the error
     """
-    data = request.get_json()
-    logger.info(f"Received request to /api/generate with payload keys: {list(data.keys() if data else [])}")
+    try:
+        deadline = deadline_from_headers(
+            request.headers,
+            current_app.config['REQUEST_BUDGET_SECONDS'],
+            current_app.config['REQUEST_BUDGET_MAX_SECONDS'],
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    store = get_shared_store(current_app.config)
+    limited = _rate_limited(store)
+    if limited is not None:
+        return limited
+    
+    tenant, refused = _request_tenant()
+    if refused is not None:
+        return refused
+    accountant = get_usage_accountant(current_app.config)
+    usage = UsageRecord(tenant)
+    exhausted = _usage_budget(accountant, usage.tenant)
+    if exhausted is not None:
+        return exhausted
+    
+    if request.mimetype in UPLOAD_MIMETYPES:
+        # Binary upload: the body is the image, the hint travels in a header
+        image_data = request.get_data()
+        prompt_hint = request.headers.get('X-Prompt-Hint') or request.args.get('promptHint')
+        normalized = request.headers.get('X-Image-Normalized') == '1'
+        with_variants = request.headers.get('X-Variants') == '1'
+        logger.info("Received %s upload to /api/generate (%d bytes, normalized=%s)",
+                    request.mimetype, len(image_data), normalized)
+    else:
+        data = request.get_json(silent=True)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Received request to /api/generate with payload keys: %s", sorted(data) if data else [])
+        
+        # Validate input
+        if not data or 'imageData' not in data:
+            logger.error("Missing image data in request")
+            return jsonify({"error": "Image data is missing"}), 400
+        
+        # Extract data
+        image_data = data.get('imageData')
+        prompt_hint = data.get('promptHint')
+        normalized = False
+        with_variants = data.get('variants') is True
     
-    # Validate input
-    if not data or 'imageData' not in data:
+    if not image_data:
         logger.error("Missing image data in request")
         return jsonify({"error": "Image data is missing"}), 400
     
-    # Extract data
-    image_data = data.get('imageData')
-    prompt_hint = data.get('promptHint')
+    # Sampled requests are written to the replay corpus once they succeed
+    capture = get_corpus_capture(current_app.config)
+    if capture is not None and not capture.sample():
+        capture = None
+    transport = 'binary' if isinstance(image_data, bytes) else 'json'
+    timings = {}
     
     try:
         # Process the image
         logger.info("Decoding and processing image")
-        image_bytes = decode_base64_image(image_data)
-        processed_image = validate_and_process_image(image_bytes)
+        deadline.check('preprocessing')
+        stage_started = time.perf_counter()
+        image_bytes = image_data if isinstance(image_data, bytes) else decode_base64_image(image_data)
+        usage.bytes_in = len(image_bytes)
+        timings['decode'] = (time.perf_counter() - stage_started) * 1000
+        stage_started = time.perf_counter()
+        processed_image = validate_and_process_image(
+            image_bytes,
+            ImageLimits.from_config(current_app.config),
+            normalized=normalized,
+        )
+        timings['preprocess'] = (time.perf_counter() - stage_started) * 1000
+        
+        # Serve repeated generations from the node-wide cache
+        cache_key = None
+        if store is not None:
+            store.incr('metrics:generate.requests')
+            cache_key = generation_cache_key(processed_image.getvalue(), prompt_hint)
+            cached_url = store.get(cache_key)
+            if cached_url is not None:
+                store.incr('metrics:generate.cache_hits')
+                usage.cache_hits = 1
+                logger.info("Serving generated art from cache")
+                if capture is not None:
+                    capture.capture(image_bytes, processed_image.getvalue(), prompt_hint, timings,
+                                    transport=transport, normalized=normalized, cache_status='HIT')
+                return _generated_response(cached_url.decode('utf-8'), deadline, 'HIT', with_variants)
         
         # Generate the art
         logger.info("Calling OpenAI to generate art")
-        image_url = generate_art_from_doodle(processed_image, prompt_hint)
+        deadline.check('upstream call')
+        stage_started = time.perf_counter()
+        image_url = generate_art_from_doodle(
+            processed_image,
+            prompt_hint,
+            deadline=deadline,
+            hedge=current_app.config['HEDGE_ENABLED'],
+            usage=usage,
+        )
+        timings['upstream'] = (time.perf_counter() - stage_started) * 1000
+        if cache_key is not None:
+            store.set(cache_key, image_url.encode('utf-8'), ttl=current_app.config['GENERATION_CACHE_TTL_SECONDS'])
+        if capture is not None:
+            capture.capture(image_bytes, processed_image.getvalue(), prompt_hint, timings, transport=transport,
+                            normalized=normalized, cache_status='MISS' if cache_key is not None else None)
         
         # Return the result
         logger.info("Successfully generated art")
-        return jsonify({"imageUrl": image_url}), 200
+        return _generated_response(image_url, deadline, 'MISS' if cache_key is not None else None, with_variants)
+    
+    except DeadlineExceeded as e:
+        logger.error("Deadline exceeded: %s", e)
+        response = jsonify({"error": str(e), "budget": deadline.to_dict()})
+        response.headers[REMAINING_HEADER] = '0'
+        return response, 504
     
     except ValueError as e:
-        logger.error(f"Validation error: {str(e)}")
+        logger.error("Validation error: %s", e)
         return jsonify({"error": f"Invalid image data: {str(e)}"}), 400
     
     except Exception as e:
-        logger.error(f"Error generating image: {str(e)}")
+        logger.error("Error generating image: %s", e)
         return jsonify({"error": f"Failed to generate image: {str(e)}"}), 500
+    
+    finally:
+        if accountant is not None:
+            accountant.record(usage, deadline.elapsed())
+
+@api.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """
+    Generate art for many doodles in one request.
+    
+    Accepts either:
+    - application/x-ndjson: one JSON object per line with imageData and
+      optional id and promptHint
+    - multipart/form-data: image files in the "images" field, with an optional
+      promptHint form field applied to all of them
+    
+    Each item counts as one request against RATE_LIMIT_PER_MINUTE, and bodies
+    over BATCH_MAX_BYTES are refused with 413. Images are preprocessed in
+    parallel and sent upstream with at most BATCH_UPSTREAM_CONCURRENCY calls in
+    flight. The response is NDJSON with one
+    line per item as it finishes:
+    - {"index", "id", "imageUrl"} on success
+    - {"index", "id", "error", "status"} on failure, with status 429 for items
+      refused because the tenant's daily budget ran out during the batch
+    followed by a final {"summary": {...}} line.
+    """
+    config = current_app.config
+    started = time.perf_counter()
+    store = get_shared_store(config)
+    limited = _rate_limited(store)
+    if limited is not None:
+        return limited
+    
+    tenant, refused = _request_tenant()
+    if refused is not None:
+        return refused
+    accountant = get_usage_accountant(config)
+    usage = UsageRecord(tenant)
+    exhausted = _usage_budget(accountant, usage.tenant)
+    if exhausted is not None:
+        return exhausted
+    
+    # Refuse oversized bodies before reading them; the limit also stops chunked
+    # bodies, which have no Content-Length, once they grow past it
+    max_bytes = config['BATCH_MAX_BYTES']
+    if request.content_length is not None and request.content_length > max_bytes:
+        return _batch_too_large(max_bytes)
+    request.max_content_length = max_bytes
+    try:
+        if request.mimetype == 'multipart/form-data':
+            items = parse_multipart_items(
+                request.files.getlist('images'),
+                request.form.get('promptHint'),
+                config['BATCH_MAX_ITEMS'],
+            )
+        else:
+            # Parsed as lines arrive, so BATCH_MAX_ITEMS stops a long body early
+            items = parse_ndjson_items(io.BufferedReader(request.stream), config['BATCH_MAX_ITEMS'])
+    except RequestEntityTooLarge:
+        return _batch_too_large(max_bytes)
+    except ValueError as e:
+        logger.error("Rejected batch: %s", e)
+        return jsonify({"error": str(e)}), 413
+    
+    if not items:
+        return jsonify({"error": "Batch contains no images"}), 400
+    
+    # The first item was counted above
+    limited = _rate_limited(store, len(items) - 1) if len(items) > 1 else None
+    if limited is not None:
+        return limited
+    
+    logger.info("Received batch of %d items", len(items))
+    generate, admit = generate_art_from_doodle, None
+    if accountant is not None:
+        usage.requests = len(items)
+        usage.bytes_in = request.content_length or 0
+        generate, admit = _batch_accounting(accountant, usage.tenant)
+    results = run_batch(
+        items,
+        generate,
+        get_preprocess_executor(config['BATCH_PREPROCESS_WORKERS']),
+        upstream_concurrency=config['BATCH_UPSTREAM_CONCURRENCY'],
+        cache=store,
+        cache_ttl=config['GENERATION_CACHE_TTL_SECONDS'],
+        item_budget=config['REQUEST_BUDGET_SECONDS'],
+        image_limits=ImageLimits.from_config(config),
+        admit=admit,
+    )
+    if accountant is not None:
+        results = _accounted(results, accountant, usage, started)
+    return Response(
+        stream_with_context(stream_ndjson(results, len(items))),
+        mimetype='application/x-ndjson',
+    )
+
+@api.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Queue a generation to be run by a job worker.
+    
+    Expects the same JSON payload or binary upload as /generate. Returns 202 with:
+    - jobId: Id to poll at /api/jobs/<jobId>, or to follow on the progress
+      WebSocket at /jobs/<jobId> (see app/progress_server.py)
+    - status: "queued"
+    """
+    received_at = time.time()
+    tenant, refused = _request_tenant()
+    if refused is not None:
+        return refused
+    exhausted = _usage_budget(get_usage_accountant(current_app.config), tenant)
+    if exhausted is not None:
+        return exhausted
+    
+    if request.mimetype in UPLOAD_MIMETYPES:
+        body = request.get_data()
+        if not body:
+            logger.error("Missing image data in job request")
+            return jsonify({"error": "Image data is missing"}), 400
+        payload = {
+            'imageData': base64.b64encode(body).decode('ascii'),
+            'promptHint': request.headers.get('X-Prompt-Hint') or request.args.get('promptHint'),
+            'normalized': request.headers.get('X-Image-Normalized') == '1',
+        }
+    else:
+        data = request.get_json(silent=True)
+        if not data or 'imageData' not in data:
+            logger.error("Missing image data in job request")
+            return jsonify({"error": "Image data is missing"}), 400
+        payload = {'imageData': data['imageData'], 'promptHint': data.get('promptHint')}
+    payload['tenant'] = tenant
+    
+    job_id = get_job_queue(current_app.config).enqueue(payload, received_at=received_at)
+    logger.info("Queued generation job %s", job_id)
+    response = jsonify({"jobId": job_id, "status": "queued"})
+    response.headers['Location'] = url_for('api.get_job', job_id=job_id)
+    return response, 202
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Return the state of a queued generation.
+    
+    Returns a JSON response with:
+    - jobId, status (queued, leased, done or failed) and attempts
+    - imageUrl (and variants, when post-processing is enabled) once the job is done
+    - error if the last attempt failed
+    
+    Responses carry a strong ETag, so polling with If-None-Match gets 304 until
+    the job changes. A finished job never changes and is cacheable for as long
+    as its image URL is valid.
+    """
+    job = get_job_queue(current_app.config).get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    body = {"jobId": job['id'], "status": job['status'], "attempts": job['attempts']}
+    if job['result']:
+        body.update(job['result'])
+        if 'variants' in body:
+            body['variants'] = _variant_urls(body['variants'])
+    if job['error']:
+        body['error'] = job['error']
+    
+    response = add_etag(jsonify(body))
+    if job['status'] in (DONE, FAILED):
+        cache_immutable(response, current_app.config['GENERATION_CACHE_TTL_SECONDS'])
+    else:
+        cache_revalidate(response)
+    return response
+
+@api.route('/usage', methods=['GET'])
+def get_usage():
+    """
+    Report usage and spend for a UTC day.
+    
+    Query parameters:
+    - period (optional): Day as YYYY-MM-DD; defaults to today
+    - tenant (optional, admin only): Only this tenant
+    
+    With an "Authorization: Bearer <ADMIN_TOKEN>" header the report covers
+    every tenant; otherwise it only covers the tenant of the caller's API key.
+    Origin tenants cannot read their usage, since anyone can send an Origin:
+    requests without a configured X-API-Key are refused with 401. Returns a
+    JSON response with:
+    - period: The day reported
+    - tenants: Per tenant requests, upstream_calls, upstream_errors,
+      cache_hits, bytes_in, upstream_ms, latency_ms, avgLatencyMs, cost (USD)
+      and budget (USD per day, null when unlimited)
+    
+    Counts from other processes appear once they have flushed (every
+    USAGE_FLUSH_SECONDS).
+    """
+    accountant = get_usage_accountant(current_app.config)
+    if accountant is None:
+        return jsonify({"error": "Usage accounting is disabled"}), 404
+    
+    period = request.args.get('period') or accountant.period()
+    if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', period):
+        return jsonify({"error": "period must be a date (YYYY-MM-DD)"}), 400
+    
+    if is_admin(request.headers, current_app.config['ADMIN_TOKEN']):
+        tenant = request.args.get('tenant')
+    else:
+        if not request.headers.get('X-API-Key'):
+            return jsonify({"error": "An API key or the admin token is required"}), 401
+        tenant, refused = _request_tenant()
+        if refused is not None:
+            return refused
+    
+    response = jsonify({"period": period, "tenants": accountant.report(tenant=tenant, period=period)})
+    response.cache_control.no_store = True
+    return response
+
+@api.route('/images/<name>', methods=['GET'])
+def get_image(name):
+    """
+    Serve a stored image variant.
+    
+    Names are content hashes (<sha256>.<ext>), so a name always refers to the
+    same bytes: responses are immutable and revalidate by ETag.
+    """
+    try:
+        path = get_variant_store(current_app.config).path(name)
+    except ValueError:
+        return jsonify({"error": "Image not found"}), 404
+    if not os.path.exists(path):
+        return jsonify({"error": "Image not found"}), 404
+    
+    digest, extension = name.split('.')
+    response = send_file(
+        path,
+        mimetype=EXTENSION_MIMETYPES[extension],
+        etag=digest,
+        max_age=current_app.config['VARIANT_MAX_AGE_SECONDS'],
+    )
+    return cache_immutable(response, current_app.config['VARIANT_MAX_AGE_SECONDS'])
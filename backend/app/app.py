@@ -1,27 +1,9 @@
-from flask import Flask
-import logging
-import os
-from dotenv import load_dotenv
-from app.api.routes import api
+"""Development entry point: ``python -m app.app``.
 
-# Load environment variables
-load_dotenv()
+The application factory lives in ``app/__init__.py``; this module only runs it.
+"""
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-def create_app(testing=False):
-    """Create and configure the Flask application."""
-    app = Flask(__name__)
-    
-    # Register blueprints
-    app.register_blueprint(api, url_prefix='/api')
-    
-    return app
+from app import create_app
 
 # For running directly (development only)
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+"""Configuration objects for the Flask application factory."""
+
+import os
+import tempfile
+
+
+def env_bool(name, default):
+    """Read a boolean environment variable ('true'/'1'/'yes' are true)."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_float(name, default):
+    """Read a float environment variable."""
+    value = os.getenv(name)
+    return float(value) if value not in (None, '') else default
+
+
+def env_int(name, default):
+    """Read an integer environment variable."""
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+class Config:
+    """
+    Default configuration, read from the environment when instantiated.
+
+    Values are resolved in ``__init__`` rather than at import time so that a
+    ``.env`` file loaded by the factory is taken into account.
+    """
+
+    def __init__(self):
+        self.TESTING = False
+        self.SECRET_KEY = os.getenv('SECRET_KEY', 'dev')
+        self.OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+
+        # End-to-end request budget; API Gateway cuts requests off at 29s
+        self.REQUEST_BUDGET_SECONDS = env_float('REQUEST_BUDGET_SECONDS', 25.0)
+        self.REQUEST_BUDGET_MAX_SECONDS = env_float('REQUEST_BUDGET_MAX_SECONDS', 28.0)
+        self.HEDGE_ENABLED = env_bool('HEDGE_ENABLED', True)
+
+        # Logging
+        self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+        self.LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+        self.LOG_SUCCESS_SAMPLE_RATE = env_float('LOG_SUCCESS_SAMPLE_RATE', 1.0)
+
+        # Node-wide shared-memory cache and counters (gunicorn workers on one host)
+        self.SHARED_STORE_ENABLED = env_bool('SHARED_STORE_ENABLED', False)
+        self.SHARED_STORE_PATH = os.getenv('SHARED_STORE_PATH', '')
+        self.SHARED_STORE_BUCKETS = env_int('SHARED_STORE_BUCKETS', 512)
+        # OpenAI result URLs expire after an hour
+        self.GENERATION_CACHE_TTL_SECONDS = env_float('GENERATION_CACHE_TTL_SECONDS', 3000.0)
+        # Requests per client address per minute; 0 disables (needs the shared store)
+        self.RATE_LIMIT_PER_MINUTE = env_int('RATE_LIMIT_PER_MINUTE', 0)
+
+        # Decode limits checked against the image header before any pixels are decoded
+        self.IMAGE_ALLOWED_FORMATS = [f.strip().upper() for f in os.getenv('IMAGE_ALLOWED_FORMATS', 'PNG,JPEG,WEBP').split(',')]
+        self.IMAGE_MAX_DIMENSION = env_int('IMAGE_MAX_DIMENSION', 4096)
+        self.IMAGE_MAX_PIXELS = env_int('IMAGE_MAX_PIXELS', 4096 * 4096)
+        self.IMAGE_MAX_FRAMES = env_int('IMAGE_MAX_FRAMES', 1)
+        self.IMAGE_MEMORY_BUDGET_BYTES = env_int('IMAGE_MEMORY_BUDGET_BYTES', 192 * 1024 * 1024)
+        self.IMAGE_DECODE_TIMEOUT_SECONDS = env_float('IMAGE_DECODE_TIMEOUT_SECONDS', 2.0)
+        # Resize filters: 'auto' (photo for JPEG, line_art otherwise), 'line_art', 'photo' or 'quality' (LANCZOS only)
+        self.IMAGE_RESAMPLING = os.getenv('IMAGE_RESAMPLING', 'auto')
+
+        # Branded, downscaled variants of each generated image
+        self.POSTPROCESS_ENABLED = env_bool('POSTPROCESS_ENABLED', True)
+        self.POSTPROCESS_VARIANTS = os.getenv('POSTPROCESS_VARIANTS', 'display:1024:webp:80,thumb:256:jpeg:85')
+        self.POSTPROCESS_WORKERS = env_int('POSTPROCESS_WORKERS', 2)
+        self.POSTPROCESS_FETCH_TIMEOUT_SECONDS = env_float('POSTPROCESS_FETCH_TIMEOUT_SECONDS', 10.0)
+        # Local directory, so /api/images only serves variants rendered on this host. With several
+        # hosts behind a load balancer, point it at a shared mount (e.g. NFS/EFS) or pin clients to a host
+        self.VARIANT_STORE_PATH = os.getenv('VARIANT_STORE_PATH', os.path.join(tempfile.gettempdir(), 'draw-with-me-variants'))
+        self.VARIANT_MAX_AGE_SECONDS = env_int('VARIANT_MAX_AGE_SECONDS', 365 * 24 * 3600)
+        self.WATERMARK_ENABLED = env_bool('WATERMARK_ENABLED', True)
+        # Empty uses the built-in "Draw With Me" badge
+        self.WATERMARK_PATH = os.getenv('WATERMARK_PATH', '')
+        self.WATERMARK_OPACITY = env_float('WATERMARK_OPACITY', 0.85)
+
+        # Batch generation
+        self.BATCH_MAX_ITEMS = env_int('BATCH_MAX_ITEMS', 1000)
+        # Largest batch body accepted, checked before it is read
+        self.BATCH_MAX_BYTES = env_int('BATCH_MAX_BYTES', 64 * 1024 * 1024)
+        self.BATCH_UPSTREAM_CONCURRENCY = env_int('BATCH_UPSTREAM_CONCURRENCY', 4)
+        # Preprocessing processes per web worker; 0 preprocesses on threads instead
+        self.BATCH_PREPROCESS_WORKERS = env_int('BATCH_PREPROCESS_WORKERS', min(4, os.cpu_count() or 1))
+
+        # Durable job queue shared by the web app and `python -m app.worker`
+        self.JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'draw-with-me-jobs.db'))
+        self.JOB_VISIBILITY_TIMEOUT_SECONDS = env_float('JOB_VISIBILITY_TIMEOUT_SECONDS', 60.0)
+        self.JOB_MAX_ATTEMPTS = env_int('JOB_MAX_ATTEMPTS', 3)
+
+        # Stage events of jobs, pushed to clients by `python -m app.progress_server`
+        self.JOB_EVENTS_RETENTION_SECONDS = env_float('JOB_EVENTS_RETENTION_SECONDS', 86400.0)
+        self.PROGRESS_HOST = os.getenv('PROGRESS_HOST', '0.0.0.0')
+        self.PROGRESS_PORT = env_int('PROGRESS_PORT', 5002)
+        self.PROGRESS_POLL_SECONDS = env_float('PROGRESS_POLL_SECONDS', 0.1)
+        self.PROGRESS_PING_SECONDS = env_float('PROGRESS_PING_SECONDS', 20.0)
+        self.PROGRESS_MAX_CONNECTIONS = env_int('PROGRESS_MAX_CONNECTIONS', 10000)
+
+        # Per-tenant usage accounting (tenant = API key, else Origin) and daily budgets
+        self.USAGE_ENABLED = env_bool('USAGE_ENABLED', True)
+        # Accepted X-API-Key values as "name=key,..."; requests with any other key are refused.
+        # Origin tenants are best-effort: non-browser clients can send any Origin
+        self.USAGE_API_KEYS = os.getenv('USAGE_API_KEYS', '')
+        self.USAGE_DB_PATH = os.getenv('USAGE_DB_PATH', os.path.join(tempfile.gettempdir(), 'draw-with-me-usage.db'))
+        self.USAGE_FLUSH_SECONDS = env_float('USAGE_FLUSH_SECONDS', 10.0)
+        # USD per images.edit call at 1024x1024
+        self.USAGE_COST_PER_CALL = env_float('USAGE_COST_PER_CALL', 0.02)
+        # USD per tenant per UTC day; 0 is unlimited. USAGE_BUDGETS ("tenant=usd,...") overrides per tenant
+        self.USAGE_DAILY_BUDGET = env_float('USAGE_DAILY_BUDGET', 0.0)
+        self.USAGE_BUDGETS = os.getenv('USAGE_BUDGETS', '')
+        # Bearer token for reports across tenants; without it /api/usage only shows the caller's own
+        self.ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+        # Opt-in sampled capture of /api/generate inputs for benchmarks/replay.py
+        self.CAPTURE_ENABLED = env_bool('CAPTURE_ENABLED', False)
+        self.CAPTURE_SAMPLE_RATE = env_float('CAPTURE_SAMPLE_RATE', 0.01)
+        self.CAPTURE_PATH = os.getenv('CAPTURE_PATH', os.path.join(tempfile.gettempdir(), 'draw-with-me-corpus'))
+        self.CAPTURE_MAX_ENTRIES = env_int('CAPTURE_MAX_ENTRIES', 1000)
+
+        # Admin-only profiling under /api/admin/profile (needs ADMIN_TOKEN); off unless enabled
+        self.PROFILING_ENABLED = env_bool('PROFILING_ENABLED', False)
+        self.PROFILE_PATH = os.getenv('PROFILE_PATH', os.path.join(tempfile.gettempdir(), 'draw-with-me-profiles'))
+        self.PROFILE_MAX_REQUESTS = env_int('PROFILE_MAX_REQUESTS', 100)
+        self.PROFILE_SAMPLE_INTERVAL_MS = env_float('PROFILE_SAMPLE_INTERVAL_MS', 5.0)
+
+        # Response compression for JSON/NDJSON bodies
+        self.COMPRESSION_ENABLED = env_bool('COMPRESSION_ENABLED', True)
+        self.COMPRESSION_MIN_BYTES = env_int('COMPRESSION_MIN_BYTES', 1024)
+        self.COMPRESSION_LEVEL = env_int('COMPRESSION_LEVEL', 6)
+
+        # Health snapshot refreshed in the background; an empty URL skips the upstream probe
+        self.HEALTH_REFRESH_SECONDS = env_float('HEALTH_REFRESH_SECONDS', 15.0)
+        self.HEALTH_UPSTREAM_URL = os.getenv('HEALTH_UPSTREAM_URL', 'https://api.openai.com/v1/models')
+        self.HEALTH_UPSTREAM_TIMEOUT_SECONDS = env_float('HEALTH_UPSTREAM_TIMEOUT_SECONDS', 2.0)
+
+        # Import openai/Pillow codecs during create_app instead of on first use
+        self.WARM_UP_ON_START = env_bool('WARM_UP_ON_START', False)
+
+
+class TestingConfig(Config):
+    """Configuration for unit tests: no logging reconfiguration, no warm-up."""
+
+    def __init__(self):
+        super().__init__()
+        self.TESTING = True
+        self.WARM_UP_ON_START = False
+        self.BATCH_PREPROCESS_WORKERS = 0
+        self.HEALTH_UPSTREAM_URL = ''
+        self.POSTPROCESS_ENABLED = False
+        self.USAGE_ENABLED = False
@@ -0,0 +1,321 @@
+"""
+WebSocket server that pushes generation progress to subscribed clients.
+
+Usage:
+    python -m app.progress_server --port 5002
+
+A client queues a generation with ``POST /api/jobs`` and connects to
+``ws://<host>:<port>/jobs/<jobId>``. It receives the job's stage events so far
+and then each new one as it is recorded, as JSON text messages::
+
+    {"type": "progress", "id": 41, "jobId": "...", "stage": "queued", "at": 1730000000.1}
+
+The ``completed`` event carries the result (``imageUrl`` and, with
+post-processing, ``variants``) and ``failed`` carries ``error``; the server
+closes the connection after either. Unknown jobs are closed with code 4404.
+
+One asyncio process holds every connection: a connection is a socket and a
+parked coroutine, and a single poller reads new events for all of them from
+the job queue's event log (one indexed query per ``PROGRESS_POLL_SECONDS``,
+however many clients are connected) and fans them out. Pings every
+``PROGRESS_PING_SECONDS`` keep proxies from dropping idle connections and
+detect dead peers. The poller also prunes events older than
+``JOB_EVENTS_RETENTION_SECONDS``.
+"""
+
+import argparse
+import asyncio
+import logging
+import re
+import signal
+import time
+
+from app.services.job_queue import TERMINAL_STAGES
+from app.utils import websocket
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Close code for a job id the queue does not know
+CLOSE_UNKNOWN_JOB = 4404
+
+_JOB_PATH = re.compile(r'^(?:/ws)?/jobs/([0-9a-f]{32})/?$')
+
+# Drop a client whose unsent events exceed this many bytes
+_MAX_BUFFERED_BYTES = 256 * 1024
+
+
+class _Subscriber:
+    """One connected client following one job."""
+
+    __slots__ = ('job_id', 'writer', 'last_id', 'last_seen', 'closing', 'held')
+
+    def __init__(self, job_id, writer):
+        self.job_id = job_id
+        self.writer = writer
+        self.last_id = 0
+        self.last_seen = time.monotonic()
+        self.closing = False
+        # Live events that arrive while the backlog is read; None once it has been sent
+        self.held = []
+
+
+class ProgressServer:
+    """
+    Fans job events out to WebSocket subscribers.
+
+    Args:
+        queue (JobQueue): Queue whose event log is followed
+        poll_interval (float): Seconds between reads of the event log
+        ping_interval (float): Seconds between pings; a client silent for
+            two intervals is disconnected
+        max_connections (int): Further handshakes are refused with 503
+        retention (float): Seconds job events are kept; 0 keeps them forever
+        image_base_url (str): Prefix of stored variant URLs (``/api/images`` on the API)
+    """
+
+    def __init__(self, queue, poll_interval=0.1, ping_interval=20.0, max_connections=10000, retention=86400.0,
+                 image_base_url='/api/images'):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.ping_interval = ping_interval
+        self.max_connections = max_connections
+        self.retention = retention
+        self.image_base_url = image_base_url.rstrip('/')
+        self.connections = 0
+        self._subscribers = {}
+        self._cursor = 0
+        self._tasks = []
+        self._server = None
+
+    async def start(self, host='0.0.0.0', port=5002):
+        """
+        Start listening and following the event log.
+
+        Returns:
+            asyncio.base_events.Server: The listening server (``port=0`` picks a free port)
+        """
+        loop = asyncio.get_running_loop()
+        self._cursor = await loop.run_in_executor(None, self.queue.last_event_id)
+        self._server = await asyncio.start_server(self._handle, host, port, limit=websocket.MAX_HEADER_BYTES,
+                                                  backlog=1024)
+        self._tasks = [asyncio.create_task(self._poll()), asyncio.create_task(self._ping())]
+        return self._server
+
+    async def stop(self):
+        """Stop accepting connections and close the open ones as going away."""
+        if self._server is not None:
+            self._server.close()
+        for task in self._tasks:
+            task.cancel()
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in list(subscribers):
+                self._close(subscriber, websocket.CLOSE_GOING_AWAY, 'Server shutting down')
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    # Connections
+
+    async def _handle(self, reader, writer):
+        subscriber = None
+        try:
+            try:
+                method, target, headers = await asyncio.wait_for(websocket.read_request(reader), 10)
+            except (websocket.ProtocolError, asyncio.TimeoutError) as e:
+                writer.write(websocket.error_response(400, str(e) or 'Handshake timed out'))
+                return
+            problem = websocket.handshake_error(headers) if method == 'GET' else (400, "Expected GET")
+            match = _JOB_PATH.match(target.split('?', 1)[0])
+            if problem is None and match is None:
+                problem = 404, "Subscribe to /jobs/<jobId>"
+            if problem is None and self.connections >= self.max_connections:
+                problem = 503, "Too many connections"
+            if problem is not None:
+                writer.write(websocket.error_response(*problem))
+                return
+
+            writer.write(websocket.handshake_response(headers['sec-websocket-key']))
+            subscriber = self._subscribe(match.group(1), writer)
+            await self._send_backlog(subscriber)
+            await self._read_until_closed(subscriber, reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error("Progress connection failed: %s", e)
+        finally:
+            if subscriber is not None:
+                self._unsubscribe(subscriber)
+            writer.close()
+
+    def _subscribe(self, job_id, writer):
+        # Registered before the backlog is read, so no event falls between the two;
+        # live events are held until the backlog has been sent (see _send_backlog)
+        subscriber = _Subscriber(job_id, writer)
+        self._subscribers.setdefault(job_id, set()).add(subscriber)
+        self.connections += 1
+        return subscriber
+
+    def _unsubscribe(self, subscriber):
+        subscribers = self._subscribers.get(subscriber.job_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.job_id]
+        self.connections -= 1
+
+    async def _send_backlog(self, subscriber):
+        loop = asyncio.get_running_loop()
+        events = await loop.run_in_executor(None, self.queue.events, subscriber.job_id)
+        if not events and await loop.run_in_executor(None, self.queue.get, subscriber.job_id) is None:
+            self._close(subscriber, CLOSE_UNKNOWN_JOB, 'Job not found')
+            return
+        # Events the poller dispatched meanwhile follow the backlog; those it
+        # already contains are skipped by _deliver
+        held, subscriber.held = subscriber.held, None
+        for event in events + held:
+            self._deliver(subscriber, event)
+
+    async def _read_until_closed(self, subscriber, reader):
+        while True:
+            try:
+                opcode, payload = await websocket.read_frame(reader)
+            except websocket.ProtocolError as e:
+                self._close(subscriber, e.close_code, str(e))
+                return
+            subscriber.last_seen = time.monotonic()
+            if opcode == websocket.OP_CLOSE:
+                if not subscriber.closing:
+                    subscriber.writer.write(websocket.encode_frame(websocket.OP_CLOSE, payload[:2]))
+                return
+            if opcode == websocket.OP_PING:
+                subscriber.writer.write(websocket.encode_frame(websocket.OP_PONG, payload))
+
+    def _deliver(self, subscriber, event):
+        if subscriber.closing or event['id'] <= subscriber.last_id:
+            return
+        subscriber.last_id = event['id']
+        transport = subscriber.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > _MAX_BUFFERED_BYTES:
+            logger.warning("Dropping slow progress subscriber of job %s", subscriber.job_id)
+            transport.abort()
+            return
+        subscriber.writer.write(websocket.text_frame(self._public_event(event)))
+        if event['stage'] in TERMINAL_STAGES:
+            self._close(subscriber, websocket.CLOSE_NORMAL, event['stage'])
+
+    def _close(self, subscriber, code, reason):
+        if subscriber.closing:
+            return
+        subscriber.closing = True
+        if not subscriber.writer.transport.is_closing():
+            subscriber.writer.write(websocket.close_frame(code, reason))
+        # Give the client a moment to answer the close before dropping the socket
+        asyncio.get_running_loop().call_later(5, subscriber.writer.close)
+
+    def _public_event(self, event):
+        message = dict(event, type='progress')
+        variants = message.get('variants')
+        if variants:
+            message['variants'] = {name: dict(variant, url=f"{self.image_base_url}/{variant['name']}")
+                                   for name, variant in variants.items()}
+        return message
+
+    # Background tasks
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        pruned_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if not self._subscribers:
+                    # Nobody to tell; just keep the cursor current
+                    self._cursor = await loop.run_in_executor(None, self.queue.last_event_id)
+                else:
+                    await self._dispatch_new_events(loop)
+                if self.retention and time.monotonic() - pruned_at > 3600:
+                    pruned_at = time.monotonic()
+                    deleted = await loop.run_in_executor(None, self.queue.prune_events, time.time() - self.retention)
+                    logger.info("Pruned %d job events", deleted)
+            except Exception as e:
+                logger.error("Could not read job events: %s", e)
+
+    async def _dispatch_new_events(self, loop):
+        while True:
+            events = await loop.run_in_executor(None, self.queue.events_since, self._cursor)
+            for event in events:
+                self._cursor = event['id']
+                for subscriber in list(self._subscribers.get(event['jobId'], ())):
+                    if subscriber.held is not None:
+                        subscriber.held.append(event)
+                    else:
+                        self._deliver(subscriber, event)
+            if len(events) < 1000:
+                return
+
+    async def _ping(self):
+        ping = websocket.encode_frame(websocket.OP_PING)
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            silent_since = time.monotonic() - 2 * self.ping_interval
+            for subscribers in list(self._subscribers.values()):
+                for subscriber in list(subscribers):
+                    if subscriber.last_seen < silent_since:
+                        subscriber.writer.transport.abort()
+                    elif not subscriber.closing:
+                        subscriber.writer.write(ping)
+
+
+def _raise_file_limit():
+    """Allow as many open sockets as the hard limit permits."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+async def serve(config, host, port):
+    """Run a progress server for ``config`` until SIGTERM or SIGINT."""
+    from app.services.job_queue import get_job_queue
+
+    server = ProgressServer(
+        get_job_queue(config),
+        poll_interval=config['PROGRESS_POLL_SECONDS'],
+        ping_interval=config['PROGRESS_PING_SECONDS'],
+        max_connections=config['PROGRESS_MAX_CONNECTIONS'],
+        retention=config['JOB_EVENTS_RETENTION_SECONDS'],
+    )
+    listening = await server.start(host, port)
+    logger.info("Progress server listening on %s", ', '.join(str(s.getsockname()) for s in listening.sockets))
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    await stopping.wait()
+    await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push generation progress over WebSockets.")
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from app.config import Config
+    from app.utils.structured_logging import configure_logging
+
+    load_dotenv()
+    config = vars(Config())
+    configure_logging(level=config['LOG_LEVEL'], fmt=config['LOG_FORMAT'])
+    _raise_file_limit()
+    asyncio.run(serve(config, args.host or config['PROGRESS_HOST'], args.port or config['PROGRESS_PORT']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,29 @@
 """Health check endpoints for monitoring the API in production."""
 
-from flask import Blueprint, jsonify
+from flask import Blueprint, current_app, jsonify
+
+from app.services.health import HealthMonitor
 
 health_bp = Blueprint('health', __name__, url_prefix='/api')
 
+def get_health_monitor(app):
+    """Return the app's health monitor, creating it on first use."""
+    monitor = app.extensions.get('health_monitor')
+    if monitor is None:
+        monitor = app.extensions.setdefault('health_monitor', HealthMonitor(app.config))
+    return monitor
+
 @health_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint to verify the API is running.
-    
+
+    Served from a snapshot refreshed in the background, so it costs the same
+    however often load balancers call it.
+
     Returns:
-        JSON response with status 'ok'
+        JSON response with status 'ok' (or 'degraded' when the upstream API
+        is unreachable), upstream reachability, cache and job queue stats
     """
-    return jsonify({
-        'status': 'ok',
-        'message': 'Draw With Me API is running',
-        'service': 'draw-with-me-api'
-    }) 
\ No newline at end of file
+    response = jsonify(get_health_monitor(current_app).snapshot())
+    response.cache_control.no_store = True
+    return response
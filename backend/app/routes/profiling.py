@@ -0,0 +1,126 @@
+"""Admin-only endpoints that drive the per-process profiler (see app/utils/profiling.py)."""
+
+import math
+import os
+
+from flask import Blueprint, current_app, jsonify, request, send_file, url_for
+
+from app.utils.admin import is_admin
+from app.utils.profiling import ARTIFACTS, SessionRunning
+
+# Longest a session may stay armed
+MAX_TIMEOUT_SECONDS = 3600
+
+profiling_bp = Blueprint('profiling', __name__, url_prefix='/api/admin/profile')
+
+@profiling_bp.before_request
+def require_admin():
+    """Refuse every profiling request without the admin token."""
+    if not is_admin(request.headers, current_app.config['ADMIN_TOKEN']):
+        return jsonify({"error": "Admin token required"}), 403
+
+@profiling_bp.after_request
+def no_store(response):
+    """Profiles describe one moment of one process; never cache them."""
+    response.cache_control.no_store = True
+    return response
+
+def _profiler():
+    return current_app.extensions['profiler']
+
+def _with_urls(session):
+    session['resultUrl'] = url_for('profiling.get_session', session_id=session['id'])
+    return session
+
+@profiling_bp.route('', methods=['POST'])
+def start_session():
+    """
+    Profile the next requests handled by this worker process.
+    
+    Expects a JSON body with:
+    - mode: "cprofile", "sample" or "memory"
+    - requests (optional): How many requests to profile; defaults to 10
+    - pathPrefix (optional): Only profile requests under this path, e.g. "/api/generate"
+    - timeoutSeconds (optional): Finish with what was collected after this long,
+      up to an hour; defaults to 300
+    - frames (optional): tracemalloc traceback depth in memory mode; defaults to 10
+    
+    Returns 202 with the session (id, pid, mode, status, resultUrl), or 409
+    if this process already has a session running.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        timeout = float(data.get('timeoutSeconds', 300))
+        if not math.isfinite(timeout) or not 0 < timeout <= MAX_TIMEOUT_SECONDS:
+            raise ValueError(f"timeoutSeconds must be between 0 and {MAX_TIMEOUT_SECONDS}")
+        session = _profiler().start(
+            data.get('mode'),
+            int(data.get('requests', 10)),
+            path_prefix=data.get('pathPrefix'),
+            timeout=timeout,
+            frames=int(data.get('frames', 10)),
+        )
+    except SessionRunning as e:
+        return jsonify({"error": str(e), "pid": os.getpid()}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(_with_urls(session)), 202
+
+@profiling_bp.route('', methods=['DELETE'])
+def stop_session():
+    """Finish this process's running session now, keeping what it collected."""
+    session = _profiler().stop()
+    if session is None:
+        return jsonify({"error": "No session is running in this process", "pid": os.getpid()}), 404
+    return jsonify(_with_urls(session))
+
+@profiling_bp.route('/endpoints', methods=['GET'])
+def endpoint_cpu():
+    """
+    Report CPU and wall time per endpoint for this process since it started.
+    
+    Returns a JSON response with pid, since and endpoints (endpoint,
+    requests, cpuMs, wallMs, avgCpuMs, cpuShare), most CPU first.
+    """
+    return jsonify(_profiler().endpoint_report())
+
+@profiling_bp.route('/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """
+    Return a session's status and, once finished, links to its artifacts.
+    
+    A running session is only known to the process profiling it; finished
+    sessions can be read from any worker on the host.
+    """
+    try:
+        session = _profiler().status(session_id)
+    except ValueError:
+        session = None
+    if session is None:
+        return jsonify({"error": "Session not found", "pid": os.getpid()}), 404
+    session = _with_urls(session)
+    session['artifactUrls'] = {
+        name: url_for('profiling.get_artifact', session_id=session_id, artifact=name)
+        for name in session.get('artifacts', [])
+    }
+    return jsonify(session)
+
+@profiling_bp.route('/<session_id>/<artifact>', methods=['GET'])
+def get_artifact(session_id, artifact):
+    """
+    Download a finished session's artifact.
+    
+    Artifacts are "pstats" (load with pstats.Stats or snakeviz), "text"
+    (a summary) and "collapsed" (stacks for flamegraph.pl or speedscope).
+    """
+    if artifact not in ARTIFACTS:
+        return jsonify({"error": "Artifact not found"}), 404
+    suffix, mimetype = ARTIFACTS[artifact]
+    try:
+        path = _profiler().result_path(session_id, suffix)
+    except ValueError:
+        return jsonify({"error": "Artifact not found"}), 404
+    if not os.path.exists(path):
+        return jsonify({"error": "Artifact not found"}), 404
+    return send_file(path, mimetype=mimetype, as_attachment=artifact == 'pstats',
+                     download_name=f"{session_id}{suffix}")
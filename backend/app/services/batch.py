@@ -0,0 +1,301 @@
+"""
+Batch generation: parallel preprocessing and capped upstream concurrency.
+
+Doodles are decoded and normalised on a process pool so a batch uses every
+core; each processed image is then handed to a small thread pool that limits
+how many OpenAI calls are in flight. Results are yielded as soon as each item
+finishes, so the caller can stream them back.
+"""
+
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from app.utils.deadline import Deadline, DeadlineExceeded
+from app.utils.image_utils import decode_base64_image, validate_and_process_image
+from app.utils.image_guard import DEFAULT_LIMITS
+from app.services.shared_store import generation_cache_key
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+_preprocess_executor = None
+_preprocess_workers = 0
+_preprocess_lock = threading.Lock()
+
+
+def get_preprocess_executor(workers):
+    """
+    Return the shared preprocessing pool, creating it on first use.
+
+    Args:
+        workers (int): Number of worker processes; 0 runs preprocessing on
+            threads of the current process instead
+
+    Returns:
+        concurrent.futures.Executor: The pool
+    """
+    global _preprocess_executor, _preprocess_workers
+    if _preprocess_executor is None:
+        with _preprocess_lock:
+            if _preprocess_executor is None:
+                _preprocess_workers = workers
+                if workers > 0:
+                    # forkserver: forking a threaded web worker is not safe
+                    _preprocess_executor = ProcessPoolExecutor(
+                        max_workers=workers,
+                        mp_context=multiprocessing.get_context('forkserver'),
+                    )
+                else:
+                    _preprocess_executor = ThreadPoolExecutor(
+                        max_workers=os.cpu_count() or 2,
+                        thread_name_prefix='batch-preprocess',
+                    )
+    return _preprocess_executor
+
+
+def replace_broken_executor(broken):
+    """
+    Swap out a process pool that lost a worker.
+
+    A ``ProcessPoolExecutor`` whose worker dies stays broken for good, so the
+    shared pool is dropped and rebuilt with the same number of workers. Safe to
+    call more than once for the same pool.
+
+    Args:
+        broken (Executor): The pool that raised ``BrokenProcessPool``
+
+    Returns:
+        concurrent.futures.Executor: The pool to use from now on
+    """
+    global _preprocess_executor
+    with _preprocess_lock:
+        replaced = _preprocess_executor is broken
+        if replaced:
+            _preprocess_executor = None
+    if replaced:
+        logger.error("Preprocessing pool broke; starting a new one")
+        broken.shutdown(wait=False, cancel_futures=True)
+    return get_preprocess_executor(_preprocess_workers)
+
+
+def preprocess_item(image_data, limits=DEFAULT_LIMITS):
+    """
+    Decode and normalise one doodle. Runs in a pool worker.
+
+    Args:
+        image_data (str or bytes): Base64/data URL string, or raw image bytes
+        limits (ImageLimits): Decode limits
+
+    Returns:
+        bytes: Processed PNG ready for the upstream call
+
+    Raises:
+        ValueError: If the image is invalid
+    """
+    if isinstance(image_data, str):
+        image_data = decode_base64_image(image_data)
+    return validate_and_process_image(image_data, limits).getvalue()
+
+
+def parse_ndjson_items(lines, max_items):
+    """
+    Parse an NDJSON batch body into items.
+
+    Each line is a JSON object with ``imageData`` and optional ``id`` and
+    ``promptHint``. Lines that cannot be used become items carrying an error.
+
+    Args:
+        lines (iterable of bytes or str): Body lines
+        max_items (int): Maximum number of items accepted
+
+    Returns:
+        list of dict: Items with ``index``, ``id`` and either ``imageData``/``promptHint`` or ``error``
+
+    Raises:
+        ValueError: If the batch holds more than ``max_items`` items
+    """
+    items = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        if not line:
+            continue
+        index = len(items)
+        if index >= max_items:
+            raise ValueError(f"Batch is limited to {max_items} items")
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            items.append({'index': index, 'id': None, 'error': f"Invalid JSON: {e}", 'status': 400})
+            continue
+        if not isinstance(record, dict) or not record.get('imageData'):
+            items.append({'index': index, 'id': _item_id(record), 'error': "Image data is missing", 'status': 400})
+            continue
+        items.append({
+            'index': index,
+            'id': _item_id(record),
+            'imageData': record['imageData'],
+            'promptHint': record.get('promptHint'),
+        })
+    return items
+
+
+def parse_multipart_items(files, prompt_hint, max_items):
+    """
+    Turn uploaded files into items; each file's name is its id.
+
+    Args:
+        files (list of FileStorage): Uploaded images
+        prompt_hint (str or None): Hint applied to every image
+        max_items (int): Maximum number of items accepted
+
+    Returns:
+        list of dict: Items as returned by ``parse_ndjson_items``
+
+    Raises:
+        ValueError: If the batch holds more than ``max_items`` items
+    """
+    if len(files) > max_items:
+        raise ValueError(f"Batch is limited to {max_items} items")
+    return [
+        {'index': index, 'id': upload.filename, 'imageData': upload.read(), 'promptHint': prompt_hint}
+        for index, upload in enumerate(files)
+    ]
+
+
+def _item_id(record):
+    return record.get('id') if isinstance(record, dict) else None
+
+
+def _item_error(item, error):
+    if isinstance(error, DeadlineExceeded):
+        message, status = str(error), 504
+    elif isinstance(error, BrokenProcessPool):
+        message, status = "Preprocessing worker crashed; retry the item", 503
+    elif isinstance(error, ValueError):
+        message, status = f"Invalid image data: {error}", 400
+    else:
+        message, status = f"Failed to generate image: {error}", 500
+    return {'index': item['index'], 'id': item['id'], 'error': message, 'status': status}
+
+
+def _generate_item(generate, processed, prompt_hint, item_budget):
+    # The budget starts when the call does, not while it waits for a slot
+    deadline = Deadline(item_budget) if item_budget else None
+    return generate(io.BytesIO(processed), prompt_hint, deadline=deadline)
+
+
+def run_batch(items, generate, preprocess_executor, upstream_concurrency=4,
+              cache=None, cache_ttl=None, item_budget=None, image_limits=DEFAULT_LIMITS, admit=None):
+    """
+    Process a batch and yield one result per item in completion order.
+
+    Args:
+        items (list of dict): Items from ``parse_ndjson_items``/``parse_multipart_items``
+        generate (callable): ``generate_art_from_doodle`` or a stand-in with the same signature
+        preprocess_executor (Executor): Pool running ``preprocess_item``
+        upstream_concurrency (int): Maximum concurrent upstream calls
+        cache (SharedStore, optional): Generation cache shared with /api/generate
+        cache_ttl (float, optional): TTL for new cache entries
+        item_budget (float, optional): Seconds each upstream call may take
+        image_limits (ImageLimits): Decode limits applied to every item
+        admit (callable, optional): Called before each item is sent upstream;
+            an item it returns False for is reported as a 429 error instead
+            (e.g. once the tenant's spend budget is exhausted)
+
+    If a preprocessing process dies, the items it took down are reported as
+    503 errors and the shared pool is replaced (``replace_broken_executor``)
+    for the remaining items and later batches.
+
+    Yields:
+        dict: ``{'index', 'id', 'imageUrl'}`` or ``{'index', 'id', 'error', 'status'}``
+    """
+    upstream = ThreadPoolExecutor(max_workers=upstream_concurrency, thread_name_prefix='batch-upstream')
+    pending = {}
+    # Pool each preprocessing future was submitted to, to replace the right one when it breaks
+    submitted_to = {}
+    try:
+        for item in items:
+            if 'error' in item:
+                yield {key: item[key] for key in ('index', 'id', 'error', 'status')}
+                continue
+            try:
+                future = preprocess_executor.submit(preprocess_item, item['imageData'], image_limits)
+            except BrokenProcessPool as e:
+                preprocess_executor = replace_broken_executor(preprocess_executor)
+                yield _item_error(item, e)
+                continue
+            pending[future] = ('preprocess', item, None)
+            submitted_to[future] = preprocess_executor
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, item, cache_key = pending.pop(future)
+                pool = submitted_to.pop(future, None)
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    replace_broken_executor(pool)
+                if error is not None:
+                    yield _item_error(item, error)
+                    continue
+
+                if stage == 'upstream':
+                    image_url = future.result()
+                    if cache_key is not None:
+                        cache.set(cache_key, image_url.encode('utf-8'), ttl=cache_ttl)
+                    yield {'index': item['index'], 'id': item['id'], 'imageUrl': image_url}
+                    continue
+
+                processed = future.result()
+                if cache is not None:
+                    cache_key = generation_cache_key(processed, item['promptHint'])
+                    cached_url = cache.get(cache_key)
+                    if cached_url is not None:
+                        yield {'index': item['index'], 'id': item['id'],
+                               'imageUrl': cached_url.decode('utf-8'), 'cached': True}
+                        continue
+                if admit is not None and not admit():
+                    yield {'index': item['index'], 'id': item['id'],
+                           'error': "Daily usage budget exhausted", 'status': 429}
+                    continue
+                next_future = upstream.submit(_generate_item, generate, processed, item['promptHint'], item_budget)
+                pending[next_future] = ('upstream', item, cache_key)
+    finally:
+        # Reached early when the client disconnects; drop work that has not started
+        for future in pending:
+            future.cancel()
+        upstream.shutdown(wait=False, cancel_futures=True)
+
+
+def stream_ndjson(results, total):
+    """
+    Serialise batch results as NDJSON lines, ending with a summary line.
+
+    Args:
+        results (iterable of dict): Output of ``run_batch``
+        total (int): Number of items in the batch
+
+    Yields:
+        str: One JSON document per line
+    """
+    started = time.perf_counter()
+    failed = 0
+    for result in results:
+        if 'error' in result:
+            failed += 1
+        yield json.dumps(result) + '\n'
+    yield json.dumps({'summary': {
+        'total': total,
+        'succeeded': total - failed,
+        'failed': failed,
+        'elapsedMs': int((time.perf_counter() - started) * 1000),
+    }}) + '\n'
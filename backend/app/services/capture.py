@@ -0,0 +1,187 @@
+"""
+Sampled capture of /api/generate inputs into a local replay corpus.
+
+Off by default. When enabled, a ``CAPTURE_SAMPLE_RATE`` fraction of
+successful generations is written to ``CAPTURE_PATH``:
+
+    <sha256>.<ext>   the decoded upload, content-addressed
+    index.ndjson     one line per capture: input name and format, transport,
+                     normalized flag, prompt hint, digest of the processed
+                     PNG, cache status and per-stage timings in ms
+
+The decoded upload is kept rather than the processed PNG so that a replay
+runs the same preprocessing work as the original request; the processed
+digest lets the replay check that it produced the same image. Writes happen
+on a background thread, and each process stops adding to the corpus once it
+holds ``CAPTURE_MAX_ENTRIES``. Index lines are appended with a single
+``write`` on an ``O_APPEND`` descriptor, so processes sharing the corpus do
+not interleave.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.image_guard import inspect_image_header
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'index.ndjson'
+
+_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp'}
+
+
+def load_corpus(root):
+    """
+    Read a corpus index.
+
+    Args:
+        root (str): Corpus directory
+
+    Returns:
+        list of dict: Index entries, oldest first; unreadable lines are skipped
+    """
+    entries = []
+    try:
+        with open(os.path.join(root, INDEX_NAME), encoding='utf-8') as index:
+            for line in index:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping malformed corpus line")
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def read_input(root, entry):
+    """Return the captured upload of a corpus entry."""
+    with open(os.path.join(root, entry['input']), 'rb') as f:
+        return f.read()
+
+
+class CorpusCapture:
+    """
+    Writes sampled generate inputs to a corpus directory.
+
+    Args:
+        root (str): Corpus directory; created if missing
+        sample_rate (float): Fraction of requests captured (0-1)
+        max_entries (int): Stop capturing once the index has this many entries
+        rng (random.Random, optional): Sampling source, for tests
+    """
+
+    def __init__(self, root, sample_rate=0.01, max_entries=1000, rng=None):
+        self.root = root
+        self.sample_rate = sample_rate
+        self.max_entries = max_entries
+        self._random = (rng or random.Random()).random
+        os.makedirs(root, exist_ok=True)
+        self._count = len(load_corpus(root))
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='corpus-capture')
+
+    def sample(self):
+        """Decide whether to capture the current request; cheap enough to call on every request."""
+        return self._count < self.max_entries and self._random() < self.sample_rate
+
+    def capture(self, image_bytes, processed_png, prompt_hint, timings, transport='json', normalized=False,
+                cache_status=None):
+        """
+        Queue a capture; returns immediately.
+
+        Args:
+            image_bytes (bytes): The decoded upload
+            processed_png (bytes): Output of ``validate_and_process_image``
+            prompt_hint (str): Prompt hint sent with the request
+            timings (dict): Milliseconds per stage
+            transport (str): ``json`` (base64 data URL) or ``binary``
+            normalized (bool): Whether the client declared the image normalized
+            cache_status (str, optional): ``HIT``/``MISS`` from the generation cache
+
+        Returns:
+            Future: Resolves to the index entry, or None when the corpus is full
+        """
+        return self._executor.submit(self._write, image_bytes, processed_png, prompt_hint, dict(timings),
+                                     transport, normalized, cache_status, time.time())
+
+    def _write(self, image_bytes, processed_png, prompt_hint, timings, transport, normalized, cache_status,
+               captured_at):
+        try:
+            with self._lock:
+                if self._count >= self.max_entries:
+                    return None
+                self._count += 1
+
+            image_format = inspect_image_header(image_bytes).format
+            name = f"{hashlib.sha256(image_bytes).hexdigest()}.{_EXTENSIONS[image_format]}"
+            path = os.path.join(self.root, name)
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(image_bytes)
+                os.replace(tmp_path, path)
+
+            entry = {
+                'input': name,
+                'inputFormat': image_format,
+                'inputBytes': len(image_bytes),
+                'transport': transport,
+                'normalized': normalized,
+                'promptHint': prompt_hint,
+                'processedDigest': hashlib.sha256(processed_png).hexdigest(),
+                'cache': cache_status,
+                'timings': {stage: round(ms, 3) for stage, ms in timings.items()},
+                'capturedAt': captured_at,
+            }
+            line = (json.dumps(entry) + '\n').encode('utf-8')
+            fd = os.open(os.path.join(self.root, INDEX_NAME), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            return entry
+        except Exception as e:
+            logger.error("Corpus capture failed: %s", e)
+            return None
+
+    def shutdown(self):
+        """Wait for queued captures to be written."""
+        self._executor.shutdown(wait=True)
+
+
+_captures = {}
+_captures_lock = threading.Lock()
+
+
+def get_corpus_capture(config):
+    """
+    Return this process's corpus capture.
+
+    Args:
+        config (Mapping): App config with the CAPTURE_* settings
+
+    Returns:
+        CorpusCapture or None: The capture, or None when capture is disabled
+    """
+    if not config['CAPTURE_ENABLED']:
+        return None
+    root = config['CAPTURE_PATH']
+    capture = _captures.get(root)
+    if capture is None:
+        with _captures_lock:
+            capture = _captures.get(root)
+            if capture is None:
+                capture = CorpusCapture(
+                    root,
+                    sample_rate=config['CAPTURE_SAMPLE_RATE'],
+                    max_entries=config['CAPTURE_MAX_ENTRIES'],
+                )
+                _captures[root] = capture
+    return capture
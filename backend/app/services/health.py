@@ -0,0 +1,142 @@
+"""
+Cached health snapshots for load balancer checks.
+
+Health checks arrive every few seconds from every load balancer, so the
+handler must not do any real work. A background thread refreshes a snapshot
+(upstream reachability, shared-store and job-queue stats) every
+``HEALTH_REFRESH_SECONDS`` and the endpoint returns the latest one.
+"""
+
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from app.services.job_queue import get_job_queue
+from app.services.shared_store import get_shared_store
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def probe_upstream(url, timeout):
+    """
+    Check that the upstream API answers HTTP at all.
+
+    Any HTTP status counts as reachable (the probe is unauthenticated, so
+    OpenAI answers 401); only connection errors and timeouts do not.
+
+    Args:
+        url (str): URL to send a HEAD request to
+        timeout (float): Seconds to wait for a response
+
+    Returns:
+        dict: ``reachable``, ``latencyMs`` and, when unreachable, ``error``
+    """
+    started = time.perf_counter()
+    try:
+        urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=timeout).close()
+    except urllib.error.HTTPError:
+        pass
+    except (urllib.error.URLError, OSError) as e:
+        reason = getattr(e, 'reason', e)
+        return {'reachable': False, 'latencyMs': int((time.perf_counter() - started) * 1000), 'error': str(reason)}
+    return {'reachable': True, 'latencyMs': int((time.perf_counter() - started) * 1000)}
+
+
+class HealthMonitor:
+    """
+    Keeps a health snapshot fresh on a daemon thread.
+
+    Args:
+        config (Mapping): App config; HEALTH_UPSTREAM_URL (empty disables the
+            probe), HEALTH_UPSTREAM_TIMEOUT_SECONDS and HEALTH_REFRESH_SECONDS
+            are read along with the shared store and job queue settings
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.interval = config['HEALTH_REFRESH_SECONDS']
+        self._snapshot = self._base_snapshot()
+        self._snapshot['upstream'] = {'reachable': None}
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _base_snapshot(self):
+        return {
+            'status': 'ok',
+            'message': 'Draw With Me API is running',
+            'service': 'draw-with-me-api',
+        }
+
+    def collect(self):
+        """
+        Build a fresh snapshot. Slow (network probe, store scan); runs on the thread.
+
+        Returns:
+            dict: Snapshot served by the health endpoint
+        """
+        snapshot = self._base_snapshot()
+        url = self.config['HEALTH_UPSTREAM_URL']
+        if url:
+            snapshot['upstream'] = probe_upstream(url, self.config['HEALTH_UPSTREAM_TIMEOUT_SECONDS'])
+            if not snapshot['upstream']['reachable']:
+                snapshot['status'] = 'degraded'
+
+        store = get_shared_store(self.config)
+        if store is not None:
+            cache = store.stats()
+            cache['generateRequests'] = store.counter('metrics:generate.requests')
+            cache['generateCacheHits'] = store.counter('metrics:generate.cache_hits')
+            snapshot['cache'] = cache
+
+        try:
+            snapshot['jobs'] = get_job_queue(self.config).stats()
+        except Exception as e:
+            logger.warning("Could not read job queue stats: %s", e)
+        snapshot['checkedAt'] = time.time()
+        return snapshot
+
+    def refresh(self):
+        """Replace the snapshot with a fresh one."""
+        try:
+            self._snapshot = self.collect()
+        except Exception as e:
+            logger.error("Health refresh failed: %s", e)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def ensure_running(self):
+        """Start the refresh thread in this process if it is not running (e.g. after a fork)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def snapshot(self):
+        """
+        Return the latest snapshot, starting the refresh thread on first use.
+
+        Returns:
+            dict: Snapshot including its age in seconds
+        """
+        self.ensure_running()
+        snapshot = dict(self._snapshot)
+        if 'checkedAt' in snapshot:
+            snapshot['ageSeconds'] = round(time.time() - snapshot['checkedAt'], 3)
+        return snapshot
+
+    def stop(self):
+        """Stop the refresh thread."""
+        self._stop.set()
@@ -0,0 +1,136 @@
+"""Deadline-aware hedged calls to slow upstream services."""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app.utils.deadline import DeadlineExceeded
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Shared pool for upstream attempts; sized for a primary plus a hedge per worker thread
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='upstream')
+
+
+class LatencyTracker:
+    """
+    Rolling window of upstream latencies used to decide when to hedge.
+
+    Args:
+        percentile (float): Percentile (0-100) the primary must exceed before a hedge fires
+        window (int): Number of recent samples kept
+        min_samples (int): Samples required before hedging is enabled
+    """
+
+    def __init__(self, percentile=95, window=200, min_samples=20):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Add one successful attempt latency to the window."""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def hedge_delay(self):
+        """
+        Return how long to wait on the primary before hedging.
+
+        Returns:
+            float or None: Latency at the configured percentile, or None while
+            there are too few samples to estimate it
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))
+        return ordered[index]
+
+
+def hedged_call(attempt, deadline, tracker=None, hedge_delay=None, hedge=True):
+    """
+    Run ``attempt`` under a deadline, firing one duplicate if the primary is slow.
+
+    The first attempt to succeed wins. A failed attempt only fails the call once
+    no other attempt is still running. Attempts that lose the race are cancelled
+    if they have not started and otherwise left to finish in the background;
+    their results are discarded.
+
+    Args:
+        attempt (callable): Called as ``attempt(index)`` where index is 0 for the
+            primary and 1 for the hedge
+        deadline (Deadline): Budget for the whole call
+        tracker (LatencyTracker, optional): Latency history; successful attempts
+            are recorded into it and it provides the hedge delay
+        hedge_delay (float, optional): Fixed hedge delay, overriding the tracker.
+            When neither gives a delay no hedge is sent.
+        hedge (bool): Set to False to only apply the deadline
+
+    Returns:
+        Whatever the winning attempt returned
+
+    Raises:
+        DeadlineExceeded: If no attempt succeeded within the budget
+        Exception: The primary's error when every attempt failed
+    """
+    deadline.check('upstream call')
+
+    if not hedge:
+        hedge_delay = None
+    elif hedge_delay is None and tracker is not None:
+        hedge_delay = tracker.hedge_delay()
+
+    def timed(index):
+        started = time.monotonic()
+        result = attempt(index)
+        if tracker is not None:
+            tracker.record(time.monotonic() - started)
+        return result
+
+    def submit(index):
+        # Carry the request's logging context into the pool thread
+        return _executor.submit(contextvars.copy_context().run, timed, index)
+
+    started = time.monotonic()
+    pending = {submit(0)}
+    errors = []
+    hedged = False
+
+    while pending:
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            break
+
+        timeout = remaining
+        if not hedged and hedge_delay is not None:
+            timeout = min(timeout, max(0.0, hedge_delay - (time.monotonic() - started)))
+
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            error = future.exception()
+            if error is None:
+                for other in pending:
+                    other.cancel()
+                if hedged:
+                    logger.info("Hedged upstream call completed")
+                return future.result()
+            errors.append(error)
+
+        if not done and not hedged and hedge_delay is not None and not deadline.expired():
+            logger.info("Primary upstream call exceeded %.3fs, sending hedge", hedge_delay)
+            pending.add(submit(1))
+            hedged = True
+
+    for future in pending:
+        future.cancel()
+
+    if errors and not pending:
+        raise errors[0]
+    raise DeadlineExceeded('upstream call')
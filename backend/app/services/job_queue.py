@@ -0,0 +1,474 @@
+"""
+Durable job queue for generations, with a SQLite (WAL) backend.
+
+Jobs follow a lease/ack protocol: a worker leases a job, which hides it from
+other workers for the visibility timeout, then acks it with a result or fails
+it. A worker that dies without doing either simply lets the lease expire and
+the job becomes visible again, so nothing in flight is lost on restart.
+
+Every job also has an append-only log of stage events (received, queued,
+preprocessed, upstream_started, retrying, completed, failed) that progress
+subscribers follow by event id. Events that change a job's status are written
+in the same transaction as the change.
+
+``JobQueue`` defines the interface; ``SQLiteJobQueue`` is the default backend
+and other stores can be plugged in by implementing the same methods.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+# Stage events, in the order a successful job goes through them
+RECEIVED = 'received'
+PREPROCESSED = 'preprocessed'
+UPSTREAM_STARTED = 'upstream_started'
+COMPLETED = 'completed'
+RETRYING = 'retrying'
+STAGES = (RECEIVED, QUEUED, PREPROCESSED, UPSTREAM_STARTED, COMPLETED)
+# Stages after which a job produces no more events
+TERMINAL_STAGES = frozenset([COMPLETED, FAILED])
+
+# A leased job as handed to a worker
+Job = namedtuple('Job', ['id', 'payload', 'attempts', 'max_attempts', 'lease_owner'])
+
+
+class JobQueue:
+    """Interface for job queue backends."""
+
+    def enqueue(self, payload, max_attempts=None, job_id=None, received_at=None):
+        """Add a job and return its id."""
+        raise NotImplementedError
+
+    def lease(self, owner, visibility_timeout=None):
+        """Lease the next available job for ``owner``; return a Job or None."""
+        raise NotImplementedError
+
+    def extend(self, job_id, owner, visibility_timeout=None):
+        """Push back the lease expiry of a job still held by ``owner``."""
+        raise NotImplementedError
+
+    def ack(self, job_id, owner, result):
+        """Complete a leased job; return False if the lease was lost."""
+        raise NotImplementedError
+
+    def fail(self, job_id, owner, error, retry=True):
+        """Fail an attempt, requeueing it with backoff if attempts remain."""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """Return a job's public state as a dict, or None."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return the number of jobs in each status."""
+        raise NotImplementedError
+
+    def add_event(self, job_id, stage, data=None):
+        """Append a stage event to a job's log and return its id."""
+        raise NotImplementedError
+
+    def events(self, job_id, after=0):
+        """Return a job's events with an id above ``after``, oldest first."""
+        raise NotImplementedError
+
+    def events_since(self, after, limit=1000):
+        """Return events of all jobs with an id above ``after``, oldest first."""
+        raise NotImplementedError
+
+    def last_event_id(self):
+        """Return the id of the newest event, or 0."""
+        raise NotImplementedError
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_available ON jobs (status, available_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    data TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id);
+CREATE INDEX IF NOT EXISTS job_events_created ON job_events (created_at);
+"""
+
+
+def _insert_event(connection, job_id, stage, data, now):
+    cursor = connection.execute(
+        "INSERT INTO job_events (job_id, stage, data, created_at) VALUES (?, ?, ?, ?)",
+        (job_id, stage, json.dumps(data) if data else None, now),
+    )
+    return cursor.lastrowid
+
+
+def _event_dict(row):
+    event = {'id': row['id'], 'jobId': row['job_id'], 'stage': row['stage'], 'at': row['created_at']}
+    if row['data']:
+        event.update(json.loads(row['data']))
+    return event
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Job queue stored in a SQLite database in WAL mode.
+
+    A queued job is visible once ``available_at`` has passed. Leasing sets
+    ``available_at`` to the lease expiry, so an expired lease makes the job
+    visible again without a separate reaper.
+
+    Args:
+        path (str): Database file, shared by the web and worker processes
+        visibility_timeout (float): Default lease length in seconds
+        max_attempts (int): Default attempts before a job is marked failed
+        retry_backoff (float): Base delay in seconds before a failed attempt is
+            retried; doubles with each attempt
+    """
+
+    def __init__(self, path, visibility_timeout=60.0, max_attempts=3, retry_backoff=2.0):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        """Return this thread's connection (sqlite3 connections are not thread-safe)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def close(self):
+        """Close this thread's connection."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def enqueue(self, payload, max_attempts=None, job_id=None, received_at=None):
+        """
+        Add a job and its ``queued`` event.
+
+        Args:
+            payload (dict): JSON-serialisable job data
+            max_attempts (int, optional): Override the default attempt limit
+            job_id (str, optional): Caller-chosen id; generated if omitted
+            received_at (float, optional): When the request arrived; also
+                records a ``received`` event with that time
+
+        Returns:
+            str: Job id
+        """
+        job_id = job_id or uuid.uuid4().hex
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                "INSERT INTO jobs (id, status, payload, max_attempts, available_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload), max_attempts or self.max_attempts, now, now, now),
+            )
+            if received_at is not None:
+                _insert_event(connection, job_id, RECEIVED, None, received_at)
+            _insert_event(connection, job_id, QUEUED, None, now)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return job_id
+
+    def lease(self, owner, visibility_timeout=None):
+        """
+        Lease the oldest available job.
+
+        Jobs whose lease expired after their last allowed attempt (the worker
+        kept dying) are marked failed instead of being handed out again.
+
+        Args:
+            owner (str): Worker id recorded on the lease
+            visibility_timeout (float, optional): Override the default lease length
+
+        Returns:
+            Job or None: The leased job, or None if nothing is available
+        """
+        connection = self._connection()
+        visibility_timeout = visibility_timeout or self.visibility_timeout
+        while True:
+            now = time.time()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(
+                    "SELECT id, payload, attempts, max_attempts FROM jobs "
+                    "WHERE status IN (?, ?) AND available_at <= ? ORDER BY available_at LIMIT 1",
+                    (QUEUED, LEASED, now),
+                ).fetchone()
+                if row is None:
+                    connection.execute('COMMIT')
+                    return None
+                if row['attempts'] >= row['max_attempts']:
+                    connection.execute(
+                        "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated_at = ? WHERE id = ?",
+                        (FAILED, "Lease expired on the final attempt", now, row['id']),
+                    )
+                    _insert_event(connection, row['id'], FAILED, {'error': "Lease expired on the final attempt"}, now)
+                    connection.execute('COMMIT')
+                    logger.warning("Job %s failed: lease expired on the final attempt", row['id'])
+                    continue
+                connection.execute(
+                    "UPDATE jobs SET status = ?, lease_owner = ?, attempts = attempts + 1, "
+                    "available_at = ?, updated_at = ? WHERE id = ?",
+                    (LEASED, owner, now + visibility_timeout, now, row['id']),
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            return Job(row['id'], json.loads(row['payload']), row['attempts'] + 1, row['max_attempts'], owner)
+
+    def extend(self, job_id, owner, visibility_timeout=None):
+        """
+        Extend a lease still held by ``owner``.
+
+        Returns:
+            bool: False if the lease has been lost
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET available_at = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+            (now + (visibility_timeout or self.visibility_timeout), now, job_id, LEASED, owner),
+        )
+        return cursor.rowcount == 1
+
+    def ack(self, job_id, owner, result):
+        """
+        Complete a leased job; its ``completed`` event carries the result.
+
+        Args:
+            job_id (str): Job id
+            owner (str): Worker that holds the lease
+            result (dict): JSON-serialisable result
+
+        Returns:
+            bool: False if the lease was lost (another worker may be running the job)
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (DONE, json.dumps(result), now, job_id, LEASED, owner),
+            )
+            acked = cursor.rowcount == 1
+            if acked:
+                _insert_event(connection, job_id, COMPLETED, result, now)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return acked
+
+    def fail(self, job_id, owner, error, retry=True):
+        """
+        Fail the current attempt of a leased job, recording a ``retrying`` or
+        ``failed`` event.
+
+        Args:
+            job_id (str): Job id
+            owner (str): Worker that holds the lease
+            error (str): Error description stored on the job
+            retry (bool): False for permanent errors (e.g. invalid input)
+
+        Returns:
+            bool: False if the lease was lost
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = ? AND lease_owner = ?",
+                (job_id, LEASED, owner),
+            ).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return False
+            if retry and row['attempts'] < row['max_attempts']:
+                delay = self.retry_backoff * (2 ** (row['attempts'] - 1))
+                connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, available_at = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (QUEUED, error, now + delay, now, job_id),
+                )
+                _insert_event(connection, job_id, RETRYING,
+                              {'error': error, 'attempt': row['attempts'], 'retryAt': now + delay}, now)
+            else:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated_at = ? WHERE id = ?",
+                    (FAILED, error, now, job_id),
+                )
+                _insert_event(connection, job_id, FAILED, {'error': error}, now)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return True
+
+    def get(self, job_id):
+        """
+        Return a job's state.
+
+        Returns:
+            dict or None: id, status, attempts, result, error and timestamps
+        """
+        row = self._connection().execute(
+            "SELECT id, status, attempts, max_attempts, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def stats(self):
+        """Return the number of jobs in each status."""
+        rows = self._connection().execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (QUEUED, LEASED, DONE, FAILED)}
+        counts.update({row['status']: row['count'] for row in rows})
+        return counts
+
+    def add_event(self, job_id, stage, data=None):
+        """
+        Append a stage event to a job's log.
+
+        Args:
+            job_id (str): Job id
+            stage (str): Stage name, e.g. ``PREPROCESSED``
+            data (dict, optional): JSON-serialisable details merged into the event
+
+        Returns:
+            int: Event id
+        """
+        return _insert_event(self._connection(), job_id, stage, data, time.time())
+
+    def events(self, job_id, after=0):
+        """
+        Return a job's events.
+
+        Args:
+            job_id (str): Job id
+            after (int): Only events with a larger id
+
+        Returns:
+            list of dict: Events (id, jobId, stage, at and their data), oldest first
+        """
+        rows = self._connection().execute(
+            "SELECT id, job_id, stage, data, created_at FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+            (job_id, after),
+        ).fetchall()
+        return [_event_dict(row) for row in rows]
+
+    def events_since(self, after, limit=1000):
+        """
+        Return the events of all jobs after a cursor.
+
+        Event ids are assigned inside write transactions, which SQLite runs
+        one at a time, so a reader that remembers the last id it saw never
+        misses an event.
+
+        Args:
+            after (int): Only events with a larger id
+            limit (int): Most events returned
+
+        Returns:
+            list of dict: Events, oldest first
+        """
+        rows = self._connection().execute(
+            "SELECT id, job_id, stage, data, created_at FROM job_events WHERE id > ? ORDER BY id LIMIT ?",
+            (after, limit),
+        ).fetchall()
+        return [_event_dict(row) for row in rows]
+
+    def last_event_id(self):
+        """Return the id of the newest event, or 0."""
+        return self._connection().execute("SELECT COALESCE(MAX(id), 0) FROM job_events").fetchone()[0]
+
+    def prune_events(self, older_than):
+        """
+        Delete events recorded before a time.
+
+        Args:
+            older_than (float): Unix time
+
+        Returns:
+            int: Number of events deleted
+        """
+        return self._connection().execute("DELETE FROM job_events WHERE created_at < ?", (older_than,)).rowcount
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(config):
+    """
+    Return this process's queue for the configured database.
+
+    Args:
+        config (Mapping): App config with the JOB_QUEUE_* settings
+
+    Returns:
+        SQLiteJobQueue: The queue
+    """
+    path = config['JOB_QUEUE_PATH']
+    queue = _queues.get(path)
+    if queue is None:
+        with _queues_lock:
+            queue = _queues.get(path)
+            if queue is None:
+                queue = SQLiteJobQueue(
+                    path,
+                    visibility_timeout=config['JOB_VISIBILITY_TIMEOUT_SECONDS'],
+                    max_attempts=config['JOB_MAX_ATTEMPTS'],
+                )
+                _queues[path] = queue
+    return queue
@@ -1,14 +1,24 @@
+import io
 import os
-from openai import OpenAI
 import logging
+import time
+from app.services.hedging import LatencyTracker, hedged_call
+from app.utils.deadline import DeadlineExceeded
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def initialize_openai_client():
+# Recent images.edit latencies, shared by all requests in this process
+upstream_latency = LatencyTracker(percentile=95, min_samples=20)
+
+def initialize_openai_client(max_retries=None):
     """
     Initialize and return the OpenAI client using API key from environment variables.
     
+    Args:
+        max_retries (int, optional): Override the SDK's retry count. Deadline-bound
+            calls use 0 so a single attempt never outlives the request budget.
+    
     Returns:
         OpenAI: Initialized OpenAI client
         
@@ -19,24 +29,48 @@ def initialize_openai_client():
     if not api_key:
         raise ValueError("OpenAI API key not found in environment variables")
     
+    # Imported here so the SDK stays off the app's import path (cold starts)
+    from openai import OpenAI
+    
+    if max_retries is not None:
+        return OpenAI(api_key=api_key, max_retries=max_retries)
     return OpenAI(api_key=api_key)
 
-def generate_art_from_doodle(image_bytes, prompt_hint=None):
+def _copy_image_buffer(image_bytes):
+    """Return an independent copy of a processed image buffer for a hedged attempt."""
+    copy = io.BytesIO(image_bytes.getvalue())
+    if hasattr(image_bytes, 'name'):
+        copy.name = image_bytes.name
+    return copy
+
+def generate_art_from_doodle(image_bytes, prompt_hint=None, deadline=None, hedge=True, usage=None, on_request=None):
     """
     Generate art from a doodle using OpenAI's image API.
     
     Args:
         image_bytes (io.BytesIO): Processed image as a file-like object
         prompt_hint (str, optional): Optional hint about the content (e.g., "cat", "robot")
+        deadline (Deadline, optional): Request budget. When given, every attempt is
+            bounded by the remaining time and a hedged duplicate may be sent if the
+            primary is slower than the recent p95 latency.
+        hedge (bool): Allow a hedged duplicate request when a deadline is given
+        usage (UsageRecord, optional): Counts every attempt sent upstream (a
+            hedge is billed like any other call), the time spent waiting and failures
+        on_request (callable, optional): Called just before the first request is
+            sent; an exception it raises cancels the call
         
     Returns:
         str: URL of the generated image
         
     Raises:
+        DeadlineExceeded: If the deadline runs out before OpenAI responds
         Exception: If the API call fails or returns an error
     """
     # Initialize the OpenAI client
-    client = initialize_openai_client()
+    if deadline is not None:
+        client = initialize_openai_client(max_retries=0)
+    else:
+        client = initialize_openai_client()
     
     # Construct the text prompt
     base_prompt = "Children's coloring book style, vibrant colors, simple and fun, based on the provided sketch"
@@ -46,23 +80,57 @@ def generate_art_from_doodle(image_bytes, prompt_hint=None):
     
     full_prompt = f"{base_prompt}. {safety_prompt}"
     
+    if on_request is not None:
+        on_request()
+    
+    started = time.perf_counter()
     try:
-        logger.info(f"Sending request to OpenAI with prompt: {full_prompt}")
+        logger.info("Sending request to OpenAI (prompt hint: %s)", prompt_hint)
+        logger.debug("OpenAI prompt: %s", full_prompt)
+        
+        def attempt(index):
+            if usage is not None:
+                usage.upstream_call()
+            image = image_bytes if index == 0 else _copy_image_buffer(image_bytes)
+            kwargs = {}
+            if deadline is not None:
+                kwargs['timeout'] = deadline.remaining()
+            return client.images.edit(
+                image=image,
+                prompt=full_prompt,
+                n=1,
+                size="1024x1024",
+                response_format="url",
+                **kwargs
+            )
         
         # Call the OpenAI API
-        response = client.images.edit(
-            image=image_bytes,
-            prompt=full_prompt,
-            n=1,
-            size="1024x1024",
-            response_format="url"
-        )
+        if deadline is None:
+            response = attempt(0)
+        else:
+            response = hedged_call(
+                attempt,
+                deadline,
+                tracker=upstream_latency,
+                hedge=hedge,
+            )
+        
+        if usage is not None:
+            usage.upstream_done(time.perf_counter() - started)
         
         # Extract the image URL from the response
         image_url = response.data[0].url
-        logger.info(f"Successfully generated image: {image_url}")
+        logger.info("Successfully generated image")
+        logger.debug("Generated image URL: %s", image_url)
         
         return image_url
+    except DeadlineExceeded:
+        logger.error("OpenAI call abandoned: request budget exhausted")
+        if usage is not None:
+            usage.upstream_done(time.perf_counter() - started, failed=True)
+        raise
     except Exception as e:
-        logger.error(f"Error generating image: {str(e)}")
+        logger.error("Error generating image: %s", e)
+        if usage is not None:
+            usage.upstream_done(time.perf_counter() - started, failed=True)
         raise Exception(f"Failed to generate image: {str(e)}")
@@ -0,0 +1,416 @@
+"""
+Post-processing of generated images: fetch once, brand, downscale, store.
+
+After a generation, the OpenAI result URL is fetched once through a pooled
+HTTP session and turned into the configured variants (e.g. a 1024px WebP
+for display and a 256px JPEG thumbnail), each with the watermark overlaid.
+Variants are stored content-addressed on disk and served from
+``/api/images/<digest>.<ext>``, so downloads never touch OpenAI or Pillow.
+
+The work runs on a small thread pool shared by the process (Pillow releases
+the GIL while resizing and encoding), and every stage is timed. Given a
+deadline, the fetch timeout is cut to the time left and each later stage
+checks it before starting.
+"""
+
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.utils.image_guard import DEFAULT_LIMITS, check_image_limits, inspect_image_header
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# One output image: longest side in pixels, format and encoder quality
+Variant = namedtuple('Variant', ['name', 'max_size', 'format', 'quality'])
+
+# Variants and per-stage timings (milliseconds) of one post-processing run
+PostProcessResult = namedtuple('PostProcessResult', ['variants', 'timings'])
+
+FORMAT_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+EXTENSION_MIMETYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg', 'png': 'image/png'}
+STORED_NAME = re.compile(r'^[0-9a-f]{64}\.(webp|jpg|png)$')
+
+# Watermark width as a fraction of the variant's width, and its margin
+WATERMARK_SCALE = 0.28
+WATERMARK_MARGIN = 0.02
+
+# Cap on fetched result size; OpenAI returns ~1-3 MB PNGs
+MAX_FETCH_BYTES = 20 * 1024 * 1024
+
+
+def parse_variants(spec):
+    """
+    Parse a variant list such as ``"display:1024:webp:80,thumb:256:jpeg:85"``.
+
+    Args:
+        spec (str): Comma-separated ``name:max_size:format[:quality]`` entries
+
+    Returns:
+        list of Variant: Parsed variants
+
+    Raises:
+        ValueError: If an entry is malformed or uses an unsupported format
+    """
+    variants = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        fields = entry.split(':')
+        if len(fields) not in (3, 4):
+            raise ValueError(f"Invalid variant {entry!r}; expected name:max_size:format[:quality]")
+        name, max_size, fmt = fields[0], int(fields[1]), fields[2].upper()
+        if fmt == 'JPG':
+            fmt = 'JPEG'
+        if fmt not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported variant format {fields[2]!r}")
+        quality = int(fields[3]) if len(fields) == 4 else 85
+        variants.append(Variant(name, max_size, fmt, quality))
+    return variants
+
+
+def _default_overlay():
+    """Render the default "Draw With Me" badge."""
+    font = ImageFont.load_default(size=48)
+    text = "Draw With Me"
+    left, top, right, bottom = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font)
+    padding = 16
+    badge = Image.new('RGBA', (right - left + 2 * padding, bottom - top + 2 * padding), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(badge)
+    draw.rounded_rectangle((0, 0, badge.width - 1, badge.height - 1), radius=padding, fill=(255, 255, 255, 200))
+    draw.text((padding - left, padding - top), text, font=font, fill=(60, 60, 160, 255))
+    return badge
+
+
+@functools.lru_cache(maxsize=32)
+def load_overlay(path, width, opacity):
+    """
+    Decode and scale the watermark once per asset, width and opacity.
+
+    Args:
+        path (str): Watermark image file; empty for the built-in badge
+        width (int): Target width in pixels
+        opacity (float): Multiplier applied to the overlay's alpha (0-1)
+
+    Returns:
+        PIL.Image.Image: RGBA overlay, kept decoded in memory
+    """
+    if path:
+        with Image.open(path) as source:
+            overlay = source.convert('RGBA')
+    else:
+        overlay = _default_overlay()
+    height = max(1, round(overlay.height * width / overlay.width))
+    overlay = overlay.resize((width, height), Image.Resampling.LANCZOS)
+    if opacity < 1.0:
+        alpha = overlay.getchannel('A').point(lambda value: int(value * opacity))
+        overlay.putalpha(alpha)
+    return overlay
+
+
+class VariantStore:
+    """
+    Content-addressed files: ``<root>/<digest[:2]>/<digest>.<ext>``.
+
+    Identical outputs share one file and a stored file never changes, so it
+    can be served with an immutable cache policy. The store is a plain
+    directory: on a deployment with several hosts, ``/api/images`` only finds
+    a variant on the host that rendered it unless ``root`` is a mount every
+    host shares.
+
+    Args:
+        root (str): Directory shared by all workers on the host
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        """
+        Return the file path for a stored name such as ``<digest>.webp``.
+
+        Raises:
+            ValueError: If the name is not a stored name
+        """
+        if not STORED_NAME.match(name):
+            raise ValueError(f"Invalid image name {name!r}")
+        return os.path.join(self.root, name[:2], name)
+
+    def put(self, data, extension):
+        """
+        Store bytes and return their name.
+
+        Args:
+            data (bytes): Encoded image
+            extension (str): File extension (webp, jpg or png)
+
+        Returns:
+            str: ``<sha256>.<extension>``
+        """
+        name = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        path = self.path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return name
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session(pool_size=8):
+    """
+    Return the process's pooled HTTP session, creating it on first use.
+
+    Connections to the image CDN are kept alive and reused across requests.
+
+    Args:
+        pool_size (int): Connections kept per host
+
+    Returns:
+        requests.Session: The session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Imported here so requests stays off the app's import path (cold starts)
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=1))
+                session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=1))
+                _session = session
+    return _session
+
+
+def fetch_image(url, timeout, max_bytes=MAX_FETCH_BYTES):
+    """
+    Download an image with the pooled session.
+
+    Args:
+        url (str): Image URL
+        timeout (float): Connect and read timeout in seconds, and the limit
+            for the whole download
+        max_bytes (int): Abort downloads larger than this
+
+    Returns:
+        bytes: Response body
+
+    Raises:
+        ValueError: If the body is larger than ``max_bytes``
+        TimeoutError: If the download takes longer than ``timeout``
+        requests.RequestException: If the download fails
+    """
+    started = time.monotonic()
+    with get_http_session().get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        body = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            body += chunk
+            if len(body) > max_bytes:
+                raise ValueError(f"Generated image is larger than {max_bytes} bytes")
+            if time.monotonic() - started > timeout:
+                raise TimeoutError(f"Generated image took longer than {timeout:.1f}s to download")
+    return bytes(body)
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+class PostProcessor:
+    """
+    Turns a generated image URL into stored, branded variants.
+
+    Args:
+        store (VariantStore): Where variants are written
+        variants (list of Variant): Outputs to produce
+        watermark_path (str): Watermark image; empty for the built-in badge,
+            None for no watermark
+        watermark_opacity (float): Watermark alpha multiplier
+        fetch (callable): ``fetch(url, timeout)`` returning the image bytes
+        fetch_timeout (float): Seconds a fetch may take (less when a deadline is shorter)
+        cache (SharedStore, optional): Node-wide cache of finished results, so a
+            URL is fetched and processed once per host
+        cache_ttl (float, optional): TTL for cached results
+        workers (int): Threads in the post-processing pool
+    """
+
+    def __init__(self, store, variants, watermark_path='', watermark_opacity=0.85, fetch=None,
+                 fetch_timeout=10.0, cache=None, cache_ttl=None, workers=2):
+        self.store = store
+        self.variants = variants
+        self.watermark_path = watermark_path
+        self.watermark_opacity = watermark_opacity
+        self.fetch = fetch or fetch_image
+        self.fetch_timeout = fetch_timeout
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='postprocess')
+
+    def submit(self, image_url, deadline=None):
+        """
+        Queue post-processing of a generated image.
+
+        Returns:
+            concurrent.futures.Future: Resolves to a PostProcessResult
+        """
+        return self._executor.submit(self.process, image_url, deadline)
+
+    def _cache_key(self, image_url):
+        return f"variants:{hashlib.sha256(image_url.encode('utf-8')).hexdigest()}"
+
+    def process(self, image_url, deadline=None):
+        """
+        Fetch, decode and render every variant of a generated image.
+
+        Args:
+            image_url (str): URL returned by the image API
+            deadline (Deadline, optional): Budget for the whole run
+
+        Returns:
+            PostProcessResult: ``variants`` maps variant name to name/format/
+                width/height/bytes of the stored file; ``timings`` maps stage
+                to milliseconds (fetch, decode, one per variant, total)
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before the last variant starts
+            ValueError: If the fetched data is not an acceptable image
+            Exception: If the download fails
+        """
+        started = time.perf_counter()
+        cache_key = self._cache_key(image_url)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return PostProcessResult(json.loads(cached), {'cache': _ms(started), 'total': _ms(started)})
+
+        timings = {}
+        stage = time.perf_counter()
+        timeout = self.fetch_timeout
+        if deadline is not None:
+            deadline.check('post-processing fetch')
+            timeout = min(timeout, deadline.remaining())
+        data = self.fetch(image_url, timeout=timeout)
+        timings['fetch'] = _ms(stage)
+
+        stage = time.perf_counter()
+        if deadline is not None:
+            deadline.check('post-processing decode')
+        check_image_limits(inspect_image_header(data), DEFAULT_LIMITS)
+        with Image.open(io.BytesIO(data)) as source:
+            image = source.convert('RGBA')
+        timings['decode'] = _ms(stage)
+
+        variants = {}
+        for variant in self.variants:
+            if deadline is not None:
+                deadline.check(f'{variant.name} variant')
+            stage = time.perf_counter()
+            variants[variant.name] = self._render(image, variant)
+            timings[variant.name] = _ms(stage)
+        timings['total'] = _ms(started)
+
+        if self.cache is not None:
+            self.cache.set(cache_key, json.dumps(variants).encode('utf-8'), ttl=self.cache_ttl)
+        logger.info("Post-processed generated image", extra={'timings_ms': timings})
+        return PostProcessResult(variants, timings)
+
+    def _render(self, image, variant):
+        rendered = image.copy()
+        rendered.thumbnail((variant.max_size, variant.max_size), Image.Resampling.LANCZOS)
+        if self.watermark_path is not None:
+            overlay = load_overlay(self.watermark_path, max(1, int(rendered.width * WATERMARK_SCALE)),
+                                   self.watermark_opacity)
+            margin = int(rendered.width * WATERMARK_MARGIN)
+            position = (rendered.width - overlay.width - margin, rendered.height - overlay.height - margin)
+            rendered.alpha_composite(overlay, dest=(max(0, position[0]), max(0, position[1])))
+
+        if variant.format == 'JPEG':
+            # No alpha in JPEG: flatten onto white like the drawing canvas
+            flattened = Image.new('RGB', rendered.size, (255, 255, 255))
+            flattened.paste(rendered, mask=rendered.getchannel('A'))
+            rendered = flattened
+        buffer = io.BytesIO()
+        params = {'optimize': True} if variant.format == 'PNG' else {'quality': variant.quality}
+        rendered.save(buffer, format=variant.format, **params)
+        data = buffer.getvalue()
+        return {
+            'name': self.store.put(data, FORMAT_EXTENSIONS[variant.format]),
+            'format': variant.format.lower(),
+            'width': rendered.width,
+            'height': rendered.height,
+            'bytes': len(data),
+        }
+
+    def shutdown(self):
+        """Stop the worker pool."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_processor = None
+_processor_lock = threading.Lock()
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_variant_store(config):
+    """Return this process's VariantStore for the configured directory."""
+    root = config['VARIANT_STORE_PATH']
+    store = _stores.get(root)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(root)
+            if store is None:
+                store = VariantStore(root)
+                _stores[root] = store
+    return store
+
+
+def get_postprocessor(config):
+    """
+    Return this process's post-processor, creating it on first use.
+
+    Args:
+        config (Mapping): App config with the POSTPROCESS_* settings
+
+    Returns:
+        PostProcessor or None: None when post-processing is disabled
+    """
+    global _processor
+    if not config.get('POSTPROCESS_ENABLED'):
+        return None
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                from app.services.shared_store import get_shared_store
+
+                _processor = PostProcessor(
+                    get_variant_store(config),
+                    parse_variants(config['POSTPROCESS_VARIANTS']),
+                    watermark_path=config['WATERMARK_PATH'] if config['WATERMARK_ENABLED'] else None,
+                    watermark_opacity=config['WATERMARK_OPACITY'],
+                    fetch_timeout=config['POSTPROCESS_FETCH_TIMEOUT_SECONDS'],
+                    cache=get_shared_store(config),
+                    cache_ttl=config['GENERATION_CACHE_TTL_SECONDS'],
+                    workers=config['POSTPROCESS_WORKERS'],
+                )
+    return _processor
@@ -0,0 +1,237 @@
+"""
+Deterministic replay of a captured corpus and statistical comparison of runs.
+
+A run drives every corpus entry through the generate path as the original
+request did (``decode_base64_image`` for JSON uploads, then
+``validate_and_process_image``) with a stubbed upstream of fixed latency,
+``repeat`` times after ``warmup`` discarded passes, and records milliseconds
+per stage. Each processed image is checked against the digest captured in
+production, so a change in output is reported alongside a change in speed.
+
+Two runs (typically of two commits on the same machine) are compared per
+stage on the median and p99. Confidence intervals come from a percentile
+bootstrap of the candidate/baseline ratio, which needs no assumption about
+the shape of latency distributions; a stage is a regression when the whole
+interval lies above 1 and the point estimate exceeds the threshold.
+"""
+
+import base64
+import gc
+import hashlib
+import logging
+import math
+import platform
+import random
+import time
+
+import PIL
+
+from app.services.capture import read_input
+from app.utils.image_guard import DEFAULT_LIMITS
+from app.utils.image_utils import decode_base64_image, validate_and_process_image
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+STAGES = ('decode', 'preprocess', 'upstream', 'total')
+
+_MIMETYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+
+def percentile(values, q):
+    """
+    Return the q-th percentile of ``values``, interpolating between ranks.
+
+    Args:
+        values (sequence of float): Samples (need not be sorted)
+        q (float): Percentile, 0-100
+
+    Returns:
+        float: The percentile
+    """
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def bootstrap_ci(values, q, iterations=2000, confidence=0.95, rng=None):
+    """
+    Percentile bootstrap confidence interval of the q-th percentile.
+
+    Args:
+        values (sequence of float): Samples
+        q (float): Percentile, 0-100 (50 for the median)
+        iterations (int): Bootstrap resamples
+        confidence (float): Interval coverage
+        rng (random.Random, optional): Resampling source
+
+    Returns:
+        tuple: (low, high)
+    """
+    rng = rng or random.Random(0)
+    estimates = [percentile(rng.choices(values, k=len(values)), q) for _ in range(iterations)]
+    tail = (1 - confidence) / 2 * 100
+    return percentile(estimates, tail), percentile(estimates, 100 - tail)
+
+
+def _stub_upstream(latency_ms):
+    if latency_ms:
+        time.sleep(latency_ms / 1000)
+    return "https://example.com/replayed.png"
+
+
+def replay_entry(root, entry, upstream_ms=0.0, limits=DEFAULT_LIMITS):
+    """
+    Replay one corpus entry.
+
+    Args:
+        root (str): Corpus directory
+        entry (dict): Index entry from ``load_corpus``
+        upstream_ms (float): Latency of the stubbed upstream call
+        limits (ImageLimits): Decode limits
+
+    Returns:
+        tuple: (timings in ms per stage, True if the processed image matches the capture)
+    """
+    image_bytes = read_input(root, entry)
+    timings = {}
+    if entry.get('transport', 'json') == 'json':
+        payload = (f"data:{_MIMETYPES[entry['inputFormat']]};base64,"
+                   + base64.b64encode(image_bytes).decode('ascii'))
+        started = time.perf_counter()
+        image_bytes = decode_base64_image(payload)
+        timings['decode'] = (time.perf_counter() - started) * 1000
+    else:
+        started = time.perf_counter()
+
+    stage_started = time.perf_counter()
+    processed = validate_and_process_image(image_bytes, limits, normalized=entry.get('normalized', False))
+    timings['preprocess'] = (time.perf_counter() - stage_started) * 1000
+
+    if upstream_ms:
+        stage_started = time.perf_counter()
+        _stub_upstream(upstream_ms)
+        timings['upstream'] = (time.perf_counter() - stage_started) * 1000
+    timings['total'] = (time.perf_counter() - started) * 1000
+
+    matches = hashlib.sha256(processed.getvalue()).hexdigest() == entry.get('processedDigest')
+    return timings, matches
+
+
+def run_replay(root, entries, repeat=5, warmup=1, upstream_ms=0.0, label=None, limits=DEFAULT_LIMITS):
+    """
+    Replay a corpus and collect per-stage samples.
+
+    The garbage collector is paused during each pass so that collections do
+    not land at random in one run's timings.
+
+    Args:
+        root (str): Corpus directory
+        entries (list of dict): Entries to replay
+        repeat (int): Measured passes over the corpus
+        warmup (int): Discarded passes before measuring
+        upstream_ms (float): Latency of the stubbed upstream call
+        label (str, optional): Name of the run, e.g. a commit hash
+        limits (ImageLimits): Decode limits
+
+    Returns:
+        dict: Run metadata, ``samples`` (ms per stage) and ``mismatches``
+            (inputs whose processed image differs from the capture)
+    """
+    samples = {stage: [] for stage in STAGES}
+    mismatches = set()
+    failures = {}
+    for iteration in range(warmup + repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            for entry in entries:
+                try:
+                    timings, matches = replay_entry(root, entry, upstream_ms, limits)
+                except (OSError, ValueError) as e:
+                    if entry['input'] not in failures:
+                        logger.warning("Replay of %s failed: %s", entry['input'], e)
+                    failures[entry['input']] = str(e)
+                    continue
+                if not matches:
+                    mismatches.add(entry['input'])
+                if iteration >= warmup:
+                    for stage, ms in timings.items():
+                        samples[stage].append(ms)
+        finally:
+            gc.enable()
+    return {
+        'label': label,
+        'createdAt': time.time(),
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'machine': platform.machine(),
+            'node': platform.node(),
+        },
+        'entries': len(entries),
+        'repeat': repeat,
+        'upstreamMs': upstream_ms,
+        'samples': {stage: values for stage, values in samples.items() if values},
+        'mismatches': sorted(mismatches),
+        'failures': failures,
+    }
+
+
+def compare_runs(baseline, candidate, iterations=2000, confidence=0.95, threshold=0.05, seed=0):
+    """
+    Compare two runs stage by stage on the median and p99.
+
+    Args:
+        baseline (dict): Output of ``run_replay``
+        candidate (dict): Output of ``run_replay``
+        iterations (int): Bootstrap resamples
+        confidence (float): Interval coverage
+        threshold (float): Relative change below which a difference is ignored
+        seed (int): Seed for the resampling, so a comparison is reproducible
+
+    Returns:
+        list of dict: One row per stage and statistic with the baseline and
+            candidate values and their intervals, the ratio with its interval
+            and a verdict of ``regression``, ``improvement`` or ``same``
+    """
+    rng = random.Random(seed)
+    tail = (1 - confidence) / 2 * 100
+    rows = []
+    for stage in STAGES:
+        before = baseline['samples'].get(stage)
+        after = candidate['samples'].get(stage)
+        if not before or not after:
+            continue
+        for statistic, q in (('median', 50), ('p99', 99)):
+            base_value, new_value = percentile(before, q), percentile(after, q)
+            ratios = []
+            for _ in range(iterations):
+                resampled_base = percentile(rng.choices(before, k=len(before)), q)
+                resampled_new = percentile(rng.choices(after, k=len(after)), q)
+                if resampled_base > 0:
+                    ratios.append(resampled_new / resampled_base)
+            if not ratios or base_value <= 0:
+                continue
+            ratio = new_value / base_value
+            low, high = percentile(ratios, tail), percentile(ratios, 100 - tail)
+            if low > 1 and ratio > 1 + threshold:
+                verdict = 'regression'
+            elif high < 1 and ratio < 1 - threshold:
+                verdict = 'improvement'
+            else:
+                verdict = 'same'
+            rows.append({
+                'stage': stage,
+                'statistic': statistic,
+                'baseline': base_value,
+                'baselineCi': bootstrap_ci(before, q, iterations // 4, confidence, rng),
+                'candidate': new_value,
+                'candidateCi': bootstrap_ci(after, q, iterations // 4, confidence, rng),
+                'ratio': ratio,
+                'ratioCi': (low, high),
+                'verdict': verdict,
+            })
+    return rows
@@ -0,0 +1,432 @@
+"""
+Node-local cache and counters shared by all worker processes through mmap.
+
+The store is a single memory-mapped file (under /dev/shm by default) laid out
+as a fixed-size, set-associative hash table plus a smaller table of integer
+counters:
+
+    header | cache buckets (ways x slot_size each) | counter buckets (ways x 40 bytes each)
+
+A key hashes to exactly one bucket and may live in any of its ways. Writers
+serialise per bucket with a POSIX byte-range lock (released by the kernel if a
+worker dies) plus a thread lock for threads of the same process. Readers take
+no lock: every cache slot carries a CRC of its contents, so a slot torn by a
+concurrent or crashed writer reads as a miss and is simply reused.
+
+When a bucket is full, expired entries are replaced first, then the least
+recently read one. All processes on a node must open the store with the same
+geometry. A file with a different geometry may still be mapped by processes
+started with the old one, so it is never resized in place (touching a page
+past the end of a shrunk file kills the process with SIGBUS): a new file is
+built and renamed over it, and the old processes keep the old file until they
+restart.
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DWMSTOR1'
+VERSION = 1
+HEADER_SIZE = 64
+
+# magic, version, cache buckets, ways, slot size, counter buckets
+_HEADER = struct.Struct('<8sIIIII')
+# state, crc32, key digest, expires_at, last_access, value length
+_SLOT = struct.Struct('<B3xI16sddI')
+# state, key digest, expires_at, value
+_COUNTER = struct.Struct('<B7x16sdq')
+
+_LAST_ACCESS_OFFSET = 32
+_COUNTER_VALUE_OFFSET = 32
+
+_EMPTY = 0
+_USED = 1
+
+_THREAD_LOCK_STRIPES = 64
+
+
+def default_store_path():
+    """Return a tmpfs-backed path when available, else the temp directory."""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'draw-with-me.store')
+
+
+def _digest(key):
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return hashlib.blake2b(key, digest_size=16).digest()
+
+
+def _slot_crc(key_digest, expires_at, value):
+    return zlib.crc32(value, zlib.crc32(key_digest + struct.pack('<d', expires_at)))
+
+
+class SharedStore:
+    """
+    mmap-backed cache and counters shared between processes on one node.
+
+    Args:
+        path (str): Backing file; created if missing
+        buckets (int): Number of cache buckets
+        ways (int): Slots per bucket (for both cache and counters)
+        slot_size (int): Bytes per cache slot, including a 44 byte header
+        counter_buckets (int): Number of counter buckets
+    """
+
+    def __init__(self, path, buckets=512, ways=8, slot_size=1024, counter_buckets=512):
+        if slot_size <= _SLOT.size:
+            raise ValueError(f"slot_size must be larger than {_SLOT.size} bytes")
+        self.path = path
+        self.buckets = buckets
+        self.ways = ways
+        self.slot_size = slot_size
+        self.counter_buckets = counter_buckets
+        self.max_value_size = slot_size - _SLOT.size
+
+        self._cache_start = HEADER_SIZE
+        self._counter_start = HEADER_SIZE + buckets * ways * slot_size
+        self.size = self._counter_start + counter_buckets * ways * _COUNTER.size
+
+        self._thread_locks = [threading.Lock() for _ in range(_THREAD_LOCK_STRIPES)]
+        self.hits = 0
+        self.misses = 0
+
+        self._mm = None
+        self._fd = self._open()
+        try:
+            self._mm = mmap.mmap(self._fd, self.size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _open(self):
+        """Open the backing file, creating or replacing it to match this geometry."""
+        expected = _HEADER.pack(MAGIC, VERSION, self.buckets, self.ways, self.slot_size, self.counter_buckets)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if self._initialize(fd, expected):
+                    return fd
+            except BaseException:
+                os.close(fd)
+                raise
+            # The file was replaced, by us or by another process; open the new one
+            os.close(fd)
+
+    def _initialize(self, fd, expected):
+        """
+        Validate or set up the file behind ``fd`` under an exclusive lock.
+
+        Returns False if ``path`` no longer refers to that file, because it was
+        replaced while we waited for the lock or has just been replaced here.
+        """
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            opened = os.fstat(fd)
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                return False
+            if (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+                return False
+            if os.pread(fd, _HEADER.size, 0) == expected and opened.st_size == self.size:
+                return True
+            if opened.st_size == 0:
+                # A new file: nobody can have mapped it yet
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, expected, 0)
+                return True
+            logger.warning("Shared store %s has a different layout; replacing it", self.path)
+            self._replace(expected)
+            return False
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+
+    def _replace(self, header):
+        """Build an empty store with ``header`` next to the backing file and rename it into place."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, self.size)
+            os.pwrite(fd, header, 0)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Unmap the store and close the backing file."""
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Locking
+
+    def _lock(self, bucket, offset):
+        """Acquire the thread and process locks for the bucket starting at ``offset``."""
+        thread_lock = self._thread_locks[bucket % _THREAD_LOCK_STRIPES]
+        thread_lock.acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+        except Exception:
+            thread_lock.release()
+            raise
+        return thread_lock
+
+    def _unlock(self, offset, thread_lock):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+        thread_lock.release()
+
+    # Cache
+
+    def _bucket(self, digest):
+        bucket = int.from_bytes(digest[:8], 'little') % self.buckets
+        return bucket, self._cache_start + bucket * self.ways * self.slot_size
+
+    def _read_slot(self, offset, digest, now):
+        """Return the slot's value if it holds ``digest``, is intact and unexpired."""
+        state, crc, key, expires_at, _, length = _SLOT.unpack_from(self._mm, offset)
+        if state != _USED or key != digest or length > self.max_value_size:
+            return None
+        if expires_at and expires_at <= now:
+            return None
+        start = offset + _SLOT.size
+        value = self._mm[start:start + length]
+        if _slot_crc(key, expires_at, value) != crc:
+            return None
+        return value
+
+    def get(self, key):
+        """
+        Look up a cached value without taking any lock.
+
+        Args:
+            key (str or bytes): Cache key
+
+        Returns:
+            bytes or None: The value, or None if absent, expired or torn
+        """
+        digest = _digest(key)
+        _, base = self._bucket(digest)
+        now = time.time()
+        for way in range(self.ways):
+            offset = base + way * self.slot_size
+            value = self._read_slot(offset, digest, now)
+            if value is not None:
+                # Approximate LRU; a racing update of this field is harmless
+                struct.pack_into('<d', self._mm, offset + _LAST_ACCESS_OFFSET, now)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value, evicting an expired or least recently read entry if needed.
+
+        Args:
+            key (str or bytes): Cache key
+            value (bytes): Value; must fit in ``max_value_size``
+            ttl (float, optional): Seconds until the entry expires
+
+        Returns:
+            bool: False if the value is too large to store
+        """
+        if len(value) > self.max_value_size:
+            return False
+        digest = _digest(key)
+        bucket, base = self._bucket(digest)
+        now = time.time()
+        expires_at = now + ttl if ttl else 0.0
+
+        thread_lock = self._lock(bucket, base)
+        try:
+            target = None
+            victim, victim_score = None, None
+            for way in range(self.ways):
+                offset = base + way * self.slot_size
+                state, crc, slot_key, slot_expires, last_access, length = _SLOT.unpack_from(self._mm, offset)
+                if state == _USED and slot_key == digest:
+                    target = offset
+                    break
+                live = state == _USED and not (slot_expires and slot_expires <= now)
+                if live and self._read_slot(offset, slot_key, now) is None:
+                    live = False  # torn by a crashed writer
+                score = last_access if live else -1.0
+                if victim is None or score < victim_score:
+                    victim, victim_score = offset, score
+            if target is None:
+                target = victim
+
+            # Hide the slot from readers while it is rewritten
+            self._mm[target] = _EMPTY
+            start = target + _SLOT.size
+            self._mm[start:start + len(value)] = value
+            _SLOT.pack_into(self._mm, target, _EMPTY, _slot_crc(digest, expires_at, value),
+                            digest, expires_at, now, len(value))
+            self._mm[target] = _USED
+        finally:
+            self._unlock(base, thread_lock)
+        return True
+
+    def delete(self, key):
+        """Remove a cached value if present."""
+        digest = _digest(key)
+        bucket, base = self._bucket(digest)
+        thread_lock = self._lock(bucket, base)
+        try:
+            for way in range(self.ways):
+                offset = base + way * self.slot_size
+                if self._mm[offset] == _USED and self._mm[offset + 8:offset + 24] == digest:
+                    self._mm[offset] = _EMPTY
+        finally:
+            self._unlock(base, thread_lock)
+
+    # Counters
+
+    def _counter_bucket(self, digest):
+        bucket = int.from_bytes(digest[:8], 'little') % self.counter_buckets
+        return bucket, self._counter_start + bucket * self.ways * _COUNTER.size
+
+    def incr(self, name, delta=1, ttl=None):
+        """
+        Atomically add to a counter shared by all processes.
+
+        Counters with a ttl disappear once it elapses (a fixed-window rate
+        limiter keys them by window). If a bucket is full, the counter closest
+        to expiry is evicted.
+
+        Args:
+            name (str): Counter name
+            delta (int): Amount to add
+            ttl (float, optional): Seconds until the counter resets; only
+                applied when the counter is created
+
+        Returns:
+            int: The counter's new value
+        """
+        digest = _digest(name)
+        bucket, base = self._counter_bucket(digest)
+        now = time.time()
+
+        thread_lock = self._lock(bucket, base)
+        try:
+            victim, victim_score = None, None
+            for way in range(self.ways):
+                offset = base + way * _COUNTER.size
+                state, key, expires_at, value = _COUNTER.unpack_from(self._mm, offset)
+                live = state == _USED and not (expires_at and expires_at <= now)
+                if live and key == digest:
+                    value += delta
+                    struct.pack_into('<q', self._mm, offset + _COUNTER_VALUE_OFFSET, value)
+                    return value
+                # Prefer free slots, then the counter expiring soonest; permanent ones last
+                score = -1.0 if not live else (expires_at or float('inf'))
+                if victim is None or score < victim_score:
+                    victim, victim_score = offset, score
+
+            expires_at = now + ttl if ttl else 0.0
+            _COUNTER.pack_into(self._mm, victim, _EMPTY, digest, expires_at, delta)
+            self._mm[victim] = _USED
+            return delta
+        finally:
+            self._unlock(base, thread_lock)
+
+    def counter(self, name):
+        """Return a counter's current value (0 if it does not exist)."""
+        digest = _digest(name)
+        _, base = self._counter_bucket(digest)
+        now = time.time()
+        for way in range(self.ways):
+            state, key, expires_at, value = _COUNTER.unpack_from(self._mm, base + way * _COUNTER.size)
+            if state == _USED and key == digest and not (expires_at and expires_at <= now):
+                return value
+        return 0
+
+    def stats(self):
+        """
+        Summarise occupancy. Scans the whole table, so keep it off the hot path.
+
+        Returns:
+            dict: Live entries, capacity and this process's hit/miss counts
+        """
+        now = time.time()
+        entries = 0
+        for index in range(self.buckets * self.ways):
+            state, _, _, expires_at, _, _ = _SLOT.unpack_from(self._mm, self._cache_start + index * self.slot_size)
+            if state == _USED and not (expires_at and expires_at <= now):
+                entries += 1
+        return {
+            'entries': entries,
+            'capacity': self.buckets * self.ways,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def clear(self):
+        """Drop every cache entry and counter."""
+        for start in range(self._cache_start, self.size, mmap.PAGESIZE):
+            end = min(start + mmap.PAGESIZE, self.size)
+            self._mm[start:end] = bytes(end - start)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_shared_store(config):
+    """
+    Return this process's handle on the node-wide store, opening it on first use.
+
+    Args:
+        config (Mapping): App config with the SHARED_STORE_* settings
+
+    Returns:
+        SharedStore or None: None when the store is disabled
+    """
+    global _store
+    if not config.get('SHARED_STORE_ENABLED'):
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SharedStore(
+                    config.get('SHARED_STORE_PATH') or default_store_path(),
+                    buckets=config.get('SHARED_STORE_BUCKETS', 512),
+                )
+    return _store
+
+
+def generation_cache_key(processed_image, prompt_hint):
+    """
+    Build the cache key for a generation: processed-image digest plus prompt hint.
+
+    Args:
+        processed_image (bytes): Normalised PNG sent upstream
+        prompt_hint (str or None): Prompt hint from the request
+
+    Returns:
+        str: Cache key
+    """
+    digest = hashlib.sha256(processed_image).hexdigest()
+    return f"gen:{digest}:{prompt_hint or ''}"
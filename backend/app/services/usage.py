@@ -0,0 +1,422 @@
+"""
+Per-tenant usage accounting and daily spend budgets.
+
+Every request that reaches the generation path is recorded against a tenant:
+the name its API key maps to in ``USAGE_API_KEYS``, else the host of its
+Origin, else ``anonymous``. A key that is not configured is refused rather
+than becoming a new tenant, so key tenants and their budgets are enforced.
+Origin is only a best-effort identity: browsers set it, but any other client
+can send whatever it likes and so start a fresh origin tenant with the
+default budget. Deployments that need a hard spend limit should require keys.
+
+A request's counts are gathered on a ``UsageRecord`` (the upstream call is
+counted by ``generate_art_from_doodle`` itself, once per attempt, so hedged
+duplicates are billed too) and added to in-memory aggregates when the request
+ends. A batch records each item's upstream calls as the item finishes and
+checks the budget before each item goes upstream, counting the calls it
+already has in flight.
+
+A background thread flushes the aggregates into a SQLite table keyed by
+tenant and UTC day every ``USAGE_FLUSH_SECONDS`` and reads back the day's
+totals of all processes. Budget checks compare those totals plus this
+process's unflushed spend against the tenant's budget: two dict lookups, no
+I/O. Processes only see each other's spend at flush time, so a tenant can
+overshoot its budget by what the other processes spend in one interval.
+"""
+
+import atexit
+import calendar
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Aggregated per tenant and day, in this order
+FIELDS = ('requests', 'upstream_calls', 'upstream_errors', 'cache_hits', 'bytes_in', 'upstream_ms', 'latency_ms', 'cost')
+_COST = FIELDS.index('cost')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    tenant TEXT NOT NULL,
+    period TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    upstream_calls INTEGER NOT NULL DEFAULT 0,
+    upstream_errors INTEGER NOT NULL DEFAULT 0,
+    cache_hits INTEGER NOT NULL DEFAULT 0,
+    bytes_in INTEGER NOT NULL DEFAULT 0,
+    upstream_ms REAL NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (tenant, period)
+);
+"""
+
+_UPSERT = "INSERT INTO usage (tenant, period, {columns}) VALUES (?, ?, {placeholders}) " \
+          "ON CONFLICT (tenant, period) DO UPDATE SET {updates}".format(
+              columns=', '.join(FIELDS),
+              placeholders=', '.join('?' for _ in FIELDS),
+              updates=', '.join(f"{field} = {field} + excluded.{field}" for field in FIELDS),
+          )
+
+
+def _hash_key(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache(maxsize=4)
+def parse_api_keys(spec):
+    """
+    Parse the API key allowlist.
+
+    Keys are kept hashed, so they are not held in memory as they were
+    configured and are looked up without comparing secrets directly.
+
+    Args:
+        spec (str): Comma-separated ``name=key`` entries, e.g.
+            ``"school-a=3f9c...,school-b=a71e..."``
+
+    Returns:
+        dict: Tenant (``key:<name>``) per SHA-256 of each key
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    tenants = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, api_key = entry.partition('=')
+        if not name.strip() or not api_key.strip():
+            raise ValueError("Invalid API key entry for tenant {!r}".format(name.strip()))
+        tenants[_hash_key(api_key.strip())] = 'key:' + name.strip()
+    return tenants
+
+
+def resolve_tenant(headers, api_keys=None):
+    """
+    Identify who a request is billed to.
+
+    Args:
+        headers (Mapping): Request headers
+        api_keys (dict, optional): Allowlist from ``parse_api_keys``
+
+    Returns:
+        str: ``key:<name>``, ``origin:<host>`` or ``anonymous``
+
+    Raises:
+        PermissionError: If an API key is sent that is not in ``api_keys``
+    """
+    api_key = headers.get('X-API-Key')
+    if api_key:
+        tenant = (api_keys or {}).get(_hash_key(api_key))
+        if tenant is None:
+            raise PermissionError("Unknown API key")
+        return tenant
+    origin = headers.get('Origin')
+    if origin:
+        return 'origin:' + origin.split('://', 1)[-1].split('/', 1)[0].lower()
+    return 'anonymous'
+
+
+def parse_budgets(spec):
+    """
+    Parse per-tenant daily budgets.
+
+    Args:
+        spec (str): Comma-separated ``tenant=usd`` entries, e.g.
+            ``"origin:school.example=5,key:school-a=20"``
+
+    Returns:
+        dict: Budget in USD per tenant
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    budgets = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        tenant, _, amount = entry.rpartition('=')
+        try:
+            budgets[tenant.strip()] = float(amount)
+        except ValueError:
+            raise ValueError(f"Invalid usage budget entry: {entry!r}")
+        if not tenant.strip():
+            raise ValueError(f"Invalid usage budget entry: {entry!r}")
+    return budgets
+
+
+def _period_bounds(now):
+    """Return the UTC day containing ``now`` and the timestamp at which it ends."""
+    day = time.gmtime(now)
+    start = calendar.timegm((day.tm_year, day.tm_mon, day.tm_mday, 0, 0, 0))
+    return time.strftime('%Y-%m-%d', day), start + 86400
+
+
+class UsageRecord:
+    """
+    Counts gathered while one request (or batch) is served.
+
+    ``upstream_call`` may be called from the threads running hedged attempts,
+    so the counters it touches are updated under a lock.
+
+    Args:
+        tenant (str): Tenant from ``resolve_tenant``
+    """
+
+    __slots__ = ('tenant', 'requests', 'upstream_calls', 'upstream_errors', 'cache_hits',
+                 'bytes_in', 'upstream_ms', '_lock')
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.requests = 1
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.upstream_ms = 0.0
+        self._lock = threading.Lock()
+
+    def upstream_call(self):
+        """Count one upstream attempt (a hedged duplicate is a second attempt)."""
+        with self._lock:
+            self.upstream_calls += 1
+
+    def upstream_done(self, seconds, failed=False):
+        """Add the time spent waiting on upstream, and count a failure."""
+        with self._lock:
+            self.upstream_ms += seconds * 1000
+            if failed:
+                self.upstream_errors += 1
+
+
+class UsageAccountant:
+    """
+    In-memory usage aggregates with periodic flush to SQLite.
+
+    Args:
+        path (str): Database file, shared by all processes on the node
+        cost_per_call (float): USD charged per upstream call
+        daily_budget (float): Default daily budget per tenant in USD; 0 is unlimited
+        budgets (dict, optional): Per-tenant overrides of the daily budget
+        flush_interval (float): Seconds between flushes
+        clock (callable): Wall clock, for tests
+    """
+
+    def __init__(self, path, cost_per_call=0.02, daily_budget=0.0, budgets=None, flush_interval=10.0,
+                 clock=time.time):
+        self.path = path
+        self.cost_per_call = cost_per_call
+        self.daily_budget = daily_budget
+        self.budgets = budgets or {}
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._pending = {}
+        self._flushing = {}
+        self._totals = {}
+        self._totals_period = None
+        self._period, self._period_end = _period_bounds(clock())
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        """Return this thread's connection (sqlite3 connections are not thread-safe)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def period(self):
+        """Return the current accounting period (UTC day, ``YYYY-MM-DD``)."""
+        if self._clock() >= self._period_end:
+            self._period, self._period_end = _period_bounds(self._clock())
+        return self._period
+
+    def seconds_until_reset(self):
+        """Return the seconds until budgets reset at the end of the UTC day."""
+        self.period()
+        return max(0, int(self._period_end - self._clock()))
+
+    def record(self, usage, latency=0.0):
+        """
+        Add a finished request's counts to this process's aggregates.
+
+        Args:
+            usage (UsageRecord): Counts gathered during the request
+            latency (float): Seconds the request took
+        """
+        values = (usage.requests, usage.upstream_calls, usage.upstream_errors, usage.cache_hits,
+                  usage.bytes_in, usage.upstream_ms, latency * 1000, usage.upstream_calls * self.cost_per_call)
+        key = (self.period(), usage.tenant)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    pending[index] += value
+        self.ensure_running()
+
+    def budget(self, tenant):
+        """Return the tenant's daily budget in USD (0 is unlimited)."""
+        return self.budgets.get(tenant, self.daily_budget)
+
+    def spent(self, tenant):
+        """Return what the tenant has spent today: flushed totals plus this process's pending spend."""
+        period = self.period()
+        total = self._totals.get(tenant, 0.0) if self._totals_period == period else 0.0
+        # Counts being written are in neither the totals nor the pending aggregates
+        for aggregates in (self._pending, self._flushing):
+            values = aggregates.get((period, tenant))
+            if values is not None:
+                total += values[_COST]
+        return total
+
+    def allow(self, tenant, in_flight=0):
+        """
+        Check the tenant's budget on the hot path; no I/O.
+
+        Args:
+            tenant (str): Tenant from ``resolve_tenant``
+            in_flight (int): Upstream calls the caller has under way and not
+                yet recorded, counted at ``cost_per_call`` each
+
+        Returns:
+            bool: False once today's spend has reached the budget
+        """
+        budget = self.budget(tenant)
+        return not budget or self.spent(tenant) + in_flight * self.cost_per_call < budget
+
+    def flush(self):
+        """Write pending aggregates to SQLite and reload today's totals of every process."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._flushing = pending
+            connection = self._connection()
+            if pending:
+                try:
+                    connection.execute('BEGIN IMMEDIATE')
+                    try:
+                        connection.executemany(_UPSERT, [(tenant, period, *values)
+                                                         for (period, tenant), values in pending.items()])
+                        connection.execute('COMMIT')
+                    except BaseException:
+                        connection.execute('ROLLBACK')
+                        raise
+                except sqlite3.Error:
+                    # Keep the counts for the next attempt
+                    with self._lock:
+                        for key, values in pending.items():
+                            current = self._pending.setdefault(key, [0] * len(FIELDS))
+                            for index, value in enumerate(values):
+                                current[index] += value
+                        self._flushing = {}
+                    raise
+            period = self.period()
+            rows = connection.execute("SELECT tenant, cost FROM usage WHERE period = ?", (period,)).fetchall()
+            self._totals = {row['tenant']: row['cost'] for row in rows}
+            self._totals_period = period
+            self._flushing = {}
+
+    def report(self, tenant=None, period=None):
+        """
+        Return flushed usage for a day, flushing this process first.
+
+        Args:
+            tenant (str, optional): Only this tenant
+            period (str, optional): UTC day (``YYYY-MM-DD``); defaults to today
+
+        Returns:
+            list of dict: One entry per tenant, highest spend first
+        """
+        self.flush()
+        period = period or self.period()
+        query = "SELECT * FROM usage WHERE period = ?"
+        params = [period]
+        if tenant is not None:
+            query += " AND tenant = ?"
+            params.append(tenant)
+        rows = self._connection().execute(query + " ORDER BY cost DESC, tenant", params).fetchall()
+        report = []
+        for row in rows:
+            entry = {'tenant': row['tenant'], 'period': row['period']}
+            entry.update({field: row[field] for field in FIELDS})
+            entry['cost'] = round(entry['cost'], 6)
+            entry['avgLatencyMs'] = round(row['latency_ms'] / row['requests'], 1) if row['requests'] else None
+            entry['budget'] = self.budget(row['tenant']) or None
+            report.append(entry)
+        return report
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Usage flush failed: %s", e)
+
+    def ensure_running(self):
+        """Start the flush thread in this process if it is not running (e.g. after a fork)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._flush_lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, name='usage-flush', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def close(self):
+        """Stop the flush thread and write what is pending."""
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error("Final usage flush failed: %s", e)
+
+
+_accountants = {}
+_accountants_lock = threading.Lock()
+
+
+def get_usage_accountant(config):
+    """
+    Return this process's accountant for the configured database.
+
+    Args:
+        config (Mapping): App config with the USAGE_* settings
+
+    Returns:
+        UsageAccountant or None: The accountant, or None when accounting is disabled
+    """
+    if not config['USAGE_ENABLED']:
+        return None
+    path = config['USAGE_DB_PATH']
+    accountant = _accountants.get(path)
+    if accountant is None:
+        with _accountants_lock:
+            accountant = _accountants.get(path)
+            if accountant is None:
+                accountant = UsageAccountant(
+                    path,
+                    cost_per_call=config['USAGE_COST_PER_CALL'],
+                    daily_budget=config['USAGE_DAILY_BUDGET'],
+                    budgets=parse_budgets(config['USAGE_BUDGETS']),
+                    flush_interval=config['USAGE_FLUSH_SECONDS'],
+                )
+                atexit.register(accountant.close)
+                _accountants[path] = accountant
+    return accountant
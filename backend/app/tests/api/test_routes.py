@@ -1,6 +1,7 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 import json
+import time
 import sys
 import os
 import base64
@@ -20,6 +21,17 @@ class TestRoutes(unittest.TestCase):
         img_buffer.seek(0)
         self.base64_img = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
         self.data_url = f"data:image/png;base64,{self.base64_img}"
+        
+        # The route reads its budget from the app config
+        from app import create_app
+        from app.config import TestingConfig
+        self.app = create_app(TestingConfig())
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+    
+    def tearDown(self):
+        """Pop the application context."""
+        self.app_context.pop()
     
     # Use function patching to test the route behavior
     @patch('app.api.routes.generate_art_from_doodle')
@@ -37,6 +49,7 @@ class TestRoutes(unittest.TestCase):
         
         # Create mock request
         mock_request = MagicMock()
+        mock_request.headers = {}
         mock_request.get_json.return_value = {
             'imageData': self.data_url,
             'promptHint': 'cat'
@@ -53,11 +66,15 @@ class TestRoutes(unittest.TestCase):
         self.assertEqual(status_code, 200)
         self.assertIn('imageUrl', response_data)
         self.assertEqual(response_data['imageUrl'], "https://example.com/generated-image.png")
+        self.assertIn('remainingMs', response_data['budget'])
+        self.assertIn('X-Request-Budget-Remaining-Ms', response.headers)
         
         # Verify mocks were called correctly
         mock_decode.assert_called_once_with(self.data_url)
-        mock_process.assert_called_once_with(b'decoded_image_data')
-        mock_generate.assert_called_once_with(io.BytesIO(b'processed_image_data'), 'cat')
+        mock_process.assert_called_once_with(b'decoded_image_data', ANY, normalized=False)
+        mock_generate.assert_called_once_with(
+            mock_process.return_value, 'cat', deadline=ANY, hedge=True, usage=ANY
+        )
     
     def test_generate_endpoint_missing_image(self):
         """Test the case where image data is missing."""
@@ -65,6 +82,7 @@ class TestRoutes(unittest.TestCase):
         
         # Create mock request
         mock_request = MagicMock()
+        mock_request.headers = {}
         mock_request.get_json.return_value = {
             'promptHint': 'cat'  # Missing imageData
         }
@@ -87,6 +105,7 @@ class TestRoutes(unittest.TestCase):
         
         # Create mock request
         mock_request = MagicMock()
+        mock_request.headers = {}
         mock_request.get_json.return_value = {
             'imageData': 'invalid-base64-data',
             'promptHint': 'cat'
@@ -112,6 +131,7 @@ class TestRoutes(unittest.TestCase):
         
         # Create mock request
         mock_request = MagicMock()
+        mock_request.headers = {}
         mock_request.get_json.return_value = {
             'imageData': self.data_url,
             'promptHint': 'cat'
@@ -136,5 +156,549 @@ class TestRoutes(unittest.TestCase):
         self.assertIn('error', response_data)
         self.assertIn('failed to generate image', response_data['error'].lower())
 
+    @patch('app.api.routes.generate_art_from_doodle')
+    @patch('app.api.routes.validate_and_process_image')
+    @patch('app.api.routes.decode_base64_image')
+    def test_generate_endpoint_client_budget(self, mock_decode, mock_process, mock_generate):
+        """Test that the client budget header is clamped and propagated."""
+        from app.api.routes import generate
+        
+        mock_decode.return_value = b'decoded_image_data'
+        mock_process.return_value = io.BytesIO(b'processed_image_data')
+        mock_generate.return_value = "https://example.com/generated-image.png"
+        
+        mock_request = MagicMock()
+        mock_request.headers = {'X-Request-Budget-Ms': '600000'}
+        mock_request.get_json.return_value = {'imageData': self.data_url}
+        
+        with patch('app.api.routes.request', mock_request):
+            response, status_code = generate()
+        
+        self.assertEqual(status_code, 200)
+        deadline = mock_generate.call_args[1]['deadline']
+        self.assertEqual(deadline.budget, self.app.config['REQUEST_BUDGET_MAX_SECONDS'])
+    
+    def test_generate_endpoint_invalid_budget(self):
+        """Test that a malformed budget header is rejected."""
+        from app.api.routes import generate
+        
+        mock_request = MagicMock()
+        mock_request.headers = {'X-Request-Budget-Ms': 'soon'}
+        mock_request.get_json.return_value = {'imageData': self.data_url}
+        
+        with patch('app.api.routes.request', mock_request):
+            response, status_code = generate()
+        
+        self.assertEqual(status_code, 400)
+    
+    def test_generate_endpoint_non_finite_budget(self):
+        """Test that nan and infinite budget headers are rejected, not turned into a 500."""
+        from app.api.routes import generate
+        
+        for value in ('nan', 'inf', '-inf', 'Infinity'):
+            mock_request = MagicMock()
+            mock_request.headers = {'X-Request-Budget-Ms': value}
+            mock_request.get_json.return_value = {'imageData': self.data_url}
+            
+            with patch('app.api.routes.request', mock_request):
+                response, status_code = generate()
+            
+            self.assertEqual(status_code, 400, value)
+    
+    def test_generate_endpoint_deadline_exceeded(self):
+        """Test that an exhausted budget returns 504 with the accounting."""
+        from app.api.routes import generate
+        from app.utils.deadline import DeadlineExceeded
+        
+        mock_request = MagicMock()
+        mock_request.headers = {}
+        mock_request.get_json.return_value = {'imageData': self.data_url}
+        
+        with patch('app.api.routes.request', mock_request):
+            with patch('app.api.routes.decode_base64_image') as mock_decode:
+                with patch('app.api.routes.validate_and_process_image') as mock_process:
+                    with patch('app.api.routes.generate_art_from_doodle') as mock_generate:
+                        mock_decode.return_value = b'decoded_image_data'
+                        mock_process.return_value = io.BytesIO(b'processed_image_data')
+                        mock_generate.side_effect = DeadlineExceeded('upstream call')
+                        
+                        response, status_code = generate()
+        
+        response_data = json.loads(response.get_data())
+        self.assertEqual(status_code, 504)
+        self.assertIn('budget', response_data)
+        self.assertEqual(response.headers['X-Request-Budget-Remaining-Ms'], '0')
+
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_generate_endpoint_binary_upload(self, mock_generate):
+        """Test a binary body with the hint and normalized declaration in headers."""
+        from app.utils.image_utils import validate_and_process_image
+        
+        mock_generate.return_value = "https://example.com/generated-image.png"
+        client = self.app.test_client()
+        img_buffer = io.BytesIO()
+        Image.new('RGB', (1024, 600), (255, 255, 255)).save(img_buffer, format='WEBP')
+        
+        with patch('app.api.routes.validate_and_process_image', wraps=validate_and_process_image) as mock_process:
+            response = client.post(
+                '/api/generate',
+                data=img_buffer.getvalue(),
+                content_type='image/webp',
+                headers={'X-Prompt-Hint': 'cat', 'X-Image-Normalized': '1'},
+            )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['imageUrl'], "https://example.com/generated-image.png")
+        mock_process.assert_called_once_with(img_buffer.getvalue(), ANY, normalized=True)
+        processed, hint = mock_generate.call_args[0]
+        self.assertEqual(hint, 'cat')
+        self.assertEqual(Image.open(processed).size, (1024, 1024))
+        
+        empty = client.post('/api/generate', data=b'', content_type='image/png')
+        self.assertEqual(empty.status_code, 400)
+
+    @patch('app.api.routes.generate_art_from_doodle')
+    @patch('app.api.routes.get_corpus_capture')
+    def test_generate_endpoint_captures_sampled_requests(self, mock_get_capture, mock_generate):
+        """Test that a sampled request is handed to the corpus capture with its stage timings."""
+        mock_generate.return_value = "https://example.com/generated-image.png"
+        capture = mock_get_capture.return_value
+        capture.sample.return_value = True
+        client = self.app.test_client()
+
+        response = client.post('/api/generate', json={'imageData': self.data_url, 'promptHint': 'cat'})
+
+        self.assertEqual(response.status_code, 200)
+        image_bytes, processed, hint, timings = capture.capture.call_args[0]
+        self.assertEqual(image_bytes, base64.b64decode(self.base64_img))
+        self.assertEqual(Image.open(io.BytesIO(processed)).size, (1024, 1024))
+        self.assertEqual(hint, 'cat')
+        self.assertEqual(set(timings), {'decode', 'preprocess', 'upstream'})
+        self.assertEqual(capture.capture.call_args[1]['transport'], 'json')
+
+        capture.sample.return_value = False
+        capture.capture.reset_mock()
+        client.post('/api/generate', json={'imageData': self.data_url})
+        capture.capture.assert_not_called()
+
+class TestBatchRoutes(unittest.TestCase):
+    def setUp(self):
+        """Create a test client and a sample doodle."""
+        from app import create_app
+        from app.config import TestingConfig
+        self.app = create_app(TestingConfig())
+        self.client = self.app.test_client()
+        
+        test_img = Image.new('RGBA', (64, 64), color=(0, 255, 0, 255))
+        img_buffer = io.BytesIO()
+        test_img.save(img_buffer, format='PNG')
+        self.png = img_buffer.getvalue()
+    
+    def _lines(self, response):
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_batch_ndjson(self, mock_generate):
+        """Test an NDJSON batch streams one line per item plus a summary."""
+        mock_generate.return_value = "https://example.com/generated.png"
+        body = '\n'.join([
+            json.dumps({'id': 'one', 'imageData': base64.b64encode(self.png).decode(), 'promptHint': 'cat'}),
+            json.dumps({'id': 'two', 'imageData': 'not-base64!'}),
+        ])
+        
+        response = self.client.post('/api/generate/batch', data=body, content_type='application/x-ndjson')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = self._lines(response)
+        results = {line['id']: line for line in lines if 'id' in line}
+        self.assertEqual(results['one']['imageUrl'], "https://example.com/generated.png")
+        self.assertEqual(results['two']['status'], 400)
+        self.assertEqual(lines[-1]['summary']['total'], 2)
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_batch_multipart(self, mock_generate):
+        """Test a multipart batch uses file names as ids."""
+        mock_generate.return_value = "https://example.com/generated.png"
+        data = {
+            'promptHint': 'robot',
+            'images': [(io.BytesIO(self.png), 'a.png'), (io.BytesIO(self.png), 'b.png')],
+        }
+        
+        response = self.client.post('/api/generate/batch', data=data, content_type='multipart/form-data')
+        
+        lines = self._lines(response)
+        self.assertEqual(sorted(line['id'] for line in lines if 'id' in line), ['a.png', 'b.png'])
+        self.assertEqual(mock_generate.call_args[0][1], 'robot')
+    
+    def test_batch_limits(self):
+        """Test empty and oversized batches are rejected."""
+        response = self.client.post('/api/generate/batch', data='', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        
+        self.app.config['BATCH_MAX_ITEMS'] = 1
+        response = self.client.post('/api/generate/batch', data='{}\n{}', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 413)
+        
+        # Bodies over the byte limit are refused before being read, chunked ones as they arrive
+        self.app.config['BATCH_MAX_BYTES'] = 100
+        body = '{"imageData": "%s"}' % ('A' * 200)
+        response = self.client.post('/api/generate/batch', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 413)
+        response = self.client.post('/api/generate/batch', input_stream=io.BytesIO(body.encode()),
+                                    content_type='application/x-ndjson', headers={'Transfer-Encoding': 'chunked'},
+                                    environ_overrides={'wsgi.input_terminated': True})
+        self.assertEqual(response.status_code, 413)
+
+class TestJobRoutes(unittest.TestCase):
+    def setUp(self):
+        """Create an app with a job queue in a temporary directory."""
+        import tempfile
+        from app import create_app
+        from app.config import TestingConfig
+        
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = TestingConfig()
+        config.JOB_QUEUE_PATH = os.path.join(self.tmpdir.name, 'jobs.db')
+        self.app = create_app(config)
+        self.client = self.app.test_client()
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_job_lifecycle(self):
+        """Test queueing a job, completing it with a worker and polling the result."""
+        from app.services.job_queue import get_job_queue
+        from app.worker import run_worker
+        
+        response = self.client.post('/api/jobs', json={'imageData': 'abc', 'promptHint': 'cat'})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['jobId']
+        self.assertTrue(response.headers['Location'].endswith(f'/api/jobs/{job_id}'))
+        
+        self.assertEqual(self.client.get(f'/api/jobs/{job_id}').get_json()['status'], 'queued')
+        
+        queue = get_job_queue(self.app.config)
+        run_worker(queue, handler=lambda payload, deadline: {'imageUrl': f"https://example.com/{payload['promptHint']}.png"},
+                   poll_interval=0.01, max_jobs=1)
+        
+        response = self.client.get(f'/api/jobs/{job_id}')
+        body = response.get_json()
+        self.assertEqual(body['status'], 'done')
+        self.assertEqual(body['imageUrl'], 'https://example.com/cat.png')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+        # A finished job revalidates without a body
+        response = self.client.get(f'/api/jobs/{job_id}', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_job_polling_revalidates(self):
+        """Test that polling an unchanged job gets 304 and a changed one gets 200."""
+        job_id = self.client.post('/api/jobs', json={'imageData': 'abc'}).get_json()['jobId']
+        response = self.client.get(f'/api/jobs/{job_id}')
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(f'/api/jobs/{job_id}', headers={'If-None-Match': etag}).status_code, 304)
+
+        from app.services.job_queue import get_job_queue
+        get_job_queue(self.app.config).lease('w1')
+        response = self.client.get(f'/api/jobs/{job_id}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'leased')
+    
+    def test_job_errors(self):
+        """Test missing image data and unknown job ids."""
+        self.assertEqual(self.client.post('/api/jobs', json={}).status_code, 400)
+        self.assertEqual(self.client.get('/api/jobs/unknown').status_code, 404)
+        self.assertEqual(self.client.post('/api/jobs', data=b'', content_type='image/webp').status_code, 400)
+
+    def test_binary_job_records_progress(self):
+        """Test that a binary upload is queued with its hint and normalized flag and logs its first stages."""
+        from app.services.job_queue import get_job_queue
+
+        img_buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), (255, 255, 255)).save(img_buffer, format='PNG')
+        response = self.client.post('/api/jobs', data=img_buffer.getvalue(), content_type='image/png',
+                                    headers={'X-Prompt-Hint': 'robot', 'X-Image-Normalized': '1'})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['jobId']
+
+        queue = get_job_queue(self.app.config)
+        self.assertEqual([event['stage'] for event in queue.events(job_id)], ['received', 'queued'])
+        payload = queue.lease('w1').payload
+        self.assertEqual(base64.b64decode(payload['imageData']), img_buffer.getvalue())
+        self.assertEqual((payload['promptHint'], payload['normalized']), ('robot', True))
+
+class TestSharedStoreRoutes(unittest.TestCase):
+    def setUp(self):
+        """Create an app whose generate route uses a temporary shared store."""
+        import tempfile
+        from app import create_app
+        from app.config import TestingConfig
+        from app.services.shared_store import SharedStore
+        
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SharedStore(os.path.join(self.tmpdir.name, 'store'), buckets=8, counter_buckets=8)
+        config = TestingConfig()
+        config.RATE_LIMIT_PER_MINUTE = 3
+        self.app = create_app(config)
+        self.client = self.app.test_client()
+        self.store_patch = patch('app.api.routes.get_shared_store', return_value=self.store)
+        self.store_patch.start()
+        
+        test_img = Image.new('RGBA', (64, 64), color=(0, 0, 255, 255))
+        img_buffer = io.BytesIO()
+        test_img.save(img_buffer, format='PNG')
+        self.payload = {
+            'imageData': base64.b64encode(img_buffer.getvalue()).decode('utf-8'),
+            'promptHint': 'robot',
+        }
+    
+    def tearDown(self):
+        """Remove the temporary store."""
+        self.store_patch.stop()
+        self.store.close()
+        self.tmpdir.cleanup()
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_repeated_generation_is_cached(self, mock_generate):
+        """Test that the same doodle and hint are only sent upstream once."""
+        mock_generate.return_value = "https://example.com/robot.png"
+        
+        first = self.client.post('/api/generate', json=self.payload)
+        second = self.client.post('/api/generate', json=self.payload)
+        
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.get_json()['imageUrl'], "https://example.com/robot.png")
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(self.store.counter('metrics:generate.cache_hits'), 1)
+    
+    @patch('app.api.routes.time')
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_rate_limit(self, mock_generate, mock_time):
+        """Test that a client over its per-minute limit gets 429."""
+        mock_generate.return_value = "https://example.com/robot.png"
+        mock_time.time.return_value = 1_000_020.0
+        
+        statuses = [self.client.post('/api/generate', json=self.payload).status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+    
+    @patch('app.api.routes.time')
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_batch_items_count_against_rate_limit(self, mock_generate, mock_time):
+        """Test that each batch item uses up one request of the per-minute limit."""
+        mock_generate.return_value = "https://example.com/robot.png"
+        mock_time.time.return_value = 1_000_020.0
+        mock_time.perf_counter.side_effect = time.perf_counter
+        batch = '\n'.join([json.dumps(self.payload)] * 2)
+        
+        response = self.client.post('/api/generate/batch', data=batch, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        response.get_data()
+        # Two of the three requests a minute are used up, so a second batch of two is refused
+        response = self.client.post('/api/generate/batch', data=batch, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.client.post('/api/generate', json=self.payload).status_code, 429)
+        self.assertEqual(mock_generate.call_count, 1)
+
+class TestUsageRoutes(unittest.TestCase):
+    def setUp(self):
+        """Create an app that accounts usage in a temporary database."""
+        import tempfile
+        from app import create_app
+        from app.config import TestingConfig
+        from app.services.usage import UsageAccountant
+        
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = TestingConfig()
+        config.ADMIN_TOKEN = 'let-me-in'
+        config.USAGE_API_KEYS = 'school-a=school-a-key'
+        self.app = create_app(config)
+        self.client = self.app.test_client()
+        self.accountant = UsageAccountant(
+            os.path.join(self.tmpdir.name, 'usage.db'),
+            cost_per_call=0.02,
+            budgets={'origin:school.example': 0.03, 'key:school-a': 0.03},
+            flush_interval=3600,
+        )
+        self.accountant_patch = patch('app.api.routes.get_usage_accountant', return_value=self.accountant)
+        self.accountant_patch.start()
+        
+        img_buffer = io.BytesIO()
+        Image.new('RGBA', (64, 64), color=(255, 0, 255, 255)).save(img_buffer, format='PNG')
+        self.payload = {'imageData': base64.b64encode(img_buffer.getvalue()).decode('utf-8')}
+        self.school = {'Origin': 'https://school.example'}
+    
+    def tearDown(self):
+        self.accountant_patch.stop()
+        self.accountant.close()
+        self.tmpdir.cleanup()
+    
+    @staticmethod
+    def _upstream(image, prompt_hint, deadline=None, hedge=True, usage=None):
+        usage.upstream_call()
+        return "https://example.com/generated.png"
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_budget_enforced(self, mock_generate):
+        """Test that a tenant is refused once its daily budget is spent, and others are not."""
+        mock_generate.side_effect = self._upstream
+        
+        statuses = [self.client.post('/api/generate', json=self.payload, headers=self.school).status_code
+                    for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        refused = self.client.post('/api/jobs', json=self.payload, headers=self.school)
+        self.assertEqual(refused.status_code, 429)
+        self.assertIn('Retry-After', refused.headers)
+        self.assertEqual(self.client.post('/api/generate', json=self.payload).status_code, 200)
+        self.assertEqual(mock_generate.call_count, 3)
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_unknown_api_key_refused(self, mock_generate):
+        """Test that only configured API keys are accepted, so keys cannot mint fresh budgets."""
+        mock_generate.side_effect = self._upstream
+        
+        known = self.client.post('/api/generate', json=self.payload, headers={'X-API-Key': 'school-a-key'})
+        self.assertEqual(known.status_code, 200)
+        for path in ('/api/generate', '/api/jobs'):
+            refused = self.client.post(path, json=self.payload, headers={'X-API-Key': 'made-up'})
+            self.assertEqual(refused.status_code, 401)
+        self.assertEqual(self.client.get('/api/usage', headers={'X-API-Key': 'made-up'}).status_code, 401)
+        self.assertEqual(mock_generate.call_count, 1)
+        
+        tenants = self.client.get('/api/usage', headers={'X-API-Key': 'school-a-key'}).get_json()['tenants']
+        self.assertEqual([entry['tenant'] for entry in tenants], ['key:school-a'])
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_usage_report(self, mock_generate):
+        """Test that callers see their own usage and the admin token sees every tenant."""
+        mock_generate.side_effect = self._upstream
+        key = {'X-API-Key': 'school-a-key'}
+        self.client.post('/api/generate', json=self.payload, headers=key)
+        self.client.post('/api/generate', json=self.payload, headers=self.school)
+        self.client.post('/api/generate', json=self.payload)
+        
+        own = self.client.get('/api/usage', headers=key).get_json()
+        self.assertEqual([entry['tenant'] for entry in own['tenants']], ['key:school-a'])
+        entry = own['tenants'][0]
+        self.assertEqual((entry['requests'], entry['upstream_calls']), (1, 1))
+        self.assertGreater(entry['bytes_in'], 0)
+        self.assertAlmostEqual(entry['cost'], 0.02)
+        
+        everyone = self.client.get('/api/usage', headers={'Authorization': 'Bearer let-me-in'}).get_json()
+        self.assertEqual({entry['tenant'] for entry in everyone['tenants']},
+                         {'key:school-a', 'origin:school.example', 'anonymous'})
+        # Anyone can claim an Origin, so it does not unlock a report
+        for headers in (self.school, {}, {'Authorization': 'Bearer nope'}):
+            self.assertEqual(self.client.get('/api/usage', headers=headers).status_code, 401)
+        self.assertEqual(self.client.get('/api/usage?period=yesterday', headers=key).status_code, 400)
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_batch_stops_at_budget(self, mock_generate):
+        """Test that a batch only sends items upstream while the tenant has budget left."""
+        mock_generate.side_effect = self._upstream
+        body = '\n'.join(json.dumps(dict(self.payload, id=f"d{index}")) for index in range(5))
+        
+        response = self.client.post('/api/generate/batch', data=body, content_type='application/x-ndjson',
+                                    headers={'X-API-Key': 'school-a-key'})
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(mock_generate.call_count, 2)
+        self.assertEqual(sorted(line.get('status', 200) for line in lines[:-1]), [200, 200, 429, 429, 429])
+        self.assertEqual(lines[-1]['summary']['failed'], 3)
+        
+        entry = self.accountant.report(tenant='key:school-a')[0]
+        self.assertEqual((entry['requests'], entry['upstream_calls']), (5, 2))
+        self.assertAlmostEqual(entry['cost'], 0.04)
+
+class TestImageRoutes(unittest.TestCase):
+    def setUp(self):
+        """Create an app whose generations are post-processed into a temporary store."""
+        import tempfile
+        from app import create_app
+        from app.config import TestingConfig
+        from app.services.postprocess import PostProcessor, VariantStore, parse_variants
+        
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = TestingConfig()
+        config.VARIANT_STORE_PATH = os.path.join(self.tmpdir.name, 'variants')
+        self.app = create_app(config)
+        self.client = self.app.test_client()
+        
+        generated = io.BytesIO()
+        Image.new('RGBA', (1024, 1024), (200, 40, 40, 255)).save(generated, format='PNG')
+        self.processor = PostProcessor(
+            VariantStore(config.VARIANT_STORE_PATH),
+            parse_variants('display:512:webp:80,thumb:128:jpeg:85'),
+            fetch=MagicMock(return_value=generated.getvalue()),
+        )
+        self.processor_patch = patch('app.api.routes.get_postprocessor', return_value=self.processor)
+        self.processor_patch.start()
+        
+        doodle = io.BytesIO()
+        Image.new('RGBA', (64, 64), (0, 0, 0, 255)).save(doodle, format='PNG')
+        self.payload = {'imageData': base64.b64encode(doodle.getvalue()).decode('utf-8')}
+    
+    def tearDown(self):
+        self.processor_patch.stop()
+        self.processor.shutdown()
+        self.tmpdir.cleanup()
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_generate_returns_variants(self, mock_generate):
+        """Test that a generation returns stored variants that can be downloaded and revalidated."""
+        mock_generate.return_value = "https://example.com/generated.png"
+        
+        response = self.client.post('/api/generate', json=dict(self.payload, variants=True))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('fetch;dur=', response.headers['Server-Timing'])
+        variants = response.get_json()['variants']
+        self.assertEqual(set(variants), {'display', 'thumb'})
+        self.assertEqual(variants['thumb']['width'], 128)
+        
+        image = self.client.get(variants['display']['url'])
+        self.assertEqual(image.status_code, 200)
+        self.assertEqual(image.mimetype, 'image/webp')
+        self.assertIn('immutable', image.headers['Cache-Control'])
+        self.assertEqual(len(image.data), variants['display']['bytes'])
+        
+        revalidated = self.client.get(variants['display']['url'], headers={'If-None-Match': image.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        image.close()
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_postprocess_failure_keeps_generation(self, mock_generate):
+        """Test that a failed fetch still returns the generated image URL."""
+        mock_generate.return_value = "https://example.com/generated.png"
+        self.processor.fetch = MagicMock(side_effect=OSError("connection reset"))
+        
+        response = self.client.post('/api/generate', json=dict(self.payload, variants=True))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['imageUrl'], "https://example.com/generated.png")
+        self.assertNotIn('variants', response.get_json())
+    
+    @patch('app.api.routes.generate_art_from_doodle')
+    def test_variants_are_opt_in(self, mock_generate):
+        """Test that /generate only fetches and renders variants when the client asks for them."""
+        mock_generate.return_value = "https://example.com/generated.png"
+        
+        response = self.client.post('/api/generate', json=self.payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('variants', response.get_json())
+        self.processor.fetch.assert_not_called()
+        
+        doodle = base64.b64decode(self.payload['imageData'])
+        response = self.client.post('/api/generate', data=doodle, content_type='image/png',
+                                    headers={'X-Variants': '1'})
+        self.assertEqual(set(response.get_json()['variants']), {'display', 'thumb'})
+        self.processor.fetch.assert_called_once()
+        # The fetch may not outlast the request budget
+        self.assertLessEqual(self.processor.fetch.call_args.kwargs['timeout'], 25.0)
+    
+    def test_unknown_image(self):
+        """Test that unknown and malformed image names are 404s."""
+        self.assertEqual(self.client.get('/api/images/' + 'a' * 64 + '.webp').status_code, 404)
+        self.assertEqual(self.client.get('/api/images/secret.txt').status_code, 404)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+import unittest.mock
+import base64
+import io
+import json
+import threading
+import time
+import sys
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services import batch
+from app.services.batch import (
+    get_preprocess_executor,
+    parse_ndjson_items,
+    preprocess_item,
+    run_batch,
+    stream_ndjson
+)
+
+def make_png(color=(255, 0, 0, 255), size=(32, 32)):
+    buffer = io.BytesIO()
+    Image.new('RGBA', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        """Create a thread pool for preprocessing."""
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.image_data = base64.b64encode(make_png()).decode('utf-8')
+    
+    def tearDown(self):
+        self.executor.shutdown()
+    
+    def test_parse_ndjson_items(self):
+        """Test that valid lines become items and bad lines become per-item errors."""
+        lines = [
+            json.dumps({'id': 'a', 'imageData': self.image_data, 'promptHint': 'cat'}).encode(),
+            b'',
+            b'{not json',
+            json.dumps({'id': 'c'}).encode(),
+        ]
+        items = parse_ndjson_items(lines, max_items=10)
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0]['promptHint'], 'cat')
+        self.assertEqual(items[1]['status'], 400)
+        self.assertEqual(items[2]['id'], 'c')
+        self.assertIn('missing', items[2]['error'])
+        
+        with self.assertRaises(ValueError):
+            parse_ndjson_items([b'{}'] * 3, max_items=2)
+    
+    def test_preprocess_item(self):
+        """Test that both base64 strings and raw bytes are normalised to 1024x1024 PNG."""
+        for data in (self.image_data, make_png()):
+            processed = preprocess_item(data)
+            self.assertEqual(Image.open(io.BytesIO(processed)).size, (1024, 1024))
+    
+    def test_run_batch_caps_concurrency_and_reports_errors(self):
+        """Test that upstream calls respect the cap and failures stay per item."""
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+        
+        def fake_generate(image, prompt_hint, deadline=None):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+            if prompt_hint == 'fail':
+                raise Exception("upstream error")
+            return f"https://example.com/{prompt_hint}.png"
+        
+        items = [{'index': i, 'id': str(i), 'imageData': self.image_data, 'promptHint': f'p{i}'} for i in range(10)]
+        items.append({'index': 10, 'id': 'bad', 'imageData': b'not-an-image', 'promptHint': None})
+        items.append({'index': 11, 'id': 'boom', 'imageData': self.image_data, 'promptHint': 'fail'})
+        items.append({'index': 12, 'id': 'parse', 'error': 'Invalid JSON', 'status': 400})
+        
+        results = list(run_batch(items, fake_generate, self.executor, upstream_concurrency=3, item_budget=5.0))
+        by_id = {r['id']: r for r in results}
+        
+        self.assertEqual(len(results), 13)
+        self.assertLessEqual(peak, 3)
+        self.assertEqual(by_id['4']['imageUrl'], 'https://example.com/p4.png')
+        self.assertEqual(by_id['bad']['status'], 400)
+        self.assertEqual(by_id['boom']['status'], 500)
+        self.assertEqual(by_id['parse']['status'], 400)
+    
+    def test_run_batch_replaces_broken_pool(self):
+        """Test that a dead preprocessing process fails only its items and the pool is rebuilt."""
+        # Start from a process pool of our own, whatever earlier tests created
+        self.addCleanup(setattr, batch, '_preprocess_executor', batch._preprocess_executor)
+        batch._preprocess_executor = None
+        pool = get_preprocess_executor(1)
+        self.assertNotIsInstance(pool, ThreadPoolExecutor)
+        self.addCleanup(lambda: batch._preprocess_executor.shutdown())
+        with self.assertRaises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result(timeout=30)
+        
+        generate = lambda image, prompt_hint, deadline=None: "https://example.com/ok.png"
+        items = [{'index': i, 'id': str(i), 'imageData': self.image_data, 'promptHint': None} for i in range(3)]
+        results = list(run_batch(items, generate, pool))
+        # The first item hits the broken pool; the rest go to its replacement
+        self.assertEqual([r.get('status') for r in sorted(results, key=lambda r: r['index'])], [503, None, None])
+        self.assertIsNot(get_preprocess_executor(1), pool)
+        
+        results = list(run_batch(items, generate, get_preprocess_executor(1)))
+        self.assertTrue(all('imageUrl' in r for r in results))
+    
+    def test_run_batch_reports_items_of_a_pool_that_breaks_midway(self):
+        """Test that futures failing with BrokenProcessPool become per-item 503s."""
+        class BreakingExecutor:
+            def submit(self, fn, *args):
+                future = Future()
+                future.set_exception(BrokenProcessPool("worker died"))
+                return future
+        
+        items = [{'index': i, 'id': str(i), 'imageData': self.image_data, 'promptHint': None} for i in range(2)]
+        with unittest.mock.patch.object(batch, 'replace_broken_executor') as mock_replace:
+            results = list(run_batch(items, None, BreakingExecutor()))
+        self.assertEqual([r['status'] for r in results], [503, 503])
+        self.assertEqual(mock_replace.call_count, 2)
+    
+    def test_stream_ndjson_summary(self):
+        """Test that the stream ends with a summary line."""
+        lines = list(stream_ndjson(iter([{'id': 'a', 'imageUrl': 'u'}, {'id': 'b', 'error': 'x'}]), 2))
+        summary = json.loads(lines[-1])['summary']
+        self.assertEqual(summary['succeeded'], 1)
+        self.assertEqual(summary['failed'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
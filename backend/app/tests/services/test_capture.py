@@ -0,0 +1,89 @@
+import unittest
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+from PIL import Image
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services.capture import INDEX_NAME, CorpusCapture, get_corpus_capture, load_corpus, read_input
+
+def png_bytes(color=(255, 255, 255)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+class TestCorpusCapture(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'corpus')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_capture_writes_input_and_index(self):
+        """Test that the upload is stored content-addressed and described in the index."""
+        capture = CorpusCapture(self.root, sample_rate=1.0)
+        image = png_bytes()
+        entry = capture.capture(image, b'processed', 'cat', {'decode': 1.23456, 'preprocess': 20.0},
+                                transport='binary', normalized=True, cache_status='MISS').result(timeout=10)
+        capture.shutdown()
+
+        self.assertEqual(entry['inputFormat'], 'PNG')
+        self.assertTrue(entry['input'].endswith('.png'))
+        self.assertEqual(entry['transport'], 'binary')
+        self.assertTrue(entry['normalized'])
+        self.assertEqual(entry['timings']['decode'], 1.235)
+        self.assertEqual(load_corpus(self.root), [entry])
+        self.assertEqual(read_input(self.root, entry), image)
+
+    def test_identical_inputs_stored_once(self):
+        """Test that repeated uploads share one file but get one index line each."""
+        capture = CorpusCapture(self.root, sample_rate=1.0)
+        for _ in range(3):
+            capture.capture(png_bytes(), b'processed', None, {})
+        capture.shutdown()
+        self.assertEqual(len(load_corpus(self.root)), 3)
+        self.assertEqual(sorted(os.listdir(self.root)), sorted([INDEX_NAME, load_corpus(self.root)[0]['input']]))
+
+    def test_max_entries_and_sampling(self):
+        """Test that capture stops at max_entries, counting entries already on disk."""
+        capture = CorpusCapture(self.root, sample_rate=1.0, max_entries=2)
+        capture.capture(png_bytes(), b'p', None, {})
+        capture.shutdown()
+
+        capture = CorpusCapture(self.root, sample_rate=1.0, max_entries=2)
+        self.assertTrue(capture.sample())
+        capture.capture(png_bytes((0, 0, 0)), b'p', None, {}).result(timeout=10)
+        self.assertFalse(capture.sample())
+        self.assertIsNone(capture.capture(png_bytes((9, 9, 9)), b'p', None, {}).result(timeout=10))
+        capture.shutdown()
+        self.assertEqual(len(load_corpus(self.root)), 2)
+
+        rare = CorpusCapture(self.root, sample_rate=0.1, max_entries=1000, rng=random.Random(3))
+        sampled = sum(rare.sample() for _ in range(1000))
+        self.assertTrue(50 < sampled < 150)
+        rare.shutdown()
+
+    def test_malformed_lines_skipped(self):
+        """Test that a torn index line does not break loading."""
+        os.makedirs(self.root)
+        with open(os.path.join(self.root, INDEX_NAME), 'w') as index:
+            index.write(json.dumps({'input': 'a.png'}) + '\n{"input": "b.pn\n')
+        self.assertEqual(load_corpus(self.root), [{'input': 'a.png'}])
+
+    def test_disabled_by_config(self):
+        """Test that no capture exists unless enabled."""
+        self.assertIsNone(get_corpus_capture({'CAPTURE_ENABLED': False}))
+        config = {'CAPTURE_ENABLED': True, 'CAPTURE_PATH': self.root, 'CAPTURE_SAMPLE_RATE': 0.5,
+                  'CAPTURE_MAX_ENTRIES': 10}
+        capture = get_corpus_capture(config)
+        self.assertIs(get_corpus_capture(config), capture)
+        self.assertEqual(capture.sample_rate, 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services.health import HealthMonitor, probe_upstream
+
+class TestHealthMonitor(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.config = {
+            'HEALTH_REFRESH_SECONDS': 0.05,
+            'HEALTH_UPSTREAM_URL': 'https://upstream.invalid/v1/models',
+            'HEALTH_UPSTREAM_TIMEOUT_SECONDS': 0.5,
+            'SHARED_STORE_ENABLED': False,
+            'JOB_QUEUE_PATH': os.path.join(self.tmpdir.name, 'jobs.db'),
+            'JOB_VISIBILITY_TIMEOUT_SECONDS': 60,
+            'JOB_MAX_ATTEMPTS': 3,
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @patch('app.services.health.probe_upstream')
+    def test_snapshot_refreshed_in_background(self, mock_probe):
+        """Test that the snapshot is served immediately and then filled in by the thread."""
+        mock_probe.return_value = {'reachable': True, 'latencyMs': 12}
+        monitor = HealthMonitor(self.config)
+        try:
+            first = monitor.snapshot()
+            self.assertEqual(first['status'], 'ok')
+
+            for _ in range(100):
+                if mock_probe.call_count >= 2:
+                    break
+                time.sleep(0.01)
+            snapshot = monitor.snapshot()
+            self.assertEqual(snapshot['upstream'], {'reachable': True, 'latencyMs': 12})
+            self.assertEqual(snapshot['jobs']['queued'], 0)
+            self.assertIn('ageSeconds', snapshot)
+            self.assertGreaterEqual(mock_probe.call_count, 2)
+        finally:
+            monitor.stop()
+
+    @patch('app.services.health.probe_upstream')
+    def test_unreachable_upstream_degrades(self, mock_probe):
+        """Test that an unreachable upstream is reported without failing the check."""
+        mock_probe.return_value = {'reachable': False, 'latencyMs': 500, 'error': 'timed out'}
+        snapshot = HealthMonitor(self.config).collect()
+        self.assertEqual(snapshot['status'], 'degraded')
+        self.assertFalse(snapshot['upstream']['reachable'])
+
+    def test_probe_connection_error(self):
+        """Test that a connection failure is reported as unreachable."""
+        result = probe_upstream('http://127.0.0.1:9/', 0.5)
+        self.assertFalse(result['reachable'])
+        self.assertIn('error', result)
+
+if __name__ == '__main__':
+    unittest.main()
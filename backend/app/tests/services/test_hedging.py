@@ -0,0 +1,96 @@
+import unittest
+import threading
+import time
+import sys
+import os
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services.hedging import LatencyTracker, hedged_call
+from app.utils.deadline import Deadline, DeadlineExceeded
+
+class TestHedging(unittest.TestCase):
+    def test_latency_tracker_percentile(self):
+        """Test that the hedge delay only appears once enough samples exist."""
+        tracker = LatencyTracker(percentile=90, min_samples=10)
+        for i in range(9):
+            tracker.record(i / 100.0)
+        self.assertIsNone(tracker.hedge_delay())
+        tracker.record(0.09)
+        self.assertAlmostEqual(tracker.hedge_delay(), 0.09)
+        for _ in range(90):
+            tracker.record(0.01)
+        self.assertAlmostEqual(tracker.hedge_delay(), 0.01)
+    
+    def test_fast_primary_is_not_hedged(self):
+        """Test that a primary finishing before the hedge delay wins alone."""
+        calls = []
+        def attempt(index):
+            calls.append(index)
+            return 'primary'
+        
+        result = hedged_call(attempt, Deadline(1.0), hedge_delay=0.5)
+        self.assertEqual(result, 'primary')
+        self.assertEqual(calls, [0])
+    
+    def test_slow_primary_is_hedged(self):
+        """Test that the hedge wins when the primary stalls."""
+        release = threading.Event()
+        def attempt(index):
+            if index == 0:
+                release.wait(2.0)
+                return 'primary'
+            return 'hedge'
+        
+        started = time.monotonic()
+        result = hedged_call(attempt, Deadline(2.0), hedge_delay=0.05)
+        release.set()
+        self.assertEqual(result, 'hedge')
+        self.assertLess(time.monotonic() - started, 1.0)
+    
+    def test_hedge_disabled(self):
+        """Test that no duplicate is sent when hedging is turned off."""
+        calls = []
+        def attempt(index):
+            calls.append(index)
+            time.sleep(0.1)
+            return 'primary'
+        
+        tracker = LatencyTracker(min_samples=1)
+        tracker.record(0.01)
+        result = hedged_call(attempt, Deadline(1.0), tracker=tracker, hedge=False)
+        self.assertEqual(result, 'primary')
+        self.assertEqual(calls, [0])
+    
+    def test_deadline_exceeded(self):
+        """Test that the call gives up when the budget runs out."""
+        release = threading.Event()
+        def attempt(index):
+            release.wait(2.0)
+            return 'late'
+        
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            hedged_call(attempt, Deadline(0.1), hedge_delay=0.02)
+        release.set()
+        self.assertLess(time.monotonic() - started, 1.0)
+    
+    def test_error_waits_for_other_attempt(self):
+        """Test that a failed primary does not fail the call while the hedge runs."""
+        def attempt(index):
+            if index == 0:
+                time.sleep(0.1)
+                raise RuntimeError("primary failed")
+            time.sleep(0.2)
+            return 'hedge'
+        
+        self.assertEqual(hedged_call(attempt, Deadline(1.0), hedge_delay=0.02), 'hedge')
+        
+        def failing(index):
+            raise RuntimeError("boom")
+        with self.assertRaises(RuntimeError):
+            hedged_call(failing, Deadline(1.0))
+
+if __name__ == '__main__':
+    unittest.main()
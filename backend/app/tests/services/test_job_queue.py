@@ -0,0 +1,291 @@
+import unittest
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services.job_queue import SQLiteJobQueue, DONE, FAILED, LEASED, QUEUED
+from app.services.job_queue import COMPLETED, PREPROCESSED, RECEIVED, RETRYING, UPSTREAM_STARTED
+from app.worker import LeaseLost, process_generation_job, run_worker
+from app.utils.deadline import Deadline
+from unittest.mock import MagicMock, patch
+
+def _lease_and_die(path):
+    queue = SQLiteJobQueue(path, visibility_timeout=0.2)
+    queue.lease('doomed-worker')
+    os._exit(1)
+
+class TestSQLiteJobQueue(unittest.TestCase):
+    def setUp(self):
+        """Create a queue in a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'jobs.db')
+        self.queue = SQLiteJobQueue(self.path, visibility_timeout=0.2, max_attempts=2, retry_backoff=0.05)
+    
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.tmpdir)
+    
+    def test_enqueue_lease_ack(self):
+        """Test the normal lifecycle of a job."""
+        job_id = self.queue.enqueue({'imageData': 'abc'})
+        self.assertEqual(self.queue.get(job_id)['status'], QUEUED)
+        
+        job = self.queue.lease('w1')
+        self.assertEqual(job.id, job_id)
+        self.assertEqual(job.payload, {'imageData': 'abc'})
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(self.queue.lease('w2'))
+        
+        self.assertTrue(self.queue.ack(job_id, 'w1', {'imageUrl': 'u'}))
+        state = self.queue.get(job_id)
+        self.assertEqual(state['status'], DONE)
+        self.assertEqual(state['result'], {'imageUrl': 'u'})
+        self.assertIsNone(self.queue.get('missing'))
+    
+    def test_jobs_leased_in_order(self):
+        """Test that jobs are handed out oldest first."""
+        first = self.queue.enqueue({'n': 1})
+        second = self.queue.enqueue({'n': 2})
+        self.assertEqual(self.queue.lease('w').id, first)
+        self.assertEqual(self.queue.lease('w').id, second)
+    
+    def test_visibility_timeout(self):
+        """Test that an expired lease is handed to another worker and the old owner cannot ack."""
+        job_id = self.queue.enqueue({})
+        self.queue.lease('slow-worker')
+        time.sleep(0.25)
+        job = self.queue.lease('fast-worker')
+        self.assertEqual(job.id, job_id)
+        self.assertEqual(job.attempts, 2)
+        self.assertFalse(self.queue.ack(job_id, 'slow-worker', {}))
+        self.assertTrue(self.queue.ack(job_id, 'fast-worker', {}))
+    
+    def test_extend_lease(self):
+        """Test that a heartbeat keeps the job hidden."""
+        self.queue.enqueue({})
+        job = self.queue.lease('w1')
+        time.sleep(0.15)
+        self.assertTrue(self.queue.extend(job.id, 'w1'))
+        time.sleep(0.1)
+        self.assertIsNone(self.queue.lease('w2'))
+    
+    def test_fail_retries_then_gives_up(self):
+        """Test retry with backoff and the attempt limit."""
+        job_id = self.queue.enqueue({})
+        job = self.queue.lease('w')
+        self.assertTrue(self.queue.fail(job_id, 'w', 'upstream error'))
+        self.assertEqual(self.queue.get(job_id)['status'], QUEUED)
+        self.assertIsNone(self.queue.lease('w'))  # still backing off
+        time.sleep(0.06)
+        job = self.queue.lease('w')
+        self.assertEqual(job.attempts, 2)
+        self.queue.fail(job_id, 'w', 'upstream error')
+        state = self.queue.get(job_id)
+        self.assertEqual(state['status'], FAILED)
+        self.assertEqual(state['error'], 'upstream error')
+    
+    def test_permanent_failure(self):
+        """Test that retry=False fails the job immediately."""
+        job_id = self.queue.enqueue({})
+        self.queue.lease('w')
+        self.queue.fail(job_id, 'w', 'bad image', retry=False)
+        self.assertEqual(self.queue.get(job_id)['status'], FAILED)
+    
+    def test_recovery_after_killed_worker(self):
+        """Test that a job leased by a worker that was killed is picked up again."""
+        job_id = self.queue.enqueue({'imageData': 'abc'})
+        context = multiprocessing.get_context('fork')
+        worker = context.Process(target=_lease_and_die, args=(self.path,))
+        worker.start()
+        worker.join(30)
+        self.assertEqual(self.queue.get(job_id)['status'], LEASED)
+        
+        time.sleep(0.25)
+        processed = run_worker(self.queue, handler=lambda payload, deadline: {'imageUrl': 'u'},
+                               worker_id='survivor', poll_interval=0.01, max_jobs=1)
+        self.assertEqual(processed, 1)
+        state = self.queue.get(job_id)
+        self.assertEqual(state['status'], DONE)
+        self.assertEqual(state['attempts'], 2)
+    
+    def test_lease_expired_on_final_attempt(self):
+        """Test that a job whose workers keep dying ends up failed."""
+        job_id = self.queue.enqueue({})
+        for _ in range(2):
+            self.queue.lease('w')
+            time.sleep(0.25)
+        self.assertIsNone(self.queue.lease('w'))
+        self.assertEqual(self.queue.get(job_id)['status'], FAILED)
+
+class TestJobEvents(unittest.TestCase):
+    def setUp(self):
+        """Create a queue in a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = SQLiteJobQueue(os.path.join(self.tmpdir, 'jobs.db'), max_attempts=2, retry_backoff=0.05)
+    
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.tmpdir)
+    
+    def test_lifecycle_events(self):
+        """Test that status changes record their events in order, with the result on completion."""
+        job_id = self.queue.enqueue({'imageData': 'abc'}, received_at=time.time() - 1)
+        self.queue.lease('w1')
+        self.queue.add_event(job_id, PREPROCESSED, {'attempt': 1})
+        self.queue.fail(job_id, 'w1', 'upstream down')
+        time.sleep(0.06)
+        self.queue.lease('w1')
+        self.queue.ack(job_id, 'w1', {'imageUrl': 'u'})
+        
+        events = self.queue.events(job_id)
+        self.assertEqual([e['stage'] for e in events], [RECEIVED, QUEUED, PREPROCESSED, RETRYING, COMPLETED])
+        self.assertLess(events[0]['at'], events[1]['at'])
+        self.assertEqual(events[2]['attempt'], 1)
+        self.assertEqual((events[3]['error'], events[3]['attempt']), ('upstream down', 1))
+        self.assertEqual(events[4]['imageUrl'], 'u')
+        self.assertEqual([e['stage'] for e in self.queue.events(job_id, after=events[2]['id'])], [RETRYING, COMPLETED])
+        
+        # A lost lease records nothing
+        self.assertFalse(self.queue.ack(job_id, 'w1', {'imageUrl': 'again'}))
+        self.assertEqual(len(self.queue.events(job_id)), 5)
+    
+    def test_failed_event(self):
+        """Test that a permanent failure ends the log with a failed event."""
+        job_id = self.queue.enqueue({})
+        self.queue.lease('w1')
+        self.queue.fail(job_id, 'w1', 'not an image', retry=False)
+        self.assertEqual(self.queue.events(job_id)[-1]['stage'], FAILED)
+        self.assertEqual(self.queue.events(job_id)[-1]['error'], 'not an image')
+    
+    def test_events_since_and_prune(self):
+        """Test following the log of all jobs by cursor and pruning old events."""
+        self.assertEqual(self.queue.last_event_id(), 0)
+        first = self.queue.enqueue({})
+        cursor = self.queue.last_event_id()
+        second = self.queue.enqueue({})
+        self.queue.add_event(first, PREPROCESSED)
+        
+        events = self.queue.events_since(cursor)
+        self.assertEqual([(e['jobId'], e['stage']) for e in events], [(second, QUEUED), (first, PREPROCESSED)])
+        self.assertEqual(len(self.queue.events_since(0, limit=2)), 2)
+        
+        self.assertEqual(self.queue.prune_events(time.time() + 1), 3)
+        self.assertEqual(self.queue.events(first), [])
+
+class TestRunWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = SQLiteJobQueue(os.path.join(self.tmpdir, 'jobs.db'), max_attempts=1)
+    
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.tmpdir)
+    
+    def test_worker_outcomes(self):
+        """Test that results are acked and errors recorded."""
+        ok = self.queue.enqueue({'kind': 'ok'})
+        invalid = self.queue.enqueue({'kind': 'invalid'})
+        broken = self.queue.enqueue({'kind': 'broken'})
+        
+        def handler(payload, deadline):
+            self.assertGreater(deadline.remaining(), 0)
+            if payload['kind'] == 'invalid':
+                raise ValueError("not an image")
+            if payload['kind'] == 'broken':
+                raise Exception("upstream down")
+            return {'imageUrl': 'u'}
+        
+        run_worker(self.queue, handler=handler, poll_interval=0.01, max_jobs=3)
+        
+        self.assertEqual(self.queue.get(ok)['result'], {'imageUrl': 'u'})
+        self.assertIn('Invalid image data', self.queue.get(invalid)['error'])
+        self.assertIn('upstream down', self.queue.get(broken)['error'])
+        self.assertEqual(self.queue.stats()[FAILED], 2)
+    
+    def test_worker_reports_progress(self):
+        """Test that handlers get a progress callback that records events with the attempt."""
+        job_id = self.queue.enqueue({})
+        
+        def handler(payload, deadline, progress):
+            progress(PREPROCESSED)
+            return {'imageUrl': 'u'}
+        
+        run_worker(self.queue, handler=handler, poll_interval=0.01, max_jobs=1, report_progress=True)
+        stages = [(e['stage'], e.get('attempt')) for e in self.queue.events(job_id)]
+        self.assertEqual(stages, [(QUEUED, None), (PREPROCESSED, 1), (COMPLETED, None)])
+    
+    def test_progress_renews_the_lease(self):
+        """Test that each stage pushes the lease expiry back."""
+        queue = SQLiteJobQueue(os.path.join(self.tmpdir, 'short.db'), visibility_timeout=0.3, max_attempts=1)
+        self.addCleanup(queue.close)
+        queue.enqueue({})
+        
+        def handler(payload, deadline, progress):
+            for stage in (PREPROCESSED, UPSTREAM_STARTED):
+                time.sleep(0.2)
+                progress(stage)
+                self.assertIsNone(queue.lease('other-worker'))
+            return {'imageUrl': 'u'}
+        
+        run_worker(queue, handler=handler, poll_interval=0.01, max_jobs=1, report_progress=True)
+        self.assertEqual(queue.stats()[DONE], 1)
+    
+    def test_lost_lease_stops_the_job(self):
+        """Test that a worker whose lease was taken over stops and leaves the job to the new owner."""
+        queue = SQLiteJobQueue(os.path.join(self.tmpdir, 'short.db'), visibility_timeout=0.1)
+        self.addCleanup(queue.close)
+        job_id = queue.enqueue({})
+        reached_upstream = []
+        
+        def handler(payload, deadline, progress):
+            time.sleep(0.15)
+            self.assertIsNotNone(queue.lease('other-worker'))
+            with self.assertRaises(LeaseLost):
+                progress(UPSTREAM_STARTED)
+            progress(UPSTREAM_STARTED)
+            reached_upstream.append(True)
+        
+        run_worker(queue, handler=handler, worker_id='slow-worker', poll_interval=0.01, max_jobs=1,
+                   report_progress=True)
+        self.assertEqual(reached_upstream, [])
+        job = queue.get(job_id)
+        self.assertEqual(job['status'], LEASED)
+        self.assertNotIn(UPSTREAM_STARTED, [e['stage'] for e in queue.events(job_id)])
+
+class TestProcessGenerationJob(unittest.TestCase):
+    def setUp(self):
+        from PIL import Image
+        import base64
+        import io
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), 'white').save(buffer, format='PNG')
+        self.payload = {'imageData': base64.b64encode(buffer.getvalue()).decode('ascii')}
+    
+    @patch('app.services.openai_service.initialize_openai_client')
+    def test_upstream_started_when_the_request_is_sent(self, mock_init_client):
+        """Test that upstream_started is reported just before the call, not with preprocessing."""
+        stages = []
+        mock_client = MagicMock()
+        mock_client.images.edit.side_effect = lambda **kwargs: (
+            stages.append('edit') or MagicMock(data=[MagicMock(url='https://example.com/a.png')]))
+        mock_init_client.return_value = mock_client
+        
+        result = process_generation_job(self.payload, Deadline(10.0), progress=stages.append)
+        self.assertEqual(result, {'imageUrl': 'https://example.com/a.png'})
+        self.assertEqual(stages, [PREPROCESSED, UPSTREAM_STARTED, 'edit'])
+        
+        # No request is sent without an API key, so the stage is never reported
+        stages.clear()
+        mock_init_client.side_effect = ValueError("OpenAI API key not found in environment variables")
+        with self.assertRaises(RuntimeError):
+            process_generation_job(self.payload, Deadline(10.0), progress=stages.append)
+        self.assertEqual(stages, [PREPROCESSED])
+
+if __name__ == '__main__':
+    unittest.main()
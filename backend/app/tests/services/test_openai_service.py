@@ -61,5 +61,50 @@ class TestOpenAIService(unittest.TestCase):
         with self.assertRaises(Exception):
             generate_art_from_doodle(image_bytes, "cat")
 
+    @patch('app.services.openai_service.initialize_openai_client')
+    def test_generate_art_from_doodle_with_deadline(self, mock_init_client):
+        """Test that a deadline bounds the OpenAI call and disables SDK retries."""
+        from app.utils.deadline import Deadline, DeadlineExceeded
+        
+        mock_client = MagicMock()
+        mock_init_client.return_value = mock_client
+        mock_response = MagicMock()
+        mock_response.data = [MagicMock(url="https://example.com/image.png")]
+        mock_client.images.edit.return_value = mock_response
+        
+        image_bytes = io.BytesIO(b'test_image_data')
+        result = generate_art_from_doodle(image_bytes, "cat", deadline=Deadline(5.0))
+        
+        self.assertEqual(result, "https://example.com/image.png")
+        mock_init_client.assert_called_with(max_retries=0)
+        timeout = mock_client.images.edit.call_args[1]["timeout"]
+        self.assertGreater(timeout, 0)
+        self.assertLessEqual(timeout, 5.0)
+        
+        # An exhausted budget is reported as such rather than as an API failure
+        with self.assertRaises(DeadlineExceeded):
+            generate_art_from_doodle(image_bytes, "cat", deadline=Deadline(0))
+    
+    @patch('app.services.openai_service.initialize_openai_client')
+    def test_generate_art_records_usage(self, mock_init_client):
+        """Test that every upstream attempt and failure is counted on the usage record."""
+        from app.services.usage import UsageRecord
+        
+        mock_client = MagicMock()
+        mock_init_client.return_value = mock_client
+        mock_response = MagicMock()
+        mock_response.data = [MagicMock(url="https://example.com/image.png")]
+        mock_client.images.edit.return_value = mock_response
+        
+        usage = UsageRecord('origin:school.example')
+        generate_art_from_doodle(io.BytesIO(b'test_image_data'), "cat", usage=usage)
+        self.assertEqual((usage.upstream_calls, usage.upstream_errors), (1, 0))
+        self.assertGreaterEqual(usage.upstream_ms, 0)
+        
+        mock_client.images.edit.side_effect = Exception("API Error")
+        with self.assertRaises(Exception):
+            generate_art_from_doodle(io.BytesIO(b'test_image_data'), "cat", usage=usage)
+        self.assertEqual((usage.upstream_calls, usage.upstream_errors), (2, 1))
+
 if __name__ == '__main__':
     unittest.main()
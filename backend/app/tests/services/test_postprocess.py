@@ -0,0 +1,167 @@
+import unittest
+import io
+import os
+import sys
+import tempfile
+from unittest.mock import MagicMock, patch
+from PIL import Image
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services.postprocess import (
+    PostProcessor,
+    Variant,
+    VariantStore,
+    fetch_image,
+    get_variant_store,
+    load_overlay,
+    parse_variants
+)
+from app.services.shared_store import SharedStore
+from app.utils.deadline import Deadline, DeadlineExceeded
+
+def generated_png(size=(1024, 1024)):
+    buffer = io.BytesIO()
+    Image.new('RGBA', size, (30, 160, 90, 255)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+class TestParseVariants(unittest.TestCase):
+    def test_parse(self):
+        """Test parsing a variant list."""
+        self.assertEqual(parse_variants('display:1024:webp:80, thumb:256:jpg'), [
+            Variant('display', 1024, 'WEBP', 80),
+            Variant('thumb', 256, 'JPEG', 85),
+        ])
+        self.assertEqual(parse_variants(''), [])
+
+    def test_invalid(self):
+        """Test that malformed entries and unknown formats are rejected."""
+        with self.assertRaises(ValueError):
+            parse_variants('display:1024')
+        with self.assertRaises(ValueError):
+            parse_variants('display:1024:tiff')
+
+class TestPostProcessor(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = VariantStore(os.path.join(self.tmpdir.name, 'variants'))
+        self.fetch = MagicMock(return_value=generated_png())
+        self.processor = PostProcessor(
+            self.store,
+            parse_variants('display:512:webp:80,thumb:128:jpeg:85'),
+            fetch=self.fetch,
+        )
+
+    def tearDown(self):
+        self.processor.shutdown()
+        self.tmpdir.cleanup()
+
+    def test_variants_rendered_and_stored(self):
+        """Test that each variant is resized, encoded, watermarked and stored by content hash."""
+        result = self.processor.submit('https://example.com/generated.png').result(timeout=10)
+
+        display, thumb = result.variants['display'], result.variants['thumb']
+        self.assertEqual((display['width'], display['height'], display['format']), (512, 512, 'webp'))
+        self.assertEqual((thumb['width'], thumb['height'], thumb['format']), (128, 128, 'jpeg'))
+        self.assertTrue(thumb['name'].endswith('.jpg'))
+
+        with Image.open(self.store.path(display['name'])) as stored:
+            self.assertEqual(stored.format, 'WEBP')
+            self.assertEqual(stored.size, (512, 512))
+            # The badge sits in the bottom-right corner; the top-left is untouched
+            corner = stored.convert('RGB').getpixel((500, 500))
+            self.assertNotEqual(corner, stored.convert('RGB').getpixel((10, 10)))
+
+        for stage in ('fetch', 'decode', 'display', 'thumb', 'total'):
+            self.assertIn(stage, result.timings)
+
+    def test_no_watermark(self):
+        """Test that watermark_path=None leaves the image unbranded."""
+        processor = PostProcessor(self.store, [Variant('png', 64, 'PNG', 85)], watermark_path=None, fetch=self.fetch)
+        result = processor.process('https://example.com/generated.png')
+        with Image.open(self.store.path(result.variants['png']['name'])) as stored:
+            self.assertEqual(stored.getextrema(), ((30, 30), (160, 160), (90, 90), (255, 255)))
+        processor.shutdown()
+
+    def test_identical_output_stored_once(self):
+        """Test that the store is content-addressed."""
+        first = self.processor.process('https://example.com/a.png')
+        second = self.processor.process('https://example.com/b.png')
+        self.assertEqual(first.variants['display']['name'], second.variants['display']['name'])
+        with self.assertRaises(ValueError):
+            self.store.path('../../etc/passwd')
+
+    def test_results_cached_in_shared_store(self):
+        """Test that a URL is only fetched once when a shared store is configured."""
+        cache = SharedStore(os.path.join(self.tmpdir.name, 'store'), buckets=8, counter_buckets=8)
+        processor = PostProcessor(self.store, parse_variants('thumb:128:jpeg'), fetch=self.fetch, cache=cache)
+        first = processor.process('https://example.com/generated.png')
+        second = processor.process('https://example.com/generated.png')
+        self.assertEqual(first.variants, second.variants)
+        self.assertIn('cache', second.timings)
+        self.assertEqual(self.fetch.call_count, 1)
+        processor.shutdown()
+        cache.close()
+
+    def test_fetched_data_is_guarded(self):
+        """Test that a non-image response is rejected before decoding."""
+        self.fetch.return_value = b'<html>expired</html>'
+        with self.assertRaises(ValueError):
+            self.processor.process('https://example.com/expired.png')
+
+    def test_deadline_bounds_every_stage(self):
+        """Test that the fetch timeout is cut to the deadline and later stages stop once it passes."""
+        self.processor.process('https://example.com/a.png', Deadline(2.0))
+        self.assertLessEqual(self.fetch.call_args.kwargs['timeout'], 2.0)
+        
+        self.processor.fetch_timeout = 0.5
+        self.processor.process('https://example.com/b.png', Deadline(2.0))
+        self.assertEqual(self.fetch.call_args.kwargs['timeout'], 0.5)
+        
+        # A fetch that uses up the budget leaves no time to render
+        now = [0.0]
+        deadline = Deadline(1.0, clock=lambda: now[0])
+        self.fetch.side_effect = lambda url, timeout: now.__setitem__(0, 1.5) or generated_png()
+        with self.assertRaises(DeadlineExceeded):
+            self.processor.process('https://example.com/c.png', deadline)
+    
+    def test_variant_store_shared_per_directory(self):
+        """Test that the configured store is built once per directory."""
+        config = {'VARIANT_STORE_PATH': os.path.join(self.tmpdir.name, 'shared')}
+        self.assertIs(get_variant_store(config), get_variant_store(dict(config)))
+        other = {'VARIANT_STORE_PATH': os.path.join(self.tmpdir.name, 'other')}
+        self.assertIsNot(get_variant_store(other), get_variant_store(config))
+
+class TestOverlayAndFetch(unittest.TestCase):
+    def test_overlay_cached_decoded(self):
+        """Test that the overlay is decoded and scaled once per width."""
+        load_overlay.cache_clear()
+        first = load_overlay('', 200, 0.5)
+        second = load_overlay('', 200, 0.5)
+        self.assertIs(first, second)
+        self.assertEqual(first.width, 200)
+        self.assertLessEqual(first.getchannel('A').getextrema()[1], 128)
+        self.assertEqual(load_overlay.cache_info().hits, 1)
+
+    @patch('app.services.postprocess.get_http_session')
+    def test_fetch_uses_pooled_session(self, mock_session):
+        """Test that downloads go through the shared session and are size-capped."""
+        response = mock_session.return_value.get.return_value.__enter__.return_value
+        response.iter_content.return_value = [b'a' * 10, b'b' * 10]
+        self.assertEqual(fetch_image('https://example.com/x.png', timeout=3), b'a' * 10 + b'b' * 10)
+        mock_session.return_value.get.assert_called_once_with('https://example.com/x.png', timeout=3, stream=True)
+        with self.assertRaises(ValueError):
+            fetch_image('https://example.com/x.png', timeout=3, max_bytes=15)
+    
+    @patch('app.services.postprocess.get_http_session')
+    def test_fetch_timeout_covers_the_whole_download(self, mock_session):
+        """Test that a download trickling in past the timeout is abandoned."""
+        response = mock_session.return_value.get.return_value.__enter__.return_value
+        response.iter_content.return_value = iter([b'a'] * 3)
+        with patch('app.services.postprocess.time.monotonic', side_effect=[0.0, 1.0, 2.0, 4.0]):
+            with self.assertRaises(TimeoutError):
+                fetch_image('https://example.com/x.png', timeout=3)
+
+if __name__ == '__main__':
+    unittest.main()
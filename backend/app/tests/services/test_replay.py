@@ -0,0 +1,106 @@
+import unittest
+import io
+import os
+import random
+import sys
+import tempfile
+from PIL import Image, ImageDraw
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services.capture import CorpusCapture, load_corpus
+from app.services.replay import bootstrap_ci, compare_runs, percentile, run_replay
+from app.utils.image_utils import validate_and_process_image
+
+def doodle_bytes(offset):
+    image = Image.new('RGB', (200, 150), 'white')
+    ImageDraw.Draw(image).line((offset, 10, 150, 120), fill='black', width=4)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def fake_run(samples, label):
+    return {'label': label, 'samples': samples, 'mismatches': [], 'environment': {}}
+
+class TestStatistics(unittest.TestCase):
+    def test_percentile(self):
+        """Test linear interpolation between ranks."""
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2.5)
+        self.assertEqual(percentile([1, 2, 3, 4], 100), 4)
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_bootstrap_ci_contains_estimate(self):
+        """Test that the interval brackets the sample median."""
+        rng = random.Random(1)
+        values = [rng.gauss(100, 10) for _ in range(200)]
+        low, high = bootstrap_ci(values, 50, iterations=500)
+        self.assertLess(low, percentile(values, 50))
+        self.assertGreater(high, percentile(values, 50))
+        self.assertLess(high - low, 10)
+
+    def test_compare_verdicts(self):
+        """Test that only changes outside the noise and above the threshold get a verdict."""
+        rng = random.Random(2)
+        base = [rng.gauss(100, 5) for _ in range(200)]
+        noisy = [rng.gauss(100, 5) for _ in range(200)]
+        slower = [value * 1.3 for value in base]
+        faster = [value * 0.7 for value in base]
+        slightly = [value * 1.02 for value in base]
+
+        def verdicts(candidate):
+            rows = compare_runs(fake_run({'total': base}, 'a'), fake_run({'total': candidate}, 'b'), iterations=400)
+            return {row['statistic']: row['verdict'] for row in rows}
+
+        self.assertEqual(verdicts(noisy), {'median': 'same', 'p99': 'same'})
+        self.assertEqual(verdicts(slower)['median'], 'regression')
+        self.assertEqual(verdicts(faster)['median'], 'improvement')
+        self.assertEqual(verdicts(slightly)['median'], 'same')
+
+    def test_compare_skips_missing_stages(self):
+        """Test that stages absent from either run are not compared."""
+        rows = compare_runs(fake_run({'total': [1, 2], 'decode': [1]}, 'a'), fake_run({'total': [1, 2]}, 'b'),
+                            iterations=20)
+        self.assertEqual({row['stage'] for row in rows}, {'total'})
+
+class TestRunReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        capture = CorpusCapture(self.root, sample_rate=1.0)
+        for offset, transport in ((10, 'json'), (30, 'binary')):
+            image = doodle_bytes(offset)
+            processed = validate_and_process_image(image).getvalue()
+            capture.capture(image, processed, 'cat', {}, transport=transport)
+        capture.capture(doodle_bytes(50), b'not what replay will produce', None, {})
+        capture.shutdown()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_run_collects_samples_and_mismatches(self):
+        """Test that each measured pass yields one sample per entry and stage."""
+        entries = load_corpus(self.root)
+        result = run_replay(self.root, entries, repeat=2, warmup=1, upstream_ms=1, label='abc')
+
+        self.assertEqual(result['label'], 'abc')
+        self.assertEqual(len(result['samples']['total']), 6)
+        self.assertEqual(len(result['samples']['preprocess']), 6)
+        self.assertEqual(len(result['samples']['upstream']), 6)
+        # Only JSON uploads have a base64 decode stage
+        self.assertEqual(len(result['samples']['decode']), 4)
+        self.assertTrue(all(ms >= 1 for ms in result['samples']['upstream']))
+        self.assertEqual(result['mismatches'], [entries[2]['input']])
+        self.assertEqual(result['failures'], {})
+
+    def test_missing_input_reported(self):
+        """Test that an entry whose input is gone is reported rather than aborting the run."""
+        entries = load_corpus(self.root)
+        os.remove(os.path.join(self.root, entries[0]['input']))
+        result = run_replay(self.root, entries, repeat=1, warmup=0)
+        self.assertIn(entries[0]['input'], result['failures'])
+        self.assertEqual(len(result['samples']['total']), 2)
+
+if __name__ == '__main__':
+    unittest.main()
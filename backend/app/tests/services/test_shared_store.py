@@ -0,0 +1,140 @@
+import unittest
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services.shared_store import SharedStore, generation_cache_key, _digest
+
+GEOMETRY = dict(buckets=8, ways=4, slot_size=256, counter_buckets=8)
+
+def _increment_many(path, count):
+    store = SharedStore(path, **GEOMETRY)
+    for _ in range(count):
+        store.incr('requests')
+    store.close()
+
+def _die_holding_lock(path):
+    store = SharedStore(path, **GEOMETRY)
+    bucket, offset = store._counter_bucket(_digest('after-crash'))
+    store._lock(bucket, offset)
+    os._exit(1)
+
+class TestSharedStore(unittest.TestCase):
+    def setUp(self):
+        """Create a store in a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'store')
+        self.store = SharedStore(self.path, **GEOMETRY)
+    
+    def tearDown(self):
+        """Close the store and remove its file."""
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+    
+    def test_get_set_delete(self):
+        """Test basic cache operations."""
+        self.assertIsNone(self.store.get('missing'))
+        self.assertTrue(self.store.set('key', b'value'))
+        self.assertEqual(self.store.get('key'), b'value')
+        self.store.set('key', b'updated')
+        self.assertEqual(self.store.get('key'), b'updated')
+        self.store.delete('key')
+        self.assertIsNone(self.store.get('key'))
+        self.assertFalse(self.store.set('big', b'x' * 1024))
+    
+    def test_ttl_expiry(self):
+        """Test that expired entries read as misses."""
+        self.store.set('short', b'value', ttl=0.05)
+        self.assertEqual(self.store.get('short'), b'value')
+        time.sleep(0.1)
+        self.assertIsNone(self.store.get('short'))
+    
+    def test_eviction_keeps_recently_read(self):
+        """Test that a full bucket evicts the least recently read entry."""
+        # Force every key into one bucket
+        store = SharedStore(os.path.join(self.tmpdir, 'one'), buckets=1, ways=4, slot_size=256, counter_buckets=1)
+        for i in range(4):
+            store.set(f'k{i}', b'v')
+            time.sleep(0.001)
+        store.get('k0')
+        store.set('k4', b'v')
+        self.assertEqual(store.get('k0'), b'v')
+        self.assertIsNone(store.get('k1'))
+        self.assertEqual(store.stats()['entries'], 4)
+        store.close()
+    
+    def test_torn_slot_is_a_miss(self):
+        """Test that a slot whose contents do not match its checksum is ignored."""
+        self.store.set('key', b'value')
+        _, base = self.store._bucket(_digest('key'))
+        for way in range(self.store.ways):
+            offset = base + way * self.store.slot_size
+            if self.store._mm[offset] == 1:
+                self.store._mm[offset + 44] ^= 0xFF
+        self.assertIsNone(self.store.get('key'))
+        self.assertTrue(self.store.set('key', b'again'))
+        self.assertEqual(self.store.get('key'), b'again')
+    
+    def test_counters(self):
+        """Test counter increments and expiry."""
+        self.assertEqual(self.store.counter('hits'), 0)
+        self.assertEqual(self.store.incr('hits'), 1)
+        self.assertEqual(self.store.incr('hits', 5), 6)
+        self.assertEqual(self.store.counter('hits'), 6)
+        self.store.incr('window', ttl=0.05)
+        time.sleep(0.1)
+        self.assertEqual(self.store.counter('window'), 0)
+        self.assertEqual(self.store.incr('window', ttl=0.05), 1)
+    
+    def test_counters_across_processes(self):
+        """Test that increments from several processes are not lost."""
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_increment_many, args=(self.path, 200)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+        self.assertEqual(self.store.counter('requests'), 800)
+    
+    def test_lock_released_when_worker_dies(self):
+        """Test that a worker killed while holding a bucket lock does not wedge the store."""
+        context = multiprocessing.get_context('fork')
+        worker = context.Process(target=_die_holding_lock, args=(self.path,))
+        worker.start()
+        worker.join(30)
+        self.assertEqual(self.store.incr('after-crash'), 1)
+    
+    def test_layout_change_reinitialises(self):
+        """Test that opening with a different geometry starts a new file and leaves the old mapping usable."""
+        self.store.set('key', b'value')
+        other = SharedStore(self.path, buckets=16, ways=4, slot_size=256, counter_buckets=8)
+        self.assertIsNone(other.get('key'))
+        
+        # The old file was replaced, not shrunk under the mapping of the store still using it
+        self.store.set('late', b'x' * 200)
+        self.assertEqual(self.store.incr('requests'), 1)
+        self.assertEqual(self.store.get('key'), b'value')
+        self.assertIsNone(other.get('late'))
+        self.assertEqual(os.listdir(self.tmpdir), ['store'])
+        
+        # Processes with the new geometry share the new file
+        again = SharedStore(self.path, buckets=16, ways=4, slot_size=256, counter_buckets=8)
+        other.set('shared', b'1')
+        self.assertEqual(again.get('shared'), b'1')
+        again.close()
+        other.close()
+    
+    def test_generation_cache_key(self):
+        """Test that the key depends on both the image and the prompt hint."""
+        self.assertNotEqual(generation_cache_key(b'a', 'cat'), generation_cache_key(b'a', 'dog'))
+        self.assertNotEqual(generation_cache_key(b'a', None), generation_cache_key(b'b', None))
+        self.assertEqual(generation_cache_key(b'a', None), generation_cache_key(b'a', ''))
+
+if __name__ == '__main__':
+    unittest.main()
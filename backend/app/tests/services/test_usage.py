@@ -0,0 +1,123 @@
+import unittest
+import os
+import sys
+import tempfile
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.services.usage import UsageAccountant, UsageRecord, parse_api_keys, parse_budgets, resolve_tenant
+
+# 2026-03-01 23:59:00 UTC
+NEAR_MIDNIGHT = 1772409540.0
+
+def record(tenant, calls=1, cache_hits=0, bytes_in=1000):
+    usage = UsageRecord(tenant)
+    for _ in range(calls):
+        usage.upstream_call()
+    usage.upstream_done(0.5)
+    usage.cache_hits = cache_hits
+    usage.bytes_in = bytes_in
+    return usage
+
+class TestTenantsAndBudgets(unittest.TestCase):
+    def test_resolve_tenant(self):
+        """Test that configured keys map to their tenant and origins are reduced to their host."""
+        api_keys = parse_api_keys('school-a=secret, school-b=other')
+        self.assertNotIn('secret', repr(api_keys))
+        tenant = resolve_tenant({'X-API-Key': 'secret', 'Origin': 'https://a.example'}, api_keys)
+        self.assertEqual(tenant, 'key:school-a')
+        self.assertEqual(resolve_tenant({'Origin': 'https://School.example:8443'}), 'origin:school.example:8443')
+        self.assertEqual(resolve_tenant({}), 'anonymous')
+    
+    def test_unknown_api_key_refused(self):
+        """Test that a key outside the allowlist is refused instead of becoming a tenant."""
+        api_keys = parse_api_keys('school-a=secret')
+        for headers in ({'X-API-Key': 'guess'}, {'X-API-Key': 'guess', 'Origin': 'https://a.example'}):
+            with self.assertRaises(PermissionError):
+                resolve_tenant(headers, api_keys)
+        with self.assertRaises(PermissionError):
+            resolve_tenant({'X-API-Key': 'secret'})
+        with self.assertRaises(ValueError):
+            parse_api_keys('school-a=')
+        with self.assertRaises(ValueError):
+            parse_api_keys('=secret')
+
+    def test_parse_budgets(self):
+        """Test parsing per-tenant budgets."""
+        self.assertEqual(parse_budgets('origin:a.example=5, key:abc=0.5'), {'origin:a.example': 5.0, 'key:abc': 0.5})
+        self.assertEqual(parse_budgets(''), {})
+        with self.assertRaises(ValueError):
+            parse_budgets('origin:a.example')
+        with self.assertRaises(ValueError):
+            parse_budgets('=5')
+
+class TestUsageAccountant(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'usage.db')
+        self.now = [NEAR_MIDNIGHT]
+        self.accountant = self.make_accountant()
+
+    def tearDown(self):
+        self.accountant.close()
+        self.tmpdir.cleanup()
+
+    def make_accountant(self, **kwargs):
+        kwargs.setdefault('cost_per_call', 0.02)
+        kwargs.setdefault('budgets', {'origin:school.example': 0.05})
+        return UsageAccountant(self.path, flush_interval=3600, clock=lambda: self.now[0], **kwargs)
+
+    def test_budget_checked_in_memory(self):
+        """Test that spend counts against the budget before it is flushed."""
+        tenant = 'origin:school.example'
+        self.assertTrue(self.accountant.allow(tenant))
+        self.accountant.record(record(tenant, calls=2))
+        self.assertAlmostEqual(self.accountant.spent(tenant), 0.04)
+        self.assertTrue(self.accountant.allow(tenant))
+        self.accountant.record(record(tenant, calls=1))
+        self.assertFalse(self.accountant.allow(tenant))
+        # Tenants without a budget are unlimited
+        self.accountant.record(record('anonymous', calls=100))
+        self.assertTrue(self.accountant.allow('anonymous'))
+
+    def test_flush_shares_totals_between_processes(self):
+        """Test that flushed spend from another accountant counts against the budget."""
+        other = self.make_accountant()
+        other.record(record('origin:school.example', calls=3))
+        self.assertTrue(self.accountant.allow('origin:school.example'))
+        other.flush()
+        self.accountant.flush()
+        self.assertFalse(self.accountant.allow('origin:school.example'))
+        other.close()
+
+    def test_report(self):
+        """Test the aggregated report."""
+        self.accountant.record(record('origin:school.example', calls=1), latency=1.0)
+        self.accountant.record(record('origin:school.example', calls=0, cache_hits=1), latency=0.2)
+        report = self.accountant.report()
+        self.assertEqual(len(report), 1)
+        entry = report[0]
+        self.assertEqual(entry['period'], '2026-03-01')
+        self.assertEqual((entry['requests'], entry['upstream_calls'], entry['cache_hits']), (2, 1, 1))
+        self.assertEqual(entry['bytes_in'], 2000)
+        self.assertAlmostEqual(entry['cost'], 0.02)
+        self.assertAlmostEqual(entry['avgLatencyMs'], 600.0)
+        self.assertEqual(entry['budget'], 0.05)
+        self.assertEqual(self.accountant.report(tenant='anonymous'), [])
+
+    def test_budget_resets_at_midnight(self):
+        """Test that a new UTC day starts with nothing spent."""
+        tenant = 'origin:school.example'
+        self.accountant.record(record(tenant, calls=3))
+        self.accountant.flush()
+        self.assertFalse(self.accountant.allow(tenant))
+        self.assertEqual(self.accountant.seconds_until_reset(), 60)
+
+        self.now[0] += 120
+        self.assertEqual(self.accountant.period(), '2026-03-02')
+        self.assertTrue(self.accountant.allow(tenant))
+        self.assertEqual(self.accountant.report(period='2026-03-01')[0]['upstream_calls'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import subprocess
+import sys
+import os
+
+# Add the parent directory to sys.path to import the app module
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(BACKEND_DIR)
+
+from app import create_app
+from app import config as app_config
+
+class TestAppFactory(unittest.TestCase):
+    def test_create_app_with_config_object(self):
+        """Test that the factory applies a config object and registers the API."""
+        app = create_app(app_config.TestingConfig())
+        self.assertTrue(app.config['TESTING'])
+        rules = {rule.rule for rule in app.url_map.iter_rules()}
+        self.assertIn('/api/generate', rules)
+        self.assertIn('/api/health', rules)
+    
+    def test_create_app_with_overrides(self):
+        """Test that a mapping overrides the defaults."""
+        app = create_app({'TESTING': True, 'HEDGE_ENABLED': False, 'REQUEST_BUDGET_SECONDS': 3.0})
+        self.assertFalse(app.config['HEDGE_ENABLED'])
+        self.assertEqual(app.config['REQUEST_BUDGET_SECONDS'], 3.0)
+        self.assertIn('LOG_LEVEL', app.config)
+    
+    def test_heavy_modules_are_lazy(self):
+        """Test that importing the WSGI app does not import openai until warm-up."""
+        script = (
+            "import sys\n"
+            "import wsgi\n"
+            "assert 'openai' not in sys.modules, 'openai imported eagerly'\n"
+            "from app import warm_up\n"
+            "warm_up()\n"
+            "assert 'openai' in sys.modules\n"
+        )
+        env = dict(os.environ, LOG_LEVEL='WARNING')
+        result = subprocess.run(
+            [sys.executable, '-c', script],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=60
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+if __name__ == '__main__':
+    unittest.main()
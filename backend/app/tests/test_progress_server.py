@@ -0,0 +1,151 @@
+import unittest
+import asyncio
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unittest.mock
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.progress_server import CLOSE_UNKNOWN_JOB, ProgressServer
+from app.services.job_queue import PREPROCESSED, UPSTREAM_STARTED, SQLiteJobQueue
+from app.utils import websocket
+
+async def receive(reader):
+    """Return the next message as a dict, or ('close', code) for a close frame."""
+    while True:
+        opcode, payload = await asyncio.wait_for(
+            websocket.read_frame(reader, max_payload=65536, require_mask=False), 5)
+        if opcode == websocket.OP_TEXT:
+            return json.loads(payload)
+        if opcode == websocket.OP_CLOSE:
+            return 'close', struct.unpack('!H', payload[:2])[0]
+
+class TestProgressServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = SQLiteJobQueue(os.path.join(self.tmpdir, 'jobs.db'), max_attempts=1)
+        self.server = ProgressServer(self.queue, poll_interval=0.01, max_connections=3)
+        listening = await self.server.start('127.0.0.1', 0)
+        self.port = listening.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        self.queue.close()
+        shutil.rmtree(self.tmpdir)
+
+    async def subscribe(self, job_id):
+        return await websocket.connect('127.0.0.1', self.port, f'/jobs/{job_id}')
+
+    async def test_progress_pushed_until_completed(self):
+        """Test that a subscriber gets the backlog, each new stage and the result, then a normal close."""
+        job_id = self.queue.enqueue({'imageData': 'abc'}, received_at=0)
+        reader, writer = await self.subscribe(job_id)
+        self.assertEqual((await receive(reader))['stage'], 'received')
+        self.assertEqual((await receive(reader))['stage'], 'queued')
+
+        job = self.queue.lease('w1')
+        self.queue.add_event(job_id, PREPROCESSED, {'attempt': job.attempts})
+        self.queue.add_event(job_id, UPSTREAM_STARTED)
+        self.queue.ack(job_id, 'w1', {'imageUrl': 'https://example.com/art.png',
+                                      'variants': {'thumb': {'name': 'abc.jpg'}}})
+
+        preprocessed = await receive(reader)
+        self.assertEqual((preprocessed['type'], preprocessed['jobId'], preprocessed['attempt']),
+                         ('progress', job_id, 1))
+        self.assertEqual((await receive(reader))['stage'], 'upstream_started')
+        completed = await receive(reader)
+        self.assertEqual(completed['stage'], 'completed')
+        self.assertEqual(completed['imageUrl'], 'https://example.com/art.png')
+        self.assertEqual(completed['variants']['thumb']['url'], '/api/images/abc.jpg')
+        self.assertEqual(await receive(reader), ('close', websocket.CLOSE_NORMAL))
+        writer.close()
+
+    async def test_event_during_backlog_read(self):
+        """Test that an event dispatched while the backlog is read does not hide the backlog."""
+        job_id = self.queue.enqueue({'imageData': 'abc'}, received_at=0)
+        await asyncio.sleep(0.1)  # Let the poller's cursor pass the backlog
+        read_events = self.queue.events
+
+        def slow_events(wanted):
+            backlog = read_events(wanted)
+            self.queue.add_event(wanted, PREPROCESSED)
+            time.sleep(0.2)  # The poller dispatches the new event meanwhile
+            return backlog
+
+        with unittest.mock.patch.object(self.queue, 'events', side_effect=slow_events):
+            reader, writer = await self.subscribe(job_id)
+            stages = [(await receive(reader))['stage'] for _ in range(3)]
+        self.assertEqual(stages, ['received', 'queued', 'preprocessed'])
+        writer.close()
+
+    async def test_finished_job_replayed(self):
+        """Test that subscribing after a job failed replays its log and closes."""
+        job_id = self.queue.enqueue({})
+        self.queue.lease('w1')
+        self.queue.fail(job_id, 'w1', 'not an image', retry=False)
+
+        reader, writer = await self.subscribe(job_id)
+        self.assertEqual((await receive(reader))['stage'], 'queued')
+        failed = await receive(reader)
+        self.assertEqual((failed['stage'], failed['error']), ('failed', 'not an image'))
+        self.assertEqual(await receive(reader), ('close', websocket.CLOSE_NORMAL))
+        writer.close()
+
+    async def test_many_subscribers_share_one_job(self):
+        """Test fan-out of one event to every subscriber of a job."""
+        job_id = self.queue.enqueue({})
+        connections = [await self.subscribe(job_id) for _ in range(3)]
+        for reader, _ in connections:
+            self.assertEqual((await receive(reader))['stage'], 'queued')
+        self.queue.add_event(job_id, PREPROCESSED)
+        for reader, writer in connections:
+            self.assertEqual((await receive(reader))['stage'], 'preprocessed')
+            writer.close()
+
+    async def test_unknown_job_and_bad_requests(self):
+        """Test the close code for unknown jobs and refused handshakes."""
+        reader, writer = await self.subscribe('0' * 32)
+        self.assertEqual(await receive(reader), ('close', CLOSE_UNKNOWN_JOB))
+        writer.close()
+
+        with self.assertRaises(websocket.ProtocolError) as raised:
+            await websocket.connect('127.0.0.1', self.port, '/jobs/not-a-job')
+        self.assertIn('404', str(raised.exception))
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        writer.write(b'GET /jobs/' + b'0' * 32 + b' HTTP/1.1\r\nHost: x\r\n\r\n')
+        self.assertTrue((await reader.readline()).startswith(b'HTTP/1.1 426'))
+        writer.close()
+
+    async def test_connection_limit_and_ping(self):
+        """Test that handshakes beyond the limit get 503 and that pings are answered."""
+        job_id = self.queue.enqueue({})
+        connections = [await self.subscribe(job_id) for _ in range(3)]
+        with self.assertRaises(websocket.ProtocolError) as raised:
+            await self.subscribe(job_id)
+        self.assertIn('503', str(raised.exception))
+
+        reader, writer = connections[0]
+        await receive(reader)
+        writer.write(websocket.encode_frame(websocket.OP_PING, b'hi', mask=True))
+        opcode, payload = await websocket.read_frame(reader, require_mask=False)
+        self.assertEqual((opcode, payload), (websocket.OP_PONG, b'hi'))
+
+        # A client that closes frees its slot
+        for reader, writer in connections:
+            writer.write(websocket.close_frame(mask=True))
+            writer.close()
+        for _ in range(100):
+            if self.server.connections == 0:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.server.connections, 0)
+
+if __name__ == '__main__':
+    unittest.main()
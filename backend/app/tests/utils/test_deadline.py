@@ -0,0 +1,57 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.utils.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    deadline_from_headers
+)
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+    def __init__(self):
+        self.now = 100.0
+    
+    def __call__(self):
+        return self.now
+
+class TestDeadline(unittest.TestCase):
+    def test_remaining_and_expiry(self):
+        """Test that the budget counts down and raises once used up."""
+        clock = FakeClock()
+        deadline = Deadline(2.0, clock=clock)
+        self.assertEqual(deadline.remaining(), 2.0)
+        deadline.check('preprocessing')
+        
+        clock.now += 1.5
+        self.assertAlmostEqual(deadline.remaining(), 0.5)
+        self.assertEqual(deadline.to_dict(), {'budgetMs': 2000, 'elapsedMs': 1500, 'remainingMs': 500})
+        
+        clock.now += 1.0
+        self.assertEqual(deadline.remaining(), 0.0)
+        self.assertTrue(deadline.expired())
+        with self.assertRaises(DeadlineExceeded) as ctx:
+            deadline.check('upstream call')
+        self.assertEqual(ctx.exception.stage, 'upstream call')
+    
+    def test_deadline_from_headers(self):
+        """Test header parsing, defaults and clamping."""
+        self.assertEqual(deadline_from_headers({}, 25.0, 28.0).budget, 25.0)
+        self.assertEqual(deadline_from_headers({'X-Request-Budget-Ms': '1500'}, 25.0, 28.0).budget, 1.5)
+        self.assertEqual(deadline_from_headers({'X-Request-Budget-Ms': '90000'}, 25.0, 28.0).budget, 28.0)
+        self.assertEqual(deadline_from_headers({'X-Request-Budget-Ms': '90000'}, 25.0).budget, 25.0)
+        
+        with self.assertRaises(ValueError):
+            deadline_from_headers({'X-Request-Budget-Ms': 'abc'}, 25.0)
+        with self.assertRaises(ValueError):
+            deadline_from_headers({'X-Request-Budget-Ms': '-5'}, 25.0)
+        for value in ('nan', 'inf', '-inf'):
+            with self.assertRaises(ValueError):
+                deadline_from_headers({'X-Request-Budget-Ms': value}, 25.0)
+
+if __name__ == '__main__':
+    unittest.main()
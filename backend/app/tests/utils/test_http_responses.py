@@ -0,0 +1,112 @@
+import unittest
+import gzip
+import json
+import sys
+import os
+import zlib
+from unittest.mock import patch
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from flask import Flask, Response, jsonify
+
+from app.utils import http_responses
+from app.utils.http_responses import add_etag, cache_immutable, init_response_layer
+
+def create_test_app():
+    """A bare app with the response layer and a few routes."""
+    app = Flask(__name__)
+    app.config.update(COMPRESSION_ENABLED=True, COMPRESSION_MIN_BYTES=256, COMPRESSION_LEVEL=6)
+    init_response_layer(app)
+
+    @app.route('/big')
+    def big():
+        return jsonify({'items': ['https://example.com/image.png'] * 50})
+
+    @app.route('/small')
+    def small():
+        return jsonify({'status': 'ok'})
+
+    @app.route('/stream')
+    def stream():
+        return Response((json.dumps({'index': i}) + '\n' for i in range(100)), mimetype='application/x-ndjson')
+
+    @app.route('/text')
+    def text():
+        return 'x' * 1000
+
+    @app.route('/immutable')
+    def immutable():
+        return cache_immutable(add_etag(jsonify({'imageUrl': 'https://example.com/image.png'})), 3000)
+
+    return app
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.client = create_test_app().test_client()
+
+    def test_gzip_above_threshold(self):
+        """Test that large JSON bodies are gzipped when the client accepts it."""
+        with patch.object(http_responses, 'brotli', None):
+            response = self.client.get('/big', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.data))['items'][0], 'https://example.com/image.png')
+        self.assertEqual(int(response.headers['Content-Length']), len(response.data))
+
+    def test_no_compression(self):
+        """Test small bodies, other content types and clients that do not accept gzip."""
+        self.assertNotIn('Content-Encoding', self.client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers)
+        self.assertNotIn('Content-Encoding', self.client.get('/text', headers={'Accept-Encoding': 'gzip'}).headers)
+        self.assertNotIn('Content-Encoding', self.client.get('/big').headers)
+        self.assertNotIn('Content-Encoding', self.client.get('/big', headers={'Accept-Encoding': 'gzip;q=0'}).headers)
+
+    def test_streamed_ndjson(self):
+        """Test that streamed NDJSON is compressed and every chunk can be decoded on arrival."""
+        with patch.object(http_responses, 'brotli', None):
+            response = self.client.get('/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertNotIn('Content-Length', response.headers)
+            decompressor = zlib.decompressobj(31)
+            first_chunk = decompressor.decompress(next(response.response))
+            self.assertEqual(json.loads(first_chunk.decode('utf-8')), {'index': 0})
+            rest = b''.join(decompressor.decompress(chunk) for chunk in response.response)
+            response.close()
+        self.assertEqual(len((first_chunk + rest).splitlines()), 100)
+
+class TestConditionalRequests(unittest.TestCase):
+    def setUp(self):
+        self.client = create_test_app().test_client()
+
+    def test_etag_and_304(self):
+        """Test that an immutable resource revalidates with 304 and an empty body."""
+        response = self.client.get('/immutable')
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=3000', response.headers['Cache-Control'])
+
+        response = self.client.get('/immutable', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        self.assertEqual(self.client.get('/immutable', headers={'If-None-Match': '"other"'}).status_code, 200)
+
+    def test_etag_differs_per_encoding(self):
+        """Test that the compressed representation has its own strong ETag."""
+        app = create_test_app()
+        app.config['COMPRESSION_MIN_BYTES'] = 0
+        client = app.test_client()
+        with patch.object(http_responses, 'brotli', None):
+            plain = client.get('/immutable').headers['ETag']
+            gzipped = client.get('/immutable', headers={'Accept-Encoding': 'gzip'})
+            self.assertNotEqual(gzipped.headers['ETag'], plain)
+            self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+
+            response = client.get('/immutable', headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+if __name__ == '__main__':
+    unittest.main()
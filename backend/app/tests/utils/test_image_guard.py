@@ -0,0 +1,159 @@
+import unittest
+import io
+import struct
+import sys
+import os
+import time
+import zlib
+from PIL import Image, ImageDraw, features
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.utils.deadline import Deadline
+from app.utils.image_guard import (
+    DECODE_CHUNK_BYTES,
+    DEFAULT_LIMITS,
+    check_image_limits,
+    decode_image,
+    estimate_decode_memory,
+    inspect_image_header
+)
+from app.utils.image_utils import validate_and_process_image
+
+def encode(image, fmt, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+def png_bomb(width, height):
+    """A valid greyscale PNG of zeros: a few KB on the wire, width*height bytes decoded."""
+    compressor = zlib.compressobj(9)
+    row = b'\x00' * (width + 1)
+    data = b''.join(compressor.compress(row) for _ in range(height)) + compressor.flush()
+    return (b'\x89PNG\r\n\x1a\n'
+            + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + png_chunk(b'IDAT', data)
+            + png_chunk(b'IEND', b''))
+
+class TestInspectImageHeader(unittest.TestCase):
+    def test_png(self):
+        """Test reading PNG dimensions and pixel layout from IHDR."""
+        info = inspect_image_header(encode(Image.new('RGBA', (320, 200)), 'PNG'))
+        self.assertEqual((info.format, info.width, info.height, info.frames), ('PNG', 320, 200, 1))
+        self.assertEqual(info.bytes_per_pixel, 4)
+        self.assertEqual(inspect_image_header(encode(Image.new('L', (5, 6)), 'PNG')).bytes_per_pixel, 1)
+
+    def test_apng_frames(self):
+        """Test that APNG frame counts are read from acTL."""
+        frames = [Image.new('RGBA', (16, 16), (i * 40, 0, 0, 255)) for i in range(3)]
+        data = encode(frames[0], 'PNG', save_all=True, append_images=frames[1:])
+        self.assertEqual(inspect_image_header(data).frames, 3)
+
+    def test_jpeg(self):
+        """Test reading baseline and progressive JPEG frame headers."""
+        image = Image.new('RGB', (640, 480), (10, 20, 30))
+        info = inspect_image_header(encode(image, 'JPEG'))
+        self.assertEqual((info.format, info.width, info.height, info.progressive), ('JPEG', 640, 480, False))
+        self.assertTrue(inspect_image_header(encode(image, 'JPEG', progressive=True)).progressive)
+
+    @unittest.skipUnless(features.check('webp'), 'Pillow built without WebP')
+    def test_webp(self):
+        """Test lossy, lossless and extended WebP headers."""
+        image = Image.new('RGB', (300, 150), (10, 20, 30))
+        self.assertEqual(inspect_image_header(encode(image, 'WEBP'))[1:3], (300, 150))
+        self.assertEqual(inspect_image_header(encode(image, 'WEBP', lossless=True))[1:3], (300, 150))
+        self.assertEqual(inspect_image_header(encode(image.convert('RGBA'), 'WEBP'))[1:3], (300, 150))
+
+    def test_rejects_other_formats_and_truncation(self):
+        """Test that formats outside the allowlist and truncated headers are rejected."""
+        with self.assertRaises(ValueError):
+            inspect_image_header(encode(Image.new('RGB', (10, 10)), 'GIF'))
+        with self.assertRaises(ValueError):
+            inspect_image_header(encode(Image.new('RGB', (10, 10)), 'BMP'))
+        with self.assertRaises(ValueError):
+            inspect_image_header(encode(Image.new('RGB', (10, 10)), 'PNG')[:20])
+        with self.assertRaises(ValueError):
+            inspect_image_header(encode(Image.new('RGB', (10, 10)), 'JPEG')[:30])
+
+class TestImageLimits(unittest.TestCase):
+    def test_bomb_rejected_before_decode(self):
+        """Test that a decompression bomb is refused from its header alone."""
+        data = png_bomb(10000, 10000)
+        self.assertLess(len(data), 1024 * 1024)
+        with self.assertRaises(ValueError) as ctx:
+            validate_and_process_image(data)
+        self.assertIn('exceed', str(ctx.exception))
+
+    def test_limits(self):
+        """Test each limit separately."""
+        info = inspect_image_header(encode(Image.new('RGBA', (3000, 3000)), 'PNG'))
+        check_image_limits(info)
+        with self.assertRaises(ValueError):
+            check_image_limits(info, DEFAULT_LIMITS._replace(allowed_formats=('JPEG',)))
+        with self.assertRaises(ValueError):
+            check_image_limits(info, DEFAULT_LIMITS._replace(max_pixels=1000 * 1000))
+        with self.assertRaises(ValueError):
+            check_image_limits(info._replace(frames=2))
+        with self.assertRaises(ValueError) as ctx:
+            check_image_limits(info, DEFAULT_LIMITS._replace(max_memory_bytes=estimate_decode_memory(info) - 1))
+        self.assertIn('MB to decode', str(ctx.exception))
+
+    def test_decode_timeout(self):
+        """Test that a decode exceeding its time limit is abandoned."""
+        data = encode(Image.new('RGBA', (100, 100)), 'PNG')
+        with self.assertRaises(ValueError) as ctx:
+            validate_and_process_image(data, DEFAULT_LIMITS._replace(decode_timeout=0))
+        self.assertIn('to decode', str(ctx.exception))
+
+    def test_decode_stopped_part_way(self):
+        """Test that a decode already under way is abandoned once the deadline passes."""
+        for fmt in ('PNG', 'JPEG'):
+            data = encode(Image.effect_noise((1500, 1500), 64).convert('RGB'), fmt, quality=95)
+            blocks = len(data) // DECODE_CHUNK_BYTES
+            self.assertGreater(blocks, 10)
+            
+            # Each deadline check advances the clock by 0.1s, so the 1s budget lasts ten reads
+            ticks = iter(i * 0.1 for i in range(1000))
+            deadline = Deadline(1.0, clock=lambda: next(ticks))
+            with self.assertRaises(ValueError) as ctx:
+                decode_image(data, inspect_image_header(data), deadline)
+            self.assertIn('to decode', str(ctx.exception))
+            self.assertLess(next(ticks), 1.5, fmt)  # stopped after about ten of the blocks
+            
+            # With time to spare the same image decodes completely
+            image = decode_image(data, inspect_image_header(data), Deadline(60.0))
+            self.assertEqual(image.size, (1500, 1500))
+    
+    def test_slow_decode_times_out(self):
+        """Test that a real decode longer than the limit stops early instead of running to the end."""
+        # Compresses well, so decoding (not reading) dominates: a few dozen blocks for 48 MB of pixels
+        image = Image.new('RGB', (4000, 4000), 'white')
+        draw = ImageDraw.Draw(image)
+        for i in range(400):
+            draw.line([((i * 7919) % 4000, (i * 104729) % 4000), ((i * 15485863) % 4000, (i * 32452843) % 4000)],
+                      fill=(i % 256,) * 3, width=3)
+        data = encode(image, 'PNG')
+        info = inspect_image_header(data)
+        started = time.perf_counter()
+        decode_image(data, info, Deadline(60.0))
+        full = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        with self.assertRaises(ValueError) as ctx:
+            decode_image(data, info, Deadline(full / 10))
+        self.assertIn('to decode', str(ctx.exception))
+        self.assertLess(time.perf_counter() - started, full / 2)
+    
+    def test_valid_images_processed(self):
+        """Test that allowed images still come out as 1024x1024 RGBA PNGs."""
+        for data in (encode(Image.new('RGB', (200, 100)), 'JPEG'), png_bomb(1000, 1000)):
+            processed = Image.open(validate_and_process_image(data))
+            self.assertEqual(processed.size, (1024, 1024))
+            self.assertEqual(processed.mode, 'RGBA')
+
+if __name__ == '__main__':
+    unittest.main()
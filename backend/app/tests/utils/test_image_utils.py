@@ -1,4 +1,5 @@
 import unittest
+import unittest.mock
 import base64
 import io
 from PIL import Image
@@ -9,10 +10,14 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
 
 from app.utils.image_utils import (
+    convert_to_srgb,
     decode_base64_image,
+    is_normalized,
+    resampling_policy,
     validate_and_process_image,
     resize_and_pad_image
 )
+from app.utils.image_guard import DEFAULT_LIMITS, inspect_image_header
 
 class TestImageUtils(unittest.TestCase):
     def setUp(self):
@@ -69,6 +74,148 @@ class TestImageUtils(unittest.TestCase):
         rect_img = Image.new('RGBA', (100, 200), color=(0, 0, 255, 255))
         result = resize_and_pad_image(rect_img, target_size=(50, 50))
         self.assertEqual(result.size, (50, 50))
+    
+    def test_normalized_input(self):
+        """Test that a declared-normalized image skips the pre-check only when its header agrees."""
+        cropped = Image.new('RGB', (300, 150), color=(0, 0, 0))
+        buffer = io.BytesIO()
+        cropped.save(buffer, format='PNG')
+        self.assertTrue(is_normalized(inspect_image_header(buffer.getvalue())))
+        
+        with unittest.mock.patch.object(Image.Image, 'save', autospec=True, side_effect=Image.Image.save) as mock_save:
+            result = Image.open(validate_and_process_image(buffer.getvalue(), normalized=True))
+        self.assertEqual(mock_save.call_count, 1)  # Only the output is encoded
+        self.assertEqual((result.size, result.mode), ((1024, 1024), 'RGBA'))
+        self.assertEqual(result.getpixel((0, 0))[3], 0)
+        self.assertEqual(result.getpixel((512, 512)), (0, 0, 0, 255))
+        
+        # A declaration the header contradicts falls back to the full path
+        oversized = Image.new('RGB', (2048, 100), color=(0, 0, 0))
+        buffer = io.BytesIO()
+        oversized.save(buffer, format='PNG')
+        self.assertFalse(is_normalized(inspect_image_header(buffer.getvalue())))
+        with unittest.mock.patch.object(Image.Image, 'save', autospec=True, side_effect=Image.Image.save) as mock_save:
+            result = Image.open(validate_and_process_image(buffer.getvalue(), normalized=True))
+        self.assertEqual(mock_save.call_count, 2)
+        self.assertEqual(result.size, (1024, 1024))
+
+class TestResampling(unittest.TestCase):
+    def test_resampling_policy(self):
+        """Test that 'auto' picks the policy by format and unknown names are refused."""
+        self.assertEqual(resampling_policy('auto', 'JPEG'), 'photo')
+        self.assertEqual(resampling_policy('auto', 'PNG'), 'line_art')
+        self.assertEqual(resampling_policy('quality', 'PNG'), 'quality')
+        with self.assertRaises(ValueError):
+            resampling_policy('nearest')
+    
+    def test_exact_size_passthrough(self):
+        """Test that an RGBA image of the target size is returned untouched."""
+        image = Image.new('RGBA', (64, 64), (1, 2, 3, 255))
+        with unittest.mock.patch.object(Image.Image, 'resize') as mock_resize:
+            self.assertIs(resize_and_pad_image(image, target_size=(64, 64)), image)
+        mock_resize.assert_not_called()
+        
+        result = resize_and_pad_image(image.convert('RGB'), target_size=(64, 64))
+        self.assertEqual((result.mode, result.getpixel((0, 0))), ('RGBA', (1, 2, 3, 255)))
+    
+    def test_integer_shrink_uses_reduce(self):
+        """Test that line art shrunk by an exact integer factor is box-reduced."""
+        image = Image.new('RGB', (128, 64), (0, 0, 0))
+        with unittest.mock.patch.object(Image.Image, 'reduce', autospec=True, side_effect=Image.Image.reduce) as mock_reduce:
+            result = resize_and_pad_image(image, target_size=(32, 32))
+            self.assertEqual(mock_reduce.call_args[0][1], 4)
+            
+            resize_and_pad_image(image, target_size=(32, 32), resampling='quality')
+            self.assertEqual(mock_reduce.call_count, 1)
+        self.assertEqual((result.size, result.mode), ((32, 32), 'RGBA'))
+        self.assertEqual(result.getpixel((16, 16)), (0, 0, 0, 255))
+        self.assertEqual(result.getpixel((16, 0)), (0, 0, 0, 0))
+    
+    def test_filters_by_direction(self):
+        """Test that line art is shrunk with BILINEAR and only enlarged with LANCZOS."""
+        image = Image.new('RGB', (100, 50))
+        with unittest.mock.patch.object(Image.Image, 'resize', autospec=True, side_effect=Image.Image.resize) as mock_resize:
+            resize_and_pad_image(image, target_size=(30, 30))
+            resize_and_pad_image(image, target_size=(300, 300))
+            resize_and_pad_image(image, target_size=(30, 30), resampling='quality')
+        filters = [call[0][2] for call in mock_resize.call_args_list]
+        self.assertEqual(filters, [Image.Resampling.BILINEAR, Image.Resampling.LANCZOS, Image.Resampling.LANCZOS])
+    
+    def test_extreme_aspect_ratio(self):
+        """Test that a sliver shrinks to a line at least one pixel wide instead of failing."""
+        for size, drawn in (((1, 4096), (511, 0, 512, 1024)), ((4096, 1), (0, 511, 1024, 512)),
+                            ((3, 5000), (511, 0, 512, 1024))):
+            result = resize_and_pad_image(Image.new('RGB', size, (0, 0, 0)), target_size=(1024, 1024))
+            self.assertEqual((result.size, result.mode), ((1024, 1024), 'RGBA'))
+            self.assertEqual(result.getchannel('A').getbbox(), drawn)
+        
+        buffer = io.BytesIO()
+        Image.new('L', (1, 4096)).save(buffer, format='PNG')
+        self.assertEqual(Image.open(validate_and_process_image(buffer.getvalue())).size, (1024, 1024))
+    
+    def test_palette_image_is_expanded_first(self):
+        """Test that palette images are converted before resizing instead of resized with NEAREST."""
+        image = Image.new('RGB', (40, 20), (255, 0, 0))
+        image.paste((0, 0, 255), (20, 0, 40, 20))
+        result = resize_and_pad_image(image.convert('P'), target_size=(30, 30))
+        self.assertEqual(result.mode, 'RGBA')
+        # The red/blue boundary is blended, not a hard edge
+        red, _, blue, _ = result.getpixel((15, 15))
+        self.assertTrue(0 < red < 255 and 0 < blue < 255)
+    
+    def test_validate_uses_policy_from_limits(self):
+        """Test that the configured policy reaches the resize."""
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 32)).save(buffer, format='JPEG')
+        with unittest.mock.patch('app.utils.image_utils.resize_and_pad_image', side_effect=resize_and_pad_image) as mock_resize:
+            validate_and_process_image(buffer.getvalue())
+            validate_and_process_image(buffer.getvalue(), DEFAULT_LIMITS._replace(resampling='quality'))
+        self.assertEqual([call.kwargs['resampling'] for call in mock_resize.call_args_list], ['photo', 'quality'])
+        with self.assertRaises(ValueError):
+            validate_and_process_image(buffer.getvalue(), DEFAULT_LIMITS._replace(resampling='nearest'))
+
+
+class TestConvertToSrgb(unittest.TestCase):
+    def setUp(self):
+        from PIL import ImageCms
+        self.ImageCms = ImageCms
+        self.srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        self.image = Image.new('RGBA', (8, 8), (200, 100, 50, 255))
+    
+    def test_without_profile(self):
+        """Test that an image without a profile is returned as it is."""
+        self.assertIs(convert_to_srgb(self.image), self.image)
+    
+    def test_srgb_profile_is_kept_without_transform(self):
+        """Test that an sRGB profile skips the transform."""
+        self.image.info['icc_profile'] = self.srgb
+        with unittest.mock.patch.object(self.ImageCms, 'applyTransform') as mock_apply:
+            result = convert_to_srgb(self.image)
+        mock_apply.assert_not_called()
+        self.assertIs(result, self.image)
+        self.assertEqual(result.info['icc_profile'], self.srgb)
+    
+    def test_other_profile_is_applied(self):
+        """Test that a non-sRGB profile is converted into a copy tagged as sRGB."""
+        other = self.srgb.replace('sRGB built-in'.encode('utf-16-be'), 'Wide built-in'.encode('utf-16-be'))
+        self.image.info['icc_profile'] = other
+        with unittest.mock.patch.object(self.ImageCms, 'applyTransform', wraps=self.ImageCms.applyTransform) as mock_apply:
+            result = convert_to_srgb(self.image)
+        mock_apply.assert_called_once()
+        self.assertIsNot(result, self.image)
+        self.assertEqual((result.mode, result.size), ('RGBA', (8, 8)))
+        # Compared by description: the profile header carries its creation time
+        tagged = self.ImageCms.ImageCmsProfile(io.BytesIO(result.info['icc_profile']))
+        self.assertIn('sRGB', self.ImageCms.getProfileDescription(tagged))
+        # The caller's image keeps its own profile
+        self.assertEqual(self.image.info['icc_profile'], other)
+    
+    def test_unusable_profile_is_ignored(self):
+        """Test that a profile that cannot be parsed leaves the image alone."""
+        self.image.info['icc_profile'] = b'not a profile'
+        result = convert_to_srgb(self.image)
+        self.assertIs(result, self.image)
+        self.assertEqual(result.info['icc_profile'], b'not a profile')
 
 if __name__ == '__main__':
     unittest.main()
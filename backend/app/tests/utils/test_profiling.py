@@ -0,0 +1,224 @@
+import unittest
+import io
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import unittest.mock
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from flask import jsonify
+
+from app.utils.profiling import Profiler, SessionRunning, collapse_stack
+
+ADMIN = {'Authorization': 'Bearer secret'}
+
+_retained = []
+
+def busy_work():
+    total = 0
+    deadline = time.perf_counter() + 0.03
+    while time.perf_counter() < deadline:
+        total += sum(sorted(range(2000), reverse=True))
+    return total
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.tmpdir.name, max_requests=5, sample_interval=0.001)
+
+    def tearDown(self):
+        self.profiler.stop()
+        self.tmpdir.cleanup()
+
+    def test_idle_requests_not_profiled(self):
+        """Test that without a session requests get no token."""
+        self.assertIsNone(self.profiler.begin_request('/api/generate'))
+
+    def test_start_validation(self):
+        """Test that invalid sessions are refused and only one runs at a time."""
+        with self.assertRaises(ValueError):
+            self.profiler.start('strace', 1)
+        with self.assertRaises(ValueError):
+            self.profiler.start('cprofile', 6)
+        session = self.profiler.start('cprofile', 1)
+        with self.assertRaises(SessionRunning):
+            self.profiler.start('sample', 1)
+        self.assertEqual(self.profiler.status(session['id'])['status'], 'running')
+        with self.assertRaises(ValueError):
+            self.profiler.result_path('../../etc/passwd', 'json')
+
+    def test_path_prefix_and_request_count(self):
+        """Test that only matching requests are claimed, up to the requested number."""
+        session = self.profiler.start('cprofile', 2, path_prefix='/api/generate')
+        self.assertIsNone(self.profiler.begin_request('/api/health'))
+        for _ in range(2):
+            token = self.profiler.begin_request('/api/generate')
+            busy_work()
+            self.profiler.end_request(token)
+        self.assertIsNone(self.profiler.begin_request('/api/generate'))
+
+        status = self.profiler.status(session['id'])
+        self.assertEqual((status['status'], status['profiled']), ('finished', 2))
+        self.assertIsNone(self.profiler.session)
+        stats = pstats.Stats(self.profiler.result_path(session['id'], 'pstats'), stream=io.StringIO())
+        self.assertTrue(any(name == 'busy_work' for _, _, name in stats.stats))
+
+    def test_cprofile_one_request_at_a_time(self):
+        """Test that overlapping requests and a profiler that cannot start are skipped, not failed."""
+        session = self.profiler.start('cprofile', 3)
+        token = self.profiler.begin_request('/work')
+        self.assertIsNone(self.profiler.begin_request('/work'))
+        self.profiler.end_request(token)
+
+        with unittest.mock.patch('cProfile.Profile.enable', side_effect=ValueError("Another profiling tool is already active")):
+            self.assertIsNone(self.profiler.begin_request('/work'))
+        self.assertEqual((self.profiler.session.claimed, self.profiler.session.in_flight), (1, 0))
+
+        # Neither skip left the profiler busy
+        token = self.profiler.begin_request('/work')
+        self.assertIsNotNone(token)
+        self.profiler.end_request(token)
+        self.assertEqual(self.profiler.status(session['id'])['profiled'], 2)
+
+    def test_sampled_stacks(self):
+        """Test that the sampler records collapsed stacks of profiled threads only."""
+        session = self.profiler.start('sample', 1)
+        token = self.profiler.begin_request('/work')
+        busy_work()
+        self.profiler.end_request(token)
+
+        with open(self.profiler.result_path(session['id'], 'collapsed')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        self.assertTrue(any('busy_work (test_profiling.py' in line for line in lines))
+        self.assertFalse(any('_sample (profiling.py' in line for line in lines))
+
+    def test_memory_diff_shows_retained_allocations(self):
+        """Test that allocations kept across requests show up in the snapshot diff."""
+        session = self.profiler.start('memory', 2)
+        for _ in range(2):
+            token = self.profiler.begin_request('/leak')
+            _retained.append(bytearray(512 * 1024))
+            self.profiler.end_request(token)
+        _retained.clear()
+
+        with open(self.profiler.result_path(session['id'], 'txt')) as f:
+            report = f.read()
+        self.assertIn('test_profiling.py', report.split('\n', 3)[3])
+        self.assertIn('after each request', report)
+        import tracemalloc
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_timeout_finishes_session(self):
+        """Test that an expired session is finished with what it collected."""
+        session = self.profiler.start('cprofile', 5, timeout=0.01)
+        self.profiler.end_request(self.profiler.begin_request('/a'))
+        time.sleep(0.02)
+        self.assertIsNone(self.profiler.begin_request('/a'))
+        self.assertEqual(self.profiler.status(session['id'])['profiled'], 1)
+
+    def test_endpoint_report(self):
+        """Test CPU and wall totals per endpoint."""
+        self.profiler.record_endpoint('api.generate', 0.02, 0.05)
+        self.profiler.record_endpoint('api.generate', 0.04, 0.05)
+        self.profiler.record_endpoint('health.health_check', 0.001, 0.001)
+        report = self.profiler.endpoint_report()
+        self.assertEqual(report['pid'], os.getpid())
+        top = report['endpoints'][0]
+        self.assertEqual(top['endpoint'], 'api.generate')
+        self.assertEqual((top['requests'], top['cpuMs'], top['avgCpuMs'], top['cpuShare']), (2, 60.0, 30.0, 0.6))
+
+    def test_collapse_stack(self):
+        """Test that stacks are rendered outermost first."""
+        def inner():
+            return collapse_stack(sys._getframe())
+        stack = inner().split(';')
+        self.assertTrue(stack[-1].startswith('inner (test_profiling.py'))
+        self.assertTrue(stack[-2].startswith('test_collapse_stack'))
+
+class TestProfilingRoutes(unittest.TestCase):
+    def setUp(self):
+        from app import create_app
+        from app.config import TestingConfig
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = TestingConfig()
+        config.PROFILING_ENABLED = True
+        config.ADMIN_TOKEN = 'secret'
+        config.PROFILE_PATH = self.tmpdir.name
+        self.app = create_app(config)
+        self.app.add_url_rule('/work', 'work', lambda: jsonify({'total': busy_work()}))
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app.extensions['profiler'].stop()
+        self.tmpdir.cleanup()
+
+    def test_admin_only(self):
+        """Test that every profiling endpoint needs the admin token."""
+        self.assertEqual(self.client.post('/api/admin/profile', json={'mode': 'cprofile'}).status_code, 403)
+        self.assertEqual(self.client.get('/api/admin/profile/endpoints',
+                                         headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+
+    def test_disabled_by_default(self):
+        """Test that the profiling surface does not exist unless enabled."""
+        from app import create_app
+        from app.config import TestingConfig
+        app = create_app(TestingConfig())
+        self.assertNotIn('profiler', app.extensions)
+        self.assertEqual(app.test_client().get('/api/admin/profile/endpoints', headers=ADMIN).status_code, 404)
+
+    def test_profile_next_requests(self):
+        """Test arming a session, profiling requests and downloading the results."""
+        response = self.client.post('/api/admin/profile', json={'mode': 'cprofile', 'requests': 2}, headers=ADMIN)
+        self.assertEqual(response.status_code, 202)
+        session = response.get_json()
+        self.assertEqual(session['pid'], os.getpid())
+        self.assertEqual(self.client.post('/api/admin/profile', json={'mode': 'sample'},
+                                          headers=ADMIN).status_code, 409)
+
+        self.assertEqual(self.client.get(session['resultUrl'], headers=ADMIN).get_json()['status'], 'running')
+        for _ in range(2):
+            self.assertEqual(self.client.get('/work').status_code, 200)
+
+        status = self.client.get(session['resultUrl'], headers=ADMIN).get_json()
+        self.assertEqual((status['status'], status['profiled']), ('finished', 2))
+        text = self.client.get(status['artifactUrls']['text'], headers=ADMIN)
+        self.assertEqual(text.mimetype, 'text/plain')
+        self.assertIn(b'busy_work', text.data)
+        pstats_file = self.client.get(status['artifactUrls']['pstats'], headers=ADMIN)
+        self.assertIn('attachment', pstats_file.headers['Content-Disposition'])
+        self.assertEqual(self.client.get(session['resultUrl'] + '/collapsed', headers=ADMIN).status_code, 404)
+
+    def test_stop_and_endpoint_cpu(self):
+        """Test stopping a session early and the per-endpoint CPU report."""
+        self.assertEqual(self.client.delete('/api/admin/profile', headers=ADMIN).status_code, 404)
+        self.client.post('/api/admin/profile', json={'mode': 'sample', 'requests': 50}, headers=ADMIN)
+        self.client.get('/work')
+        stopped = self.client.delete('/api/admin/profile', headers=ADMIN).get_json()
+        self.assertEqual((stopped['status'], stopped['profiled']), ('finished', 1))
+
+        report = self.client.get('/api/admin/profile/endpoints', headers=ADMIN).get_json()
+        work = next(row for row in report['endpoints'] if row['endpoint'] == 'work')
+        self.assertEqual(work['requests'], 1)
+        self.assertGreater(work['cpuMs'], 10)
+        # Profiling endpoints are accounted but never profiled themselves
+        self.assertTrue(any(row['endpoint'].startswith('profiling.') for row in report['endpoints']))
+
+    def test_invalid_session(self):
+        """Test bad arguments and unknown sessions."""
+        self.assertEqual(self.client.post('/api/admin/profile', json={'mode': 'cprofile', 'requests': 'many'},
+                                          headers=ADMIN).status_code, 400)
+        for timeout in ('nan', 'inf', -1, 0, 86400):
+            self.assertEqual(self.client.post('/api/admin/profile', json={'mode': 'cprofile', 'timeoutSeconds': timeout},
+                                              headers=ADMIN).status_code, 400)
+        self.assertEqual(self.client.get('/api/admin/profile/' + '0' * 32, headers=ADMIN).status_code, 404)
+        self.assertEqual(self.client.get('/api/admin/profile/nope', headers=ADMIN).status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
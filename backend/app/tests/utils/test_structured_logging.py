@@ -0,0 +1,84 @@
+import unittest
+import io
+import json
+import logging
+import sys
+import os
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.utils.structured_logging import (
+    SamplingFilter,
+    begin_request,
+    configure_logging,
+    shutdown_logging,
+    sampled
+)
+
+class TestStructuredLogging(unittest.TestCase):
+    def setUp(self):
+        """Route logging to an in-memory stream."""
+        self.root = logging.getLogger()
+        self.saved_handlers = list(self.root.handlers)
+        self.saved_level = self.root.level
+        self.stream = io.StringIO()
+        self.logger = logging.getLogger('test.structured')
+    
+    def tearDown(self):
+        """Restore the previous root logger configuration."""
+        shutdown_logging()
+        self.root.handlers = self.saved_handlers
+        self.root.setLevel(self.saved_level)
+        sampled.set(None)
+    
+    def _records(self):
+        shutdown_logging()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+    
+    def test_json_output_with_correlation_id(self):
+        """Test that records are JSON with the request's correlation id and extras."""
+        configure_logging(level='INFO', fmt='json', stream=self.stream)
+        begin_request('req-123')
+        self.logger.info("Processed %s items", 3, extra={'stage': 'decode'})
+        
+        records = self._records()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['message'], 'Processed 3 items')
+        self.assertEqual(records[0]['correlation_id'], 'req-123')
+        self.assertEqual(records[0]['stage'], 'decode')
+        self.assertEqual(records[0]['level'], 'INFO')
+    
+    def test_sampling_keeps_errors(self):
+        """Test that unsampled requests drop success logs but keep errors."""
+        configure_logging(level='INFO', fmt='json', sample_rate=0.0, stream=self.stream)
+        begin_request('req-unsampled', sample_rate=0.0)
+        self.logger.info("success")
+        self.logger.error("failure")
+        
+        records = self._records()
+        self.assertEqual([r['message'] for r in records], ['failure'])
+    
+    def test_sampling_filter_per_request(self):
+        """Test that the sampling decision made for a request applies to all its records."""
+        log_filter = SamplingFilter(rate=0.5)
+        record = logging.LogRecord('x', logging.INFO, '', 0, 'msg', (), None)
+        sampled.set(True)
+        self.assertTrue(log_filter.filter(record))
+        sampled.set(False)
+        self.assertFalse(log_filter.filter(record))
+    
+    def test_request_id_header(self):
+        """Test that responses echo the incoming request id or generate one."""
+        from app import create_app
+        from app.config import TestingConfig
+        app = create_app(TestingConfig())
+        client = app.test_client()
+        
+        response = client.get('/api/health', headers={'X-Request-ID': 'abc'})
+        self.assertEqual(response.headers['X-Request-ID'], 'abc')
+        response = client.get('/api/health')
+        self.assertTrue(response.headers['X-Request-ID'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import asyncio
+import os
+import sys
+
+# Add the parent directory to sys.path to import the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from app.utils import websocket
+
+def reader_for(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+class TestWebSocket(unittest.IsolatedAsyncioTestCase):
+    def test_accept_key(self):
+        """Test the handshake key transform with the example from RFC 6455."""
+        self.assertEqual(websocket.accept_key('dGhlIHNhbXBsZSBub25jZQ=='), 's3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+
+    def test_handshake_validation(self):
+        """Test that only well-formed version 13 upgrades are accepted."""
+        headers = {'upgrade': 'websocket', 'connection': 'keep-alive, Upgrade',
+                   'sec-websocket-version': '13', 'sec-websocket-key': 'dGhlIHNhbXBsZSBub25jZQ=='}
+        self.assertIsNone(websocket.handshake_error(headers))
+        self.assertEqual(websocket.handshake_error(dict(headers, upgrade='h2c'))[0], 426)
+        self.assertEqual(websocket.handshake_error(dict(headers, **{'sec-websocket-version': '8'}))[0], 426)
+        self.assertEqual(websocket.handshake_error(dict(headers, **{'sec-websocket-key': 'short'}))[0], 400)
+        self.assertIn(b'Sec-WebSocket-Version: 13', websocket.error_response(426, 'upgrade'))
+
+    async def test_read_request(self):
+        """Test parsing a request head."""
+        method, target, headers = await websocket.read_request(
+            reader_for(b'GET /jobs/abc HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\n\r\n'))
+        self.assertEqual((method, target, headers['upgrade']), ('GET', '/jobs/abc', 'websocket'))
+        with self.assertRaises(websocket.ProtocolError):
+            await websocket.read_request(reader_for(b'GET /\r\n\r\n'))
+
+    async def test_frame_round_trip(self):
+        """Test masked and unmasked frames of every length encoding."""
+        for size in (0, 5, 125, 126, 70000):
+            payload = os.urandom(size)
+            opcode, data = await websocket.read_frame(reader_for(websocket.encode_frame(websocket.OP_BINARY, payload,
+                                                                                       mask=True)), max_payload=size)
+            self.assertEqual((opcode, data), (websocket.OP_BINARY, payload))
+            opcode, data = await websocket.read_frame(reader_for(websocket.encode_frame(websocket.OP_TEXT, payload)),
+                                                      max_payload=size, require_mask=False)
+            self.assertEqual(data, payload)
+
+    async def test_invalid_frames(self):
+        """Test that unmasked, oversized and fragmented control frames are rejected."""
+        with self.assertRaises(websocket.ProtocolError):
+            await websocket.read_frame(reader_for(websocket.encode_frame(websocket.OP_TEXT, 'hi')))
+        with self.assertRaises(websocket.ProtocolError) as raised:
+            await websocket.read_frame(reader_for(websocket.encode_frame(websocket.OP_TEXT, 'x' * 5000, mask=True)))
+        self.assertEqual(raised.exception.close_code, websocket.CLOSE_TOO_BIG)
+        fragmented_ping = bytes([websocket.OP_PING, 0x80]) + b'\x00' * 4
+        with self.assertRaises(websocket.ProtocolError):
+            await websocket.read_frame(reader_for(fragmented_ping))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+"""Authorization of operator-only endpoints by the ADMIN_TOKEN bearer token."""
+
+import hmac
+
+
+def is_admin(headers, admin_token):
+    """
+    Check for an ``Authorization: Bearer <ADMIN_TOKEN>`` header.
+
+    Args:
+        headers (Mapping): Request headers
+        admin_token (str): Configured token; empty means nobody is an admin
+
+    Returns:
+        bool: True if the header carries the token
+    """
+    if not admin_token:
+        return False
+    authorization = headers.get('Authorization', '').encode('utf-8')
+    return hmac.compare_digest(authorization, f"Bearer {admin_token}".encode('utf-8'))
@@ -0,0 +1,100 @@
+"""End-to-end request budgets for the generate path."""
+
+import math
+import time
+
+# Header a client can send to request a tighter budget than the server default
+BUDGET_HEADER = 'X-Request-Budget-Ms'
+
+# Header set on responses with the unused part of the budget
+REMAINING_HEADER = 'X-Request-Budget-Remaining-Ms'
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request budget runs out before the work is finished."""
+
+    def __init__(self, stage):
+        super().__init__(f"Request budget exhausted during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    A monotonic deadline shared by every stage of a request.
+
+    Args:
+        budget_seconds (float): Total time the request is allowed to take
+        clock (callable, optional): Monotonic clock, overridable for tests
+    """
+
+    def __init__(self, budget_seconds, clock=time.monotonic):
+        self._clock = clock
+        self.budget = float(budget_seconds)
+        self.started_at = clock()
+        self.expires_at = self.started_at + self.budget
+
+    def remaining(self):
+        """Return the seconds left in the budget (never negative)."""
+        return max(0.0, self.expires_at - self._clock())
+
+    def elapsed(self):
+        """Return the seconds spent since the deadline was created."""
+        return self._clock() - self.started_at
+
+    def expired(self):
+        """Return True once the budget is used up."""
+        return self.remaining() <= 0.0
+
+    def check(self, stage):
+        """
+        Raise if the budget is already exhausted.
+
+        Args:
+            stage (str): Name of the stage about to start, used in the error
+
+        Raises:
+            DeadlineExceeded: If no budget is left
+        """
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    def to_dict(self):
+        """Return the budget accounting included in API responses."""
+        return {
+            'budgetMs': int(self.budget * 1000),
+            'elapsedMs': int(self.elapsed() * 1000),
+            'remainingMs': int(self.remaining() * 1000),
+        }
+
+
+def deadline_from_headers(headers, default_seconds, max_seconds=None):
+    """
+    Build a Deadline from the client budget header, falling back to the default.
+
+    A client can only shorten the budget: values above ``max_seconds`` (or the
+    default when no maximum is given) are clamped.
+
+    Args:
+        headers (Mapping): Request headers
+        default_seconds (float): Budget used when the client sends none
+        max_seconds (float, optional): Upper bound for client supplied budgets
+
+    Returns:
+        Deadline: Deadline starting now
+
+    Raises:
+        ValueError: If the header is present but not a positive, finite number
+    """
+    ceiling = max_seconds if max_seconds is not None else default_seconds
+    raw = headers.get(BUDGET_HEADER)
+    if raw is None or raw == '':
+        return Deadline(min(default_seconds, ceiling))
+
+    try:
+        budget_ms = float(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"{BUDGET_HEADER} must be a number of milliseconds")
+    if not math.isfinite(budget_ms) or budget_ms <= 0:
+        raise ValueError(f"{BUDGET_HEADER} must be a positive, finite number")
+
+    return Deadline(min(budget_ms / 1000.0, ceiling))
@@ -0,0 +1,163 @@
+"""
+Response layer: compression, cache headers and conditional requests.
+
+``init_response_layer`` installs an ``after_request`` hook that
+
+- answers conditional GET/HEAD requests with 304 when the response carries an
+  ETag that matches ``If-None-Match``, and
+- compresses JSON and NDJSON bodies with brotli (when the ``brotli`` package is
+  installed) or gzip, according to the client's ``Accept-Encoding``.
+
+Buffered bodies are compressed only above ``COMPRESSION_MIN_BYTES``. Streamed
+bodies (the batch endpoint) are compressed chunk by chunk and flushed after
+every chunk, so each NDJSON line still reaches the client as soon as it is
+produced.
+
+Routes opt into HTTP caching with ``add_etag`` and ``cache_immutable`` or
+``cache_revalidate``; the hook does the rest.
+"""
+
+import gzip
+import logging
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = frozenset(['application/json', 'application/x-ndjson'])
+
+
+def supported_encodings():
+    """Return the content codings this process can produce, preferred first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def add_etag(response):
+    """
+    Set a strong ETag computed from the (uncompressed) response body.
+
+    Args:
+        response (Response): Buffered response
+
+    Returns:
+        Response: The same response
+    """
+    response.add_etag(weak=False)
+    return response
+
+
+def cache_immutable(response, max_age):
+    """
+    Mark a response as never changing for ``max_age`` seconds.
+
+    Args:
+        response (Response): Response for an immutable resource
+        max_age (int): Seconds caches may reuse it without revalidating
+
+    Returns:
+        Response: The same response
+    """
+    response.cache_control.public = True
+    response.cache_control.max_age = int(max_age)
+    response.cache_control.immutable = True
+    return response
+
+
+def cache_revalidate(response):
+    """
+    Let caches store a response but revalidate it (by ETag) on every use.
+
+    Returns:
+        Response: The same response
+    """
+    response.cache_control.no_cache = True
+    return response
+
+
+def _negotiate_encoding():
+    return request.accept_encodings.best_match(supported_encodings())
+
+
+def _compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _compress_stream(chunks, encoding, level):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        # wbits=31 writes a gzip container around the deflate stream
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def _encoded_etag(response, encoding):
+    # A strong validator must differ between representations of the resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+
+
+def init_response_layer(app):
+    """
+    Register the compression and conditional-request hook.
+
+    Args:
+        app (Flask): Application; reads COMPRESSION_ENABLED,
+            COMPRESSION_MIN_BYTES and COMPRESSION_LEVEL from its config
+    """
+
+    @app.after_request
+    def finalize_response(response):
+        config = app.config
+        compressible = (
+            config['COMPRESSION_ENABLED']
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+            and 200 <= response.status_code < 300
+            and 'Content-Encoding' not in response.headers
+            and not response.direct_passthrough
+        )
+        if compressible:
+            response.vary.add('Accept-Encoding')
+            encoding = _negotiate_encoding()
+            # calculate_content_length would buffer a streamed body, so check first
+            if not response.is_streamed and response.calculate_content_length() < config['COMPRESSION_MIN_BYTES']:
+                encoding = None
+        else:
+            encoding = None
+
+        if encoding:
+            _encoded_etag(response, encoding)
+        if request.method in ('GET', 'HEAD') and response.get_etag()[0]:
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+        if not encoding:
+            return response
+
+        level = config['COMPRESSION_LEVEL']
+        if response.is_streamed:
+            response.response = _compress_stream(response.iter_encoded(), encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(_compress(response.get_data(), encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,286 @@
+"""
+Bounded-cost image parsing: header inspection before any pixel is decoded.
+
+``inspect_image_header`` reads only the container headers of PNG, JPEG and
+WebP files (a few dozen bytes, plus chunk headers to count animation frames)
+to learn the format, dimensions, frame count and pixel layout. ``check_image_limits``
+rejects anything outside the allowlist or whose decoded size would exceed the
+memory budget, so a small, highly compressed "decompression bomb" is refused
+before Pillow allocates its pixels. ``decode_image`` then decodes with a
+deadline check before every block of compressed data the decoder reads, so a
+PNG or JPEG decode that runs past the time limit is abandoned part way.
+"""
+
+import io
+import logging
+import struct
+from collections import namedtuple
+
+from PIL import Image
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# What the header says about an image
+ImageInfo = namedtuple('ImageInfo', ['format', 'width', 'height', 'frames', 'bytes_per_pixel', 'progressive'])
+
+# Compressed bytes handed to the decoder between decode time checks
+DECODE_CHUNK_BYTES = 64 * 1024
+
+# Processing output: the resized and padded 1024x1024 RGBA canvases, plus PNG encoder buffers
+_OUTPUT_BYTES = 2 * 1024 * 1024 * 4 + 8 * 1024 * 1024
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG colour type -> Pillow bytes per pixel for 8-bit data (multi-band modes use 4)
+_PNG_BYTES_PER_PIXEL = {0: 1, 2: 4, 3: 1, 4: 4, 6: 4}
+_JPEG_SOF_MARKERS = frozenset([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+_JPEG_PROGRESSIVE_MARKERS = frozenset([0xC2, 0xC6, 0xCA, 0xCE])
+
+
+class ImageLimits(namedtuple('ImageLimits', [
+        'allowed_formats', 'max_dimension', 'max_pixels', 'max_frames', 'max_memory_bytes', 'decode_timeout',
+        'resampling'])):
+    """
+    Per-request limits on what may be decoded, and how it is resampled.
+
+    Args:
+        allowed_formats (tuple of str): Pillow format names, e.g. ('PNG', 'JPEG', 'WEBP')
+        max_dimension (int): Maximum width or height in pixels
+        max_pixels (int): Maximum width * height
+        max_frames (int): Maximum animation frames
+        max_memory_bytes (int): Budget for the estimated peak decode memory
+        decode_timeout (float): Seconds the decode may take
+        resampling (str): Resize policy, 'auto' or a key of
+            ``app.utils.image_utils.RESAMPLING_POLICIES``
+    """
+
+    @classmethod
+    def from_config(cls, config):
+        """Build limits from the app config's IMAGE_* settings."""
+        return cls(
+            allowed_formats=tuple(config['IMAGE_ALLOWED_FORMATS']),
+            max_dimension=config['IMAGE_MAX_DIMENSION'],
+            max_pixels=config['IMAGE_MAX_PIXELS'],
+            max_frames=config['IMAGE_MAX_FRAMES'],
+            max_memory_bytes=config['IMAGE_MEMORY_BUDGET_BYTES'],
+            decode_timeout=config['IMAGE_DECODE_TIMEOUT_SECONDS'],
+            resampling=config['IMAGE_RESAMPLING'],
+        )
+
+
+DEFAULT_LIMITS = ImageLimits(
+    allowed_formats=('PNG', 'JPEG', 'WEBP'),
+    max_dimension=4096,
+    max_pixels=4096 * 4096,
+    max_frames=1,
+    max_memory_bytes=192 * 1024 * 1024,
+    decode_timeout=2.0,
+    resampling='auto',
+)
+
+
+def _unpack(fmt, data, offset):
+    try:
+        return struct.unpack_from(fmt, data, offset)
+    except struct.error:
+        raise ValueError("Truncated image header")
+
+
+def _inspect_png(data):
+    length, chunk_type = _unpack('>I4s', data, 8)
+    if chunk_type != b'IHDR' or length < 13:
+        raise ValueError("PNG is missing its IHDR chunk")
+    width, height, bit_depth, color_type = _unpack('>IIBB', data, 16)
+    if color_type not in _PNG_BYTES_PER_PIXEL:
+        raise ValueError(f"Invalid PNG colour type {color_type}")
+    bytes_per_pixel = _PNG_BYTES_PER_PIXEL[color_type]
+    if bit_depth == 16 and bytes_per_pixel == 1:
+        bytes_per_pixel = 4  # 16-bit greyscale decodes to mode I
+
+    # An APNG declares its frame count in acTL, which must precede the image data
+    frames = 1
+    offset = 8
+    while offset + 8 <= len(data):
+        length, chunk_type = _unpack('>I4s', data, offset)
+        if chunk_type == b'acTL':
+            frames = _unpack('>I', data, offset + 8)[0]
+            break
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        offset += 12 + length
+    return ImageInfo('PNG', width, height, frames, bytes_per_pixel, False)
+
+
+def _inspect_jpeg(data):
+    offset = 2
+    while True:
+        marker_start = data.find(b'\xff', offset)
+        if marker_start < 0 or marker_start + 1 >= len(data):
+            raise ValueError("Truncated image header")
+        offset = marker_start + 1
+        while offset < len(data) and data[offset] == 0xFF:
+            offset += 1  # fill bytes
+        if offset >= len(data):
+            raise ValueError("Truncated image header")
+        marker = data[offset]
+        offset += 1
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue  # markers without a length
+        if marker in (0xD9, 0xDA):
+            raise ValueError("JPEG has no frame header")
+        length = _unpack('>H', data, offset)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            _, height, width, components = _unpack('>BHHB', data, offset + 2)
+            if height == 0:
+                raise ValueError("JPEG height is not declared in the frame header")
+            progressive = marker in _JPEG_PROGRESSIVE_MARKERS
+            return ImageInfo('JPEG', width, height, 1, 1 if components == 1 else 4, progressive)
+        offset += length
+
+
+def _inspect_webp(data):
+    chunk_type = data[12:16]
+    if chunk_type == b'VP8 ':
+        if data[23:26] != b'\x9d\x01\x2a':
+            raise ValueError("Invalid VP8 frame header")
+        width, height = _unpack('<HH', data, 26)
+        return ImageInfo('WEBP', width & 0x3FFF, height & 0x3FFF, 1, 4, False)
+    if chunk_type == b'VP8L':
+        if data[20:21] != b'\x2f':
+            raise ValueError("Invalid VP8L signature")
+        bits = _unpack('<I', data, 21)[0]
+        return ImageInfo('WEBP', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, 1, 4, False)
+    if chunk_type == b'VP8X':
+        flags = _unpack('<B', data, 20)[0]
+        width = int.from_bytes(_unpack('3s', data, 24)[0], 'little') + 1
+        height = int.from_bytes(_unpack('3s', data, 27)[0], 'little') + 1
+        frames = 1
+        if flags & 0x02:
+            # Animated: count the ANMF chunks (headers only)
+            frames = 0
+            offset = 12
+            while offset + 8 <= len(data):
+                fourcc, length = _unpack('<4sI', data, offset)
+                if fourcc == b'ANMF':
+                    frames += 1
+                offset += 8 + length + (length & 1)
+        return ImageInfo('WEBP', width, height, frames, 4, False)
+    raise ValueError("Unknown WebP chunk type")
+
+
+def inspect_image_header(image_bytes):
+    """
+    Identify an image from its header without decoding it.
+
+    Args:
+        image_bytes (bytes): Raw image bytes
+
+    Returns:
+        ImageInfo: Format, dimensions, frame count and decoded bytes per pixel
+
+    Raises:
+        ValueError: If the format is not PNG, JPEG or WebP, or the header is malformed
+    """
+    if image_bytes[:8] == _PNG_SIGNATURE:
+        return _inspect_png(image_bytes)
+    if image_bytes[:3] == b'\xff\xd8\xff':
+        return _inspect_jpeg(image_bytes)
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return _inspect_webp(image_bytes)
+    raise ValueError("Unsupported image format")
+
+
+def estimate_decode_memory(info):
+    """
+    Estimate peak memory for decoding and processing an image.
+
+    The peak is the larger of the decode phase (the decoded frame plus, for
+    progressive JPEGs, libjpeg's coefficient buffer) and the conversion phase
+    (the decoded frame plus its RGBA copy; single-band images go through an
+    intermediate RGB copy), plus the output canvases and encoder buffers. Checked
+    against measured max RSS with benchmarks/bench_image_guard.py.
+
+    Args:
+        info (ImageInfo): Header information
+
+    Returns:
+        int: Estimated bytes
+    """
+    pixels = info.width * info.height
+    decoded = pixels * info.bytes_per_pixel
+    decode_peak = decoded
+    if info.progressive:
+        # 16-bit DCT coefficients for each of up to three components
+        decode_peak += pixels * 2 * (1 if info.bytes_per_pixel == 1 else 3)
+    convert_peak = decoded + pixels * 4 * (2 if info.bytes_per_pixel == 1 else 1)
+    return max(decode_peak, convert_peak) + _OUTPUT_BYTES
+
+
+def check_image_limits(info, limits=DEFAULT_LIMITS):
+    """
+    Reject images that are not allowed or too expensive to decode.
+
+    Args:
+        info (ImageInfo): Header information
+        limits (ImageLimits): Limits to enforce
+
+    Raises:
+        ValueError: If any limit is exceeded
+    """
+    if info.format not in limits.allowed_formats:
+        raise ValueError(f"Image format {info.format} is not allowed")
+    if info.width <= 0 or info.height <= 0:
+        raise ValueError("Image has no pixels")
+    if max(info.width, info.height) > limits.max_dimension:
+        raise ValueError(f"Image dimensions {info.width}x{info.height} exceed {limits.max_dimension} pixels")
+    if info.width * info.height > limits.max_pixels:
+        raise ValueError(f"Image has more than {limits.max_pixels} pixels")
+    if info.frames > limits.max_frames:
+        raise ValueError(f"Image has {info.frames} frames (limit {limits.max_frames})")
+    estimate = estimate_decode_memory(info)
+    if estimate > limits.max_memory_bytes:
+        raise ValueError(f"Image would need {estimate // (1024 * 1024)} MB to decode "
+                         f"(limit {limits.max_memory_bytes // (1024 * 1024)} MB)")
+
+
+class _DeadlineFile(io.BytesIO):
+    """In-memory image file whose reads fail once the decode deadline has passed."""
+
+    def __init__(self, image_bytes, deadline):
+        super().__init__(image_bytes)
+        self.deadline = deadline
+
+    def read(self, size=-1):
+        if self.deadline.expired():
+            raise ValueError(f"Image took longer than {self.deadline.budget:.1f}s to decode")
+        return super().read(size)
+
+
+def decode_image(image_bytes, info, deadline):
+    """
+    Decode an already inspected image, checking the deadline between blocks.
+
+    Pillow's decode loop reads PNG and JPEG data ``DECODE_CHUNK_BYTES`` at a
+    time and decodes each block before reading the next; every read checks the
+    deadline, so a slow decode is abandoned part way through. A single block
+    is not interruptible: for a progressive JPEG most of the work happens once
+    the last block is in, and WebP is decoded in one call by libwebp. Their
+    cost is bounded by the header checks alone.
+
+    Args:
+        image_bytes (bytes): Raw image bytes
+        info (ImageInfo): Result of ``inspect_image_header``
+        deadline (Deadline): Decode time limit
+
+    Returns:
+        PIL.Image.Image: Decoded image
+
+    Raises:
+        ValueError: If the image cannot be decoded within the deadline
+    """
+    image = Image.open(_DeadlineFile(image_bytes, deadline), formats=[info.format])
+    image.decodermaxblock = DECODE_CHUNK_BYTES
+    image.load()
+    if image.format != info.format:
+        raise ValueError(f"Image header says {info.format} but decodes as {image.format}")
+    return image
@@ -1,7 +1,32 @@
 import base64
+import functools
 import io
+import logging
 import re
+from collections import namedtuple
 from PIL import Image
+from app.utils.deadline import Deadline
+from app.utils.image_guard import DEFAULT_LIMITS, check_image_limits, decode_image, inspect_image_header
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# How an image is resampled to fit the target: the filter for shrinking and
+# for enlarging, whether an exact integer shrink uses Image.reduce (a box
+# filter), and the reducing_gap passed to Image.resize when shrinking
+ResamplingPolicy = namedtuple('ResamplingPolicy', ['downscale', 'upscale', 'box_reduce', 'reducing_gap'])
+
+RESAMPLING_POLICIES = {
+    # Canvas drawings: flat fills and strokes lose nothing visible to a bilinear shrink
+    'line_art': ResamplingPolicy(Image.Resampling.BILINEAR, Image.Resampling.LANCZOS, True, None),
+    # Photos keep LANCZOS, after a box pre-reduction when shrinking by 3x or more
+    'photo': ResamplingPolicy(Image.Resampling.LANCZOS, Image.Resampling.LANCZOS, False, 1.5),
+    # LANCZOS for every resize, as before the policies existed
+    'quality': ResamplingPolicy(Image.Resampling.LANCZOS, Image.Resampling.LANCZOS, False, None),
+}
+
+# Modes Pillow resamples directly; others (palette, bilevel, 16-bit) are converted first
+_RESAMPLE_MODES = frozenset(['RGBA', 'RGB', 'LA', 'L'])
 
 def decode_base64_image(base64_string):
     """
@@ -46,81 +71,211 @@ def decode_base64_image(base64_string):
     except Exception as e:
         raise ValueError(f"Invalid base64 string: {str(e)}")
 
-def validate_and_process_image(image_bytes):
+def is_normalized(info, target_size=(1024, 1024)):
+    """
+    Check from the header alone whether an image already fits the target.
+    
+    A client-normalized image has been cropped and, if needed, downscaled so
+    that it fits within ``target_size``; the 4MB pre-check on a re-encoded copy
+    is pointless for it and is replaced by a check on the output.
+    
+    Args:
+        info (ImageInfo): Header information from ``inspect_image_header``
+        target_size (tuple): Target size as (width, height)
+        
+    Returns:
+        bool: True if the image fits within the target
+    """
+    return info.width <= target_size[0] and info.height <= target_size[1]
+
+def resampling_policy(name, image_format=None):
+    """
+    Pick the resampling policy for a request.
+    
+    Args:
+        name (str): A key of ``RESAMPLING_POLICIES``, or 'auto' to choose by
+            format: 'photo' for JPEG, 'line_art' for everything else
+        image_format (str, optional): Pillow format name of the input
+        
+    Returns:
+        str: Key of ``RESAMPLING_POLICIES``
+        
+    Raises:
+        ValueError: If the policy name is unknown
+    """
+    if name == 'auto':
+        return 'photo' if image_format == 'JPEG' else 'line_art'
+    if name not in RESAMPLING_POLICIES:
+        raise ValueError(f"Unknown resampling policy {name!r}")
+    return name
+
+def validate_and_process_image(image_bytes, limits=DEFAULT_LIMITS, normalized=False):
     """
     Validate image bytes and process into the required format for OpenAI API.
     
+    The header is inspected first and the image is only decoded if its format,
+    dimensions, frame count and estimated memory are within ``limits``; the
+    decode must finish within ``limits.decode_timeout``. The resize filter
+    follows ``limits.resampling`` (see ``resampling_policy``), and an image with
+    an embedded colour profile other than sRGB is converted to sRGB.
+    
+    When the client declares the image ``normalized`` (already cropped and
+    downscaled to fit the target) and the header confirms it, the intermediate
+    PNG encode is skipped and the 4MB limit is checked on the output instead.
+    A declaration the header does not confirm is ignored.
+    
     Args:
         image_bytes (bytes): Raw image bytes
+        limits (ImageLimits): Decode limits (see ``app.utils.image_guard``)
+        normalized (bool): Whether the client declared the image normalized
         
     Returns:
         io.BytesIO: In-memory file-like object containing the processed image
         
     Raises:
-        ValueError: If the image is invalid, empty, or too large
+        ValueError: If the image is invalid, empty, too large or too slow to decode
     """
     if not image_bytes:
         raise ValueError("Empty image data")
     
+    # Refuse decompression bombs before any pixels are allocated
+    info = inspect_image_header(image_bytes)
+    check_image_limits(info, limits)
+    deadline = Deadline(limits.decode_timeout)
+    normalized = normalized and is_normalized(info)
+    resampling = resampling_policy(limits.resampling, info.format)
+    
     try:
-        # Open the image with PIL
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Ensure it's in RGBA format (with alpha channel)
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
+        # Decode with PIL, giving up once the time limit has passed
+        image = decode_image(image_bytes, info, deadline)
+        if deadline.expired():
+            raise ValueError(f"Image took longer than {limits.decode_timeout:.1f}s to decode")
         
         # Validate image size (OpenAI API has a 4MB limit)
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        if len(img_byte_arr.getvalue()) > 4 * 1024 * 1024:  # 4MB
-            raise ValueError("Image is too large (>4MB)")
+        if not normalized:
+            img_byte_arr = io.BytesIO()
+            image.save(img_byte_arr, format='PNG')
+            if len(img_byte_arr.getvalue()) > 4 * 1024 * 1024:  # 4MB
+                raise ValueError("Image is too large (>4MB)")
         
-        # Resize to fit OpenAI requirements (1024x1024 is optimal)
-        image = resize_and_pad_image(image, target_size=(1024, 1024))
+        # Resize to fit OpenAI requirements (1024x1024 is optimal); this also converts to RGBA
+        image = resize_and_pad_image(image, target_size=(1024, 1024), resampling=resampling)
+        image = convert_to_srgb(image)
         
         # Save the resized image to a new byte buffer
         output_buffer = io.BytesIO()
         image.save(output_buffer, format='PNG')
+        if normalized and output_buffer.tell() > 4 * 1024 * 1024:  # 4MB
+            raise ValueError("Image is too large (>4MB)")
         output_buffer.seek(0)
         
         return output_buffer
     except Exception as e:
-        if isinstance(e, ValueError) and "too large" in str(e):
+        if isinstance(e, ValueError) and ("too large" in str(e) or "to decode" in str(e)):
             raise  # Re-raise our own ValueError
         raise ValueError(f"Invalid image data: {str(e)}")
 
-def resize_and_pad_image(image, target_size=(1024, 1024)):
+def resize_and_pad_image(image, target_size=(1024, 1024), resampling='line_art'):
     """
     Resize an image to the target size while maintaining aspect ratio and adding padding.
     
+    An image that already has the target size is only converted to RGBA if
+    needed; an exact integer shrink uses ``Image.reduce`` when the policy allows
+    it, and otherwise the policy's downscale or upscale filter is used. The
+    image is resized in its decoded mode and converted to RGBA at the new size.
+    Padding is transparent.
+    
     Args:
         image (PIL.Image): Image to resize
         target_size (tuple): Target size as (width, height)
+        resampling (str): Key of ``RESAMPLING_POLICIES``
         
     Returns:
-        PIL.Image: Resized and padded image
+        PIL.Image: Resized and padded RGBA image (``image`` itself if it
+        already is one of the target size)
     """
+    policy = RESAMPLING_POLICIES[resampling]
+    
     # Calculate the scaling factor to maintain aspect ratio
     width_ratio = target_size[0] / image.width
     height_ratio = target_size[1] / image.height
     scale_factor = min(width_ratio, height_ratio)
     
-    # Calculate new dimensions
-    new_width = int(image.width * scale_factor)
-    new_height = int(image.height * scale_factor)
+    # Calculate new dimensions; a sliver (e.g. 1x4096) keeps at least one pixel
+    new_width = max(1, int(image.width * scale_factor))
+    new_height = max(1, int(image.height * scale_factor))
     
-    # Resize the image while maintaining aspect ratio
-    resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    # Pillow resizes palette and bilevel images with NEAREST whatever the filter
+    if image.mode not in _RESAMPLE_MODES:
+        image = image.convert('RGBA')
     
-    # Create a new blank image with the target size and paste the resized image
-    new_image = Image.new('RGBA', target_size, (255, 255, 255, 0))  # Transparent background
+    # Resize the image while maintaining aspect ratio (a no-op for fitted images)
+    if (new_width, new_height) != image.size:
+        factor = image.width // new_width
+        if policy.box_reduce and factor > 1 and image.size == (new_width * factor, new_height * factor):
+            image = image.reduce(factor)
+        elif new_width > image.width:
+            image = image.resize((new_width, new_height), policy.upscale)
+        else:
+            image = image.resize((new_width, new_height), policy.downscale, reducing_gap=policy.reducing_gap)
     
-    # Calculate the position to paste the resized image (center it)
+    # Converting after the resize touches fewer pixels and, for RGB, fewer bands
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    if image.size == tuple(target_size):
+        return image
+    
+    # Pad in one step: cropping beyond the edges yields a target-size image
+    # whose outside pixels are zero, i.e. transparent
     paste_x = (target_size[0] - new_width) // 2
     paste_y = (target_size[1] - new_height) // 2
+    return image.crop((-paste_x, -paste_y, target_size[0] - paste_x, target_size[1] - paste_y))
+
+@functools.lru_cache(maxsize=16)
+def _srgb_transform(icc_profile, mode):
+    from PIL import ImageCms
     
-    # Paste the resized image onto the new image
-    new_image.paste(resized_image, (paste_x, paste_y))
+    source = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+    if 'srgb' in ImageCms.getProfileDescription(source).lower():
+        return None
+    return ImageCms.buildTransform(source, ImageCms.createProfile('sRGB'), mode, mode)
+
+@functools.lru_cache(maxsize=1)
+def _srgb_profile():
+    from PIL import ImageCms
+    
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+
+def convert_to_srgb(image):
+    """
+    Convert an image with an embedded colour profile to sRGB.
+    
+    Images without a profile or with an sRGB one are returned as they are,
+    without touching the pixels; transforms are cached per profile. A
+    converted image is a new image tagged with an sRGB profile; ``image``
+    itself is never modified. A profile that cannot be applied (e.g. a
+    greyscale one on RGBA pixels) is ignored.
     
-    return new_image
+    Args:
+        image (PIL.Image): RGB or RGBA image
+        
+    Returns:
+        PIL.Image: Image in sRGB (``image`` itself if no conversion was needed)
+    """
+    icc_profile = image.info.get('icc_profile')
+    if not icc_profile:
+        return image
+    try:
+        from PIL import ImageCms
+    except ImportError:  # Pillow built without littlecms
+        return image
+    try:
+        transform = _srgb_transform(icc_profile, image.mode)
+    except (ImageCms.PyCMSError, OSError, ValueError) as e:
+        logger.debug("Ignoring colour profile: %s", e)
+        return image
+    if transform is None:
+        return image
+    converted = ImageCms.applyTransform(image, transform)
+    converted.info['icc_profile'] = _srgb_profile()
+    return converted
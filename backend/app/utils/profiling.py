@@ -0,0 +1,510 @@
+"""
+On-demand profiling of live requests.
+
+Off by default (``PROFILING_ENABLED``). When enabled, ``init_profiling``
+installs request hooks that
+
+- always account CPU (``time.thread_time``) and wall time per endpoint,
+  which costs two clock reads per request, and
+- while a session is armed, profile the next N requests in one of three modes:
+
+  ``cprofile``  deterministic profile of each request thread, aggregated
+                into one pstats file (plus a text summary); one request is
+                profiled at a time and overlapping ones are left alone
+  ``sample``    a daemon thread samples the stacks of profiled request
+                threads every ``PROFILE_SAMPLE_INTERVAL_MS`` and writes
+                flamegraph-ready collapsed stacks; cheap enough for hot paths
+  ``memory``    tracemalloc snapshots (after a full collection) when the
+                session is armed and after the last request, diffed to show
+                what the requests left behind, with the traced total after
+                each request
+
+Sessions are per process: arming one profiles only the worker that received
+the request, so it is safe to do on a single worker of a busy pool. Results
+are written to ``PROFILE_PATH`` as ``<id>.json`` (metadata) plus artifacts,
+so any worker on the host can serve them once the session finishes.
+"""
+
+import cProfile
+import collections
+import gc
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample', 'memory')
+
+# Artifact name -> (file suffix, mimetype)
+ARTIFACTS = {
+    'pstats': ('.pstats', 'application/octet-stream'),
+    'text': ('.txt', 'text/plain'),
+    'collapsed': ('.collapsed', 'text/plain'),
+}
+
+_MODE_ARTIFACTS = {'cprofile': ('pstats', 'text'), 'sample': ('collapsed',), 'memory': ('text',)}
+
+
+class SessionRunning(Exception):
+    """Raised when a session is armed while another one is running in the process."""
+
+    def __init__(self, session_id):
+        super().__init__(f"Session {session_id} is already running in this process")
+        self.session_id = session_id
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """
+    Render a frame and its callers as a collapsed stack, outermost first.
+
+    Args:
+        frame (frame): Innermost frame
+
+    Returns:
+        str: Frames joined by ``;`` as expected by flamegraph.pl and speedscope
+    """
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class ProfileSession:
+    """
+    One armed profiling session.
+
+    Args:
+        mode (str): One of ``MODES``
+        requests (int): Number of requests to profile
+        path_prefix (str, optional): Only profile requests whose path starts with it
+        timeout (float): Seconds after which the session finishes with what it has
+        frames (int): Traceback depth kept by tracemalloc in ``memory`` mode
+    """
+
+    def __init__(self, mode, requests, path_prefix=None, timeout=300.0, frames=10):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.requests = requests
+        self.path_prefix = path_prefix
+        self.frames = frames
+        self.started_at = time.time()
+        self.expires = time.monotonic() + timeout
+        self.claimed = 0
+        self.completed = 0
+        self.in_flight = 0
+        self.finished = False
+        self.threads = set()
+        self.stats = None
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.traced = []
+        self.baseline = None
+        self.started_tracemalloc = False
+        self.sampler = None
+
+    def describe(self):
+        """Return the session metadata as a JSON-serialisable dict."""
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'pid': os.getpid(),
+            'requests': self.requests,
+            'profiled': self.completed,
+            'pathPrefix': self.path_prefix,
+            'startedAt': self.started_at,
+            'status': 'finished' if self.finished else 'running',
+        }
+
+
+class Profiler:
+    """
+    Per-process profiling state: endpoint CPU totals and the armed session.
+
+    Args:
+        root (str): Directory results are written to; created if missing
+        max_requests (int): Largest number of requests a session may profile
+        sample_interval (float): Seconds between stack samples in ``sample`` mode
+    """
+
+    def __init__(self, root, max_requests=100, sample_interval=0.005):
+        self.root = root
+        self.max_requests = max_requests
+        self.sample_interval = sample_interval
+        self.session = None
+        self._lock = threading.Lock()
+        # Held while a request is under cProfile: only one profiler can be active at a time
+        self._cprofile_lock = threading.Lock()
+        self._endpoints = {}
+        self._since = time.time()
+
+    # Endpoint accounting
+
+    def record_endpoint(self, endpoint, cpu_seconds, wall_seconds):
+        """Add one request to an endpoint's CPU and wall time totals."""
+        with self._lock:
+            totals = self._endpoints.get(endpoint)
+            if totals is None:
+                totals = self._endpoints[endpoint] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += cpu_seconds
+            totals[2] += wall_seconds
+
+    def endpoint_report(self):
+        """
+        Return CPU and wall time per endpoint since the process started.
+
+        Returns:
+            dict: ``pid``, ``since`` and ``endpoints`` (requests, cpuMs,
+                wallMs, avgCpuMs and cpuShare, the fraction of wall time
+                spent on CPU), busiest endpoint first
+        """
+        with self._lock:
+            totals = {endpoint: list(values) for endpoint, values in self._endpoints.items()}
+        endpoints = [{
+            'endpoint': endpoint,
+            'requests': count,
+            'cpuMs': round(cpu * 1000, 3),
+            'wallMs': round(wall * 1000, 3),
+            'avgCpuMs': round(cpu * 1000 / count, 3),
+            'cpuShare': round(cpu / wall, 3) if wall else None,
+        } for endpoint, (count, cpu, wall) in totals.items()]
+        endpoints.sort(key=lambda row: row['cpuMs'], reverse=True)
+        return {'pid': os.getpid(), 'since': self._since, 'endpoints': endpoints}
+
+    # Sessions
+
+    def start(self, mode, requests, path_prefix=None, timeout=300.0, frames=10):
+        """
+        Arm a session for the next ``requests`` requests in this process.
+
+        Args:
+            mode (str): One of ``MODES``
+            requests (int): Number of requests to profile
+            path_prefix (str, optional): Only profile requests under this path
+            timeout (float): Seconds after which the session finishes anyway
+            frames (int): tracemalloc traceback depth in ``memory`` mode
+
+        Returns:
+            dict: Session metadata, including its id
+
+        Raises:
+            ValueError: If the arguments are invalid
+            SessionRunning: If this process already has a session running
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if not 1 <= requests <= self.max_requests:
+            raise ValueError(f"requests must be between 1 and {self.max_requests}")
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+        if not 1 <= frames <= 100:
+            raise ValueError("frames must be between 1 and 100")
+
+        self._expire()
+        session = ProfileSession(mode, requests, path_prefix, timeout, frames)
+        with self._lock:
+            if self.session is not None:
+                raise SessionRunning(self.session.id)
+            self.session = session
+
+        os.makedirs(self.root, exist_ok=True)
+        if mode == 'memory':
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                session.started_tracemalloc = True
+            gc.collect()
+            session.baseline = tracemalloc.take_snapshot()
+        elif mode == 'sample':
+            session.sampler = threading.Thread(target=self._sample, args=(session,), name='profile-sampler',
+                                               daemon=True)
+            session.sampler.start()
+        logger.info("Profiling session %s armed: %s for %d requests", session.id, mode, requests)
+        return session.describe()
+
+    def begin_request(self, path):
+        """
+        Start profiling the current request if a session wants it.
+
+        In ``cprofile`` mode a request that arrives while another is being
+        profiled is skipped, as is one whose profiler cannot be enabled
+        (e.g. another tool is profiling the process); profiling never fails
+        the request.
+
+        Args:
+            path (str): Request path
+
+        Returns:
+            tuple or None: Token for ``end_request``, or None when the request
+                is not profiled
+        """
+        session = self.session
+        if session is None:
+            return None
+        if time.monotonic() > session.expires:
+            self._expire()
+            return None
+        if session.path_prefix and not path.startswith(session.path_prefix):
+            return None
+        cprofile = session.mode == 'cprofile'
+        if cprofile and not self._cprofile_lock.acquire(blocking=False):
+            return None
+        with self._lock:
+            if session.finished or session.claimed >= session.requests:
+                if cprofile:
+                    self._cprofile_lock.release()
+                return None
+            session.claimed += 1
+            session.in_flight += 1
+            if session.mode == 'sample':
+                session.threads.add(threading.get_ident())
+
+        profile = None
+        if cprofile:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                logger.warning("Not profiling request to %s: %s", path, e)
+                with self._lock:
+                    session.claimed -= 1
+                    session.in_flight -= 1
+                self._cprofile_lock.release()
+                return None
+        return session, profile
+
+    def end_request(self, token):
+        """Stop profiling a request started with ``begin_request``."""
+        session, profile = token
+        if profile is not None:
+            try:
+                profile.disable()
+            finally:
+                self._cprofile_lock.release()
+        traced = None
+        if session.mode == 'memory':
+            import tracemalloc
+            traced = tracemalloc.get_traced_memory()[0]
+
+        with self._lock:
+            if profile is not None:
+                if session.stats is None:
+                    session.stats = pstats.Stats(profile)
+                else:
+                    session.stats.add(profile)
+            if traced is not None:
+                session.traced.append(traced)
+            session.threads.discard(threading.get_ident())
+            session.in_flight -= 1
+            session.completed += 1
+            done = session.completed >= session.requests and not session.finished
+            if done:
+                session.finished = True
+        if done:
+            self._finish(session)
+
+    def stop(self):
+        """
+        Finish the running session early with what it has collected.
+
+        Returns:
+            dict or None: Metadata of the stopped session, or None if none was running
+        """
+        with self._lock:
+            session = self.session
+            if session is None or session.finished:
+                return None
+            session.finished = True
+        self._finish(session)
+        return session.describe()
+
+    def _expire(self):
+        session = self.session
+        if session is not None and time.monotonic() > session.expires:
+            logger.warning("Profiling session %s timed out after %d of %d requests",
+                           session.id, session.completed, session.requests)
+            self.stop()
+
+    def status(self, session_id):
+        """
+        Return a session's metadata.
+
+        Finished sessions are read from ``root``, so any process on the host
+        can answer for them; a running session is only known to its process.
+
+        Args:
+            session_id (str): Session id from ``start``
+
+        Returns:
+            dict or None: Metadata, or None if the session is unknown here
+        """
+        self._expire()
+        session = self.session
+        if session is not None and session.id == session_id:
+            return session.describe()
+        try:
+            with open(self.result_path(session_id, 'json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def result_path(self, session_id, suffix):
+        """
+        Return the path of a session's result file.
+
+        Raises:
+            ValueError: If the id is not a session id
+        """
+        if len(session_id) != 32 or any(c not in '0123456789abcdef' for c in session_id):
+            raise ValueError("Invalid session id")
+        return os.path.join(self.root, f"{session_id}.{suffix.lstrip('.')}")
+
+    def _sample(self, session):
+        interval = self.sample_interval
+        own = threading.get_ident()
+        while not session.finished:
+            time.sleep(interval)
+            if time.monotonic() > session.expires:
+                self._expire()
+                break
+            threads = set(session.threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None and ident != own:
+                    session.stacks[collapse_stack(frame)] += 1
+            session.samples += 1
+            del frames
+
+    def _finish(self, session):
+        # Wait briefly for requests still being profiled so their data lands in the results
+        deadline = time.monotonic() + 5
+        while session.in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if session.sampler is not None and session.sampler is not threading.current_thread():
+            session.sampler.join(timeout=1)
+        try:
+            artifacts = self._write_artifacts(session)
+            metadata = dict(session.describe(), finishedAt=time.time(), artifacts=artifacts)
+            if session.mode == 'sample':
+                metadata['samples'] = session.samples
+            tmp_path = self.result_path(session.id, 'json') + f".{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, self.result_path(session.id, 'json'))
+            logger.info("Profiling session %s finished after %d requests", session.id, session.completed)
+        except Exception as e:
+            logger.error("Could not write profiling session %s: %s", session.id, e)
+        finally:
+            if session.started_tracemalloc:
+                import tracemalloc
+                tracemalloc.stop()
+            session.baseline = None
+            with self._lock:
+                if self.session is session:
+                    self.session = None
+
+    def _write_artifacts(self, session):
+        written = []
+        if session.mode == 'cprofile' and session.stats is not None:
+            session.stats.dump_stats(self.result_path(session.id, 'pstats'))
+            written.append('pstats')
+            text = io.StringIO()
+            session.stats.stream = text
+            session.stats.sort_stats('cumulative').print_stats(60)
+            self._write_text(session.id, 'txt', text.getvalue())
+            written.append('text')
+        elif session.mode == 'sample':
+            lines = [f"{stack} {count}" for stack, count in session.stacks.most_common()]
+            self._write_text(session.id, 'collapsed', '\n'.join(lines) + '\n')
+            written.append('collapsed')
+        elif session.mode == 'memory':
+            self._write_text(session.id, 'txt', self._memory_report(session))
+            written.append('text')
+        return [name for name in _MODE_ARTIFACTS[session.mode] if name in written]
+
+    def _memory_report(self, session):
+        import tracemalloc
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot()
+        ignored = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ]
+        snapshot = snapshot.filter_traces(ignored)
+        baseline = session.baseline.filter_traces(ignored)
+        lines = [
+            f"Allocations still held after {session.completed} requests, compared to when the session was armed",
+            f"Traced memory after each request (bytes): {', '.join(str(t) for t in session.traced)}",
+            '',
+        ]
+        for stat in snapshot.compare_to(baseline, 'traceback')[:25]:
+            if stat.size_diff <= 0:
+                break
+            lines.append(f"+{stat.size_diff} B in {stat.count_diff:+d} blocks "
+                         f"(now {stat.size} B in {stat.count} blocks)")
+            lines.extend(f"    {line}" for line in stat.traceback.format(most_recent_first=True))
+        return '\n'.join(lines) + '\n'
+
+    def _write_text(self, session_id, suffix, text):
+        with open(self.result_path(session_id, suffix), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def init_profiling(app):
+    """
+    Register the request hooks that feed the app's ``Profiler``.
+
+    The hooks run on every request; with no session armed they only read
+    two clocks. ``teardown_request`` is used so streamed responses are
+    measured until their last chunk.
+
+    Args:
+        app (Flask): Application to instrument
+
+    Returns:
+        Profiler: The profiler, also stored in ``app.extensions['profiler']``
+    """
+    from flask import g, request
+
+    profiler = Profiler(
+        app.config['PROFILE_PATH'],
+        max_requests=app.config['PROFILE_MAX_REQUESTS'],
+        sample_interval=app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000,
+    )
+    app.extensions['profiler'] = profiler
+
+    @app.before_request
+    def _begin_profiling():
+        g.profile_clocks = (time.thread_time(), time.perf_counter())
+        if profiler.session is not None and request.blueprint != 'profiling':
+            g.profile_token = profiler.begin_request(request.path)
+
+    @app.teardown_request
+    def _end_profiling(exc):
+        token = g.pop('profile_token', None)
+        if token is not None:
+            profiler.end_request(token)
+        clocks = g.pop('profile_clocks', None)
+        if clocks is not None:
+            profiler.record_endpoint(request.endpoint or '<unmatched>',
+                                     time.thread_time() - clocks[0], time.perf_counter() - clocks[1])
+
+    return profiler
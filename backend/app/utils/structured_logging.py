@@ -0,0 +1,222 @@
+"""
+Structured JSON logging with a non-blocking queue handler.
+
+Request threads only put records on an in-memory queue; a background
+QueueListener formats them as JSON and writes them out. Every record carries
+the correlation id of the request that produced it, and success logs
+(below WARNING) can be sampled per request while errors are always kept.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+# Header used to pass a correlation id in and echo it back
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Per-request state, visible to every log call made on behalf of the request
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+sampled = contextvars.ContextVar('log_sampled', default=None)
+
+# Attributes every LogRecord has; anything else was passed via ``extra``
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single JSON object per line."""
+
+    def format(self, record):
+        payload = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request_id = getattr(record, 'correlation_id', None)
+        if request_id:
+            payload['correlation_id'] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and key != 'correlation_id':
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep every WARNING and above; keep lower levels for a sample of requests.
+
+    The decision is made once per request (see ``begin_request``) so a sampled
+    request is logged completely. Records emitted outside a request are sampled
+    individually.
+
+    Args:
+        rate (float): Fraction of requests whose success logs are kept (0-1)
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        keep = sampled.get()
+        if keep is None:
+            keep = random.random() < self.rate
+        return keep
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that defers message formatting to the listener thread.
+
+    The stock handler renders the message in the calling thread. Here the
+    record is only stamped with the correlation id and enqueued; arguments are
+    kept as-is, so callers must pass values that are not mutated afterwards.
+    """
+
+    def prepare(self, record):
+        record.correlation_id = correlation_id.get()
+        return record
+
+
+def begin_request(request_id=None, sample_rate=1.0):
+    """
+    Start the logging context for a request.
+
+    Args:
+        request_id (str, optional): Incoming correlation id; a new one is generated if absent
+        sample_rate (float): Fraction of requests whose success logs are kept
+
+    Returns:
+        str: The correlation id in effect for the request
+    """
+    request_id = request_id or uuid.uuid4().hex
+    correlation_id.set(request_id)
+    sampled.set(sample_rate >= 1.0 or random.random() < sample_rate)
+    return request_id
+
+
+def configure_logging(level='INFO', fmt='json', sample_rate=1.0, stream=None):
+    """
+    Route all logging through a queue to a background JSON (or text) writer.
+
+    Calling it again replaces the previous configuration.
+
+    Args:
+        level (str or int): Root log level
+        fmt (str): 'json' for structured output, 'text' for the plain format
+        sample_rate (float): Fraction of requests whose success logs are kept
+        stream (file, optional): Destination, defaults to stderr
+
+    Returns:
+        logging.handlers.QueueListener: The running listener
+    """
+    global _listener
+    shutdown_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, ContextQueueHandler):
+            root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def _restart_listener_after_fork():
+    """Give a forked worker its own queue and listener thread.
+
+    Threads do not survive fork, so a listener started in a preloading master
+    would leave workers enqueueing records nobody writes.
+    """
+    global _listener
+    if _listener is None:
+        return
+    handlers = _listener.handlers
+    log_queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, ContextQueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush and stop the background listener, if one is running."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def init_request_logging(app):
+    """
+    Register hooks that give each request a correlation id and sampling decision.
+
+    Args:
+        app (Flask): Application to instrument
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _begin_request_logging():
+        g.request_id = begin_request(
+            request.headers.get(REQUEST_ID_HEADER),
+            app.config.get('LOG_SUCCESS_SAMPLE_RATE', 1.0),
+        )
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _end_request_logging(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        started = g.get('request_started')
+        if started is not None:
+            level = logging.INFO
+            if response.status_code >= 500:
+                level = logging.ERROR
+            elif response.status_code >= 400:
+                level = logging.WARNING
+            if logger.isEnabledFor(level):
+                logger.log(level, "Request completed", extra={
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+                })
+        return response
+
+
+atexit.register(shutdown_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
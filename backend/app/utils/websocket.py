@@ -0,0 +1,246 @@
+"""
+Minimal WebSocket (RFC 6455) support on asyncio streams.
+
+Just what the progress server needs: the opening handshake, unfragmented
+frames and control frames (ping, pong, close). Messages flow server to
+client; anything a client sends besides control frames is read and ignored,
+so client frames are capped at ``MAX_CLIENT_PAYLOAD``. ``connect`` is a
+matching client for tests and benchmarks.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+
+_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+
+MAX_HEADER_BYTES = 8192
+MAX_CLIENT_PAYLOAD = 4096
+
+_REASONS = {400: 'Bad Request', 404: 'Not Found', 426: 'Upgrade Required', 503: 'Service Unavailable'}
+
+
+class ProtocolError(ValueError):
+    """Raised when the peer breaks the WebSocket protocol."""
+
+    def __init__(self, message, close_code=CLOSE_PROTOCOL_ERROR):
+        super().__init__(message)
+        self.close_code = close_code
+
+
+def accept_key(key):
+    """Return the Sec-WebSocket-Accept value for a Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1((key + _GUID).encode('ascii')).digest()).decode('ascii')
+
+
+async def read_request(reader):
+    """
+    Read an HTTP request head.
+
+    Args:
+        reader (asyncio.StreamReader): Connection to read from
+
+    Returns:
+        tuple: (method, target, headers) with lower-cased header names
+
+    Raises:
+        ProtocolError: If the head is malformed or larger than ``MAX_HEADER_BYTES``
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.LimitOverrunError:
+        raise ProtocolError("Request head too large")
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("Connection closed during the handshake")
+    if len(head) > MAX_HEADER_BYTES:
+        raise ProtocolError("Request head too large")
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) != 3:
+        raise ProtocolError("Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return parts[0], parts[1], headers
+
+
+def handshake_error(headers):
+    """
+    Check that request headers ask for a WebSocket upgrade this module speaks.
+
+    Args:
+        headers (dict): Lower-cased request headers
+
+    Returns:
+        tuple or None: (status, message) describing the problem, or None if valid
+    """
+    if headers.get('upgrade', '').lower() != 'websocket':
+        return 426, "Expected a WebSocket upgrade"
+    if 'upgrade' not in [token.strip().lower() for token in headers.get('connection', '').split(',')]:
+        return 400, "Expected Connection: Upgrade"
+    if headers.get('sec-websocket-version') != '13':
+        return 426, "Only WebSocket version 13 is supported"
+    key = headers.get('sec-websocket-key', '')
+    try:
+        if len(base64.b64decode(key, validate=True)) != 16:
+            raise ValueError
+    except ValueError:
+        return 400, "Invalid Sec-WebSocket-Key"
+    return None
+
+
+def handshake_response(key):
+    """Return the 101 response completing the handshake for ``key``."""
+    return (
+        "HTTP/1.1 101 Switching Protocols\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n"
+    ).encode('ascii')
+
+
+def error_response(status, message):
+    """Return a plain HTTP error response that closes the connection."""
+    body = json.dumps({'error': message}).encode('utf-8')
+    head = (
+        f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n"
+    )
+    if status == 426:
+        head += "Sec-WebSocket-Version: 13\r\n"
+    return (head + "\r\n").encode('ascii') + body
+
+
+def _mask(payload, key):
+    # XOR with the repeated 4-byte key, a machine word at a time
+    repeated = (key * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(len(payload), 'big')
+
+
+def encode_frame(opcode, payload=b'', mask=False):
+    """
+    Encode a single, final frame.
+
+    Args:
+        opcode (int): ``OP_*`` constant
+        payload (bytes or str): Frame payload; str is UTF-8 encoded
+        mask (bool): Mask the payload, as clients must
+
+    Returns:
+        bytes: The frame
+    """
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, mask_bit | 127, length)
+    if mask:
+        key = os.urandom(4)
+        return header + key + _mask(payload, key)
+    return header + payload
+
+
+def close_frame(code=CLOSE_NORMAL, reason='', mask=False):
+    """Encode a close frame with a status code and reason."""
+    return encode_frame(OP_CLOSE, struct.pack('!H', code) + reason.encode('utf-8')[:120], mask=mask)
+
+
+def text_frame(message, mask=False):
+    """Encode a JSON-serialisable message as a text frame."""
+    return encode_frame(OP_TEXT, json.dumps(message, separators=(',', ':')), mask=mask)
+
+
+async def read_frame(reader, max_payload=MAX_CLIENT_PAYLOAD, require_mask=True):
+    """
+    Read one frame.
+
+    Args:
+        reader (asyncio.StreamReader): Connection to read from
+        max_payload (int): Largest payload accepted
+        require_mask (bool): Reject unmasked frames (servers must)
+
+    Returns:
+        tuple: (opcode, payload bytes)
+
+    Raises:
+        asyncio.IncompleteReadError: If the connection closes mid-frame
+        ProtocolError: If the frame is invalid or too large
+    """
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    masked = second & 0x80
+    length = second & 0x7F
+    if first & 0x70:
+        raise ProtocolError("Reserved bits set")
+    if require_mask and not masked:
+        raise ProtocolError("Client frames must be masked")
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if opcode >= OP_CLOSE and (length > 125 or not first & 0x80):
+        raise ProtocolError("Invalid control frame")
+    if length > max_payload:
+        raise ProtocolError("Frame too large", CLOSE_TOO_BIG)
+    key = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    return opcode, _mask(payload, key) if key else payload
+
+
+async def connect(host, port, path):
+    """
+    Open a client connection (for tests and benchmarks).
+
+    Args:
+        host (str): Server host
+        port (int): Server port
+        path (str): Request target, e.g. ``/jobs/<id>``
+
+    Returns:
+        tuple: (reader, writer) after a successful handshake
+
+    Raises:
+        ProtocolError: If the server refuses the upgrade; the message holds
+            the status line
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    writer.write((
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\n"
+        "Sec-WebSocket-Version: 13\r\n\r\n"
+    ).encode('ascii'))
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+    if not status_line.startswith('HTTP/1.1 101') or accept_key(key).encode('ascii') not in head:
+        writer.close()
+        raise ProtocolError(status_line)
+    return reader, writer
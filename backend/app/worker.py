@@ -0,0 +1,256 @@
+"""
+Job worker processes for the durable generation queue.
+
+Usage:
+    python -m app.worker --processes 4
+
+Each process leases jobs from the queue, runs preprocessing and the OpenAI
+call, and acks the result, recording stage events for progress subscribers
+(see app/progress_server.py) along the way. Every stage renews the lease, and
+a worker that finds its lease taken over stops before calling OpenAI again.
+The supervisor restarts processes that die; their leased jobs become visible
+again once the visibility timeout passes.
+"""
+
+import argparse
+import functools
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from app.utils.deadline import Deadline, DeadlineExceeded
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """Raised when another worker has taken over the job being processed."""
+
+
+def process_generation_job(payload, deadline, limits=None, postprocessor=None, accountant=None, progress=None):
+    """
+    Run one generation job.
+
+    Args:
+        payload (dict): Job payload with imageData and optional promptHint,
+            normalized and tenant
+        deadline (Deadline): Budget for the job, shorter than its lease
+        limits (ImageLimits, optional): Decode limits; defaults to DEFAULT_LIMITS
+        postprocessor (PostProcessor, optional): Renders branded variants of the
+            result within what is left of ``deadline``
+        accountant (UsageAccountant, optional): Records the attempt against the job's tenant
+        progress (callable, optional): Called with a stage name as each stage
+            starts or ends; under ``run_worker`` it also renews the job's lease
+            and raises ``LeaseLost`` if the lease has passed to another worker
+
+    Returns:
+        dict: Job result with imageUrl, and variants when post-processing succeeded
+
+    Raises:
+        ValueError: If the image is invalid (not retried)
+        Exception: If the OpenAI call fails (retried)
+    """
+    from app.utils.image_guard import DEFAULT_LIMITS
+    from app.utils.image_utils import decode_base64_image, validate_and_process_image
+    from app.services.job_queue import PREPROCESSED, UPSTREAM_STARTED
+    from app.services.openai_service import generate_art_from_doodle
+    from app.services.usage import UsageRecord
+
+    usage = UsageRecord(payload.get('tenant') or 'anonymous')
+    try:
+        image_bytes = decode_base64_image(payload['imageData'])
+        usage.bytes_in = len(image_bytes)
+        deadline.check('preprocessing')
+        processed_image = validate_and_process_image(
+            image_bytes, limits or DEFAULT_LIMITS, normalized=payload.get('normalized', False)
+        )
+        on_request = None
+        if progress is not None:
+            progress(PREPROCESSED)
+            on_request = functools.partial(progress, UPSTREAM_STARTED)
+        try:
+            image_url = generate_art_from_doodle(
+                processed_image, payload.get('promptHint'), deadline=deadline, usage=usage, on_request=on_request
+            )
+        except ValueError as e:
+            # Only input errors are permanent; a missing API key is not the image's fault
+            raise RuntimeError(str(e)) from e
+    finally:
+        if accountant is not None:
+            accountant.record(usage, deadline.elapsed())
+
+    result = {'imageUrl': image_url}
+    if postprocessor is not None:
+        # The generation itself succeeded; missing variants must not fail the job
+        try:
+            result['variants'] = postprocessor.process(image_url, deadline).variants
+        except Exception as e:
+            logger.error("Post-processing failed: %s", e)
+    return result
+
+
+def _record_progress(queue, job, owner, stage):
+    """
+    Renew the lease on ``job`` as a stage starts and record the stage event.
+
+    Raises:
+        LeaseLost: If the lease expired and another worker may hold the job;
+            the caller must stop before doing (and paying for) more work
+    """
+    if not queue.extend(job.id, owner):
+        raise LeaseLost(f"Lease on job {job.id} was lost before {stage}")
+    # Progress reporting never fails a job
+    try:
+        queue.add_event(job.id, stage, {'attempt': job.attempts})
+    except Exception as e:
+        logger.warning("Could not record %s event for job %s: %s", stage, job.id, e)
+
+
+def run_worker(queue, handler=process_generation_job, stop_event=None, worker_id=None,
+               poll_interval=0.5, max_jobs=None, report_progress=False):
+    """
+    Lease and process jobs until stopped.
+
+    Args:
+        queue (JobQueue): Queue to consume
+        handler (callable): Called as ``handler(payload, deadline)``; returns the result dict
+        stop_event (Event, optional): Set to stop after the current job
+        worker_id (str, optional): Lease owner id; defaults to host:pid
+        poll_interval (float): Seconds to wait when the queue is empty
+        max_jobs (int, optional): Stop after this many jobs (for tests and benchmarks)
+        report_progress (bool): Also pass the handler ``progress``, a callable
+            that renews the lease and records a stage event for the job
+
+    Returns:
+        int: Number of jobs processed
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    processed = 0
+    while not (stop_event is not None and stop_event.is_set()):
+        if max_jobs is not None and processed >= max_jobs:
+            break
+        job = queue.lease(worker_id)
+        if job is None:
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+
+        # Finish (or give up) before the lease expires and another worker takes over
+        deadline = Deadline(queue.visibility_timeout * 0.9)
+        try:
+            if report_progress:
+                result = handler(job.payload, deadline,
+                                 progress=functools.partial(_record_progress, queue, job, worker_id))
+            else:
+                result = handler(job.payload, deadline)
+        except LeaseLost as e:
+            # The job now belongs to another worker; leave its state alone
+            logger.warning("%s", e)
+        except ValueError as e:
+            logger.error("Job %s rejected: %s", job.id, e)
+            queue.fail(job.id, worker_id, f"Invalid image data: {e}", retry=False)
+        except DeadlineExceeded as e:
+            logger.error("Job %s timed out: %s", job.id, e)
+            queue.fail(job.id, worker_id, str(e))
+        except Exception as e:
+            logger.error("Job %s attempt %d failed: %s", job.id, job.attempts, e)
+            queue.fail(job.id, worker_id, f"Failed to generate image: {e}")
+        else:
+            if not queue.ack(job.id, worker_id, result):
+                logger.warning("Lease on job %s was lost before it completed", job.id)
+        processed += 1
+    return processed
+
+
+class _StopFlag:
+    """Stop request that is safe to set from a signal handler, unlike an Event."""
+
+    def __init__(self):
+        self.requested = False
+
+    def set(self, *_):
+        self.requested = True
+
+    def is_set(self):
+        return self.requested
+
+    def wait(self, timeout):
+        if not self.requested:
+            time.sleep(timeout)
+
+
+def _worker_main(config):
+    """Entry point of one worker process; SIGTERM stops it after the current job."""
+    from app.services.job_queue import get_job_queue
+    from app.services.postprocess import get_postprocessor
+    from app.services.usage import get_usage_accountant
+    from app.utils.image_guard import ImageLimits
+    from app.utils.structured_logging import configure_logging
+
+    stopping = _StopFlag()
+    signal.signal(signal.SIGTERM, stopping.set)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_logging(level=config['LOG_LEVEL'], fmt=config['LOG_FORMAT'])
+    accountant = get_usage_accountant(config)
+    handler = functools.partial(
+        process_generation_job,
+        limits=ImageLimits.from_config(config),
+        postprocessor=get_postprocessor(config),
+        accountant=accountant,
+    )
+    run_worker(get_job_queue(config), handler=handler, stop_event=stopping, report_progress=True)
+    # Worker processes exit without running atexit handlers
+    if accountant is not None:
+        accountant.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run generation job workers.")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from app.config import Config
+    from app.utils.structured_logging import configure_logging
+
+    load_dotenv()
+    config = vars(Config())
+    configure_logging(level=config['LOG_LEVEL'], fmt=config['LOG_FORMAT'])
+
+    stopping = _StopFlag()
+    signal.signal(signal.SIGTERM, stopping.set)
+    signal.signal(signal.SIGINT, stopping.set)
+    context = multiprocessing.get_context('spawn')
+
+    def start():
+        process = context.Process(target=_worker_main, args=(config,), daemon=True)
+        process.start()
+        return process
+
+    workers = [start() for _ in range(args.processes)]
+    logger.info("Started %d job workers on %s", len(workers), config['JOB_QUEUE_PATH'])
+    while not stopping.is_set():
+        for index, process in enumerate(workers):
+            if not process.is_alive():
+                logger.warning("Job worker %s exited with %s; restarting", process.pid, process.exitcode)
+                workers[index] = start()
+        stopping.wait(1.0)
+
+    # Each worker finishes its current job; a lease left behind is recovered by another worker
+    logger.info("Stopping job workers")
+    for process in workers:
+        process.terminate()
+    for process in workers:
+        process.join(timeout=config['JOB_VISIBILITY_TIMEOUT_SECONDS'])
+        if process.is_alive():
+            process.kill()
+
+
+if __name__ == '__main__':
+    main()
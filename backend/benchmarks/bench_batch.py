@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Throughput of POST /api/generate/batch versus sequential /api/generate calls.
+
+The OpenAI call is replaced by a mock upstream that sleeps for a fixed latency
+(plus jitter), so the numbers show how well preprocessing parallelism and the
+upstream concurrency cap overlap work. Requests go through Flask's test client.
+
+Usage:
+    python benchmarks/bench_batch.py --sizes 10,100,1000 --upstream-ms 200 --concurrency 8
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image, ImageDraw
+
+
+def make_doodle(rng, size=(800, 600)):
+    """A white canvas with a few random strokes, like the frontend exports."""
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        points = [(rng.randrange(size[0]), rng.randrange(size[1])) for _ in range(6)]
+        draw.line(points, fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)), width=5)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def make_upstream(latency, jitter, rng):
+    def generate(image_bytes, prompt_hint=None, deadline=None, hedge=True):
+        time.sleep(latency + rng.random() * jitter)
+        return "https://example.com/generated.png"
+    return generate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--upstream-ms', type=float, default=200.0, help='Mock upstream latency')
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--concurrency', type=int, default=8, help='BATCH_UPSTREAM_CONCURRENCY')
+    parser.add_argument('--preprocess-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--sequential-max', type=int, default=100,
+                        help='Skip the sequential baseline above this many items')
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.config import TestingConfig
+
+    config = TestingConfig()
+    config.BATCH_UPSTREAM_CONCURRENCY = args.concurrency
+    config.BATCH_PREPROCESS_WORKERS = args.preprocess_workers
+    config.BATCH_MAX_ITEMS = max(int(s) for s in args.sizes.split(','))
+    config.HEDGE_ENABLED = False
+    app = create_app(config)
+    client = app.test_client()
+
+    rng = random.Random(3)
+    pool = [make_doodle(rng) for _ in range(20)]
+    upstream = make_upstream(args.upstream_ms / 1000.0, args.jitter_ms / 1000.0, rng)
+
+    print(f"{'items':>6}{'sequential s':>15}{'items/s':>10}{'batch s':>10}{'items/s':>10}{'speedup':>9}")
+    with patch('app.api.routes.generate_art_from_doodle', upstream):
+        # Start the preprocessing pool outside the timed region
+        client.post('/api/generate/batch', data=json.dumps({'imageData': pool[0]}),
+                    content_type='application/x-ndjson').get_data()
+
+        for size in (int(s) for s in args.sizes.split(',')):
+            doodles = [pool[i % len(pool)] for i in range(size)]
+
+            sequential = None
+            if size <= args.sequential_max:
+                started = time.perf_counter()
+                for i, doodle in enumerate(doodles):
+                    response = client.post('/api/generate', json={'imageData': doodle, 'promptHint': f'item {i}'})
+                    assert response.status_code == 200, response.get_data(as_text=True)
+                sequential = time.perf_counter() - started
+
+            body = '\n'.join(json.dumps({'id': i, 'imageData': d, 'promptHint': f'item {i}'})
+                             for i, d in enumerate(doodles))
+            started = time.perf_counter()
+            response = client.post('/api/generate/batch', data=body, content_type='application/x-ndjson')
+            lines = response.get_data(as_text=True).splitlines()
+            batch = time.perf_counter() - started
+            summary = json.loads(lines[-1])['summary']
+            assert summary['failed'] == 0, lines[:3]
+
+            if sequential is None:
+                print(f"{size:>6}{'skipped':>15}{'':>10}{batch:>10.2f}{size / batch:>10.1f}{'':>9}")
+            else:
+                print(f"{size:>6}{sequential:>15.2f}{size / sequential:>10.1f}{batch:>10.2f}"
+                      f"{size / batch:>10.1f}{sequential / batch:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Upload size and server preprocessing cost of the two /api/generate inputs.
+
+"data URL" is the previous client: the full 800x600 canvas as a base64 PNG in
+JSON, decoded and run through the full preprocessing path. "normalized" is
+what the export worker sends: the drawing cropped to its ink (downscaled only
+if it exceeds 1024) and encoded as lossless WebP or PNG, uploaded as a binary
+body and declared normalized, so the server skips its size pre-check. The
+client export is reproduced here with Pillow; "upscaled" is the same crop
+scaled up to 1024 on the client instead, for comparison.
+
+Usage:
+    python benchmarks/bench_client_export.py --doodles 30
+"""
+
+import argparse
+import base64
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image, ImageDraw, ImageOps, features
+
+from app.utils.image_utils import decode_base64_image, validate_and_process_image
+
+
+def make_doodle(rng):
+    """A few strokes on a white 800x600 canvas, covering part of it."""
+    image = Image.new('RGB', (800, 600), 'white')
+    draw = ImageDraw.Draw(image)
+    cx, cy = rng.randrange(200, 600), rng.randrange(150, 450)
+    for _ in range(rng.randrange(5, 30)):
+        points = [(cx + rng.randrange(-150, 150), cy + rng.randrange(-120, 120)) for _ in range(6)]
+        draw.line(points, fill=(rng.randrange(200), rng.randrange(200), rng.randrange(200)), width=5, joint='curve')
+    return image
+
+
+def data_url(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def client_export(image, fmt, upscale=False):
+    """What the export worker does: crop to the ink with padding, fit within 1024, encode."""
+    left, top, right, bottom = ImageOps.invert(image).getbbox() or (0, 0, *image.size)
+    box = (max(0, left - 16), max(0, top - 16), min(image.width, right + 16), min(image.height, bottom + 16))
+    cropped = image.crop(box)
+    scale = 1024 / max(cropped.size)
+    if scale < 1 or upscale:
+        cropped = cropped.resize(tuple(max(1, round(side * scale)) for side in cropped.size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    cropped.save(buffer, format=fmt, lossless=True)
+    return buffer.getvalue()
+
+
+def timed(process, inputs):
+    durations = []
+    for data in inputs:
+        started = time.perf_counter()
+        process(data)
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doodles', type=int, default=30)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    doodles = [make_doodle(rng) for _ in range(args.doodles)]
+    formats = ['WEBP', 'PNG'] if features.check('webp') else ['PNG']
+    cases = [('data URL PNG, full path', [data_url(d) for d in doodles],
+              lambda url: validate_and_process_image(decode_base64_image(url)))]
+    for fmt in formats:
+        exported = [client_export(d, fmt) for d in doodles]
+        cases.append((f"{fmt} crop, normalized", exported, lambda data: validate_and_process_image(data, normalized=True)))
+        cases.append((f"{fmt} crop, not declared", exported, validate_and_process_image))
+    cases.append((f"{formats[0]} crop upscaled", [client_export(d, formats[0], upscale=True) for d in doodles],
+                  lambda data: validate_and_process_image(data, normalized=True)))
+
+    validate_and_process_image(client_export(doodles[0], 'PNG'))  # warm up codecs
+    print(f"{'input':<28}{'upload KB p50':>14}{'server ms p50':>15}{'p95':>8}")
+    for name, inputs, process in cases:
+        durations = sorted(timed(process, inputs))
+        size = statistics.median(len(data) for data in inputs) / 1024
+        print(f"{name:<28}{size:>14.1f}{statistics.median(durations):>15.1f}{durations[int(len(durations) * 0.95)]:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Bytes on the wire with and without the response layer.
+
+Requests go through Flask's test client; body bytes (what the client
+downloads, excluding headers) are compared for identity, gzip and, if the
+``brotli`` package is installed, brotli. The batch endpoint uses a mock
+upstream. The last rows show job polling with and without If-None-Match.
+
+Usage:
+    python benchmarks/bench_compression.py --batch-size 100 --polls 20
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_batch import make_doodle
+
+
+def fake_generate(image_bytes, prompt_hint=None, deadline=None, hedge=True):
+    return (f"https://oaidalleapiprodscus.blob.core.windows.net/private/org-abc/user-def/"
+            f"img-{random.getrandbits(64):016x}.png?st=2024-01-01T00%3A00%3A00Z&se=2024-01-01T02%3A00%3A00Z"
+            f"&sp=r&sv=2021-08-06&sr=b&sig={random.getrandbits(128):032x}")
+
+
+def body_size(client, method, path, encoding, **kwargs):
+    headers = kwargs.pop('headers', {})
+    if encoding:
+        headers['Accept-Encoding'] = encoding
+    response = client.open(path, method=method, headers=headers, **kwargs)
+    data = response.get_data()
+    return len(data), response.headers.get('Content-Encoding', 'identity'), response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--polls', type=int, default=20, help='Polls of a finished job')
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.config import TestingConfig
+    from app.services.job_queue import get_job_queue
+    from app.utils.http_responses import supported_encodings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = TestingConfig()
+        config.JOB_QUEUE_PATH = os.path.join(tmp, 'jobs.db')
+        config.HEDGE_ENABLED = False
+        app = create_app(config)
+        client = app.test_client()
+
+        rng = random.Random(5)
+        doodle = make_doodle(rng)
+        batch = '\n'.join(json.dumps({'id': f'item-{i}', 'imageData': doodle, 'promptHint': 'cat'})
+                          for i in range(args.batch_size))
+
+        job_id = client.post('/api/jobs', json={'imageData': doodle}).get_json()['jobId']
+        queue = get_job_queue(app.config)
+        job = queue.lease('bench')
+        queue.ack(job.id, 'bench', {'imageUrl': fake_generate(None)})
+
+        requests = [
+            ('health', 'GET', '/api/health', {}),
+            ('job result', 'GET', f'/api/jobs/{job_id}', {}),
+            (f'batch x{args.batch_size}', 'POST', '/api/generate/batch',
+             {'data': batch, 'content_type': 'application/x-ndjson'}),
+        ]
+        encodings = [None] + supported_encodings()
+        print(f"{'response':<14}" + ''.join(f"{encoding or 'identity':>12}" for encoding in encodings) + f"{'saved':>8}")
+        with patch('app.api.routes.generate_art_from_doodle', fake_generate):
+            for name, method, path, kwargs in requests:
+                sizes = []
+                for encoding in encodings:
+                    size, applied, _ = body_size(client, method, path, encoding, **dict(kwargs))
+                    sizes.append(f"{size}{'' if applied == (encoding or 'identity') else '*'}")
+                best = min(int(s.rstrip('*')) for s in sizes)
+                identity = int(sizes[0].rstrip('*'))
+                print(f"{name:<14}" + ''.join(f"{s:>12}" for s in sizes) + f"{1 - best / identity:>8.0%}")
+
+        # Polling a finished job: full bodies every time versus revalidation
+        path = f'/api/jobs/{job_id}'
+        full = sum(body_size(client, 'GET', path, None)[0] for _ in range(args.polls))
+        _, _, first = body_size(client, 'GET', path, None)
+        etag = first.headers['ETag']
+        started = time.perf_counter()
+        revalidated = first.content_length + sum(
+            body_size(client, 'GET', path, None, headers={'If-None-Match': etag})[0] for _ in range(args.polls - 1))
+        elapsed = time.perf_counter() - started
+        print(f"\n{args.polls} polls of a finished job: {full} body bytes unconditional, "
+              f"{revalidated} with If-None-Match ({(elapsed / (args.polls - 1)) * 1e3:.2f} ms per 304)")
+        print("* = response left uncompressed (below COMPRESSION_MIN_BYTES)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Measure tail latency of upstream calls with and without hedging.
+
+The upstream is simulated: most calls take around the base latency, but a
+Pareto-distributed tail occasionally stalls a call for many times longer, the
+way a slow OpenAI replica does. Each mode replays the same seeded delay stream.
+
+Usage:
+    python benchmarks/bench_hedging.py --requests 500 --concurrency 8
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.services.hedging import LatencyTracker, hedged_call
+from app.utils.deadline import Deadline, DeadlineExceeded
+
+
+class HeavyTailedUpstream:
+    """Mock upstream whose delays are drawn from a shifted Pareto distribution."""
+
+    def __init__(self, base, alpha, cap, seed):
+        self.base = base
+        self.alpha = alpha
+        self.cap = cap
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def __call__(self, index):
+        with self._lock:
+            self.calls += 1
+            delay = min(self.cap, self.base * self._random.paretovariate(self.alpha))
+        time.sleep(delay)
+        return delay
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def run(mode, args):
+    upstream = HeavyTailedUpstream(args.base_ms / 1000.0, args.alpha, args.cap_ms / 1000.0, args.seed)
+    tracker = LatencyTracker(percentile=args.percentile, min_samples=20)
+    latencies = []
+    timeouts = 0
+    lock = threading.Lock()
+
+    def one_request(_):
+        nonlocal timeouts
+        deadline = Deadline(args.budget_ms / 1000.0)
+        started = time.monotonic()
+        try:
+            hedged_call(upstream, deadline, tracker=tracker, hedge=(mode == 'hedged'))
+        except DeadlineExceeded:
+            with lock:
+                timeouts += 1
+        with lock:
+            latencies.append(time.monotonic() - started)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one_request, range(args.requests)))
+
+    return {
+        'mode': mode,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'max': max(latencies) * 1000,
+        'timeouts': timeouts,
+        'extra_calls': upstream.calls - args.requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--base-ms', type=float, default=20.0, help='Minimum upstream latency')
+    parser.add_argument('--alpha', type=float, default=1.3, help='Pareto shape; lower means a heavier tail')
+    parser.add_argument('--cap-ms', type=float, default=2000.0, help='Longest simulated stall')
+    parser.add_argument('--budget-ms', type=float, default=1500.0, help='Per-request deadline')
+    parser.add_argument('--percentile', type=float, default=95.0, help='Hedge trigger percentile')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'timeouts':>10}{'extra':>8}")
+    for mode in ('primary', 'hedged'):
+        r = run(mode, args)
+        print(f"{r['mode']:<10}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['p99']:>10.1f}"
+              f"{r['max']:>10.1f}{r['timeouts']:>10}{r['extra_calls']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Worst-case memory and latency of image preprocessing on an adversarial corpus.
+
+Every sample is processed in a fresh child process, once with the previous
+pipeline (``Image.open`` + ``convert('RGBA')`` with no pre-decode checks) and
+once with ``validate_and_process_image`` and its header guard. Peak memory is
+the child's max RSS growth over its baseline. Children that exceed
+``--timeout`` are killed.
+
+Usage:
+    python benchmarks/bench_image_guard.py --timeout 60
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import struct
+import sys
+import time
+import zlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image
+
+from app.utils.image_utils import resize_and_pad_image, validate_and_process_image
+
+
+def legacy_process(image_bytes):
+    """The preprocessing path before the header guard, for comparison."""
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    if len(buffer.getvalue()) > 4 * 1024 * 1024:
+        raise ValueError("Image is too large (>4MB)")
+    output = io.BytesIO()
+    resize_and_pad_image(image).save(output, format='PNG')
+    return output
+
+
+def encode(image, fmt, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def png_bomb(width, height, color_type=0):
+    """A valid PNG of zero bytes: tiny compressed, width*height pixels decoded."""
+    channels = {0: 1, 6: 4}[color_type]
+    compressor = zlib.compressobj(9)
+    row = b'\x00' * (width * channels + 1)
+    data = b''.join(compressor.compress(row) for _ in range(height)) + compressor.flush()
+    return (b'\x89PNG\r\n\x1a\n'
+            + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+            + png_chunk(b'IDAT', data)
+            + png_chunk(b'IEND', b''))
+
+
+def jpeg_header_bomb(width, height):
+    """A JPEG whose frame header declares a huge image but carries no data."""
+    real = encode(Image.new('RGB', (8, 8)), 'JPEG')
+    sof = real.index(b'\xff\xc0')
+    return real[:sof + 5] + struct.pack('>HH', height, width) + real[sof + 9:]
+
+
+def build_corpus():
+    doodle = Image.new('RGBA', (800, 600), (255, 255, 255, 255))
+    frames = [Image.new('RGBA', (64, 64), (i % 256, 0, 0, 255)) for i in range(200)]
+    corpus = [
+        ('doodle 800x600 png', encode(doodle, 'PNG')),
+        ('png zeros 4096x4096', png_bomb(4096, 4096)),
+        ('png bomb 8192x8192', png_bomb(8192, 8192)),
+        ('png rgba bomb 6000x6000', png_bomb(6000, 6000, color_type=6)),
+        ('png bomb 30000x30000', png_bomb(30000, 30000)),
+        ('apng 200 frames', encode(frames[0], 'PNG', save_all=True, append_images=frames[1:])),
+        ('jpeg progressive 4096', encode(Image.new('RGB', (4096, 4096), (90, 120, 200)), 'JPEG', progressive=True)),
+        ('jpeg header 60000x60000', jpeg_header_bomb(60000, 60000)),
+        ('webp lossless 8192x8192', encode(Image.new('RGB', (8192, 8192)), 'WEBP', lossless=True)),
+        ('gif 1000x1000', encode(Image.new('P', (1000, 1000)), 'GIF')),
+    ]
+    return corpus
+
+
+def run_sample(process, data, results):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    try:
+        process(data)
+        outcome = 'ok'
+    except Exception as e:
+        outcome = f"{type(e).__name__}: {e}"[:60]
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    results.put((elapsed, peak / 1024, outcome))
+
+
+def measure(context, process, data, timeout):
+    results = context.Queue()
+    child = context.Process(target=run_sample, args=(process, data, results))
+    child.start()
+    child.join(timeout)
+    if child.is_alive():
+        child.kill()
+        child.join()
+        return timeout, None, 'killed (timeout)'
+    if child.exitcode != 0:
+        return None, None, f"died with exit code {child.exitcode}"
+    return results.get()
+
+
+def format_row(elapsed, peak, outcome):
+    elapsed = f"{elapsed * 1000:.0f}" if elapsed is not None else '-'
+    peak = f"{peak:.0f}" if peak is not None else '-'
+    return f"{elapsed:>9}{peak:>8}  {outcome:<34}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timeout', type=float, default=60.0, help='Seconds before a child is killed')
+    args = parser.parse_args()
+
+    # fork: children inherit the imported modules, so RSS growth is the sample's alone
+    context = multiprocessing.get_context('fork')
+    Image.preinit()
+    validate_and_process_image(encode(Image.new('RGBA', (8, 8)), 'PNG'))
+
+    print(f"{'sample':<26}{'KB':>7}  {'legacy ms':>9}{'MB':>8}  {'outcome':<34}{'guarded ms':>10}{'MB':>8}  outcome")
+    for name, data in build_corpus():
+        legacy = measure(context, legacy_process, data, args.timeout)
+        guarded = measure(context, validate_and_process_image, data, args.timeout)
+        print(f"{name:<26}{len(data) / 1024:>7.0f}  {format_row(*legacy)}{format_row(*guarded)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Throughput and crash recovery of the SQLite job queue.
+
+Measures enqueue rate from N producer processes, lease+ack rate from N
+consumer processes (with a no-op handler, so the number is queue overhead
+only), and how long a job leased by a SIGKILLed worker takes to be completed
+by a survivor. Recovery time is bounded by the visibility timeout.
+
+Usage:
+    python benchmarks/bench_job_queue.py --jobs 5000 --processes 4 --visibility 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.services.job_queue import SQLiteJobQueue, DONE
+from app.worker import run_worker
+
+PAYLOAD = {'imageData': 'x' * 2048, 'promptHint': 'cat'}
+
+
+def produce(path, count):
+    queue = SQLiteJobQueue(path)
+    for _ in range(count):
+        queue.enqueue(PAYLOAD)
+
+
+def consume(path, visibility):
+    queue = SQLiteJobQueue(path, visibility_timeout=visibility)
+    while True:
+        job = queue.lease(f"bench:{os.getpid()}")
+        if job is None:
+            return
+        queue.ack(job.id, job.lease_owner, {'imageUrl': 'https://example.com/a.png'})
+
+
+def hang(payload, deadline):
+    time.sleep(3600)
+
+
+def run_processes(context, target, args, processes):
+    started = time.perf_counter()
+    workers = [context.Process(target=target, args=args) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    return time.perf_counter() - started
+
+
+def measure_recovery(context, path, visibility):
+    queue = SQLiteJobQueue(path, visibility_timeout=visibility)
+    job_id = queue.enqueue(PAYLOAD)
+    victim = context.Process(target=run_worker, args=(queue, hang), kwargs={'poll_interval': 0.01})
+    victim.start()
+    while queue.get(job_id)['status'] != 'leased':
+        time.sleep(0.005)
+    os.kill(victim.pid, signal.SIGKILL)
+    victim.join()
+
+    killed = time.perf_counter()
+    survivor = context.Process(target=run_worker, args=(queue, lambda payload, deadline: {}),
+                               kwargs={'poll_interval': 0.01, 'max_jobs': 1})
+    survivor.start()
+    survivor.join()
+    assert queue.get(job_id)['status'] == DONE
+    return time.perf_counter() - killed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--visibility', type=float, default=2.0, help='Visibility timeout in seconds')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('fork')
+    per_process = args.jobs // args.processes
+    total = per_process * args.processes
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'jobs.db')
+        SQLiteJobQueue(path).close()
+
+        elapsed = run_processes(context, produce, (path, per_process), args.processes)
+        print(f"enqueue      {total} jobs, {args.processes} processes: {total / elapsed:>9.0f} jobs/s")
+
+        elapsed = run_processes(context, consume, (path, args.visibility), args.processes)
+        stats = SQLiteJobQueue(path).stats()
+        assert stats[DONE] == total, stats
+        print(f"lease+ack    {total} jobs, {args.processes} processes: {total / elapsed:>9.0f} jobs/s")
+
+        recovery = measure_recovery(context, os.path.join(tmp, 'recovery.db'), args.visibility)
+        print(f"recovery     killed worker's job completed after {recovery:.2f} s "
+              f"(visibility timeout {args.visibility:.2f} s)")
+
+
+if __name__ == '__main__':
+    main()
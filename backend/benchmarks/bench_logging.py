@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Measure the per-request cost of logging on the generate path under concurrency.
+
+Each simulated request makes the same log calls as /api/generate. Three setups
+are compared, all writing to a real file:
+
+- basicconfig: the previous setup, a synchronous StreamHandler behind
+  basicConfig with eagerly built f-string messages (including the full prompt
+  and image URL)
+- queue: the structured JSON setup with every request logged
+- queue-sampled: the structured JSON setup keeping a sample of success logs
+
+Only time spent inside logging calls on the request threads is counted; the
+background writer's work is excluded because it is off the request path.
+
+Usage:
+    python benchmarks/bench_logging.py --requests 20000 --threads 8
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils.structured_logging import begin_request, configure_logging, shutdown_logging
+
+PROMPT = ("Children's coloring book style, vibrant colors, simple and fun, based on the provided "
+          "sketch of a cat. Ensure output is safe for children, not scary, not violent, not NSFW.")
+URL = "https://oaidalleapiprodscus.blob.core.windows.net/private/org-abc/user-def/img-0123456789.png?st=x&se=y&sig=z"
+
+logger = logging.getLogger('bench.generate')
+
+
+def eager_request(keys):
+    """Log calls as they were written before structured logging."""
+    logger.info(f"Received request to /api/generate with payload keys: {list(keys)}")
+    logger.info("Decoding and processing image")
+    logger.info("Calling OpenAI to generate art")
+    logger.info(f"Sending request to OpenAI with prompt: {PROMPT}")
+    logger.info(f"Successfully generated image: {URL}")
+    logger.info("Successfully generated art")
+
+
+def lazy_request(keys, sample_rate):
+    """Log calls as they are written now."""
+    begin_request(sample_rate=sample_rate)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Received request to /api/generate with payload keys: %s", sorted(keys))
+    logger.info("Decoding and processing image")
+    logger.info("Calling OpenAI to generate art")
+    logger.info("Sending request to OpenAI (prompt hint: %s)", 'cat')
+    logger.debug("OpenAI prompt: %s", PROMPT)
+    logger.info("Successfully generated image")
+    logger.debug("Generated image URL: %s", URL)
+    logger.info("Successfully generated art")
+    logger.info("Request completed", extra={'method': 'POST', 'path': '/api/generate',
+                                            'status': 200, 'duration_ms': 812.4})
+
+
+def reset_root():
+    shutdown_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+def run(setup, args, path):
+    reset_root()
+    sink = open(path, 'w')
+    if setup == 'basicconfig':
+        logging.basicConfig(level=logging.INFO, stream=sink,
+                            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        handle = lambda: eager_request(('imageData', 'promptHint'))
+    else:
+        rate = args.sample_rate if setup == 'queue-sampled' else 1.0
+        configure_logging(level='INFO', fmt='json', sample_rate=rate, stream=sink)
+        handle = lambda: lazy_request(('imageData', 'promptHint'), rate)
+
+    spent = []
+    lock = threading.Lock()
+
+    def worker(count):
+        total = 0.0
+        for _ in range(count):
+            started = time.perf_counter()
+            handle()
+            total += time.perf_counter() - started
+        with lock:
+            spent.append(total)
+
+    per_thread = args.requests // args.threads
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(worker, [per_thread] * args.threads))
+    wall = time.perf_counter() - wall_started
+
+    reset_root()
+    sink.close()
+    requests = per_thread * args.threads
+    return sum(spent) / requests * 1e6, requests / wall, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--sample-rate', type=float, default=0.1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.log')
+        print(f"{'setup':<16}{'us/request':>12}{'requests/s':>14}{'log bytes':>14}")
+        for setup in ('basicconfig', 'queue', 'queue-sampled'):
+            per_request_us, throughput, size = run(setup, args, path)
+            print(f"{setup:<16}{per_request_us:>12.1f}{throughput:>14.0f}{size:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Per-stage cost of post-processing generated images.
+
+Generated images are served by a local HTTP server. With the requests package
+installed they are fetched through the pooled session; otherwise the fetch
+stage reads them from memory and is reported as such. Each configuration
+processes ``--images`` distinct images and reports p50/p95 per stage, plus
+throughput. "cold overlay" clears the overlay cache before every image, which
+is what compositing in the request thread without a cache costs.
+
+Usage:
+    python benchmarks/bench_postprocess.py --images 40 --workers 1,2,4
+"""
+
+import argparse
+import http.server
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image, ImageDraw
+
+from app.services.postprocess import PostProcessor, VariantStore, fetch_image, load_overlay, parse_variants
+
+
+def make_generated(rng):
+    """A 1024x1024 PNG with enough detail to resemble a generated image."""
+    image = Image.new('RGB', (1024, 1024), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randrange(1024), rng.randrange(1024)
+        draw.ellipse((x, y, x + rng.randrange(20, 200), y + rng.randrange(20, 200)),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def serve(images):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            body = images[int(self.path.strip('/'))]
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(processor, urls, cold_overlay):
+    started = time.perf_counter()
+    if cold_overlay:
+        results = []
+        for url in urls:
+            load_overlay.cache_clear()
+            results.append(processor.process(url))
+    else:
+        results = [future.result() for future in [processor.submit(url) for url in urls]]
+    elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--variants', default='display:1024:webp:80,thumb:256:jpeg:85')
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    images = [make_generated(rng) for _ in range(args.images)]
+    try:
+        import requests  # noqa: F401
+        server = serve(images)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        fetch = fetch_image
+        source = 'local HTTP, pooled session'
+    except ImportError:
+        base = 'memory://'
+        fetch = lambda url, timeout: images[int(url.rsplit('/', 1)[1])]
+        source = 'in memory (requests not installed)'
+    urls = [f"{base}/{i}" for i in range(args.images)]
+
+    variants = parse_variants(args.variants)
+    stages = ['fetch', 'decode'] + [v.name for v in variants] + ['total']
+    print(f"fetch: {source}; variants: {args.variants}")
+    print(f"{'configuration':<22}{'images/s':>9}" + ''.join(f"{s + ' p50/p95':>20}" for s in stages))
+
+    configurations = [('cold overlay, 1 thread', 1, True)]
+    configurations += [(f"cached, {n} workers", n, False) for n in (int(w) for w in args.workers.split(','))]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, workers, cold in configurations:
+            processor = PostProcessor(VariantStore(tmp), variants, fetch=fetch, workers=workers)
+            processor.process(urls[0])  # warm up codecs and the overlay cache
+            results, elapsed = run(processor, urls, cold)
+            processor.shutdown()
+            columns = []
+            for stage in stages:
+                values = sorted(result.timings[stage] for result in results)
+                columns.append(f"{statistics.median(values):>9.1f}/{values[int(len(values) * 0.95)]:<9.1f}")
+            print(f"{name:<22}{len(urls) / elapsed:>9.1f}" + ''.join(f"{c:>20}" for c in columns))
+
+
+if __name__ == '__main__':
+    main()
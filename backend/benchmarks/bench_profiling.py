@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Overhead of the profiling hooks, idle and with a session armed.
+
+Two measurements through Flask's test client:
+
+- hooks: /api/health (a cached snapshot, so almost nothing but the hooks
+  themselves) with profiling disabled and enabled but idle, in us/request
+- generate: /api/generate with a mock upstream, p50/p95 per request with
+  profiling disabled, idle, and armed in each mode for every request
+
+Usage:
+    python benchmarks/bench_profiling.py --requests 100 --health-requests 5000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_batch import make_doodle
+
+ADMIN = {'Authorization': 'Bearer bench'}
+
+
+def make_client(tmp, enabled, max_requests):
+    from app import create_app
+    from app.config import TestingConfig
+
+    config = TestingConfig()
+    config.PROFILING_ENABLED = enabled
+    config.ADMIN_TOKEN = 'bench'
+    config.PROFILE_PATH = tmp
+    config.PROFILE_MAX_REQUESTS = max_requests
+    config.HEDGE_ENABLED = False
+    return create_app(config).test_client()
+
+
+def bench_hooks(tmp, requests, enabled):
+    client = make_client(tmp, enabled, requests)
+    client.get('/api/health')
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get('/api/health')
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def bench_generate(tmp, requests, enabled, mode=None):
+    client = make_client(tmp, enabled, requests)
+    payload = {'imageData': make_doodle(random.Random(5)), 'promptHint': 'cat'}
+    durations = []
+    cpu_started = time.process_time()
+    with patch('app.api.routes.generate_art_from_doodle', return_value='https://example.com/generated.png'):
+        client.post('/api/generate', json=payload)
+        if mode:
+            response = client.post('/api/admin/profile', json={'mode': mode, 'requests': requests}, headers=ADMIN)
+            assert response.status_code == 202, response.get_json()
+        for _ in range(requests):
+            started = time.perf_counter()
+            client.post('/api/generate', json=payload)
+            durations.append((time.perf_counter() - started) * 1000)
+    cpu_ms = (time.process_time() - cpu_started) * 1000 / requests
+    durations.sort()
+    return statistics.median(durations), durations[int(len(durations) * 0.95)], cpu_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--health-requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"/api/health ({args.health_requests} requests)")
+        for enabled in (False, True, False, True):
+            cost = bench_hooks(tmp, args.health_requests, enabled)
+            print(f"  profiling {'idle    ' if enabled else 'disabled'}: {cost:7.1f} us/request")
+
+        print(f"/api/generate ({args.requests} requests, mock upstream)")
+        bench_generate(tmp, 10, False)  # warm up codecs
+        configurations = [('disabled', False, None), ('idle', True, None), ('cprofile', True, 'cprofile'),
+                          ('sample', True, 'sample'), ('memory', True, 'memory')]
+        for name, enabled, mode in configurations:
+            p50, p95, cpu_ms = bench_generate(tmp, args.requests, enabled, mode)
+            print(f"  {name:<9} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  cpu {cpu_ms:7.2f} ms/request")
+
+
+if __name__ == '__main__':
+    main()
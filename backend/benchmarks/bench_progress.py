@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Connection capacity of the progress WebSocket server.
+
+Starts ``python -m app.progress_server`` in a subprocess on a temporary job
+queue, then for each connection count:
+
+- opens that many subscriptions (``--per-job`` clients per queued job) and
+  reports handshakes/s and the server's RSS per connection
+- leaves them idle for ``--idle-seconds`` and reports the server's CPU use
+- records one event for every job and reports how long delivery to all
+  clients took (p50/p99 from the event's timestamp) and the server's CPU
+  time for the fan-out
+
+Clients run in this process on one event loop, so on small machines the
+client side limits handshake and delivery rates as much as the server does.
+
+Usage:
+    python benchmarks/bench_progress.py --connections 1000,5000,10000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.job_queue import PREPROCESSED, SQLiteJobQueue
+from app.utils import websocket
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_stats(pid):
+    """Return (RSS in KB, CPU seconds) of a process."""
+    with open(f'/proc/{pid}/status') as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return rss, (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def raise_file_limit():
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def next_message(reader):
+    while True:
+        opcode, payload = await websocket.read_frame(reader, max_payload=65536, require_mask=False)
+        if opcode == websocket.OP_TEXT:
+            return json.loads(payload)
+        if opcode == websocket.OP_PING:
+            continue
+        raise ConnectionError(f"Unexpected opcode {opcode}")
+
+
+async def open_subscriptions(port, job_ids, per_job, concurrency=200):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def subscribe(job_id):
+        async with semaphore:
+            reader, writer = await websocket.connect('127.0.0.1', port, f'/jobs/{job_id}')
+            await next_message(reader)  # the queued event
+            return reader, writer
+
+    return await asyncio.gather(*(subscribe(job_id) for job_id in job_ids for _ in range(per_job)))
+
+
+async def bench(port, pid, queue, connections, per_job, idle_seconds):
+    job_ids = [queue.enqueue({}) for _ in range(max(1, connections // per_job))]
+    rss_before, _ = process_stats(pid)
+    started = time.perf_counter()
+    clients = await open_subscriptions(port, job_ids, per_job)
+    handshake_seconds = time.perf_counter() - started
+    await asyncio.sleep(0.5)
+    rss_after, cpu_idle_start = process_stats(pid)
+
+    await asyncio.sleep(idle_seconds)
+    _, cpu_idle_end = process_stats(pid)
+
+    received = []
+
+    async def wait_for_event(reader):
+        event = await next_message(reader)
+        received.append(time.time() - event['at'])
+
+    waiters = asyncio.gather(*(wait_for_event(reader) for reader, _ in clients))
+    _, cpu_fanout_start = process_stats(pid)
+    for job_id in job_ids:
+        queue.add_event(job_id, PREPROCESSED)
+    await asyncio.wait_for(waiters, 120)
+    _, cpu_fanout_end = process_stats(pid)
+
+    for _, writer in clients:
+        writer.write(websocket.close_frame(mask=True))
+        writer.close()
+    await asyncio.sleep(1)
+
+    received.sort()
+    return {
+        'connections': len(clients),
+        'handshakes_per_s': len(clients) / handshake_seconds,
+        'kb_per_connection': (rss_after - rss_before) / len(clients),
+        'rss_mb': rss_after / 1024,
+        'idle_cpu_pct': (cpu_idle_end - cpu_idle_start) / idle_seconds * 100,
+        'fanout_p50_ms': received[len(received) // 2] * 1000,
+        'fanout_p99_ms': received[int(len(received) * 0.99)] * 1000,
+        'fanout_cpu_ms': (cpu_fanout_end - cpu_fanout_start) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', default='1000,5000')
+    parser.add_argument('--per-job', type=int, default=1, help='Clients subscribed to each job')
+    parser.add_argument('--idle-seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    limit = raise_file_limit()
+    counts = [int(c) for c in args.connections.split(',')]
+    # Each connection takes a descriptor in this process and one in the server
+    if max(counts) + 100 > limit:
+        sys.exit(f"Open file limit is {limit}; lower --connections")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(os.environ, JOB_QUEUE_PATH=os.path.join(tmp, 'jobs.db'), LOG_LEVEL='WARNING',
+                   PROGRESS_MAX_CONNECTIONS=str(max(counts) * 2))
+        server = subprocess.Popen([sys.executable, '-m', 'app.progress_server', '--host', '127.0.0.1',
+                                   '--port', str(port)], cwd=os.path.dirname(os.path.dirname(__file__)) or '.',
+                                  env=env)
+        try:
+            for _ in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            queue = SQLiteJobQueue(env['JOB_QUEUE_PATH'])
+            print(f"{'connections':>11}{'handshakes/s':>14}{'KB/conn':>9}{'RSS MB':>8}{'idle CPU':>10}"
+                  f"{'fan-out p50/p99 ms':>21}{'fan-out CPU ms':>16}")
+            for count in counts:
+                r = asyncio.run(bench(port, server.pid, queue, count, args.per_job, args.idle_seconds))
+                print(f"{r['connections']:>11}{r['handshakes_per_s']:>14.0f}{r['kb_per_connection']:>9.1f}"
+                      f"{r['rss_mb']:>8.1f}{r['idle_cpu_pct']:>9.2f}%"
+                      f"{r['fanout_p50_ms']:>11.0f}/{r['fanout_p99_ms']:<9.0f}{r['fanout_cpu_ms']:>16.0f}")
+        finally:
+            server.terminate()
+            server.wait(10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Speed and quality of the resampling policies in ``resize_and_pad_image``.
+
+Each case of the corpus is a set of doodles (strokes on a white canvas) or
+photo-like images at one source size, chosen to hit each path: the 800x600
+canvas (upscaled), a 2x high-DPI canvas (an exact integer shrink), a fractional
+shrink, an already square 1024 image (passthrough) and JPEG photos. For every
+policy the table shows ms per image (median over the corpus) and SSIM against
+the LANCZOS baseline ('quality'), computed on luminance over white on 8x8
+blocks. "before" is the previous implementation: convert to RGBA, LANCZOS,
+then paste onto a new canvas.
+
+Usage:
+    python benchmarks/bench_resample.py --images 20
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from array import array
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image, ImageDraw, ImageFilter, ImageMath
+
+from app.utils.image_utils import RESAMPLING_POLICIES, resize_and_pad_image
+
+TARGET = (1024, 1024)
+
+# (case, source size, kind)
+CASES = [
+    ('canvas 800x600', (800, 600), 'doodle'),
+    ('hi-dpi 2048x1536', (2048, 1536), 'doodle'),
+    ('retina 1600x1200', (1600, 1200), 'doodle'),
+    ('square 1024x1024', (1024, 1024), 'doodle'),
+    ('photo 3000x2000 JPEG', (3000, 2000), 'photo'),
+    ('photo 4000x3000 JPEG', (4000, 3000), 'photo'),
+]
+
+
+def make_doodle(rng, size):
+    """Strokes on a white canvas, scaled with the canvas size."""
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    width = max(2, size[0] // 160)
+    for _ in range(rng.randrange(5, 30)):
+        points = [(rng.randrange(size[0]), rng.randrange(size[1])) for _ in range(6)]
+        draw.line(points, fill=(rng.randrange(200), rng.randrange(200), rng.randrange(200)), width=width,
+                  joint='curve')
+    return image
+
+
+def make_photo(rng, size):
+    """Smooth colour fields with fine grain, decoded from a JPEG like an uploaded photo."""
+    small = Image.new('RGB', (8, 6))
+    small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(48)])
+    image = small.resize(size, Image.Resampling.BICUBIC)
+    grain = Image.effect_noise(size, 24).convert('RGB')
+    image = Image.blend(image, grain, 0.15).filter(ImageFilter.DETAIL)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return Image.open(io.BytesIO(buffer.getvalue())).convert('RGB')
+
+
+def previous_resize_and_pad(image, target_size=TARGET):
+    """resize_and_pad_image before the resampling policies."""
+    image = image.convert('RGBA')
+    scale = min(target_size[0] / image.width, target_size[1] / image.height)
+    size = (int(image.width * scale), int(image.height * scale))
+    if size != image.size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    canvas = Image.new('RGBA', target_size, (255, 255, 255, 0))
+    canvas.paste(image, ((target_size[0] - size[0]) // 2, (target_size[1] - size[1]) // 2))
+    return canvas
+
+
+def luminance(image):
+    """Luminance of an RGBA image composited over white, as floats."""
+    background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+    return Image.alpha_composite(background, image).convert('L').convert('F')
+
+
+def ssim(a, b, block=8):
+    """Mean SSIM of two same-size RGBA images over non-overlapping blocks."""
+    x, y = luminance(a), luminance(b)
+    products = [ImageMath.lambda_eval(lambda args: args['p'] * args['q'], p=p, q=q) for p, q in ((x, x), (y, y), (x, y))]
+    mx, my, mxx, myy, mxy = (array('f', im.reduce(block).tobytes()) for im in [x, y] + products)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    total = 0.0
+    for ux, uy, uxx, uyy, uxy in zip(mx, my, mxx, myy, mxy):
+        vx, vy, cov = uxx - ux * ux, uyy - uy * uy, uxy - ux * uy
+        total += (2 * ux * uy + c1) * (2 * cov + c2) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    return total / len(mx)
+
+
+def time_ms(fn, image, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(image)
+        runs.append((time.perf_counter() - started) * 1000)
+    return min(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=10, help='Images per case')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per image (the fastest counts)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    resizers = [('before', previous_resize_and_pad)] + [
+        (name, lambda image, name=name: resize_and_pad_image(image, TARGET, resampling=name))
+        for name in RESAMPLING_POLICIES
+    ]
+
+    print(f"{'case':<22}" + ''.join(f"{name + ' ms':>13}" for name, _ in resizers)
+          + ''.join(f"{name + ' SSIM':>15}" for name in RESAMPLING_POLICIES if name != 'quality'))
+    for case, size, kind in CASES:
+        make = make_doodle if kind == 'doodle' else make_photo
+        corpus = [make(rng, size) for _ in range(args.images)]
+        times = {name: [] for name, _ in resizers}
+        scores = {name: [] for name in RESAMPLING_POLICIES if name != 'quality'}
+        for image in corpus:
+            for name, resize in resizers:
+                times[name].append(time_ms(resize, image, args.repeat))
+            baseline = resize_and_pad_image(image, TARGET, resampling='quality')
+            for name in scores:
+                scores[name].append(ssim(resize_and_pad_image(image, TARGET, resampling=name), baseline))
+        print(f"{case:<22}" + ''.join(f"{statistics.median(times[name]):>13.2f}" for name, _ in resizers)
+              + ''.join(f"{min(scores[name]):>15.4f}" for name in scores))
+    print("SSIM is the worst image of each case; 1.0 is identical to the LANCZOS baseline.")
+
+
+if __name__ == '__main__':
+    main()
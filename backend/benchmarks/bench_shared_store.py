@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Compare lookup latency of the mmap shared store with a local Redis stand-in.
+
+The stand-in is a minimal RESP server (GET/SET/INCR) running in a separate
+process on loopback, which is the round trip a node-local Redis would cost
+without any of Redis's own work. If ``--redis-url`` is given and the redis
+package is installed, a real Redis is measured as well.
+
+Latencies are per operation, measured from N worker processes at once to
+include lock and socket contention.
+
+Usage:
+    python benchmarks/bench_shared_store.py --ops 20000 --processes 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.services.shared_store import SharedStore
+
+VALUE = b"https://oaidalleapiprodscus.blob.core.windows.net/private/img-0123456789.png?sig=abcdef" * 3
+
+
+def serve_resp(port_queue):
+    """Run a tiny single-threaded RESP server until killed."""
+    data = {}
+
+    async def handle(reader, writer):
+        while True:
+            header = await reader.readline()
+            if not header:
+                break
+            args = []
+            for _ in range(int(header[1:])):
+                length = int((await reader.readline())[1:])
+                args.append((await reader.readexactly(length + 2))[:-2])
+            command = args[0].upper()
+            if command == b'GET':
+                value = data.get(args[1])
+                writer.write(b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value))
+            elif command == b'SET':
+                data[args[1]] = args[2]
+                writer.write(b'+OK\r\n')
+            elif command == b'INCR':
+                value = int(data.get(args[1], b'0')) + 1
+                data[args[1]] = str(value).encode()
+                writer.write(b':%d\r\n' % value)
+            await writer.drain()
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port_queue.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+
+class RespClient:
+    """Minimal blocking RESP client for the stand-in."""
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile('rb')
+
+    def _call(self, *args):
+        out = b'*%d\r\n' % len(args)
+        for arg in args:
+            out += b'$%d\r\n%s\r\n' % (len(arg), arg)
+        self.sock.sendall(out)
+        line = self.file.readline()
+        if line[:1] == b'$':
+            length = int(line[1:])
+            return None if length < 0 else self.file.read(length + 2)[:-2]
+        if line[:1] == b':':
+            return int(line[1:])
+        return line
+
+    def get(self, key):
+        return self._call(b'GET', key.encode())
+
+    def set(self, key, value, ttl=None):
+        return self._call(b'SET', key.encode(), value)
+
+    def incr(self, key):
+        return self._call(b'INCR', key.encode())
+
+
+class RedisClient:
+    """Adapter giving redis-py the same interface."""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        return self.client.set(key, value)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+def make_client(kind, target):
+    if kind == 'mmap':
+        return SharedStore(target)
+    if kind == 'resp':
+        return RespClient(target)
+    return RedisClient(target)
+
+
+def worker(kind, target, ops, keys, results):
+    client = make_client(kind, target)
+    timings = {'get': [], 'set': [], 'incr': []}
+    for i in range(ops):
+        key = f"gen:{i % keys}"
+        started = time.perf_counter()
+        client.get(key)
+        timings['get'].append(time.perf_counter() - started)
+        if i % 10 == 0:
+            started = time.perf_counter()
+            client.set(key, VALUE)
+            timings['set'].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        client.incr('metrics:requests')
+        timings['incr'].append(time.perf_counter() - started)
+    results.put(timings)
+
+
+def run(kind, target, args):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(kind, target, args.ops, args.keys, results))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    merged = {'get': [], 'set': [], 'incr': []}
+    for _ in processes:
+        for op, values in results.get().items():
+            merged[op].extend(values)
+    for process in processes:
+        process.join()
+    return merged
+
+
+def report(name, merged):
+    for op in ('get', 'set', 'incr'):
+        values = sorted(merged[op])
+        p50 = statistics.median(values) * 1e6
+        p99 = values[int(len(values) * 0.99)] * 1e6
+        print(f"{name:<14}{op:<6}{p50:>10.1f}{p99:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=int, default=20000, help='Lookups per process')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--keys', type=int, default=2000)
+    parser.add_argument('--redis-url', help='Also benchmark a real Redis, e.g. redis://localhost:6379/0')
+    args = parser.parse_args()
+
+    print(f"{'backend':<14}{'op':<6}{'p50 us':>10}{'p99 us':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.store')
+        SharedStore(path).close()
+        report('mmap store', run('mmap', path, args))
+
+    context = multiprocessing.get_context('fork')
+    port_queue = context.Queue()
+    server = context.Process(target=serve_resp, args=(port_queue,), daemon=True)
+    server.start()
+    try:
+        report('resp stand-in', run('resp', port_queue.get(timeout=10), args))
+    finally:
+        server.terminate()
+
+    if args.redis_url:
+        report('redis', run('redis', args.redis_url, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Measure import time and memory of the WSGI app.
+
+Each scenario runs in a fresh interpreter:
+
+- lazy: ``import wsgi`` as deployed (what a Lambda cold start pays)
+- eager: ``import wsgi`` plus the openai SDK, as the app used to import it
+- warm: ``import wsgi`` followed by ``warm_up()``
+
+With ``--workers N`` it also measures gunicorn-style preloading: the master
+imports and warms the app, forks N workers that each process one image, and
+the workers report how much of their memory is still shared with the master
+(Linux only, from /proc/self/smaps_rollup).
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5 --workers 4
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'lazy': "import wsgi",
+    'eager': "import wsgi, openai",
+    'warm': "import wsgi; from app import warm_up; warm_up()",
+}
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+rss_kb = 0
+with open('/proc/self/status') as status:
+    for line in status:
+        if line.startswith('VmRSS:'):
+            rss_kb = int(line.split()[1])
+print(json.dumps({{'seconds': elapsed, 'rss_kb': rss_kb}}))
+"""
+
+PRELOAD = """
+import io, json, os, sys
+import wsgi
+from app import warm_up
+from app.utils.image_utils import validate_and_process_image
+from PIL import Image
+{warm}
+
+def smaps():
+    values = {{}}
+    with open('/proc/self/smaps_rollup') as rollup:
+        for line in rollup:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1])
+    return values
+
+sample = io.BytesIO()
+Image.new('RGBA', (640, 480), (255, 0, 0, 255)).save(sample, format='PNG')
+payload = sample.getvalue()
+
+read_fd, write_fd = os.pipe()
+children = []
+for _ in range({workers}):
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        import openai
+        validate_and_process_image(payload)
+        os.write(write_fd, (json.dumps(smaps()) + '\\n').encode())
+        os._exit(0)
+    children.append(pid)
+os.close(write_fd)
+for pid in children:
+    os.waitpid(pid, 0)
+with os.fdopen(read_fd) as results:
+    print(json.dumps([json.loads(line) for line in results]))
+"""
+
+
+def run_python(code):
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    result = subprocess.run([sys.executable, '-c', code], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=0, help='Also measure pre-fork sharing with N workers')
+    args = parser.parse_args()
+
+    print(f"{'scenario':<10}{'import ms (median)':>20}{'RSS MB (median)':>18}")
+    for name, statement in SCENARIOS.items():
+        samples = [run_python(PROBE.format(statement=statement)) for _ in range(args.runs)]
+        seconds = statistics.median(s['seconds'] for s in samples)
+        rss = statistics.median(s['rss_kb'] for s in samples)
+        print(f"{name:<10}{seconds * 1000:>20.1f}{rss / 1024:>18.1f}")
+
+    if args.workers and os.path.exists('/proc/self/smaps_rollup'):
+        print()
+        print(f"{'master':<16}{'private MB/worker':>20}{'shared MB/worker':>18}")
+        for label, warm in (('no preload', ''), ('warm + freeze', 'warm_up(freeze=True)')):
+            workers = run_python(PRELOAD.format(warm=warm, workers=args.workers))
+            private = statistics.mean(w['Private_Clean'] + w['Private_Dirty'] for w in workers)
+            shared = statistics.mean(w['Shared_Clean'] + w['Shared_Dirty'] for w in workers)
+            print(f"{label:<16}{private / 1024:>20.1f}{shared / 1024:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Overhead of usage accounting on the request path.
+
+Three measurements:
+
+- hot path: ``allow`` + ``record`` per request, from 1..N threads, with
+  ``--tenants`` distinct tenants (the flush thread runs meanwhile)
+- flush: time to upsert one interval's aggregates and reload the day's totals
+- end to end: /api/generate through Flask's test client with a mock upstream,
+  with accounting disabled and enabled, as p50/p95 per request
+
+Usage:
+    python benchmarks/bench_usage.py --requests 2000 --tenants 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_batch import make_doodle
+
+from app.services.usage import UsageAccountant, UsageRecord
+
+
+def fake_generate(image_bytes, prompt_hint=None, deadline=None, hedge=True, usage=None):
+    if usage is not None:
+        usage.upstream_call()
+        usage.upstream_done(0.0)
+    return "https://example.com/generated.png"
+
+
+def hot_path(accountant, tenants, count):
+    for i in range(count):
+        usage = UsageRecord(tenants[i % len(tenants)])
+        if accountant.allow(usage.tenant):
+            usage.upstream_call()
+            usage.bytes_in = 20000
+            accountant.record(usage, 0.1)
+
+
+def bench_hot_path(tmp, tenants, requests, threads):
+    accountant = UsageAccountant(os.path.join(tmp, f'hot-{threads}.db'), daily_budget=1e9, flush_interval=0.5)
+    workers = [threading.Thread(target=hot_path, args=(accountant, tenants, requests // threads))
+               for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    accountant.close()
+    return elapsed / (requests // threads * threads) * 1e6
+
+
+def bench_flush(tmp, tenants, rounds=20):
+    accountant = UsageAccountant(os.path.join(tmp, 'flush.db'), flush_interval=3600)
+    durations = []
+    for _ in range(rounds):
+        hot_path(accountant, tenants, len(tenants) * 5)
+        started = time.perf_counter()
+        accountant.flush()
+        durations.append((time.perf_counter() - started) * 1000)
+    accountant.close()
+    return statistics.median(durations)
+
+
+def bench_requests(tmp, requests, enabled):
+    from app import create_app
+    from app.config import TestingConfig
+
+    config = TestingConfig()
+    config.USAGE_ENABLED = enabled
+    config.USAGE_DB_PATH = os.path.join(tmp, f'app-{enabled}.db')
+    config.HEDGE_ENABLED = False
+    client = create_app(config).test_client()
+    payload = {'imageData': make_doodle(__import__('random').Random(5)), 'promptHint': 'cat'}
+    durations = []
+    with patch('app.api.routes.generate_art_from_doodle', fake_generate):
+        for i in range(requests):
+            headers = {'Origin': f'https://school-{i % 50}.example'}
+            started = time.perf_counter()
+            client.post('/api/generate', json=payload, headers=headers)
+            durations.append((time.perf_counter() - started) * 1000)
+    durations.sort()
+    return statistics.median(durations), durations[int(len(durations) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--tenants', type=int, default=200)
+    parser.add_argument('--threads', default='1,4,16')
+    parser.add_argument('--http-requests', type=int, default=300)
+    args = parser.parse_args()
+
+    tenants = [f'origin:school-{i}.example' for i in range(args.tenants)]
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"hot path (allow + record), {args.tenants} tenants")
+        for threads in (int(t) for t in args.threads.split(',')):
+            print(f"  {threads:>3} threads: {bench_hot_path(tmp, tenants, args.requests, threads):6.2f} us/request")
+        print(f"flush of {args.tenants} tenants: {bench_flush(tmp, tenants):.2f} ms")
+
+        print(f"/api/generate end to end ({args.http_requests} requests, mock upstream)")
+        bench_requests(tmp, 20, False)  # warm up codecs
+        for enabled in (False, True):
+            p50, p95 = bench_requests(tmp, args.http_requests, enabled)
+            print(f"  accounting {'on ' if enabled else 'off'}: p50 {p50:.2f} ms  p95 {p95:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Replay a captured /api/generate corpus and compare runs between commits.
+
+Capture a corpus in production with CAPTURE_ENABLED=true (see
+app/services/capture.py), or seed a synthetic one through the real capture
+path. Then run the replay on each commit and compare:
+
+    python benchmarks/replay.py seed --corpus /tmp/corpus --doodles 50
+    git checkout main && python benchmarks/replay.py run --corpus /tmp/corpus -o main.json
+    git checkout my-branch && python benchmarks/replay.py run --corpus /tmp/corpus -o branch.json
+    python benchmarks/replay.py compare main.json branch.json
+
+``compare`` prints the median and p99 of each stage with bootstrap
+confidence intervals and exits with status 1 if any stage regressed, so it
+can gate CI. Runs are only comparable on the same machine.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.capture import load_corpus
+from app.services.replay import compare_runs, run_replay
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def seed(args):
+    """Send synthetic doodles through /api/generate with capture on and a stub upstream."""
+    from bench_batch import make_doodle
+    from app import create_app
+    from app.config import TestingConfig
+    from app.services.capture import get_corpus_capture
+
+    config = TestingConfig()
+    config.CAPTURE_ENABLED = True
+    config.CAPTURE_SAMPLE_RATE = 1.0
+    config.CAPTURE_PATH = args.corpus
+    config.CAPTURE_MAX_ENTRIES = args.doodles + len(load_corpus(args.corpus))
+    app = create_app(config)
+    client = app.test_client()
+    rng = random.Random(args.seed)
+    hints = ['cat', 'robot', 'dinosaur', None]
+    with patch('app.api.routes.generate_art_from_doodle', return_value='https://example.com/generated.png'):
+        for i in range(args.doodles):
+            size = rng.choice([(800, 600), (400, 300), (1600, 1200)])
+            response = client.post('/api/generate', json={'imageData': make_doodle(rng, size),
+                                                          'promptHint': hints[i % len(hints)]})
+            if response.status_code != 200:
+                print(f"doodle {i}: {response.status_code} {response.get_json()}", file=sys.stderr)
+    get_corpus_capture(app.config).shutdown()
+    print(f"{len(load_corpus(args.corpus))} entries in {args.corpus}")
+
+
+def run(args):
+    entries = load_corpus(args.corpus)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        sys.exit(f"No corpus entries in {args.corpus}")
+    label = args.label or current_commit()
+    result = run_replay(args.corpus, entries, repeat=args.repeat, warmup=args.warmup,
+                        upstream_ms=args.upstream_ms, label=label)
+    with open(args.output, 'w') as f:
+        json.dump(result, f)
+    print(f"{label}: {result['entries']} entries x {result['repeat']} passes -> {args.output}")
+    for stage, values in result['samples'].items():
+        ordered = sorted(values)
+        print(f"  {stage:<11} median {ordered[len(ordered) // 2]:8.2f} ms")
+    if result['mismatches']:
+        print(f"  {len(result['mismatches'])} entries produced a different image than when captured")
+    if result['failures']:
+        print(f"  {len(result['failures'])} entries failed: {sorted(result['failures'].items())[:3]}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline['environment'] != candidate['environment']:
+        print(f"warning: runs come from different environments:\n  {baseline['environment']}\n"
+              f"  {candidate['environment']}", file=sys.stderr)
+
+    rows = compare_runs(baseline, candidate, iterations=args.iterations, confidence=args.confidence,
+                        threshold=args.threshold)
+    level = f"{args.confidence:.0%} CI"
+    print(f"{baseline['label']} -> {candidate['label']} ({level}, threshold {args.threshold:.0%})")
+    print(f"{'stage':<11}{'stat':<8}{'baseline ms':>26}{'candidate ms':>26}{'ratio':>24}  verdict")
+    for row in rows:
+        def cell(value, interval):
+            return f"{value:8.2f} [{interval[0]:7.2f}, {interval[1]:7.2f}]"
+        print(f"{row['stage']:<11}{row['statistic']:<8}{cell(row['baseline'], row['baselineCi']):>26}"
+              f"{cell(row['candidate'], row['candidateCi']):>26}"
+              f"{row['ratio']:8.3f} [{row['ratioCi'][0]:.3f}, {row['ratioCi'][1]:.3f}]  {row['verdict']}")
+    changed = sorted(set(candidate['mismatches']) - set(baseline['mismatches']))
+    if changed:
+        print(f"{len(changed)} entries now produce a different image than when captured")
+    if any(row['verdict'] == 'regression' for row in rows):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='Capture synthetic doodles into a corpus')
+    seed_parser.add_argument('--corpus', required=True)
+    seed_parser.add_argument('--doodles', type=int, default=50)
+    seed_parser.add_argument('--seed', type=int, default=7)
+    seed_parser.set_defaults(func=seed)
+
+    run_parser = commands.add_parser('run', help='Replay a corpus and write the samples')
+    run_parser.add_argument('--corpus', required=True)
+    run_parser.add_argument('-o', '--output', required=True)
+    run_parser.add_argument('--label', help='Run name; defaults to the current commit')
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--warmup', type=int, default=1)
+    run_parser.add_argument('--upstream-ms', type=float, default=0.0, help='Latency of the stubbed upstream')
+    run_parser.add_argument('--limit', type=int, help='Only replay the first N entries')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two runs')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--confidence', type=float, default=0.95)
+    compare_parser.add_argument('--threshold', type=float, default=0.05, help='Ignore relative changes below this')
+    compare_parser.add_argument('--iterations', type=int, default=2000, help='Bootstrap resamples')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
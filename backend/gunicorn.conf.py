@@ -0,0 +1,28 @@
+"""
+Gunicorn configuration for the Draw With Me backend.
+
+Usage:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is loaded once in the master (preload) and warmed up there, so workers
+fork with openai, Pillow's codecs and the app already in memory and share those
+pages copy-on-write.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5001')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '35'))
+preload_app = True
+
+# Workers on this node share one cache and one set of rate/metrics counters
+os.environ.setdefault('SHARED_STORE_ENABLED', 'true')
+
+
+def on_starting(server):
+    """Warm up in the master after the app is preloaded, before workers fork."""
+    from app import warm_up
+    warm_up(freeze=True)
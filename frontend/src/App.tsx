@@ -3,8 +3,8 @@ import './App.css';
 import DrawingCanvas from './components/DrawingCanvas';
 import Controls from './components/Controls';
 import GeneratedImageDisplay from './components/GeneratedImageDisplay';
-import { Color, Tool, Template } from './types';
-import { generateArt } from './services/api';
+import { Color, Tool, Template, GenerationProgress } from './types';
+import { generateArtWithProgress } from './services/api';
 import { useCanvas } from './hooks/useCanvas';
 
 function App() {
@@ -16,6 +16,7 @@ function App() {
   // Generated image state
   const [generatedImageUrl, setGeneratedImageUrl] = useState<string | null>(null);
   const [isGenerating, setIsGenerating] = useState(false);
+  const [progress, setProgress] = useState<GenerationProgress | null>(null);
   const [error, setError] = useState<string | null>(null);
   
   // Canvas functions from hook
@@ -23,7 +24,7 @@ function App() {
     canvasRef,
     clearCanvas,
     loadTemplate,
-    getCanvasImage,
+    exportCanvasImage,
     setColor: setCanvasColor,
     setTool: setCanvasTool,
     startDrawing,
@@ -59,19 +60,17 @@ function App() {
   const handleGenerate = async () => {
     try {
       setError(null);
+      setProgress(null);
       setIsGenerating(true);
       
-      // Get canvas image as data URL
-      const imageData = getCanvasImage();
-      if (!imageData) {
+      // Crop, scale and encode the drawing (in a worker where supported)
+      const image = await exportCanvasImage();
+      if (!image) {
         throw new Error('Failed to get canvas image');
       }
       
-      // Call API to generate art
-      const response = await generateArt({
-        imageData,
-        promptHint: activeTemplate?.id,
-      });
+      // Call API to generate art, following its progress
+      const response = await generateArtWithProgress(image, activeTemplate?.id, setProgress);
       
       // Set generated image URL
       setGeneratedImageUrl(response.imageUrl);
@@ -80,6 +79,7 @@ function App() {
       console.error('Error generating art:', err);
     } finally {
       setIsGenerating(false);
+      setProgress(null);
     }
   };
   
@@ -123,6 +123,7 @@ function App() {
           <GeneratedImageDisplay
             imageUrl={generatedImageUrl}
             isLoading={isGenerating}
+            progress={progress}
           />
           
           {error && (
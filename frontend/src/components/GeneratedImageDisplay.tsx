@@ -1,15 +1,39 @@
 import React from 'react';
+import { GenerationProgress, GenerationStage } from '../types';
 
 interface GeneratedImageDisplayProps {
   imageUrl: string | null;
   isLoading: boolean;
+  progress?: GenerationProgress | null;
 }
 
+// Happy-path stages in order, with what to tell the user while each is the latest
+const STEPS: { stage: GenerationStage; label: string }[] = [
+  { stage: 'received', label: 'Sending your drawing...' },
+  { stage: 'queued', label: 'Waiting for a free artist...' },
+  { stage: 'preprocessed', label: 'Getting your drawing ready...' },
+  { stage: 'upstream_started', label: 'Painting your art...' },
+  { stage: 'completed', label: 'Adding the finishing touches...' },
+];
+
+const stepIndex = (progress?: GenerationProgress | null): number => {
+  if (!progress) {
+    return 0;
+  }
+  // A retry goes back to waiting in the queue
+  const stage = progress.stage === 'retrying' ? 'queued' : progress.stage;
+  return Math.max(0, STEPS.findIndex((step) => step.stage === stage));
+};
+
 const GeneratedImageDisplay: React.FC<GeneratedImageDisplayProps> = ({
   imageUrl,
   isLoading,
+  progress,
 }) => {
   if (isLoading) {
+    const step = stepIndex(progress);
+    const percent = Math.round(((step + 1) / STEPS.length) * 100);
+    const label = progress?.stage === 'retrying' ? 'Trying again...' : STEPS[step].label;
     return (
       <div className="generated-image-container loading">
         <div className="loading-spinner" style={{ textAlign: 'center', padding: '20px' }}>
@@ -24,7 +48,34 @@ const GeneratedImageDisplay: React.FC<GeneratedImageDisplayProps> = ({
               margin: '0 auto',
             }}
           />
-          <p>Generating your art...</p>
+          <p>{progress ? label : 'Generating your art...'}</p>
+          {progress && (
+            <div
+              className="generation-progress"
+              role="progressbar"
+              aria-valuemin={0}
+              aria-valuemax={100}
+              aria-valuenow={percent}
+              aria-valuetext={label}
+              style={{
+                height: '8px',
+                maxWidth: '300px',
+                margin: '0 auto',
+                backgroundColor: '#f3f3f3',
+                borderRadius: '4px',
+                overflow: 'hidden',
+              }}
+            >
+              <div
+                style={{
+                  width: `${percent}%`,
+                  height: '100%',
+                  backgroundColor: '#3498db',
+                  transition: 'width 0.3s ease',
+                }}
+              />
+            </div>
+          )}
         </div>
       </div>
     );
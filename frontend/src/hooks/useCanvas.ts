@@ -1,5 +1,6 @@
 import { useRef, useEffect, useState, useCallback } from 'react';
-import { Color, Tool } from '../types';
+import { Color, ExportedImage, Tool } from '../types';
+import { exportCanvas } from '../services/canvasExport';
 
 interface UseCanvasOptions {
   width?: number;
@@ -128,6 +129,12 @@ export const useCanvas = ({
     return canvasRef.current.toDataURL('image/png');
   }, []);
   
+  // Export the drawing for upload, encoded off the main thread where supported
+  const exportCanvasImage = useCallback((): Promise<ExportedImage | null> => {
+    if (!canvasRef.current) return Promise.resolve(null);
+    return exportCanvas(canvasRef.current);
+  }, []);
+  
   // Load template onto canvas
   const loadTemplate = useCallback((templateSrc: string) => {
     if (!ctxRef.current || !canvasRef.current) return;
@@ -156,6 +163,7 @@ export const useCanvas = ({
     stopDrawing,
     clearCanvas,
     getCanvasImage,
+    exportCanvasImage,
     loadTemplate,
     setColor,
     color,
@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { GenerateRequest, GenerateResponse } from '../types';
+import { ExportedImage, GenerateRequest, GenerateResponse, GenerationProgress, JobStatus } from '../types';
 
 // Create an axios instance with common config
 const apiClient = axios.create({
@@ -9,6 +9,30 @@ const apiClient = axios.create({
   },
 });
 
+// Progress WebSocket server (python -m app.progress_server); without it generation is one synchronous request
+const PROGRESS_URL = process.env.REACT_APP_PROGRESS_URL;
+const POLL_INTERVAL_MS = 1000;
+
+const toApiError = (error: unknown): Error => {
+  // Handle axios errors
+  if (axios.isAxiosError(error) && error.response) {
+    return new Error(error.response.data.error || 'Failed to generate art');
+  }
+  return new Error('Network error or server unavailable');
+};
+
+// Headers of a binary upload; the drawing is declared normalized (cropped and fitted by exportCanvas)
+const uploadHeaders = (image: ExportedImage, promptHint?: string): Record<string, string> => {
+  const headers: Record<string, string> = {
+    'Content-Type': image.blob.type,
+    'X-Image-Normalized': '1',
+  };
+  if (promptHint) {
+    headers['X-Prompt-Hint'] = promptHint;
+  }
+  return headers;
+};
+
 /**
  * Generate art from a doodle using the backend API
  */
@@ -17,10 +41,116 @@ export const generateArt = async (request: GenerateRequest): Promise<GenerateRes
     const response = await apiClient.post<GenerateResponse>('/generate', request);
     return response.data;
   } catch (error) {
-    // Handle axios errors
-    if (axios.isAxiosError(error) && error.response) {
-      throw new Error(error.response.data.error || 'Failed to generate art');
-    }
-    throw new Error('Network error or server unavailable');
+    throw toApiError(error);
+  }
+};
+
+/**
+ * Generate art from an exported drawing, uploaded as a binary body.
+ * The image is declared normalized (already cropped and fitted to the
+ * 1024 target) so the backend can skip its own size pre-check.
+ */
+export const generateArtFromImage = async (image: ExportedImage, promptHint?: string): Promise<GenerateResponse> => {
+  try {
+    const response = await apiClient.post<GenerateResponse>('/generate', image.blob, {
+      headers: uploadHeaders(image, promptHint),
+    });
+    return response.data;
+  } catch (error) {
+    throw toApiError(error);
+  }
+};
+
+/**
+ * Queue a generation for the job workers and return its job id.
+ */
+export const createGenerationJob = async (image: ExportedImage, promptHint?: string): Promise<string> => {
+  try {
+    const response = await apiClient.post<{ jobId: string }>('/jobs', image.blob, {
+      headers: uploadHeaders(image, promptHint),
+    });
+    return response.data.jobId;
+  } catch (error) {
+    throw toApiError(error);
+  }
+};
+
+/**
+ * Poll a job until it finishes, reporting its status as coarse progress.
+ * Used when the progress WebSocket is not configured or drops.
+ */
+const pollJob = (jobId: string, onProgress: (progress: GenerationProgress) => void): Promise<GenerateResponse> =>
+  new Promise((resolve, reject) => {
+    const poll = async () => {
+      try {
+        const { data } = await apiClient.get<JobStatus>(`/jobs/${jobId}`);
+        if (data.status === 'done' && data.imageUrl) {
+          onProgress({ jobId, stage: 'completed', imageUrl: data.imageUrl });
+          resolve({ imageUrl: data.imageUrl });
+        } else if (data.status === 'failed') {
+          reject(new Error(data.error || 'Failed to generate art'));
+        } else {
+          onProgress({ jobId, stage: data.status === 'leased' ? 'upstream_started' : 'queued' });
+          setTimeout(poll, POLL_INTERVAL_MS);
+        }
+      } catch (error) {
+        reject(toApiError(error));
+      }
+    };
+    poll();
+  });
+
+/**
+ * Follow a queued generation over the progress WebSocket until it completes.
+ * Falls back to polling the job if the socket closes before the result arrives.
+ */
+export const watchGeneration = (
+  jobId: string,
+  onProgress: (progress: GenerationProgress) => void,
+): Promise<GenerateResponse> => {
+  if (!PROGRESS_URL || typeof WebSocket === 'undefined') {
+    return pollJob(jobId, onProgress);
+  }
+  return new Promise((resolve, reject) => {
+    let settled = false;
+    const socket = new WebSocket(`${PROGRESS_URL.replace(/\/$/, '')}/jobs/${jobId}`);
+    socket.onmessage = (message: MessageEvent<string>) => {
+      const event = JSON.parse(message.data) as GenerationProgress;
+      onProgress(event);
+      if (event.stage === 'completed' && event.imageUrl) {
+        settled = true;
+        resolve({ imageUrl: event.imageUrl });
+      } else if (event.stage === 'failed') {
+        settled = true;
+        reject(new Error(event.error || 'Failed to generate art'));
+      }
+    };
+    socket.onclose = () => {
+      if (!settled) {
+        settled = true;
+        pollJob(jobId, onProgress).then(resolve, reject);
+      }
+    };
+  });
+};
+
+/**
+ * Generate art from an exported drawing, reporting progress as it goes.
+ * With a progress server the generation runs as a job and stages are pushed
+ * over a WebSocket, so no request has to stay open for the whole generation;
+ * otherwise this is a single synchronous request.
+ */
+export const generateArtWithProgress = async (
+  image: ExportedImage,
+  promptHint: string | undefined,
+  onProgress: (progress: GenerationProgress) => void,
+): Promise<GenerateResponse> => {
+  if (!PROGRESS_URL) {
+    onProgress({ stage: 'received' });
+    const response = await generateArtFromImage(image, promptHint);
+    onProgress({ stage: 'completed', imageUrl: response.imageUrl });
+    return response;
   }
-}; 
\ No newline at end of file
+  const jobId = await createGenerationJob(image, promptHint);
+  return watchGeneration(jobId, onProgress);
+};
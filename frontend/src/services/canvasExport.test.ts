@@ -0,0 +1,143 @@
+import type { ExportResponse } from '../workers/exportWorker';
+import { ExportedImage } from '../types';
+
+// Stands in for the export worker; tests drive its replies and failures
+// (jest.mock factories may only use names starting with "mock")
+class MockWorker {
+  onmessage: ((event: MessageEvent<ExportResponse>) => void) | null = null;
+  onerror: ((event: ErrorEvent) => void) | null = null;
+  onmessageerror: ((event: MessageEvent) => void) | null = null;
+  postMessage = jest.fn();
+  terminate = jest.fn();
+
+  reply(data: ExportResponse) {
+    this.onmessage?.({ data } as MessageEvent<ExportResponse>);
+  }
+
+  fail(message: string) {
+    this.onerror?.({ message, preventDefault: jest.fn() } as unknown as ErrorEvent);
+  }
+}
+
+let mockWorkers: MockWorker[] = [];
+jest.mock('../workers/spawnExportWorker', () => ({
+  spawnExportWorker: () => {
+    const worker = new MockWorker();
+    mockWorkers.push(worker);
+    return worker;
+  },
+}));
+
+const WORKER_BLOB = new Blob(['worker']);
+const MAIN_THREAD_BLOB = new Blob(['main thread']);
+
+// Lets the bitmap snapshot and the worker's dynamic import resolve
+const settle = async () => {
+  for (let i = 0; i < 20; i++) await Promise.resolve();
+};
+
+// Checks which path produced an export: blobs are compared by identity, not content
+const expectExported = async (exported: Promise<ExportedImage>, blob: Blob) => {
+  const image = await exported;
+  expect(image.blob).toBe(blob);
+  expect([image.width, image.height]).toEqual([40, 30]);
+};
+
+const makeCanvas = (): HTMLCanvasElement => {
+  const canvas = document.createElement('canvas');
+  canvas.width = 40;
+  canvas.height = 30;
+  return canvas;
+};
+
+describe('exportCanvas', () => {
+  const globals = globalThis as unknown as Record<string, unknown>;
+  let exportCanvas: typeof import('./canvasExport').exportCanvas;
+
+  beforeEach(() => {
+    mockWorkers = [];
+    globals.Worker = MockWorker;
+    globals.OffscreenCanvas = class {};
+    globals.createImageBitmap = jest.fn().mockResolvedValue({});
+    // jsdom has no 2D context; the main-thread fallback gets a blank white one
+    const context = {
+      getImageData: (x: number, y: number, width: number, height: number) => ({
+        data: new Uint8ClampedArray(width * height * 4).fill(255),
+      }),
+      drawImage: jest.fn(),
+    };
+    (jest.spyOn(HTMLCanvasElement.prototype, 'getContext') as jest.Mock).mockReturnValue(context);
+    (jest.spyOn(HTMLCanvasElement.prototype, 'toBlob') as jest.Mock).mockImplementation((callback: BlobCallback) =>
+      callback(MAIN_THREAD_BLOB),
+    );
+    jest.spyOn(console, 'warn').mockImplementation(() => {});
+    // Fresh module state: no worker and no pending exports
+    jest.resetModules();
+    ({ exportCanvas } = require('./canvasExport'));
+  });
+
+  afterEach(() => {
+    jest.useRealTimers();
+    jest.restoreAllMocks();
+    delete globals.Worker;
+    delete globals.OffscreenCanvas;
+    delete globals.createImageBitmap;
+  });
+
+  test('resolves with the worker reply', async () => {
+    const exported = exportCanvas(makeCanvas());
+    await settle();
+    const [worker] = mockWorkers;
+    worker.reply({ id: worker.postMessage.mock.calls[0][0].id, blob: WORKER_BLOB, width: 40, height: 30 });
+    await expectExported(exported, WORKER_BLOB);
+  });
+
+  test('settles pending exports when the worker errors and respawns it', async () => {
+    const first = exportCanvas(makeCanvas());
+    const second = exportCanvas(makeCanvas());
+    await settle();
+    const [broken] = mockWorkers;
+    expect(broken.postMessage).toHaveBeenCalledTimes(2);
+
+    broken.fail('worker script crashed');
+    await expectExported(first, MAIN_THREAD_BLOB);
+    await expectExported(second, MAIN_THREAD_BLOB);
+    expect(broken.terminate).toHaveBeenCalled();
+
+    const next = exportCanvas(makeCanvas());
+    await settle();
+    expect(mockWorkers).toHaveLength(2);
+    const fresh = mockWorkers[1];
+    fresh.reply({ id: fresh.postMessage.mock.calls[0][0].id, blob: WORKER_BLOB, width: 40, height: 30 });
+    await expectExported(next, WORKER_BLOB);
+  });
+
+  test('settles pending exports when the worker sends an unreadable reply', async () => {
+    const exported = exportCanvas(makeCanvas());
+    await settle();
+    mockWorkers[0].onmessageerror?.({} as MessageEvent);
+    await expectExported(exported, MAIN_THREAD_BLOB);
+    expect(mockWorkers[0].terminate).toHaveBeenCalled();
+  });
+
+  test('falls back when the worker stops answering and respawns it', async () => {
+    jest.useFakeTimers();
+    const exported = exportCanvas(makeCanvas());
+    await settle();
+    const [hung] = mockWorkers;
+
+    jest.advanceTimersByTime(15000);
+    await expectExported(exported, MAIN_THREAD_BLOB);
+    expect(hung.terminate).toHaveBeenCalled();
+
+    // A late reply from the dropped worker is ignored
+    hung.reply({ id: hung.postMessage.mock.calls[0][0].id, blob: WORKER_BLOB, width: 40, height: 30 });
+
+    const next = exportCanvas(makeCanvas());
+    await settle();
+    expect(mockWorkers).toHaveLength(2);
+    const fresh = mockWorkers[1];
+    fresh.reply({ id: fresh.postMessage.mock.calls[0][0].id, blob: WORKER_BLOB, width: 40, height: 30 });
+    await expectExported(next, WORKER_BLOB);
+  });
+});
@@ -0,0 +1,131 @@
+import type { ExportRequest, ExportResponse } from '../workers/exportWorker';
+import { ExportedImage } from '../types';
+import { findInkBounds, fitToTarget } from '../utils/inkBounds';
+
+// Preferred upload encoding; browsers that cannot encode it fall back to PNG.
+// Quality 1 selects lossless WebP, which is far smaller than lossy for line art.
+const EXPORT_TYPE = 'image/webp';
+const EXPORT_QUALITY = 1;
+
+// How long an export may take in the worker before falling back to the main thread
+const WORKER_TIMEOUT_MS = 15000;
+
+let workerPromise: Promise<Worker> | null = null;
+let nextRequestId = 0;
+const pending = new Map<number, { resolve: (image: ExportedImage) => void; reject: (error: Error) => void }>();
+
+const supportsWorkerExport = (): boolean =>
+  typeof Worker !== 'undefined' &&
+  typeof createImageBitmap !== 'undefined' &&
+  'OffscreenCanvas' in globalThis;
+
+/**
+ * Fail every waiting export and drop the worker, so the next export starts a new one
+ */
+const discardWorker = (worker: Worker | null, error: Error): void => {
+  workerPromise = null;
+  worker?.terminate();
+  const requests = Array.from(pending.values());
+  pending.clear();
+  requests.forEach((request) => request.reject(error));
+};
+
+/**
+ * Start the export worker once and route its replies to the waiting callers
+ */
+const getWorker = (): Promise<Worker> => {
+  if (!workerPromise) {
+    workerPromise = import('../workers/spawnExportWorker').then(({ spawnExportWorker }) => {
+      const worker = spawnExportWorker();
+      worker.onmessage = (event: MessageEvent<ExportResponse>) => {
+        const { id, blob, width, height, error } = event.data;
+        const request = pending.get(id);
+        if (!request) return;
+        pending.delete(id);
+        if (blob && width && height) {
+          request.resolve({ blob, width, height });
+        } else {
+          request.reject(new Error(error || 'Failed to export drawing'));
+        }
+      };
+      worker.onerror = (event: ErrorEvent) => {
+        event.preventDefault();
+        discardWorker(worker, new Error(event.message || 'Export worker failed'));
+      };
+      worker.onmessageerror = () => discardWorker(worker, new Error('Export worker sent an unreadable reply'));
+      return worker;
+    });
+    // A worker that cannot be loaded is retried on the next export
+    workerPromise.catch(() => {
+      workerPromise = null;
+    });
+  }
+  return workerPromise;
+};
+
+const exportInWorker = async (canvas: HTMLCanvasElement): Promise<ExportedImage> => {
+  // Snapshotting into a bitmap is cheap; everything else happens in the worker
+  const bitmap = await createImageBitmap(canvas);
+  const worker = await getWorker();
+  const id = nextRequestId++;
+  return new Promise<ExportedImage>((resolve, reject) => {
+    // A worker that stops answering is replaced, failing everything it holds
+    const timer = setTimeout(
+      () => discardWorker(worker, new Error('Export worker timed out')),
+      WORKER_TIMEOUT_MS,
+    );
+    pending.set(id, {
+      resolve: (image) => {
+        clearTimeout(timer);
+        resolve(image);
+      },
+      reject: (error) => {
+        clearTimeout(timer);
+        reject(error);
+      },
+    });
+    const message: ExportRequest = { id, bitmap, type: EXPORT_TYPE, quality: EXPORT_QUALITY };
+    worker.postMessage(message, [bitmap]);
+  });
+};
+
+const exportOnMainThread = (canvas: HTMLCanvasElement): Promise<ExportedImage> => {
+  const ctx = canvas.getContext('2d');
+  if (!ctx) return Promise.reject(new Error('Failed to get canvas image'));
+  const bounds = findInkBounds(ctx.getImageData(0, 0, canvas.width, canvas.height).data, canvas.width, canvas.height);
+  const size = fitToTarget(bounds);
+
+  const output = document.createElement('canvas');
+  output.width = size.width;
+  output.height = size.height;
+  const outputCtx = output.getContext('2d');
+  if (!outputCtx) return Promise.reject(new Error('Failed to get canvas image'));
+  outputCtx.imageSmoothingEnabled = true;
+  outputCtx.imageSmoothingQuality = 'high';
+  outputCtx.drawImage(canvas, bounds.x, bounds.y, bounds.width, bounds.height, 0, 0, size.width, size.height);
+
+  // toBlob still encodes asynchronously, unlike toDataURL
+  return new Promise<ExportedImage>((resolve, reject) => {
+    output.toBlob(
+      (blob) => (blob ? resolve({ blob, ...size }) : reject(new Error('Failed to get canvas image'))),
+      EXPORT_TYPE,
+      EXPORT_QUALITY,
+    );
+  });
+};
+
+/**
+ * Export a drawing for upload: cropped to the ink, downscaled to fit the
+ * backend's 1024 target if needed and encoded as WebP (or PNG where WebP
+ * encoding is unsupported). Runs in a Web Worker with OffscreenCanvas when available so
+ * encoding does not block the UI, falling back to the main thread otherwise.
+ */
+export const exportCanvas = (canvas: HTMLCanvasElement): Promise<ExportedImage> => {
+  if (!supportsWorkerExport()) {
+    return exportOnMainThread(canvas);
+  }
+  return exportInWorker(canvas).catch((error) => {
+    console.warn('Worker export failed, exporting on the main thread:', error);
+    return exportOnMainThread(canvas);
+  });
+};
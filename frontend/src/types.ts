@@ -13,10 +13,43 @@ export interface GenerateRequest {
   promptHint?: string;
 }
 
+export interface ExportedImage {
+  blob: Blob;
+  width: number;
+  height: number;
+}
+
 export interface GenerateResponse {
   imageUrl: string;
 }
 
+// Stages a queued generation reports, in order; 'retrying' and 'failed' are off the happy path
+export type GenerationStage =
+  | 'received'
+  | 'queued'
+  | 'preprocessed'
+  | 'upstream_started'
+  | 'retrying'
+  | 'completed'
+  | 'failed';
+
+export interface GenerationProgress {
+  stage: GenerationStage;
+  jobId?: string;
+  at?: number;
+  attempt?: number;
+  imageUrl?: string;
+  error?: string;
+}
+
+export interface JobStatus {
+  jobId: string;
+  status: 'queued' | 'leased' | 'done' | 'failed';
+  attempts: number;
+  imageUrl?: string;
+  error?: string;
+}
+
 export interface ErrorResponse {
   error: string;
 } 
\ No newline at end of file
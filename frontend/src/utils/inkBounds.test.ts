@@ -0,0 +1,49 @@
+import { EXPORT_TARGET_SIZE, findInkBounds, fitToTarget } from './inkBounds';
+
+// A white canvas with the given pixels painted black
+const canvasPixels = (width: number, height: number, ink: Array<[number, number]> = []): Uint8ClampedArray => {
+  const pixels = new Uint8ClampedArray(width * height * 4).fill(255);
+  ink.forEach(([x, y]) => pixels.set([0, 0, 0, 255], (y * width + x) * 4));
+  return pixels;
+};
+
+describe('findInkBounds', () => {
+  test('returns the whole canvas when nothing is drawn', () => {
+    expect(findInkBounds(canvasPixels(40, 30), 40, 30)).toEqual({ x: 0, y: 0, width: 40, height: 30 });
+  });
+
+  test('pads the ink bounding box', () => {
+    const pixels = canvasPixels(100, 80, [[20, 30], [50, 40]]);
+    expect(findInkBounds(pixels, 100, 80, 5)).toEqual({ x: 15, y: 25, width: 41, height: 21 });
+  });
+
+  test('clamps the padding to the canvas', () => {
+    const pixels = canvasPixels(50, 50, [[2, 1], [48, 49]]);
+    expect(findInkBounds(pixels, 50, 50, 16)).toEqual({ x: 0, y: 0, width: 50, height: 50 });
+  });
+
+  test('ignores near-white and transparent pixels', () => {
+    const pixels = canvasPixels(10, 10);
+    pixels.set([252, 252, 252, 255], (5 * 10 + 5) * 4);
+    pixels.set([0, 0, 0, 0], (2 * 10 + 2) * 4);
+    expect(findInkBounds(pixels, 10, 10, 0)).toEqual({ x: 0, y: 0, width: 10, height: 10 });
+  });
+});
+
+describe('fitToTarget', () => {
+  test('leaves regions that fit alone', () => {
+    expect(fitToTarget({ x: 0, y: 0, width: 800, height: 600 })).toEqual({ width: 800, height: 600 });
+  });
+
+  test('downscales the longest side to the target', () => {
+    expect(fitToTarget({ x: 0, y: 0, width: 2048, height: 1536 })).toEqual({
+      width: EXPORT_TARGET_SIZE,
+      height: 768,
+    });
+    expect(fitToTarget({ x: 0, y: 0, width: 300, height: 1200 }, 600)).toEqual({ width: 150, height: 600 });
+  });
+
+  test('keeps at least one pixel on each side', () => {
+    expect(fitToTarget({ x: 0, y: 0, width: 5000, height: 1 })).toEqual({ width: EXPORT_TARGET_SIZE, height: 1 });
+  });
+});
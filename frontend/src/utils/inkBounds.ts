@@ -0,0 +1,80 @@
+/**
+ * Geometry shared by the canvas export worker and its main-thread fallback.
+ */
+
+// Longest side of an exported drawing; matches the backend's 1024x1024 target
+export const EXPORT_TARGET_SIZE = 1024;
+
+// Blank margin kept around the ink, in canvas pixels
+export const INK_PADDING = 16;
+
+// Channel value below which a pixel counts as ink on the white background
+const INK_THRESHOLD = 250;
+
+export interface InkBounds {
+  x: number;
+  y: number;
+  width: number;
+  height: number;
+}
+
+const isInk = (pixels: Uint8ClampedArray, offset: number): boolean =>
+  pixels[offset + 3] > 0 &&
+  (pixels[offset] < INK_THRESHOLD || pixels[offset + 1] < INK_THRESHOLD || pixels[offset + 2] < INK_THRESHOLD);
+
+/**
+ * Find the padded bounding box of everything drawn on a white canvas.
+ * Returns the whole canvas when nothing has been drawn.
+ */
+export const findInkBounds = (
+  pixels: Uint8ClampedArray,
+  width: number,
+  height: number,
+  padding: number = INK_PADDING,
+): InkBounds => {
+  let top = height;
+  let bottom = -1;
+  let left = width;
+  let right = -1;
+
+  for (let y = 0; y < height; y++) {
+    const row = y * width * 4;
+    for (let x = 0; x < width; x++) {
+      if (isInk(pixels, row + x * 4)) {
+        if (y < top) top = y;
+        bottom = y;
+        if (x < left) left = x;
+        if (x > right) right = x;
+      }
+    }
+  }
+
+  if (bottom < 0) {
+    return { x: 0, y: 0, width, height };
+  }
+
+  const x = Math.max(0, left - padding);
+  const y = Math.max(0, top - padding);
+  return {
+    x,
+    y,
+    width: Math.min(width, right + padding + 1) - x,
+    height: Math.min(height, bottom + padding + 1) - y,
+  };
+};
+
+/**
+ * Size of a region once downscaled to fit within the target, keeping its
+ * aspect ratio. Regions that already fit are left alone: the backend scales
+ * them up, and upscaling here would only make the upload larger.
+ */
+export const fitToTarget = (
+  bounds: InkBounds,
+  target: number = EXPORT_TARGET_SIZE,
+): { width: number; height: number } => {
+  const scale = Math.min(1, target / Math.max(bounds.width, bounds.height));
+  return {
+    width: Math.max(1, Math.round(bounds.width * scale)),
+    height: Math.max(1, Math.round(bounds.height * scale)),
+  };
+};
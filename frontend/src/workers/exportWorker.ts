@@ -0,0 +1,72 @@
+/**
+ * Web Worker that crops, scales and encodes a drawing off the main thread.
+ *
+ * Receives an ImageBitmap of the canvas and replies with an encoded Blob
+ * (WebP where the browser can encode it, PNG otherwise) cropped to the ink
+ * and downscaled, if needed, to fit the backend's 1024 target.
+ */
+import { findInkBounds, fitToTarget } from '../utils/inkBounds';
+
+export interface ExportRequest {
+  id: number;
+  bitmap: ImageBitmap;
+  type: string;
+  quality: number;
+}
+
+export interface ExportResponse {
+  id: number;
+  blob?: Blob;
+  width?: number;
+  height?: number;
+  error?: string;
+}
+
+type Drawing2D = Pick<
+  CanvasRenderingContext2D,
+  'drawImage' | 'getImageData' | 'imageSmoothingEnabled' | 'imageSmoothingQuality'
+>;
+
+interface WorkerCanvas {
+  getContext(contextId: '2d'): Drawing2D | null;
+  convertToBlob(options?: { type?: string; quality?: number }): Promise<Blob>;
+}
+
+interface ExportWorkerScope {
+  OffscreenCanvas: new (width: number, height: number) => WorkerCanvas;
+  onmessage: ((event: MessageEvent<ExportRequest>) => void) | null;
+  postMessage(message: ExportResponse): void;
+}
+
+// eslint-disable-next-line no-restricted-globals
+const scope = self as unknown as ExportWorkerScope;
+
+const exportBitmap = async ({ bitmap, type, quality }: ExportRequest) => {
+  // Read the pixels back to find where the drawing actually is
+  const source = new scope.OffscreenCanvas(bitmap.width, bitmap.height);
+  const sourceCtx = source.getContext('2d');
+  if (!sourceCtx) throw new Error('2D canvas is not available in the worker');
+  sourceCtx.drawImage(bitmap, 0, 0);
+  const pixels = sourceCtx.getImageData(0, 0, bitmap.width, bitmap.height).data;
+  const bounds = findInkBounds(pixels, bitmap.width, bitmap.height);
+  const size = fitToTarget(bounds);
+
+  // Draw the cropped region at the target size and encode it
+  const output = new scope.OffscreenCanvas(size.width, size.height);
+  const outputCtx = output.getContext('2d');
+  if (!outputCtx) throw new Error('2D canvas is not available in the worker');
+  outputCtx.imageSmoothingEnabled = true;
+  outputCtx.imageSmoothingQuality = 'high';
+  outputCtx.drawImage(bitmap, bounds.x, bounds.y, bounds.width, bounds.height, 0, 0, size.width, size.height);
+  bitmap.close();
+
+  const blob = await output.convertToBlob({ type, quality });
+  return { blob, ...size };
+};
+
+scope.onmessage = (event) => {
+  const { id } = event.data;
+  exportBitmap(event.data)
+    .then((result) => scope.postMessage({ id, ...result }))
+    .catch((error) => scope.postMessage({ id, error: error instanceof Error ? error.message : String(error) }));
+};
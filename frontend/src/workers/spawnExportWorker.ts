@@ -0,0 +1,6 @@
+/**
+ * Kept in its own module so that `import.meta` is only reached when a worker
+ * is actually created (it is loaded with a dynamic import).
+ */
+export const spawnExportWorker = (): Worker =>
+  new Worker(new URL('./exportWorker.ts', import.meta.url));